@@ -1,9 +1,78 @@
-import streamlit as st
-import pkg_resources
-import nltk
+import os
+import sys
+import json
+import random
+import re
+import math
+import time
+import copy
+import uuid
+import pickle
+import socket
+import sqlite3
+import subprocess
+import hashlib
+import argparse
+import importlib.util
+import threading
+import logging
+import pandas as pd
+import numpy as np
+import io
+from typing import List, Dict, Any, Optional, Tuple, Union, Set, Callable
+from datetime import datetime
+import concurrent.futures
+from functools import lru_cache
+from collections import Counter, OrderedDict, defaultdict, deque
+from collections.abc import Sequence
+from types import MappingProxyType, SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import warnings
+warnings.filterwarnings('ignore')
+
+logger = logging.getLogger(__name__)
+
+
+class _LazyModule:
+    """
+    Модуль, который импортируется при первом обращении к его атрибуту
+
+    Тяжелые зависимости (Streamlit, клиенты API, NLTK, графики) не нужны воркерам очереди,
+    консольным командам и пулу построения промптов, поэтому импорт модуля приложения их не загружает.
+    """
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name: Полное имя модуля (например, 'matplotlib.pyplot')
+        """
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str):
+        # Вызывается только для отсутствующих атрибутов, то есть для атрибутов самого модуля
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self) -> str:
+        state = "загружен" if self._module is not None else "не загружен"
+        return f"<ленивый модуль {self._name} ({state})>"
+
+
+st = _LazyModule("streamlit")
+nltk = _LazyModule("nltk")
+anthropic = _LazyModule("anthropic")
+openai = _LazyModule("openai")
+plt = _LazyModule("matplotlib.pyplot")
+sns = _LazyModule("seaborn")
+
+# Модули, которые не должны загружаться при импорте приложения (проверяется командой bench-import)
+LAZY_DEPENDENCIES = (
+    "streamlit", "nltk", "anthropic", "openai", "httpx", "matplotlib", "seaborn", "sklearn", "pkg_resources"
+)
 
-streamlit_version = pkg_resources.get_distribution("streamlit").version
-print(f"Текущая версия Streamlit: {streamlit_version}")
 
 def safe_rerun():
     try:
@@ -14,92 +83,28 @@ def safe_rerun():
         except AttributeError:
             st.warning("Невозможно выполнить rerun в данной версии Streamlit")
 
-st.set_page_config(
-    page_title="Synthetica Financial: Симулятор финансовых респондентов",
-    page_icon="", 
-    layout="wide", 
-    initial_sidebar_state="expanded"
-)
 
-def ensure_nltk_resources():
-    """Гарантирует наличие всех необходимых ресурсов NLTK"""
-    resources = [
-        ('punkt', 'tokenizers/punkt'),
-        ('stopwords', 'corpora/stopwords')
-    ]
-    
-    for resource, path in resources:
+@lru_cache(maxsize=None)
+def load_russian_stopwords() -> frozenset:
+    """
+    Русские стоп-слова NLTK (ресурсы загружаются при первом анализе отзывов, а не при импорте)
+
+    Returns:
+        Множество стоп-слов
+    """
+    from nltk.corpus import stopwords
+
+    for resource, path in (('punkt', 'tokenizers/punkt'), ('stopwords', 'corpora/stopwords')):
         try:
             nltk.data.find(path)
-            print(f"Ресурс {resource} найден")
         except LookupError:
-            print(f"Загрузка ресурса {resource}...")
+            logger.info(f"Загрузка ресурса NLTK {resource}...")
             nltk.download(resource, quiet=True)
 
-ensure_nltk_resources()
-
-@st.cache_resource
-def load_nltk_resources():
-    """Загрузка необходимых ресурсов NLTK"""
-    try:
-        nltk.data.find('tokenizers/punkt')
-    except LookupError:
-        nltk.download('punkt', quiet=True)
-    
-    try:
-        nltk.data.find('corpora/stopwords')
-    except LookupError:
-        nltk.download('stopwords', quiet=True)
-    
-    if 'russian' not in stopwords.fileids():  
+    if 'russian' not in stopwords.fileids():
         nltk.download('stopwords', quiet=True)
+    return frozenset(stopwords.words('russian'))
 
-ensure_nltk_resources()
-
-import os
-import json
-import random
-import re
-import math
-import time
-import pandas as pd
-import numpy as np
-import io
-import matplotlib.pyplot as plt
-import seaborn as sns
-from typing import List, Dict, Any, Optional, Tuple, Union, Set
-from datetime import datetime
-import anthropic
-import openai
-from tqdm import tqdm
-import concurrent.futures
-from functools import lru_cache
-from collections import Counter, defaultdict
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.decomposition import LatentDirichletAllocation
-import warnings
-warnings.filterwarnings('ignore')
-
-@st.cache_resource
-def load_nltk_resources():
-    """Загрузка необходимых ресурсов NLTK"""
-    # Загружаем базовый punkt (без указания языка)
-    try:
-        nltk.data.find('tokenizers/punkt')
-    except LookupError:
-        nltk.download('punkt', quiet=True)
-    
-    try:
-        nltk.data.find('corpora/stopwords')
-    except LookupError:
-        nltk.download('stopwords', quiet=True)
-    
-    if 'russian' not in stopwords.fileids():  # Изменено с available_languages() на fileids()
-        nltk.download('stopwords', quiet=True)
-        
-load_nltk_resources()
 
 class NumpyEncoder(json.JSONEncoder):
     """Специальный класс для сериализации numpy типов в JSON"""
@@ -110,8 +115,213 @@ class NumpyEncoder(json.JSONEncoder):
             return float(obj)
         elif isinstance(obj, np.ndarray):
             return obj.tolist()
+        elif isinstance(obj, MappingProxyType):
+            # Неизменяемые статические каталоги (freeze_catalog)
+            return dict(obj)
+        elif isinstance(obj, Sequence):
+            # Колоночные последовательности (например, PersonaCohort) сериализуются как списки
+            return list(obj)
         return super(NumpyEncoder, self).default(obj)
 
+def freeze_catalog(value):
+    """
+    Неизменяемая копия статического каталога: словари - MappingProxyType, списки - кортежи
+
+    Каталоги создаются один раз при импорте модуля и передаются экземплярам по ссылке
+    (в том числе в дочерние процессы после fork), поэтому изменить их через экземпляр нельзя.
+    Данные, которые попадают в персону, копируются в обычные списки и словари.
+
+    Args:
+        value: Словарь, список или значение каталога
+
+    Returns:
+        Неизменяемая структура с тем же содержимым
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze_catalog(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze_catalog(item) for item in value)
+    return value
+
+
+# Стоимость моделей в долларах США за 1 млн токенов (вход / выход / кэшированный вход)
+MODEL_PRICING = {
+    "claude-3-5-sonnet-20241022": {"provider": "claude", "input": 3.0, "output": 15.0, "cached_input": 0.3,
+                                   "cache_write_input": 3.75},
+    "claude-3-5-haiku-20241022": {"provider": "claude", "input": 0.8, "output": 4.0, "cached_input": 0.08,
+                                  "cache_write_input": 1.0},
+    "claude-3-opus-20240229": {"provider": "claude", "input": 15.0, "output": 75.0, "cached_input": 1.5,
+                               "cache_write_input": 18.75},
+    "gpt-4o": {"provider": "openai", "input": 2.5, "output": 10.0, "cached_input": 1.25},
+    "gpt-4-turbo": {"provider": "openai", "input": 10.0, "output": 30.0, "cached_input": 10.0},
+    "gpt-3.5-turbo": {"provider": "openai", "input": 0.5, "output": 1.5, "cached_input": 0.5}
+}
+
+# Априорная оценка длины ответа в токенах по уровню финансовой грамотности (пока нет истории)
+DEFAULT_OUTPUT_TOKENS = {
+    "отсутствие знаний": 120,
+    "начинающий": 160,
+    "средний": 220,
+    "продвинутый": 280,
+    "эксперт": 340
+}
+
+# Модель задержки одного запроса к API: фиксированная часть + генерация выходных токенов
+LLM_LATENCY_MODEL = {
+    "base_seconds": 1.5,
+    "output_tokens_per_second": 50.0
+}
+
+# Названия банковских продуктов в профиле персоны (порядок колонок в PersonaCohort)
+PERSONA_PRODUCT_NAMES = (
+    "Дебетовая карта", "Кредитная карта", "Потребительский кредит", "Ипотека",
+    "Вклад", "Инвестиции", "Страхование"
+)
+
+def sample_prefix_without_replacement(rng: np.random.Generator, pool_sizes: np.ndarray, counts: np.ndarray,
+                                      max_count: int, chunk_size: int = 100_000) -> np.ndarray:
+    """
+    Пакетная выборка без возвращения: для каждой строки выбирается counts[i] индексов из диапазона [0, pool_sizes[i])
+
+    Используются случайные ключи: индексы с наименьшими ключами образуют равномерную выборку без возвращения
+    (аналог random.sample для каждой строки). Строки обрабатываются порциями для ограничения памяти.
+
+    Args:
+        rng: Генератор случайных чисел NumPy
+        pool_sizes: Размер пула для каждой строки (пул - префикс общего плоского списка)
+        counts: Количество элементов для каждой строки (не больше pool_sizes и max_count)
+        max_count: Максимальное количество элементов (ширина результата)
+        chunk_size: Количество строк в порции
+
+    Returns:
+        Массив (N x max_count) индексов, незаполненные позиции равны -1
+    """
+    n = len(pool_sizes)
+    result = np.full((n, max_count), -1, dtype=np.int32)
+    if n == 0 or max_count == 0:
+        return result
+
+    pool_width = int(pool_sizes.max())
+    positions = np.arange(pool_width)
+    slots = np.arange(max_count)
+
+    for start in range(0, n, chunk_size):
+        end = min(n, start + chunk_size)
+        keys = rng.random((end - start, pool_width), dtype=np.float32)
+        # Элементы за пределами пула строки никогда не выбираются
+        keys[positions[None, :] >= pool_sizes[start:end, None]] = 2.0
+        order = np.argsort(keys, axis=1)[:, :max_count]
+        if order.shape[1] < max_count:
+            order = np.pad(order, ((0, 0), (0, max_count - order.shape[1])), constant_values=-1)
+        result[start:end] = np.where(slots[None, :] < counts[start:end, None], order, -1)
+
+    return result
+
+
+def sample_categorical(rng: np.random.Generator, cum_weights: np.ndarray,
+                       conditions: Optional[np.ndarray] = None, size: Optional[int] = None) -> np.ndarray:
+    """
+    Пакетная выборка категорий по таблице накопленных весов
+
+    Args:
+        rng: Генератор случайных чисел NumPy
+        cum_weights: Накопленные нормированные веса (C x K) - по строке на условие
+        conditions: Индекс условия для каждой выборки (None - единственное условие 0)
+        size: Количество выборок (если conditions не задан)
+
+    Returns:
+        Массив индексов категорий
+    """
+    if conditions is None:
+        conditions = np.zeros(size, dtype=np.intp)
+    u = rng.random(len(conditions))
+    return (u[:, None] >= cum_weights[conditions]).sum(axis=1)
+
+
+def cumulative_weights(weight_rows: List[List[float]], width: Optional[int] = None) -> np.ndarray:
+    """
+    Таблица накопленных нормированных весов (строки дополняются нулевыми весами до одной ширины)
+
+    Args:
+        weight_rows: Списки весов для каждого условия
+        width: Ширина таблицы (по умолчанию - длина самой длинной строки)
+
+    Returns:
+        Массив (C x K) накопленных весов, последний столбец равен 1
+    """
+    width = width or max(len(row) for row in weight_rows)
+    table = np.zeros((len(weight_rows), width))
+    for k, row in enumerate(weight_rows):
+        table[k, :len(row)] = row
+    table = np.cumsum(table / table.sum(axis=1, keepdims=True), axis=1)
+    table[:, -1] = 1.0
+    return table
+
+
+# Потоки случайных чисел запуска (ключи SeedSequence): генерация персон, расширение профилей, задачи,
+# локальная постобработка ответов
+RNG_STREAM_PERSONA = 0
+RNG_STREAM_ENHANCE = 1
+RNG_STREAM_TASK = 2
+RNG_STREAM_POSTPROCESS = 3
+
+
+def spawn_rng(seed: Optional[int], *key: int) -> Optional[random.Random]:
+    """
+    Независимый поток случайных чисел для части запуска
+
+    Зерно запуска разделяется через np.random.SeedSequence: каждый ключ (например, поток задач,
+    индекс персоны, индекс вопроса) дает свой поток, не зависящий от порядка выполнения и числа потоков.
+
+    Args:
+        seed: Зерно запуска (None - без фиксации, используется глобальный модуль random)
+        *key: Ключ потока (spawn_key)
+
+    Returns:
+        random.Random или None, если зерно не задано
+    """
+    if seed is None:
+        return None
+    state = np.random.SeedSequence(seed, spawn_key=key).generate_state(4, dtype=np.uint32)
+    return random.Random(int.from_bytes(state.tobytes(), "little"))
+
+
+def spawn_generator(seed: Optional[int], *key: int) -> np.random.Generator:
+    """
+    Независимый поток случайных чисел NumPy для пакетной части запуска (см. spawn_rng)
+
+    Args:
+        seed: Зерно запуска (None - без фиксации)
+        *key: Ключ потока (spawn_key)
+
+    Returns:
+        np.random.Generator
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=key))
+
+
+# Последовательности кириллических символов (для приближенного подсчета токенов)
+CYRILLIC_RE = re.compile(r"[А-Яа-яЁё]+")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Приближенный подсчет токенов без обращения к API
+
+    Кириллица токенизируется плотнее латиницы: в среднем ~2.5 символа на токен
+    против ~4 символов для латиницы, цифр и пунктуации.
+
+    Args:
+        text: Исходный текст
+
+    Returns:
+        Оценка количества токенов
+    """
+    if not text:
+        return 0
+    cyrillic = sum(map(len, CYRILLIC_RE.findall(text)))
+    return math.ceil(cyrillic / 2.5 + (len(text) - cyrillic) / 4)
+
 class BankReviewsAnalyzer:
     """Класс для анализа отзывов о банках и извлечения полезной информации"""
 
@@ -123,11 +333,18 @@ class BankReviewsAnalyzer:
         self.sentiment_by_bank = {}
         self.frequent_terms = {}
         self.topics = {}
-        self.russian_stopwords = set(stopwords.words('russian')) | {
-            'банк', 'банка', 'банку', 'банком', 'банке', 'банков', 'банки', 'банкам', 'банками', 'банках',
-            'это', 'этот', 'эта', 'эти', 'того', 'этого', 'тот', 'те', 'который', 'которого', 'которая',
-            'когда', 'где', 'как', 'что', 'чем', 'почему', 'зачем', 'кто', 'кого', 'кому', 'кем', 'ком'
-        }
+        self._russian_stopwords = None
+
+    @property
+    def russian_stopwords(self) -> Set[str]:
+        """Стоп-слова для анализа отзывов (NLTK загружается при первом обращении)"""
+        if self._russian_stopwords is None:
+            self._russian_stopwords = set(load_russian_stopwords()) | {
+                'банк', 'банка', 'банку', 'банком', 'банке', 'банков', 'банки', 'банкам', 'банками', 'банках',
+                'это', 'этот', 'эта', 'эти', 'того', 'этого', 'тот', 'те', 'который', 'которого', 'которая',
+                'когда', 'где', 'как', 'что', 'чем', 'почему', 'зачем', 'кто', 'кого', 'кому', 'кем', 'ком'
+            }
+        return self._russian_stopwords
 
     def load_reviews(self, file_data) -> None:
         """
@@ -218,6 +435,11 @@ class BankReviewsAnalyzer:
         # Извлечение наиболее частых терминов и проблем из отзывов
         if 'text' in self.reviews_data.columns:
             try:
+                # sklearn и токенизатор NLTK нужны только для анализа отзывов
+                from nltk.tokenize import word_tokenize
+                from sklearn.feature_extraction.text import TfidfVectorizer
+                from sklearn.decomposition import LatentDirichletAllocation
+
                 # Получение частотности терминов для всех отзывов
                 all_texts = ' '.join(self.reviews_data['text'].fillna('').astype(str).tolist())
                 all_words = [word.lower() for word in word_tokenize(all_texts)
@@ -369,293 +591,417 @@ class BankReviewsAnalyzer:
         result['categorized_terms'] = dict(categorized_terms)
         return result
 
+
+# Каталоги базы знаний (FinancialKnowledgeBase)
+# Уровни финансовой грамотности
+FINANCIAL_LITERACY_LEVELS = freeze_catalog({
+    "отсутствие знаний": {
+        "description": "Практически не знаком с банковскими услугами и финансовыми инструментами",
+        "vocabulary_complexity": 0.2,
+        "accuracy": 0.3,
+        "confidence": 0.5,
+        "detail_level": 0.2
+    },
+    "начинающий": {
+        "description": "Имеет базовые знания (банковские карты, простые вклады)",
+        "vocabulary_complexity": 0.4,
+        "accuracy": 0.5,
+        "confidence": 0.6,
+        "detail_level": 0.4
+    },
+    "средний": {
+        "description": "Понимает основные финансовые инструменты, имеет опыт использования кредитов",
+        "vocabulary_complexity": 0.6,
+        "accuracy": 0.7,
+        "confidence": 0.7,
+        "detail_level": 0.6
+    },
+    "продвинутый": {
+        "description": "Хорошо разбирается в банковских продуктах, имеет опыт инвестирования",
+        "vocabulary_complexity": 0.8,
+        "accuracy": 0.85,
+        "confidence": 0.8,
+        "detail_level": 0.8
+    },
+    "эксперт": {
+        "description": "Глубоко понимает финансовые процессы, активно использует сложные финансовые инструменты",
+        "vocabulary_complexity": 0.95,
+        "accuracy": 0.95,
+        "confidence": 0.9,
+        "detail_level": 0.9
+    }
+})
+
+# Словарь финансовых терминов по уровням
+FINANCIAL_VOCABULARY = freeze_catalog({
+    "отсутствие знаний": [
+        "деньги", "зарплата", "банкомат", "карточка", "счет в банке", "проценты", "кредит", "долг",
+        "комиссия", "накопления", "сберкнижка", "пластиковая карта", "обналичить", "снять деньги",
+        "положить деньги", "банк", "посчитать проценты", "переплата", "рассрочка", "пин-код"
+    ],
+    "начинающий": [
+        "дебетовая карта", "кредитная карта", "вклад", "процентная ставка", "овердрафт",
+        "банковский счет", "мобильный банк", "перевод", "снятие наличных", "пополнение счета",
+        "кредитный лимит", "задолженность", "минимальный платеж", "льготный период", "смс-информирование",
+        "интернет-банк", "мобильное приложение", "страховка", "комиссия за обслуживание", "остаток по счету"
+    ],
+    "средний": [
+        "капитализация процентов", "льготный период", "кредитная история", "рефинансирование",
+        "автоплатеж", "кешбэк", "задолженность", "кредитный лимит", "страховка", "депозит",
+        "инвестиции", "накопительный счет", "потребительский кредит", "ипотека", "досрочное погашение",
+        "аннуитетный платеж", "целевой кредит", "конвертация валют", "неснижаемый остаток",
+        "овердрафт", "пролонгация вклада", "составление бюджета", "налоговый вычет"
+    ],
+    "продвинутый": [
+        "диверсификация", "инвестиционный портфель", "облигации", "акции", "фондовый рынок",
+        "аннуитетный платеж", "ипотечные каникулы", "брокерский счет", "ИИС", "налоговый вычет",
+        "пассивный доход", "финансовое планирование", "страхование жизни", "НПФ", "пенсионные накопления",
+        "валютный риск", "ключевая ставка", "биржевой курс", "срочный рынок", "индексный фонд",
+        "реструктуризация кредита", "кредитный скоринг", "лизинг", "субсидирование ставки"
+    ],
+    "эксперт": [
+        "волатильность", "ликвидность", "хеджирование рисков", "ETF", "фьючерсы", "облигации федерального займа",
+        "дюрация", "аллокация активов", "доходность к погашению", "структурные продукты", "маржинальная торговля",
+        "деривативы", "РЕПО", "своп", "субординированные облигации", "листинг", "интервальные ПИФы",
+        "безотзывные депозиты", "эскроу счет", "кредитные дефолтные свопы", "опционы", "финансовые коэффициенты",
+        "ранжирование активов", "первичное размещение", "торговля в шорт", "стоп-лосс"
+    ]
+})
+
+# Типичные заблуждения о финансах по уровню знаний
+FINANCIAL_MISCONCEPTIONS = freeze_catalog({
+    "отсутствие знаний": [
+        "Все банки одинаковые, разницы нет",
+        "Кредит - это всегда плохо, а долг - признак безответственности",
+        "Все банки обманывают клиентов",
+        "Хранить деньги дома надежнее, чем в банке",
+        "Инвестиции - это только для богатых",
+        "Наличные деньги всегда лучше безналичных",
+        "Чем больше банк, тем он надежнее",
+        "При оформлении кредита главное - низкая процентная ставка",
+        "Банкоматы других банков всегда берут огромную комиссию",
+        "Банковские карты небезопасны, с них легко украсть деньги",
+        "Любую банковскую услугу можно отменить в течение 14 дней",
+        "Страхование - это всегда переплата",
+        "В интернет-банке легко могут украсть все деньги",
+        "Все финансовые вопросы очень сложные, в них невозможно разобраться"
+    ],
+    "начинающий": [
+        "Кредитная карта - это бесплатные деньги",
+        "Чем выше процент по вкладу, тем надежнее банк",
+        "Страхование - это всегда переплата",
+        "Любой кредит можно погасить досрочно без последствий",
+        "Если не снимать деньги с карты, комиссий не будет",
+        "Перевыпуск карты всегда платный",
+        "Всегда выгоднее брать кредит в том банке, где получаешь зарплату",
+        "Если платить минимальный платеж по кредитной карте, долг не растет",
+        "Ипотека - это всегда невыгодно, лучше копить на квартиру",
+        "Все инвестиции очень рискованные",
+        "Овердрафт - это дополнительная бесплатная услуга",
+        "Комиссия зависит только от суммы перевода",
+        "Дебетовая и кредитная карты работают одинаково"
+    ],
+    "средний": [
+        "Инвестиции всегда приносят доход",
+        "Кешбэк - это просто маркетинг без реальной выгоды",
+        "Чем больше кредитных карт, тем лучше кредитная история",
+        "Рефинансирование всегда выгодно",
+        "Все страховки одинаковые по покрытию",
+        "Золото - самая надежная инвестиция",
+        "Чем выше кэшбэк, тем выгоднее карта",
+        "Всегда лучше досрочно погашать кредит",
+        "Инвестиционный счет (ИИС) выгоден только богатым",
+        "Налоговый вычет можно получить только один раз",
+        "ETF фонды всегда лучше ПИФов",
+        "Для инвестиций нужны большие суммы денег",
+        "При инфляции выгоднее всего хранить деньги в валюте"
+    ]
+})
+
+# Типичные проблемные ситуации с банками
+BANKING_PROBLEMS = freeze_catalog({
+    "общие": [
+        "Долгое ожидание в очереди в отделении",
+        "Сложный и запутанный интерфейс приложения",
+        "Высокие комиссии за переводы",
+        "Частые сбои в работе онлайн-банка",
+        "Навязчивые звонки с предложением услуг",
+        "Плохая работа службы поддержки",
+        "Изменение условий обслуживания без предупреждения"
+    ],
+    "карты": [
+        "Неожиданное списание средств за обслуживание карты",
+        "Проблемы с начислением кэшбэка",
+        "Блокировка карты по подозрению в мошенничестве",
+        "Отказ в увеличении кредитного лимита",
+        "Проблемы с использованием карты за границей",
+        "Неожиданные комиссии при снятии наличных"
+    ],
+    "кредиты": [
+        "Отказ в выдаче кредита без объяснения причин",
+        "Скрытые комиссии при оформлении кредита",
+        "Навязывание дополнительных услуг при оформлении кредита",
+        "Проблемы с досрочным погашением",
+        "Ошибочное начисление штрафов за просрочку",
+        "Сложности с получением справки о погашении кредита"
+    ],
+    "вклады": [
+        "Проблемы с закрытием вклада",
+        "Некорректное начисление процентов",
+        "Отказ в досрочном снятии средств",
+        "Изменение процентной ставки в одностороннем порядке",
+        "Проблемы с автоматической пролонгацией вклада"
+    ],
+    "онлайн-банкинг": [
+        "Сложная процедура восстановления доступа",
+        "Ошибки при проведении платежей",
+        "Отсутствие нужных функций в приложении",
+        "Некорректное отображение баланса",
+        "Сбои при входе в приложение"
+    ]
+})
+
+# Модели финансового поведения
+FINANCIAL_BEHAVIOR_PATTERNS = freeze_catalog({
+    "избегающий риска": [
+        "Я предпочитаю надежные способы сбережения, даже если они менее доходны",
+        "Лучше иметь меньший, но гарантированный доход",
+        "Я избегаю кредитов, если только они не крайне необходимы",
+        "Перед любым финансовым решением я долго все изучаю",
+        "Стараюсь всегда иметь финансовую подушку на случай непредвиденных расходов",
+        "Предпочитаю консервативные финансовые инструменты",
+        "Внимательно изучаю все условия договоров"
+    ],
+    "импульсивный": [
+        "Я часто принимаю спонтанные финансовые решения",
+        "Меня привлекают акции и спецпредложения",
+        "Я могу взять кредит на крупную покупку без длительных раздумий",
+        "Планирование бюджета не для меня",
+        "Предпочитаю тратить, а не копить",
+        "Часто поддаюсь на маркетинговые уловки",
+        "Живу сегодняшним днем, не думая о завтрашнем"
+    ],
+    "прагматичный": [
+        "Я всегда сравниваю условия разных банков",
+        "Важно понимать все условия договора",
+        "Я регулярно анализирую свои расходы",
+        "Перед крупными тратами я обдумываю все за и против",
+        "Веду учет доходов и расходов",
+        "Пользуюсь финансовыми инструментами, которые реально приносят пользу",
+        "Стараюсь находить баланс между тратами и сбережениями"
+    ],
+    "осознанный минималист": [
+        "Стараюсь тщательно выбирать на что тратить деньги",
+        "Предпочитаю качественные вещи, которые прослужат долго",
+        "Считаю, что деньги должны приносить пользу и радость",
+        "Не гонюсь за модой и брендами",
+        "Избегаю импульсивных покупок",
+        "Трачу на то, что действительно ценно для меня"
+    ],
+    "статусный": [
+        "Для меня важен престиж банка и премиальное обслуживание",
+        "Предпочитаю платиновые и премиальные карты",
+        "Готов платить больше за статусные услуги и продукты",
+        "Важно иметь лучшие условия обслуживания",
+        "Обращаю внимание на бренд и имидж финансовой организации",
+        "Пользуюсь дополнительными премиальными сервисами"
+    ]
+})
+
+# Распространенные финансовые цели людей
+FINANCIAL_GOALS = freeze_catalog({
+    "краткосрочные": [
+        "накопить на отпуск",
+        "купить новый телефон/гаджет",
+        "сделать ремонт",
+        "создать подушку безопасности",
+        "погасить кредит",
+        "накопить на обучение",
+        "купить подарок близкому человеку"
+    ],
+    "среднесрочные": [
+        "накопить на автомобиль",
+        "первоначальный взнос по ипотеке",
+        "оплатить образование",
+        "открыть небольшой бизнес",
+        "сделать капитальный ремонт в квартире",
+        "накопить на свадьбу"
+    ],
+    "долгосрочные": [
+        "накопить на пенсию",
+        "купить недвижимость без ипотеки",
+        "обеспечить образование детям",
+        "достичь финансовой независимости",
+        "создать пассивный доход",
+        "накопить на дорогостоящее лечение"
+    ]
+})
+
+# Банковские продукты и их особенности
+BANKING_PRODUCTS = freeze_catalog({
+    "дебетовые карты": {
+        "назначение": "Для хранения денег и ежедневных расчетов",
+        "функции": ["платежи", "переводы", "снятие наличных", "кэшбэк", "бесконтактная оплата"],
+        "особенности": ["могут иметь плату за обслуживание", "разные условия кэшбэка и бонусов", "лимиты на снятие наличных"]
+    },
+    "кредитные карты": {
+        "назначение": "Для заимствования денег у банка для покупок",
+        "функции": ["льготный период", "кредитный лимит", "минимальный платеж", "кэшбэк", "бонусные программы"],
+        "особенности": ["высокие проценты после льготного периода", "комиссии за снятие наличных", "плата за обслуживание"]
+    },
+    "потребительские кредиты": {
+        "назначение": "Для крупных покупок или других целей",
+        "функции": ["фиксированная сумма", "регулярные ежемесячные платежи", "фиксированный срок"],
+        "особенности": ["требуется подтверждение дохода", "может требоваться залог или поручитель", "в случае просрочки начисляются штрафы"]
+    },
+    "ипотека": {
+        "назначение": "Для покупки недвижимости",
+        "функции": ["длительный срок (до 30 лет)", "залог недвижимости", "первоначальный взнос"],
+        "особенности": ["строгая проверка платежеспособности", "обязательное страхование", "возможность использования материнского капитала"]
+    },
+    "вклады": {
+        "назначение": "Для сбережения и приумножения денег",
+        "функции": ["начисление процентов", "срочные и до востребования", "возможность пополнения", "капитализация процентов"],
+        "особенности": ["защита вкладов до 1,4 млн рублей", "штрафы за досрочное снятие", "разные процентные ставки в зависимости от суммы и срока"]
+    },
+    "накопительные счета": {
+        "назначение": "Для гибкого накопления",
+        "функции": ["свободное пополнение и снятие", "начисление процентов на остаток", "нет срока"],
+        "особенности": ["ставка обычно ниже, чем по вкладам", "проценты часто зависят от суммы на счете", "банк может менять условия"]
+    },
+    "инвестиционные продукты": {
+        "назначение": "Для приумножения капитала",
+        "функции": ["акции", "облигации", "ПИФы", "ИИС", "брокерский счет"],
+        "особенности": ["нет гарантии доходности", "есть риски", "возможность налоговых вычетов", "долгосрочный характер"]
+    }
+})
+
+
+# Порядок уровней финансовой грамотности: пул уровня включает элементы всех предыдущих
+LITERACY_LEVELS_ORDER = ("отсутствие знаний", "начинающий", "средний", "продвинутый", "эксперт")
+
+
+@lru_cache(maxsize=None)
+def knowledge_base_pools() -> SimpleNamespace:
+    """
+    Плоские пулы каталогов базы знаний для пакетной выборки (строятся один раз на процесс)
+
+    Словарь и заблуждения уровня включают элементы всех предыдущих уровней,
+    поэтому пул уровня - это префикс плоского списка, упорядоченного по уровням.
+
+    Returns:
+        SimpleNamespace с плоскими кортежами и массивами длин префиксов (только для чтения)
+    """
+    levels_order = LITERACY_LEVELS_ORDER
+
+    flat_vocabulary = []
+    vocabulary_prefix = []
+    flat_misconceptions = []
+    misconception_prefix = []
+    for level in levels_order:
+        flat_vocabulary.extend(FINANCIAL_VOCABULARY.get(level, ()))
+        vocabulary_prefix.append(len(flat_vocabulary))
+        flat_misconceptions.extend(FINANCIAL_MISCONCEPTIONS.get(level, ()))
+        misconception_prefix.append(len(flat_misconceptions))
+
+    vocabulary_prefix = np.array(vocabulary_prefix)
+    misconception_prefix = np.array(misconception_prefix)
+    vocabulary_prefix.flags.writeable = False
+    misconception_prefix.flags.writeable = False
+
+    return SimpleNamespace(
+        flat_vocabulary=tuple(flat_vocabulary),
+        vocabulary_prefix=vocabulary_prefix,
+        flat_misconceptions=tuple(flat_misconceptions),
+        misconception_prefix=misconception_prefix,
+        flat_goals=tuple(goal for goals in FINANCIAL_GOALS.values() for goal in goals),
+        flat_problems=tuple(problem for problems in BANKING_PROBLEMS.values() for problem in problems),
+        # Готовые накопительные пулы уровней для одиночных вызовов (без сборки списка на каждый вызов)
+        vocabulary_by_level=tuple(tuple(flat_vocabulary[:size]) for size in vocabulary_prefix.tolist()),
+        misconceptions_by_level=tuple(tuple(flat_misconceptions[:size]) for size in misconception_prefix.tolist()),
+        level_index=MappingProxyType({level: i for i, level in enumerate(levels_order)})
+    )
+
+
 class FinancialKnowledgeBase:
     """База знаний о финансовых продуктах, терминах и типичных заблуждениях"""
 
     def __init__(self):
         """Инициализация базы знаний"""
-        # Уровни финансовой грамотности
-        self.financial_literacy_levels = {
-            "отсутствие знаний": {
-                "description": "Практически не знаком с банковскими услугами и финансовыми инструментами",
-                "vocabulary_complexity": 0.2,
-                "accuracy": 0.3,
-                "confidence": 0.5,
-                "detail_level": 0.2
-            },
-            "начинающий": {
-                "description": "Имеет базовые знания (банковские карты, простые вклады)",
-                "vocabulary_complexity": 0.4,
-                "accuracy": 0.5,
-                "confidence": 0.6,
-                "detail_level": 0.4
-            },
-            "средний": {
-                "description": "Понимает основные финансовые инструменты, имеет опыт использования кредитов",
-                "vocabulary_complexity": 0.6,
-                "accuracy": 0.7,
-                "confidence": 0.7,
-                "detail_level": 0.6
-            },
-            "продвинутый": {
-                "description": "Хорошо разбирается в банковских продуктах, имеет опыт инвестирования",
-                "vocabulary_complexity": 0.8,
-                "accuracy": 0.85,
-                "confidence": 0.8,
-                "detail_level": 0.8
-            },
-            "эксперт": {
-                "description": "Глубоко понимает финансовые процессы, активно использует сложные финансовые инструменты",
-                "vocabulary_complexity": 0.95,
-                "accuracy": 0.95,
-                "confidence": 0.9,
-                "detail_level": 0.9
-            }
-        }
+        # Статические каталоги создаются один раз при импорте модуля и общие для всех экземпляров
+        self.financial_literacy_levels = FINANCIAL_LITERACY_LEVELS
+        self.financial_vocabulary = FINANCIAL_VOCABULARY
+        self.financial_misconceptions = FINANCIAL_MISCONCEPTIONS
+        self.banking_problems = BANKING_PROBLEMS
+        self.financial_behavior_patterns = FINANCIAL_BEHAVIOR_PATTERNS
+        self.financial_goals = FINANCIAL_GOALS
+        self.banking_products = BANKING_PRODUCTS
+
+        self._build_sampling_pools()
+
+    def _build_sampling_pools(self) -> None:
+        """Плоские пулы для пакетной выборки (общие для всех экземпляров, см. knowledge_base_pools)"""
+        pools = knowledge_base_pools()
+        self._flat_vocabulary = pools.flat_vocabulary
+        self._vocabulary_prefix = pools.vocabulary_prefix
+        self._flat_misconceptions = pools.flat_misconceptions
+        self._misconception_prefix = pools.misconception_prefix
+        self._flat_goals = pools.flat_goals
+        self._flat_problems = pools.flat_problems
+        self._vocabulary_by_level = pools.vocabulary_by_level
+        self._misconceptions_by_level = pools.misconceptions_by_level
+        self._level_index = pools.level_index
+
+    def sample_vocabulary_batch(self, literacy_idx: np.ndarray, rng: np.random.Generator,
+                                num_terms: int = 10) -> np.ndarray:
+        """
+        Пакетная выборка словарного запаса (аналог get_vocabulary_for_level для массива персон)
 
-        # Словарь финансовых терминов по уровням
-        self.financial_vocabulary = {
-            "отсутствие знаний": [
-                "деньги", "зарплата", "банкомат", "карточка", "счет в банке", "проценты", "кредит", "долг",
-                "комиссия", "накопления", "сберкнижка", "пластиковая карта", "обналичить", "снять деньги",
-                "положить деньги", "банк", "посчитать проценты", "переплата", "рассрочка", "пин-код"
-            ],
-            "начинающий": [
-                "дебетовая карта", "кредитная карта", "вклад", "процентная ставка", "овердрафт",
-                "банковский счет", "мобильный банк", "перевод", "снятие наличных", "пополнение счета",
-                "кредитный лимит", "задолженность", "минимальный платеж", "льготный период", "смс-информирование",
-                "интернет-банк", "мобильное приложение", "страховка", "комиссия за обслуживание", "остаток по счету"
-            ],
-            "средний": [
-                "капитализация процентов", "льготный период", "кредитная история", "рефинансирование",
-                "автоплатеж", "кешбэк", "задолженность", "кредитный лимит", "страховка", "депозит",
-                "инвестиции", "накопительный счет", "потребительский кредит", "ипотека", "досрочное погашение",
-                "аннуитетный платеж", "целевой кредит", "конвертация валют", "неснижаемый остаток",
-                "овердрафт", "пролонгация вклада", "составление бюджета", "налоговый вычет"
-            ],
-            "продвинутый": [
-                "диверсификация", "инвестиционный портфель", "облигации", "акции", "фондовый рынок",
-                "аннуитетный платеж", "ипотечные каникулы", "брокерский счет", "ИИС", "налоговый вычет",
-                "пассивный доход", "финансовое планирование", "страхование жизни", "НПФ", "пенсионные накопления",
-                "валютный риск", "ключевая ставка", "биржевой курс", "срочный рынок", "индексный фонд",
-                "реструктуризация кредита", "кредитный скоринг", "лизинг", "субсидирование ставки"
-            ],
-            "эксперт": [
-                "волатильность", "ликвидность", "хеджирование рисков", "ETF", "фьючерсы", "облигации федерального займа",
-                "дюрация", "аллокация активов", "доходность к погашению", "структурные продукты", "маржинальная торговля",
-                "деривативы", "РЕПО", "своп", "субординированные облигации", "листинг", "интервальные ПИФы",
-                "безотзывные депозиты", "эскроу счет", "кредитные дефолтные свопы", "опционы", "финансовые коэффициенты",
-                "ранжирование активов", "первичное размещение", "торговля в шорт", "стоп-лосс"
-            ]
-        }
+        Args:
+            literacy_idx: Индексы уровней финансовой грамотности
+            rng: Генератор случайных чисел NumPy
+            num_terms: Количество терминов
 
-        # Типичные заблуждения о финансах по уровню знаний
-        self.financial_misconceptions = {
-            "отсутствие знаний": [
-                "Все банки одинаковые, разницы нет",
-                "Кредит - это всегда плохо, а долг - признак безответственности",
-                "Все банки обманывают клиентов",
-                "Хранить деньги дома надежнее, чем в банке",
-                "Инвестиции - это только для богатых",
-                "Наличные деньги всегда лучше безналичных",
-                "Чем больше банк, тем он надежнее",
-                "При оформлении кредита главное - низкая процентная ставка",
-                "Банкоматы других банков всегда берут огромную комиссию",
-                "Банковские карты небезопасны, с них легко украсть деньги",
-                "Любую банковскую услугу можно отменить в течение 14 дней",
-                "Страхование - это всегда переплата",
-                "В интернет-банке легко могут украсть все деньги",
-                "Все финансовые вопросы очень сложные, в них невозможно разобраться"
-            ],
-            "начинающий": [
-                "Кредитная карта - это бесплатные деньги",
-                "Чем выше процент по вкладу, тем надежнее банк",
-                "Страхование - это всегда переплата",
-                "Любой кредит можно погасить досрочно без последствий",
-                "Если не снимать деньги с карты, комиссий не будет",
-                "Перевыпуск карты всегда платный",
-                "Всегда выгоднее брать кредит в том банке, где получаешь зарплату",
-                "Если платить минимальный платеж по кредитной карте, долг не растет",
-                "Ипотека - это всегда невыгодно, лучше копить на квартиру",
-                "Все инвестиции очень рискованные",
-                "Овердрафт - это дополнительная бесплатная услуга",
-                "Комиссия зависит только от суммы перевода",
-                "Дебетовая и кредитная карты работают одинаково"
-            ],
-            "средний": [
-                "Инвестиции всегда приносят доход",
-                "Кешбэк - это просто маркетинг без реальной выгоды",
-                "Чем больше кредитных карт, тем лучше кредитная история",
-                "Рефинансирование всегда выгодно",
-                "Все страховки одинаковые по покрытию",
-                "Золото - самая надежная инвестиция",
-                "Чем выше кэшбэк, тем выгоднее карта",
-                "Всегда лучше досрочно погашать кредит",
-                "Инвестиционный счет (ИИС) выгоден только богатым",
-                "Налоговый вычет можно получить только один раз",
-                "ETF фонды всегда лучше ПИФов",
-                "Для инвестиций нужны большие суммы денег",
-                "При инфляции выгоднее всего хранить деньги в валюте"
-            ]
-        }
+        Returns:
+            Массив (N x num_terms) индексов в плоском словаре (-1 - нет термина)
+        """
+        pool_sizes = self._vocabulary_prefix[literacy_idx]
+        counts = np.minimum(num_terms, pool_sizes)
+        return sample_prefix_without_replacement(rng, pool_sizes, counts, num_terms)
 
-        # Типичные проблемные ситуации с банками
-        self.banking_problems = {
-            "общие": [
-                "Долгое ожидание в очереди в отделении",
-                "Сложный и запутанный интерфейс приложения",
-                "Высокие комиссии за переводы",
-                "Частые сбои в работе онлайн-банка",
-                "Навязчивые звонки с предложением услуг",
-                "Плохая работа службы поддержки",
-                "Изменение условий обслуживания без предупреждения"
-            ],
-            "карты": [
-                "Неожиданное списание средств за обслуживание карты",
-                "Проблемы с начислением кэшбэка",
-                "Блокировка карты по подозрению в мошенничестве",
-                "Отказ в увеличении кредитного лимита",
-                "Проблемы с использованием карты за границей",
-                "Неожиданные комиссии при снятии наличных"
-            ],
-            "кредиты": [
-                "Отказ в выдаче кредита без объяснения причин",
-                "Скрытые комиссии при оформлении кредита",
-                "Навязывание дополнительных услуг при оформлении кредита",
-                "Проблемы с досрочным погашением",
-                "Ошибочное начисление штрафов за просрочку",
-                "Сложности с получением справки о погашении кредита"
-            ],
-            "вклады": [
-                "Проблемы с закрытием вклада",
-                "Некорректное начисление процентов",
-                "Отказ в досрочном снятии средств",
-                "Изменение процентной ставки в одностороннем порядке",
-                "Проблемы с автоматической пролонгацией вклада"
-            ],
-            "онлайн-банкинг": [
-                "Сложная процедура восстановления доступа",
-                "Ошибки при проведении платежей",
-                "Отсутствие нужных функций в приложении",
-                "Некорректное отображение баланса",
-                "Сбои при входе в приложение"
-            ]
-        }
+    def sample_misconceptions_batch(self, literacy_idx: np.ndarray, rng: np.random.Generator,
+                                    num_items: int = 3) -> np.ndarray:
+        """
+        Пакетная выборка заблуждений (аналог get_misconceptions_for_level для массива персон)
 
-        # Модели финансового поведения
-        self.financial_behavior_patterns = {
-            "избегающий риска": [
-                "Я предпочитаю надежные способы сбережения, даже если они менее доходны",
-                "Лучше иметь меньший, но гарантированный доход",
-                "Я избегаю кредитов, если только они не крайне необходимы",
-                "Перед любым финансовым решением я долго все изучаю",
-                "Стараюсь всегда иметь финансовую подушку на случай непредвиденных расходов",
-                "Предпочитаю консервативные финансовые инструменты",
-                "Внимательно изучаю все условия договоров"
-            ],
-            "импульсивный": [
-                "Я часто принимаю спонтанные финансовые решения",
-                "Меня привлекают акции и спецпредложения",
-                "Я могу взять кредит на крупную покупку без длительных раздумий",
-                "Планирование бюджета не для меня",
-                "Предпочитаю тратить, а не копить",
-                "Часто поддаюсь на маркетинговые уловки",
-                "Живу сегодняшним днем, не думая о завтрашнем"
-            ],
-            "прагматичный": [
-                "Я всегда сравниваю условия разных банков",
-                "Важно понимать все условия договора",
-                "Я регулярно анализирую свои расходы",
-                "Перед крупными тратами я обдумываю все за и против",
-                "Веду учет доходов и расходов",
-                "Пользуюсь финансовыми инструментами, которые реально приносят пользу",
-                "Стараюсь находить баланс между тратами и сбережениями"
-            ],
-            "осознанный минималист": [
-                "Стараюсь тщательно выбирать на что тратить деньги",
-                "Предпочитаю качественные вещи, которые прослужат долго",
-                "Считаю, что деньги должны приносить пользу и радость",
-                "Не гонюсь за модой и брендами",
-                "Избегаю импульсивных покупок",
-                "Трачу на то, что действительно ценно для меня"
-            ],
-            "статусный": [
-                "Для меня важен престиж банка и премиальное обслуживание",
-                "Предпочитаю платиновые и премиальные карты",
-                "Готов платить больше за статусные услуги и продукты",
-                "Важно иметь лучшие условия обслуживания",
-                "Обращаю внимание на бренд и имидж финансовой организации",
-                "Пользуюсь дополнительными премиальными сервисами"
-            ]
-        }
+        Args:
+            literacy_idx: Индексы уровней финансовой грамотности
+            rng: Генератор случайных чисел NumPy
+            num_items: Количество заблуждений
 
-        # Распространенные финансовые цели людей
-        self.financial_goals = {
-            "краткосрочные": [
-                "накопить на отпуск",
-                "купить новый телефон/гаджет",
-                "сделать ремонт",
-                "создать подушку безопасности",
-                "погасить кредит",
-                "накопить на обучение",
-                "купить подарок близкому человеку"
-            ],
-            "среднесрочные": [
-                "накопить на автомобиль",
-                "первоначальный взнос по ипотеке",
-                "оплатить образование",
-                "открыть небольшой бизнес",
-                "сделать капитальный ремонт в квартире",
-                "накопить на свадьбу"
-            ],
-            "долгосрочные": [
-                "накопить на пенсию",
-                "купить недвижимость без ипотеки",
-                "обеспечить образование детям",
-                "достичь финансовой независимости",
-                "создать пассивный доход",
-                "накопить на дорогостоящее лечение"
-            ]
-        }
+        Returns:
+            Массив (N x num_items) индексов в плоском списке заблуждений (-1 - нет элемента)
+        """
+        pool_sizes = self._misconception_prefix[literacy_idx]
+        # Чем выше уровень, тем меньше заблуждений
+        counts = np.minimum(np.minimum(num_items, np.maximum(1, 5 - literacy_idx)), pool_sizes)
+        return sample_prefix_without_replacement(rng, pool_sizes, counts, num_items)
 
-        # Банковские продукты и их особенности
-        self.banking_products = {
-            "дебетовые карты": {
-                "назначение": "Для хранения денег и ежедневных расчетов",
-                "функции": ["платежи", "переводы", "снятие наличных", "кэшбэк", "бесконтактная оплата"],
-                "особенности": ["могут иметь плату за обслуживание", "разные условия кэшбэка и бонусов", "лимиты на снятие наличных"]
-            },
-            "кредитные карты": {
-                "назначение": "Для заимствования денег у банка для покупок",
-                "функции": ["льготный период", "кредитный лимит", "минимальный платеж", "кэшбэк", "бонусные программы"],
-                "особенности": ["высокие проценты после льготного периода", "комиссии за снятие наличных", "плата за обслуживание"]
-            },
-            "потребительские кредиты": {
-                "назначение": "Для крупных покупок или других целей",
-                "функции": ["фиксированная сумма", "регулярные ежемесячные платежи", "фиксированный срок"],
-                "особенности": ["требуется подтверждение дохода", "может требоваться залог или поручитель", "в случае просрочки начисляются штрафы"]
-            },
-            "ипотека": {
-                "назначение": "Для покупки недвижимости",
-                "функции": ["длительный срок (до 30 лет)", "залог недвижимости", "первоначальный взнос"],
-                "особенности": ["строгая проверка платежеспособности", "обязательное страхование", "возможность использования материнского капитала"]
-            },
-            "вклады": {
-                "назначение": "Для сбережения и приумножения денег",
-                "функции": ["начисление процентов", "срочные и до востребования", "возможность пополнения", "капитализация процентов"],
-                "особенности": ["защита вкладов до 1,4 млн рублей", "штрафы за досрочное снятие", "разные процентные ставки в зависимости от суммы и срока"]
-            },
-            "накопительные счета": {
-                "назначение": "Для гибкого накопления",
-                "функции": ["свободное пополнение и снятие", "начисление процентов на остаток", "нет срока"],
-                "особенности": ["ставка обычно ниже, чем по вкладам", "проценты часто зависят от суммы на счете", "банк может менять условия"]
-            },
-            "инвестиционные продукты": {
-                "назначение": "Для приумножения капитала",
-                "функции": ["акции", "облигации", "ПИФы", "ИИС", "брокерский счет"],
-                "особенности": ["нет гарантии доходности", "есть риски", "возможность налоговых вычетов", "долгосрочный характер"]
-            }
-        }
+    def sample_goals_batch(self, n: int, rng: np.random.Generator, num_goals: int = 2) -> np.ndarray:
+        """
+        Пакетная выборка финансовых целей (аналог get_random_financial_goals)
+
+        Args:
+            n: Количество персон
+            rng: Генератор случайных чисел NumPy
+            num_goals: Количество целей
+
+        Returns:
+            Массив (N x num_goals) индексов в плоском списке целей
+        """
+        pool_sizes = np.full(n, len(self._flat_goals))
+        counts = np.minimum(num_goals, pool_sizes)
+        return sample_prefix_without_replacement(rng, pool_sizes, counts, num_goals)
 
     def get_literacy_level_info(self, level: str) -> Dict:
         """
@@ -673,89 +1019,83 @@ class FinancialKnowledgeBase:
             # Возвращаем информацию о среднем уровне, если указанный не найден
             return self.financial_literacy_levels["средний"]
 
-    def get_vocabulary_for_level(self, level: str, num_terms: int = 10) -> List[str]:
+    def get_vocabulary_for_level(self, level: str, num_terms: int = 10,
+                                 rng: Optional[random.Random] = None) -> List[str]:
         """
         Получение словарного запаса для указанного уровня грамотности
 
         Args:
             level: Уровень финансовой грамотности
             num_terms: Количество терминов для возврата
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
             Список финансовых терминов соответствующего уровня
         """
-        # Для каждого уровня включаем термины всех предыдущих уровней
-        all_terms = []
-
-        levels_order = ["отсутствие знаний", "начинающий", "средний", "продвинутый", "эксперт"]
-
-        for l in levels_order:
-            all_terms.extend(self.financial_vocabulary.get(l, []))
-            if l == level:
-                break
+        rng = rng or random
+        # Накопительный пул уровня (термины всех предыдущих уровней включены) построен заранее;
+        # для неизвестного уровня берется весь словарь
+        level_index = self._level_index.get(level, len(self._vocabulary_by_level) - 1)
+        all_terms = self._vocabulary_by_level[level_index]
 
         # Возвращаем случайную выборку терминов
-        return random.sample(all_terms, min(num_terms, len(all_terms)))
+        return rng.sample(all_terms, min(num_terms, len(all_terms)))
 
-    def get_misconceptions_for_level(self, level: str, num_items: int = 3) -> List[str]:
+    def get_misconceptions_for_level(self, level: str, num_items: int = 3,
+                                     rng: Optional[random.Random] = None) -> List[str]:
         """
         Получение типичных заблуждений для указанного уровня грамотности
 
         Args:
             level: Уровень финансовой грамотности
             num_items: Количество заблуждений для возврата
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
             Список типичных финансовых заблуждений
         """
-        # Для каждого уровня включаем заблуждения всех предыдущих уровней
-        all_misconceptions = []
-
-        levels_order = ["отсутствие знаний", "начинающий", "средний", "продвинутый", "эксперт"]
-        level_index = levels_order.index(level) if level in levels_order else 2  # Используем "средний" уровень по умолчанию
-
-        for i in range(level_index + 1):
-            current_level = levels_order[i]
-            if current_level in self.financial_misconceptions:
-                all_misconceptions.extend(self.financial_misconceptions[current_level])
+        rng = rng or random
+        # Накопительный пул уровня (включает все предыдущие уровни) построен заранее
+        level_index = self._level_index.get(level, 2)  # Используем "средний" уровень по умолчанию
+        all_misconceptions = self._misconceptions_by_level[level_index]
 
         # Чем выше уровень, тем меньше заблуждений
         max_misconceptions = max(1, 5 - level_index)
 
-        return random.sample(all_misconceptions, min(num_items, max_misconceptions, len(all_misconceptions)))
+        return rng.sample(all_misconceptions, min(num_items, max_misconceptions, len(all_misconceptions)))
 
-    def get_behavior_patterns(self, behavior_type: str) -> List[str]:
+    def get_behavior_patterns(self, behavior_type: str, rng: Optional[random.Random] = None) -> List[str]:
         """
         Получение шаблонов финансового поведения
 
         Args:
             behavior_type: Тип поведения
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
             Список шаблонов поведения
         """
+        rng = rng or random
         if behavior_type in self.financial_behavior_patterns:
-            return self.financial_behavior_patterns[behavior_type]
+            return list(self.financial_behavior_patterns[behavior_type])
         else:
             # Если тип не найден, возвращаем случайный тип
-            random_type = random.choice(list(self.financial_behavior_patterns.keys()))
-            return self.financial_behavior_patterns[random_type]
+            random_type = rng.choice(list(self.financial_behavior_patterns.keys()))
+            return list(self.financial_behavior_patterns[random_type])
 
-    def get_random_financial_goals(self, num_goals: int = 2) -> List[str]:
+    def get_random_financial_goals(self, num_goals: int = 2, rng: Optional[random.Random] = None) -> List[str]:
         """
         Получение случайных финансовых целей
 
         Args:
             num_goals: Количество целей для возврата
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
             Список финансовых целей
         """
-        all_goals = []
-        for goals in self.financial_goals.values():
-            all_goals.extend(goals)
-
-        return random.sample(all_goals, min(num_goals, len(all_goals)))
+        rng = rng or random
+        return rng.sample(self._flat_goals, min(num_goals, len(self._flat_goals)))
 
     def get_product_info(self, product_type: str) -> Dict:
         """
@@ -768,7 +1108,7 @@ class FinancialKnowledgeBase:
             Словарь с информацией о продукте
         """
         if product_type in self.banking_products:
-            return self.banking_products[product_type]
+            return dict(self.banking_products[product_type])
         else:
             # Возвращаем список всех продуктов
             return {k: v["назначение"] for k, v in self.banking_products.items()}
@@ -784,141 +1124,132 @@ class FinancialKnowledgeBase:
             Список типичных проблем
         """
         if category and category in self.banking_problems:
-            return self.banking_problems[category]
+            return list(self.banking_problems[category])
         elif category is None:
             # Возвращаем все проблемы
-            all_problems = []
-            for problems in self.banking_problems.values():
-                all_problems.extend(problems)
-            return all_problems
+            return list(self._flat_problems)
         else:
-            return self.banking_problems["общие"]
+            return list(self.banking_problems["общие"])
 
 # НОВЫЕ КЛАССЫ ДЛЯ УЛУЧШЕНИЯ РЕАЛИСТИЧНОСТИ РЕСПОНДЕНТОВ
 
+
+# Каталоги когнитивных искажений (CognitiveBiases)
+# Основные финансовые когнитивные искажения
+FINANCIAL_BIASES = freeze_catalog({
+    "эффект_якоря": {
+        "description": "Тенденция чрезмерно полагаться на первую предоставленную информацию (якорь)",
+        "examples": [
+            "Если первая увиденная цена кредита 10%, все остальные предложения сравниваются с ней",
+            "Первоначальная цена товара влияет на восприятие скидки, даже если она завышена",
+            "Зарплатные ожидания формируются вокруг первого полученного предложения"
+        ],
+        "trigger_words": ["первый", "изначально", "сначала", "начальный", "первоначальный"]
+    },
+    "избегание_потерь": {
+        "description": "Потери воспринимаются сильнее, чем эквивалентные выигрыши",
+        "examples": [
+            "Отказ продавать акции в минус, даже когда это рационально",
+            "Страх потерять накопления перевешивает потенциальную выгоду от инвестиций",
+            "Избегание финансовых решений от страха сделать ошибку"
+        ],
+        "trigger_words": ["потеря", "риск", "страх", "опасно", "минус", "убыток"]
+    },
+    "эффект_необратимых_затрат": {
+        "description": "Продолжение инвестирования из-за уже вложенных средств",
+        "examples": [
+            "Продолжение держать убыточные инвестиции, потому что 'уже столько вложил'",
+            "Отказ отказаться от ненужной подписки из-за предыдущих затрат",
+            "Удержание ненужных вещей из-за их стоимости"
+        ],
+        "trigger_words": ["уже вложил", "жалко бросать", "столько потрачено", "не пропадать же"]
+    },
+    "чрезмерная_самоуверенность": {
+        "description": "Переоценка собственных знаний и способностей",
+        "examples": [
+            "Уверенность в способности 'переиграть рынок' без специальных знаний",
+            "Игнорирование профессиональных финансовых советов",
+            "Недостаточная диверсификация из-за уверенности в конкретных активах"
+        ],
+        "trigger_words": ["я лучше знаю", "сам разберусь", "это очевидно", "я уверен"]
+    },
+    "стадное_поведение": {
+        "description": "Следование финансовым решениям большинства",
+        "examples": [
+            "Инвестирование в популярные активы без собственного анализа",
+            "Выбор банка, которым пользуются знакомые",
+            "Паника при падении рынка из-за общего настроения"
+        ],
+        "trigger_words": ["все так делают", "популярно", "тренд", "мои знакомые"]
+    },
+    "ментальный_учет": {
+        "description": "Разделение денег на категории, изменяющее отношение к тратам",
+        "examples": [
+            "Готовность тратить 'подарочные' деньги на роскошь, даже при наличии долгов",
+            "Разделение денег на 'можно тратить' и 'нельзя трогать'",
+            "Разное отношение к одинаковым суммам из разных источников"
+        ],
+        "trigger_words": ["это другие деньги", "эти деньги на", "специальные деньги", "особый случай"]
+    },
+    "эффект_текущего_момента": {
+        "description": "Предпочтение немедленного вознаграждения перед долгосрочной выгодой",
+        "examples": [
+            "Трата на сиюминутные желания вместо откладывания на важные цели",
+            "Импульсивные покупки вместо запланированных",
+            "Отказ от инвестирования в пользу трат на развлечения"
+        ],
+        "trigger_words": ["хочу сейчас", "зачем ждать", "живем один раз", "надо себя баловать"]
+    }
+})
+
+# Уровни склонности к когнитивным искажениям
+BIAS_LEVELS = freeze_catalog({
+    "слабый": 0.2,    # Редко проявляется, слабое влияние
+    "средний": 0.5,   # Периодически проявляется, умеренное влияние
+    "сильный": 0.8    # Часто проявляется, сильное влияние
+})
+
+
 class CognitiveBiases:
     """Класс для моделирования когнитивных искажений в финансовом поведении"""
 
     def __init__(self):
         """Инициализация моделей когнитивных искажений"""
-        # Основные финансовые когнитивные искажения
-        self.financial_biases = {
-            "эффект_якоря": {
-                "description": "Тенденция чрезмерно полагаться на первую предоставленную информацию (якорь)",
-                "examples": [
-                    "Если первая увиденная цена кредита 10%, все остальные предложения сравниваются с ней",
-                    "Первоначальная цена товара влияет на восприятие скидки, даже если она завышена",
-                    "Зарплатные ожидания формируются вокруг первого полученного предложения"
-                ],
-                "trigger_words": ["первый", "изначально", "сначала", "начальный", "первоначальный"]
-            },
-            "избегание_потерь": {
-                "description": "Потери воспринимаются сильнее, чем эквивалентные выигрыши",
-                "examples": [
-                    "Отказ продавать акции в минус, даже когда это рационально",
-                    "Страх потерять накопления перевешивает потенциальную выгоду от инвестиций",
-                    "Избегание финансовых решений от страха сделать ошибку"
-                ],
-                "trigger_words": ["потеря", "риск", "страх", "опасно", "минус", "убыток"]
-            },
-            "эффект_необратимых_затрат": {
-                "description": "Продолжение инвестирования из-за уже вложенных средств",
-                "examples": [
-                    "Продолжение держать убыточные инвестиции, потому что 'уже столько вложил'",
-                    "Отказ отказаться от ненужной подписки из-за предыдущих затрат",
-                    "Удержание ненужных вещей из-за их стоимости"
-                ],
-                "trigger_words": ["уже вложил", "жалко бросать", "столько потрачено", "не пропадать же"]
-            },
-            "чрезмерная_самоуверенность": {
-                "description": "Переоценка собственных знаний и способностей",
-                "examples": [
-                    "Уверенность в способности 'переиграть рынок' без специальных знаний",
-                    "Игнорирование профессиональных финансовых советов",
-                    "Недостаточная диверсификация из-за уверенности в конкретных активах"
-                ],
-                "trigger_words": ["я лучше знаю", "сам разберусь", "это очевидно", "я уверен"]
-            },
-            "стадное_поведение": {
-                "description": "Следование финансовым решениям большинства",
-                "examples": [
-                    "Инвестирование в популярные активы без собственного анализа",
-                    "Выбор банка, которым пользуются знакомые",
-                    "Паника при падении рынка из-за общего настроения"
-                ],
-                "trigger_words": ["все так делают", "популярно", "тренд", "мои знакомые"]
-            },
-            "ментальный_учет": {
-                "description": "Разделение денег на категории, изменяющее отношение к тратам",
-                "examples": [
-                    "Готовность тратить 'подарочные' деньги на роскошь, даже при наличии долгов",
-                    "Разделение денег на 'можно тратить' и 'нельзя трогать'",
-                    "Разное отношение к одинаковым суммам из разных источников"
-                ],
-                "trigger_words": ["это другие деньги", "эти деньги на", "специальные деньги", "особый случай"]
-            },
-            "эффект_текущего_момента": {
-                "description": "Предпочтение немедленного вознаграждения перед долгосрочной выгодой",
-                "examples": [
-                    "Трата на сиюминутные желания вместо откладывания на важные цели",
-                    "Импульсивные покупки вместо запланированных",
-                    "Отказ от инвестирования в пользу трат на развлечения"
-                ],
-                "trigger_words": ["хочу сейчас", "зачем ждать", "живем один раз", "надо себя баловать"]
-            }
-        }
+        # Статические каталоги создаются один раз при импорте модуля и общие для всех экземпляров
+        self.financial_biases = FINANCIAL_BIASES
+        self.bias_levels = BIAS_LEVELS
 
-        # Уровни склонности к когнитивным искажениям
-        self.bias_levels = {
-            "слабый": 0.2,    # Редко проявляется, слабое влияние
-            "средний": 0.5,   # Периодически проявляется, умеренное влияние
-            "сильный": 0.8    # Часто проявляется, сильное влияние
-        }
-
-    def get_random_biases(self, num_biases: int = 2, literacy_level: str = "средний") -> Dict[str, float]:
+    def get_random_biases(self, num_biases: int = 2, literacy_level: str = "средний",
+                          rng: Optional[random.Random] = None) -> Dict[str, float]:
         """
         Генерация случайного набора когнитивных искажений для персоны
 
         Args:
             num_biases: Количество искажений для генерации
             literacy_level: Уровень финансовой грамотности
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
             Словарь с когнитивными искажениями и их силой
         """
-        # Корректируем количество искажений на основе уровня грамотности
-        if literacy_level == "отсутствие знаний":
-            num_biases = min(4, num_biases + 2)
-        elif literacy_level == "начинающий":
-            num_biases = min(3, num_biases + 1)
-        elif literacy_level == "эксперт":
-            num_biases = max(1, num_biases - 1)
-
+        rng = rng or random
         # Выбираем случайные искажения
-        selected_biases = random.sample(list(self.financial_biases.keys()), k=min(num_biases, len(self.financial_biases)))
+        num_biases = self._bias_count(num_biases, literacy_level)
+        selected_biases = rng.sample(list(self.financial_biases.keys()), k=num_biases)
 
         # Определяем силу проявления каждого искажения
         bias_strengths = {}
-
-        # Распределение вероятностей уровней искажений в зависимости от грамотности
-        if literacy_level in ["отсутствие знаний", "начинающий"]:
-            level_weights = {"слабый": 0.2, "средний": 0.3, "сильный": 0.5}
-        elif literacy_level == "средний":
-            level_weights = {"слабый": 0.3, "средний": 0.5, "сильный": 0.2}
-        elif literacy_level in ["продвинутый", "эксперт"]:
-            level_weights = {"слабый": 0.5, "средний": 0.4, "сильный": 0.1}
-        else:
-            level_weights = {"слабый": 0.33, "средний": 0.34, "сильный": 0.33}
+        level_weights = self._bias_level_weights(literacy_level)
 
         # Назначаем силу каждому искажению
         for bias in selected_biases:
-            bias_level = random.choices(
+            bias_level = rng.choices(
                 list(level_weights.keys()),
                 weights=list(level_weights.values())
             )[0]
 
             # Добавляем случайную вариацию для реалистичности
-            strength = self.bias_levels[bias_level] * random.uniform(0.8, 1.2)
+            strength = self.bias_levels[bias_level] * rng.uniform(0.8, 1.2)
             # Ограничиваем в диапазоне [0.1, 1.0]
             strength = max(0.1, min(1.0, strength))
 
@@ -926,26 +1257,86 @@ class CognitiveBiases:
 
         return bias_strengths
 
-    def apply_bias_to_prompt(self, prompt: str, bias_name: str, bias_strength: float) -> str:
+    def _bias_count(self, num_biases: int, literacy_level: str) -> int:
+        """Количество искажений с поправкой на уровень финансовой грамотности"""
+        if literacy_level == "отсутствие знаний":
+            num_biases = min(4, num_biases + 2)
+        elif literacy_level == "начинающий":
+            num_biases = min(3, num_biases + 1)
+        elif literacy_level == "эксперт":
+            num_biases = max(1, num_biases - 1)
+
+        return min(num_biases, len(self.financial_biases))
+
+    def _bias_level_weights(self, literacy_level: str) -> Dict[str, float]:
+        """Распределение вероятностей уровней искажений в зависимости от грамотности"""
+        if literacy_level in ["отсутствие знаний", "начинающий"]:
+            return {"слабый": 0.2, "средний": 0.3, "сильный": 0.5}
+        elif literacy_level == "средний":
+            return {"слабый": 0.3, "средний": 0.5, "сильный": 0.2}
+        elif literacy_level in ["продвинутый", "эксперт"]:
+            return {"слабый": 0.5, "средний": 0.4, "сильный": 0.1}
+        else:
+            return {"слабый": 0.33, "средний": 0.34, "сильный": 0.33}
+
+    def get_random_biases_batch(self, literacy_codes: np.ndarray, literacy_levels: Sequence[str],
+                                rng: np.random.Generator, num_biases: int = 2) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Добавление инструкций по когнитивному искажению в промпт
+        Пакетная генерация когнитивных искажений (распределения совпадают с get_random_biases)
+
+        Args:
+            literacy_codes: Индексы уровней финансовой грамотности для каждой персоны
+            literacy_levels: Названия уровней грамотности (справочник для индексов)
+            rng: Генератор случайных чисел NumPy
+            num_biases: Базовое количество искажений
+
+        Returns:
+            Кортеж (индексы искажений в financial_biases, сила искажений) - массивы (N x max_count),
+            незаполненные позиции: индекс -1 и сила 0
+        """
+        n = len(literacy_codes)
+        counts_by_level = np.array([self._bias_count(num_biases, level) for level in literacy_levels])
+        level_names = list(self.bias_levels.keys())
+        level_values = np.array(list(self.bias_levels.values()))
+        level_table = cumulative_weights([
+            [self._bias_level_weights(level).get(name, 0.0) for name in level_names] for level in literacy_levels
+        ])
+
+        counts = counts_by_level[literacy_codes]
+        max_count = int(counts_by_level.max()) if len(literacy_levels) else 0
+        bias_idx = sample_prefix_without_replacement(
+            rng, np.full(n, len(self.financial_biases)), counts, max_count
+        )
+
+        # Уровень и сила для каждой позиции (лишние позиции отбрасываются маской)
+        slot_literacy = np.repeat(literacy_codes, max_count)
+        levels = sample_categorical(rng, level_table, slot_literacy).reshape(n, max_count)
+        strength = np.clip(level_values[levels] * rng.uniform(0.8, 1.2, size=(n, max_count)), 0.1, 1.0)
+        strength = np.where(bias_idx >= 0, strength, 0.0)
+
+        return bias_idx, strength.astype(np.float32)
+
+    def render_bias(self, bias_name: str, bias_strength: float, rng: Optional[random.Random] = None) -> str:
+        """
+        Блок инструкций по когнитивному искажению (без заголовка раздела)
 
         Args:
-            prompt: Исходный промпт
             bias_name: Название когнитивного искажения
             bias_strength: Сила искажения (0.0-1.0)
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
-            Модифицированный промпт
+            Текст блока или пустая строка для неизвестного искажения
         """
+        rng = rng or random
         if bias_name not in self.financial_biases:
-            return prompt
+            return ""
 
         bias_info = self.financial_biases[bias_name]
         bias_level = "заметно" if bias_strength > 0.65 else "умеренно" if bias_strength > 0.35 else "слегка"
 
         # Выбираем случайный пример проявления искажения
-        example = random.choice(bias_info["examples"])
+        example = rng.choice(bias_info["examples"])
 
         # Формируем инструкцию по применению искажения
         bias_instruction = f"""
@@ -953,138 +1344,165 @@ class CognitiveBiases:
 - {bias_info["description"]}
 - Проявляется {bias_level} (сила: {bias_strength:.1f})
 - Пример: {example}
-- Это может отражаться в ответе фразами типа: "{', '.join(random.sample(bias_info["trigger_words"], k=min(3, len(bias_info["trigger_words"]))))}"
+- Это может отражаться в ответе фразами типа: "{', '.join(rng.sample(bias_info["trigger_words"], k=min(3, len(bias_info["trigger_words"]))))}"
 """
+        return bias_instruction
 
-        # Добавляем инструкцию в промпт
-        if "КОГНИТИВНЫЕ ИСКАЖЕНИЯ:" in prompt:
-            # Если раздел уже есть, добавляем в него
-            prompt = prompt.replace("КОГНИТИВНЫЕ ИСКАЖЕНИЯ:", f"КОГНИТИВНЫЕ ИСКАЖЕНИЯ:\n{bias_instruction}")
-        else:
-            # Иначе добавляем новый раздел перед "ОБЩИЕ ПРАВИЛА ОТВЕТА"
-            if "ОБЩИЕ ПРАВИЛА ОТВЕТА" in prompt:
-                prompt = prompt.replace("ОБЩИЕ ПРАВИЛА ОТВЕТА", f"КОГНИТИВНЫЕ ИСКАЖЕНИЯ:\n{bias_instruction}\n\nОБЩИЕ ПРАВИЛА ОТВЕТА")
-            else:
+    def apply_bias_to_prompt(self, prompt: str, bias_name: str, bias_strength: float,
+                             rng: Optional[random.Random] = None) -> str:
+        """
+        Добавление инструкций по когнитивному искажению в промпт
+
+        Args:
+            prompt: Исходный промпт
+            bias_name: Название когнитивного искажения
+            bias_strength: Сила искажения (0.0-1.0)
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
+
+        Returns:
+            Модифицированный промпт
+        """
+        bias_instruction = self.render_bias(bias_name, bias_strength, rng=rng)
+        if not bias_instruction:
+            return prompt
+
+        # Добавляем инструкцию в промпт
+        if "КОГНИТИВНЫЕ ИСКАЖЕНИЯ:" in prompt:
+            # Если раздел уже есть, добавляем в него
+            prompt = prompt.replace("КОГНИТИВНЫЕ ИСКАЖЕНИЯ:", f"КОГНИТИВНЫЕ ИСКАЖЕНИЯ:\n{bias_instruction}")
+        else:
+            # Иначе добавляем новый раздел перед "ОБЩИЕ ПРАВИЛА ОТВЕТА"
+            if "ОБЩИЕ ПРАВИЛА ОТВЕТА" in prompt:
+                prompt = prompt.replace("ОБЩИЕ ПРАВИЛА ОТВЕТА", f"КОГНИТИВНЫЕ ИСКАЖЕНИЯ:\n{bias_instruction}\n\nОБЩИЕ ПРАВИЛА ОТВЕТА")
+            else:
                 prompt += f"\n\nКОГНИТИВНЫЕ ИСКАЖЕНИЯ:\n{bias_instruction}"
 
         return prompt
 
 
+# Каталоги эмоциональных факторов (EmotionalFactors)
+# Основные эмоциональные факторы, влияющие на финансовое поведение
+FINANCIAL_EMOTIONS = freeze_catalog({
+    "финансовая_тревога": {
+        "description": "Беспокойство и страх по поводу финансового положения/будущего",
+        "examples": [
+            "Постоянное беспокойство о нехватке денег",
+            "Страх потерять работу и доход",
+            "Избегание проверки банковского баланса",
+            "Ощущение, что денег всегда недостаточно, даже при объективно нормальном положении"
+        ],
+        "trigger_words": ["беспокоюсь", "страшно", "вдруг", "а если", "тревожно", "боюсь"],
+        "common_topics": ["долги", "кредиты", "инвестиции", "сбережения", "пенсия"]
+    },
+    "финансовый_стыд": {
+        "description": "Чувство стыда или неполноценности из-за финансовых проблем/решений",
+        "examples": [
+            "Избегание обсуждения долгов даже с близкими",
+            "Сокрытие финансовых трудностей",
+            "Ощущение собственной безответственности из-за финансовых проблем",
+            "Сравнение своего положения с другими не в свою пользу"
+        ],
+        "trigger_words": ["стыдно признаться", "неудобно говорить", "не хочу, чтобы знали", "скрываю"],
+        "common_topics": ["долги", "кредиты", "низкий доход", "неудачные инвестиции"]
+    },
+    "финансовая_гордость": {
+        "description": "Гордость за финансовые достижения, умные решения",
+        "examples": [
+            "Удовлетворение от накопленной суммы",
+            "Гордость за выгодные инвестиции",
+            "Удовольствие от статусных финансовых продуктов",
+            "Желание делиться успешным опытом"
+        ],
+        "trigger_words": ["горжусь", "доволен", "удалось", "смог достичь", "преуспел"],
+        "common_topics": ["инвестиции", "накопления", "премиальные услуги", "финансовые цели"]
+    },
+    "финансовый_фатализм": {
+        "description": "Вера в предопределенность финансового положения, отсутствие контроля",
+        "examples": [
+            "Убеждение, что богатство - дело удачи или судьбы",
+            "Ощущение бессмысленности финансового планирования",
+            "Перекладывание ответственности на внешние обстоятельства",
+            "Отказ от активных действий по улучшению ситуации"
+        ],
+        "trigger_words": ["от меня не зависит", "как повезет", "судьба такая", "всё равно ничего не изменить"],
+        "common_topics": ["инвестиции", "накопления", "карьера", "доходы"]
+    },
+    "финансовая_надежда": {
+        "description": "Оптимизм относительно финансового будущего",
+        "examples": [
+            "Вера в улучшение финансового положения",
+            "Готовность пробовать новые финансовые инструменты",
+            "Позитивное отношение к возможностям",
+            "Устойчивость перед временными трудностями"
+        ],
+        "trigger_words": ["верю", "надеюсь", "обязательно получится", "всё наладится", "перспективы"],
+        "common_topics": ["инвестиции", "карьера", "развитие", "новые возможности"]
+    },
+    "финансовая_вина": {
+        "description": "Чувство вины за финансовые решения или ситуацию",
+        "examples": [
+            "Самообвинение за неправильные финансовые решения",
+            "Чувство вины за траты на себя",
+            "Вина за зависимость от финансовой поддержки других",
+            "Обвинение себя в жадности или расточительности"
+        ],
+        "trigger_words": ["виноват", "не должен был", "ошибся", "подвел", "жалею"],
+        "common_topics": ["долги", "траты", "неудачные решения", "содержание близких"]
+    },
+    "финансовое_безразличие": {
+        "description": "Апатия и отстраненность от финансовых вопросов",
+        "examples": [
+            "Игнорирование финансового планирования",
+            "Отсутствие интереса к оптимизации трат/доходов",
+            "Делегирование финансовых решений другим",
+            "Жизнь сегодняшним днем без мыслей о будущем"
+        ],
+        "trigger_words": ["не интересно", "как-нибудь", "всё равно", "не заморачиваюсь", "не важно"],
+        "common_topics": ["планирование", "инвестиции", "бюджет", "пенсия"]
+    }
+})
+
+# Уровни склонности к эмоциональным факторам
+EMOTION_LEVELS = freeze_catalog({
+    "слабый": 0.2,    # Редко проявляется, слабое влияние
+    "средний": 0.5,   # Периодически проявляется, умеренное влияние
+    "сильный": 0.8    # Часто проявляется, сильное влияние
+})
+
+
 class EmotionalFactors:
     """Класс для моделирования эмоциональных факторов в финансовом поведении"""
 
     def __init__(self):
         """Инициализация моделей эмоциональных факторов"""
-        # Основные эмоциональные факторы, влияющие на финансовое поведение
-        self.financial_emotions = {
-            "финансовая_тревога": {
-                "description": "Беспокойство и страх по поводу финансового положения/будущего",
-                "examples": [
-                    "Постоянное беспокойство о нехватке денег",
-                    "Страх потерять работу и доход",
-                    "Избегание проверки банковского баланса",
-                    "Ощущение, что денег всегда недостаточно, даже при объективно нормальном положении"
-                ],
-                "trigger_words": ["беспокоюсь", "страшно", "вдруг", "а если", "тревожно", "боюсь"],
-                "common_topics": ["долги", "кредиты", "инвестиции", "сбережения", "пенсия"]
-            },
-            "финансовый_стыд": {
-                "description": "Чувство стыда или неполноценности из-за финансовых проблем/решений",
-                "examples": [
-                    "Избегание обсуждения долгов даже с близкими",
-                    "Сокрытие финансовых трудностей",
-                    "Ощущение собственной безответственности из-за финансовых проблем",
-                    "Сравнение своего положения с другими не в свою пользу"
-                ],
-                "trigger_words": ["стыдно признаться", "неудобно говорить", "не хочу, чтобы знали", "скрываю"],
-                "common_topics": ["долги", "кредиты", "низкий доход", "неудачные инвестиции"]
-            },
-            "финансовая_гордость": {
-                "description": "Гордость за финансовые достижения, умные решения",
-                "examples": [
-                    "Удовлетворение от накопленной суммы",
-                    "Гордость за выгодные инвестиции",
-                    "Удовольствие от статусных финансовых продуктов",
-                    "Желание делиться успешным опытом"
-                ],
-                "trigger_words": ["горжусь", "доволен", "удалось", "смог достичь", "преуспел"],
-                "common_topics": ["инвестиции", "накопления", "премиальные услуги", "финансовые цели"]
-            },
-            "финансовый_фатализм": {
-                "description": "Вера в предопределенность финансового положения, отсутствие контроля",
-                "examples": [
-                    "Убеждение, что богатство - дело удачи или судьбы",
-                    "Ощущение бессмысленности финансового планирования",
-                    "Перекладывание ответственности на внешние обстоятельства",
-                    "Отказ от активных действий по улучшению ситуации"
-                ],
-                "trigger_words": ["от меня не зависит", "как повезет", "судьба такая", "всё равно ничего не изменить"],
-                "common_topics": ["инвестиции", "накопления", "карьера", "доходы"]
-            },
-            "финансовая_надежда": {
-                "description": "Оптимизм относительно финансового будущего",
-                "examples": [
-                    "Вера в улучшение финансового положения",
-                    "Готовность пробовать новые финансовые инструменты",
-                    "Позитивное отношение к возможностям",
-                    "Устойчивость перед временными трудностями"
-                ],
-                "trigger_words": ["верю", "надеюсь", "обязательно получится", "всё наладится", "перспективы"],
-                "common_topics": ["инвестиции", "карьера", "развитие", "новые возможности"]
-            },
-            "финансовая_вина": {
-                "description": "Чувство вины за финансовые решения или ситуацию",
-                "examples": [
-                    "Самообвинение за неправильные финансовые решения",
-                    "Чувство вины за траты на себя",
-                    "Вина за зависимость от финансовой поддержки других",
-                    "Обвинение себя в жадности или расточительности"
-                ],
-                "trigger_words": ["виноват", "не должен был", "ошибся", "подвел", "жалею"],
-                "common_topics": ["долги", "траты", "неудачные решения", "содержание близких"]
-            },
-            "финансовое_безразличие": {
-                "description": "Апатия и отстраненность от финансовых вопросов",
-                "examples": [
-                    "Игнорирование финансового планирования",
-                    "Отсутствие интереса к оптимизации трат/доходов",
-                    "Делегирование финансовых решений другим",
-                    "Жизнь сегодняшним днем без мыслей о будущем"
-                ],
-                "trigger_words": ["не интересно", "как-нибудь", "всё равно", "не заморачиваюсь", "не важно"],
-                "common_topics": ["планирование", "инвестиции", "бюджет", "пенсия"]
-            }
-        }
-
-        # Уровни склонности к эмоциональным факторам
-        self.emotion_levels = {
-            "слабый": 0.2,    # Редко проявляется, слабое влияние
-            "средний": 0.5,   # Периодически проявляется, умеренное влияние
-            "сильный": 0.8    # Часто проявляется, сильное влияние
-        }
+        # Статические каталоги создаются один раз при импорте модуля и общие для всех экземпляров
+        self.financial_emotions = FINANCIAL_EMOTIONS
+        self.emotion_levels = EMOTION_LEVELS
 
-    def get_random_emotions(self, num_emotions: int = 2) -> Dict[str, float]:
+    def get_random_emotions(self, num_emotions: int = 2, rng: Optional[random.Random] = None) -> Dict[str, float]:
         """
         Генерация случайного набора эмоциональных факторов для персоны
 
         Args:
             num_emotions: Количество эмоциональных факторов
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
             Словарь с эмоциональными факторами и их силой
         """
+        rng = rng or random
         # Выбираем случайные эмоциональные факторы
-        selected_emotions = random.sample(list(self.financial_emotions.keys()), k=min(num_emotions, len(self.financial_emotions)))
+        selected_emotions = rng.sample(list(self.financial_emotions.keys()), k=min(num_emotions, len(self.financial_emotions)))
 
         # Определяем силу проявления каждого фактора
         emotion_strengths = {}
 
         for emotion in selected_emotions:
             # Выбираем случайный уровень с равной вероятностью
-            emotion_level = random.choice(list(self.emotion_levels.keys()))
+            emotion_level = rng.choice(list(self.emotion_levels.keys()))
 
             # Добавляем случайную вариацию для реалистичности
-            strength = self.emotion_levels[emotion_level] * random.uniform(0.8, 1.2)
+            strength = self.emotion_levels[emotion_level] * rng.uniform(0.8, 1.2)
             # Ограничиваем в диапазоне [0.1, 1.0]
             strength = max(0.1, min(1.0, strength))
 
@@ -1092,21 +1510,48 @@ class EmotionalFactors:
 
         return emotion_strengths
 
-    def apply_emotion_to_prompt(self, prompt: str, emotion_name: str, emotion_strength: float, topic: str = None) -> str:
+    def get_random_emotions_batch(self, n: int, rng: np.random.Generator,
+                                  num_emotions: int = 2) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Добавление инструкций по эмоциональному фактору в промпт
+        Пакетная генерация эмоциональных факторов (распределения совпадают с get_random_emotions)
+
+        Args:
+            n: Количество персон
+            rng: Генератор случайных чисел NumPy
+            num_emotions: Количество эмоциональных факторов
+
+        Returns:
+            Кортеж (индексы факторов в financial_emotions, сила факторов) - массивы (N x num_emotions)
+        """
+        num_emotions = min(num_emotions, len(self.financial_emotions))
+        emotion_idx = sample_prefix_without_replacement(
+            rng, np.full(n, len(self.financial_emotions)), np.full(n, num_emotions), num_emotions
+        )
+
+        # Уровень выбирается с равной вероятностью
+        level_values = np.array(list(self.emotion_levels.values()))
+        levels = rng.integers(0, len(level_values), size=(n, num_emotions))
+        strength = np.clip(level_values[levels] * rng.uniform(0.8, 1.2, size=(n, num_emotions)), 0.1, 1.0)
+
+        return emotion_idx, strength.astype(np.float32)
+
+    def render_emotion(self, emotion_name: str, emotion_strength: float, topic: str = None,
+                       rng: Optional[random.Random] = None) -> str:
+        """
+        Блок инструкций по эмоциональному фактору (без заголовка раздела)
 
         Args:
-            prompt: Исходный промпт
             emotion_name: Название эмоционального фактора
             emotion_strength: Сила фактора (0.0-1.0)
             topic: Тема вопроса
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
-            Модифицированный промпт
+            Текст блока или пустая строка, если фактор не проявляется в ответе на вопрос
         """
+        rng = rng or random
         if emotion_name not in self.financial_emotions:
-            return prompt
+            return ""
 
         emotion_info = self.financial_emotions[emotion_name]
         emotion_level = "сильно" if emotion_strength > 0.65 else "умеренно" if emotion_strength > 0.35 else "слегка"
@@ -1118,7 +1563,7 @@ class EmotionalFactors:
             relevant_to_topic = any(t in topic.lower() for t in emotion_info["common_topics"])
 
             # Даже если нет прямого соответствия, с некоторой вероятностью всё равно применяем
-            if not relevant_to_topic and random.random() < 0.3:
+            if not relevant_to_topic and rng.random() < 0.3:
                 relevant_to_topic = True
 
         # Если эмоция не релевантна теме и у нас есть тема, уменьшаем силу
@@ -1128,10 +1573,10 @@ class EmotionalFactors:
 
         # Если сила стала слишком мала, пропускаем
         if emotion_strength < 0.2:
-            return prompt
+            return ""
 
         # Выбираем случайный пример проявления эмоции
-        example = random.choice(emotion_info["examples"])
+        example = rng.choice(emotion_info["examples"])
 
         # Формируем инструкцию по применению эмоционального фактора
         emotion_instruction = f"""
@@ -1139,8 +1584,28 @@ class EmotionalFactors:
 - {emotion_info["description"]}
 - Проявляется {emotion_level} (сила: {emotion_strength:.1f})
 - Пример: {example}
-- Это может отражаться в ответе фразами типа: "{', '.join(random.sample(emotion_info["trigger_words"], k=min(3, len(emotion_info["trigger_words"]))))}"
+- Это может отражаться в ответе фразами типа: "{', '.join(rng.sample(emotion_info["trigger_words"], k=min(3, len(emotion_info["trigger_words"]))))}"
 """
+        return emotion_instruction
+
+    def apply_emotion_to_prompt(self, prompt: str, emotion_name: str, emotion_strength: float, topic: str = None,
+                                rng: Optional[random.Random] = None) -> str:
+        """
+        Добавление инструкций по эмоциональному фактору в промпт
+
+        Args:
+            prompt: Исходный промпт
+            emotion_name: Название эмоционального фактора
+            emotion_strength: Сила фактора (0.0-1.0)
+            topic: Тема вопроса
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
+
+        Returns:
+            Модифицированный промпт
+        """
+        emotion_instruction = self.render_emotion(emotion_name, emotion_strength, topic, rng=rng)
+        if not emotion_instruction:
+            return prompt
 
         # Добавляем инструкцию в промпт
         if "ЭМОЦИОНАЛЬНЫЕ ФАКТОРЫ:" in prompt:
@@ -1156,198 +1621,212 @@ class EmotionalFactors:
         return prompt
 
 
-class LinguisticVariation:
-    """Класс для моделирования лингвистических вариаций в речи"""
-
-    def __init__(self):
-        """Инициализация моделей лингвистических вариаций"""
-        # Региональные особенности речи
-        self.regional_speech_patterns = {
-            "Москва": {
-                "words": ["мкад", "кольцевая", "область", "замкадье", "столичный", "садовое", "выхино"],
-                "expressions": ["на районе", "московские цены", "как в столице"]
-            },
-            "Санкт-Петербург": {
-                "words": ["парадная", "поребрик", "кура", "шаверма", "культурная столица"],
-                "expressions": ["на Петроградке", "у нас в Питере", "на Ваське"]
-            },
-            "Центральный": {
-                "words": ["тульский", "воронежский", "областной центр"],
-                "expressions": ["в центре России", "недалеко от Москвы"]
-            },
-            "Южный": {
-                "words": ["хата", "станица", "кубанский", "краснодарский"],
-                "expressions": ["у нас на юге", "по-кубански", "как на Дону"]
-            },
-            "Северо-Кавказский": {
-                "words": ["джигит", "тейп", "аул", "лезгинка"],
-                "expressions": ["у нас в горах", "на Кавказе так не принято"]
-            },
-            "Приволжский": {
-                "words": ["татарстанский", "казанский", "приволжский"],
-                "expressions": ["у нас на Волге", "по-волжски", "в Татарстане"]
-            },
-            "Уральский": {
-                "words": ["заводской", "суровый", "уральский", "горнозаводской"],
-                "expressions": ["у нас на Урале", "как на Урале говорят", "по-уральски"]
-            },
-            "Сибирский": {
-                "words": ["тайга", "мороз", "сибирский", "шишка"],
-                "expressions": ["у нас в Сибири", "по-сибирски", "не мороз, а дубак"]
-            },
-            "Дальневосточный": {
-                "words": ["океан", "приморский", "сопка", "владивостокский"],
-                "expressions": ["у нас на Дальнем", "во Владике", "дальневосточный"]
-            }
+# Каталоги лингвистических вариаций (LinguisticVariation)
+# Региональные особенности речи
+REGIONAL_SPEECH_PATTERNS = freeze_catalog({
+    "Москва": {
+        "words": ["мкад", "кольцевая", "область", "замкадье", "столичный", "садовое", "выхино"],
+        "expressions": ["на районе", "московские цены", "как в столице"]
+    },
+    "Санкт-Петербург": {
+        "words": ["парадная", "поребрик", "кура", "шаверма", "культурная столица"],
+        "expressions": ["на Петроградке", "у нас в Питере", "на Ваське"]
+    },
+    "Центральный": {
+        "words": ["тульский", "воронежский", "областной центр"],
+        "expressions": ["в центре России", "недалеко от Москвы"]
+    },
+    "Южный": {
+        "words": ["хата", "станица", "кубанский", "краснодарский"],
+        "expressions": ["у нас на юге", "по-кубански", "как на Дону"]
+    },
+    "Северо-Кавказский": {
+        "words": ["джигит", "тейп", "аул", "лезгинка"],
+        "expressions": ["у нас в горах", "на Кавказе так не принято"]
+    },
+    "Приволжский": {
+        "words": ["татарстанский", "казанский", "приволжский"],
+        "expressions": ["у нас на Волге", "по-волжски", "в Татарстане"]
+    },
+    "Уральский": {
+        "words": ["заводской", "суровый", "уральский", "горнозаводской"],
+        "expressions": ["у нас на Урале", "как на Урале говорят", "по-уральски"]
+    },
+    "Сибирский": {
+        "words": ["тайга", "мороз", "сибирский", "шишка"],
+        "expressions": ["у нас в Сибири", "по-сибирски", "не мороз, а дубак"]
+    },
+    "Дальневосточный": {
+        "words": ["океан", "приморский", "сопка", "владивостокский"],
+        "expressions": ["у нас на Дальнем", "во Владике", "дальневосточный"]
+    }
+})
+
+# Слова-паразиты по возрастным группам
+FILLER_WORDS_BY_AGE = freeze_catalog({
+    "18-25": ["типа", "короче", "прикинь", "реально", "вообще", "капец", "блин", "походу", "имхо"],
+    "26-35": ["собственно", "как бы", "в принципе", "фактически", "буквально", "объективно", "чисто"],
+    "36-50": ["так сказать", "в общем-то", "собственно говоря", "по сути", "значит", "видите ли", "скажем так"],
+    "51-65": ["знаете ли", "понимаете", "надо сказать", "откровенно говоря", "если позволите"],
+    "66-80": ["стало быть", "вот", "значится", "видите как", "не побоюсь этого слова", "истинно"]
+})
+
+# Поколенческий сленг
+GENERATIONAL_SLANG = freeze_catalog({
+    "18-25": {
+        "финансовый": ["крипта", "донатить", "скам", "застейкать", "холдить", "задонатить", "байнуть", "го на аирдроп", "изи", "хайпануть"],
+        "общий": ["краш", "чилить", "кринж", "рофл", "зашквар", "чекать", "агриться", "токсик", "хейтить", "флексить", "рилток"]
+    },
+    "26-35": {
+        "финансовый": ["профит", "кэшбек", "инвестить", "стартап", "венчур", "инфлуенсер", "монетизировать", "хакатон"],
+        "общий": ["лайфхак", "хейтер", "топчик", "форсить", "зафейлить", "лол", "жиза", "хапнуть", "стартапер"]
+    },
+    "36-50": {
+        "финансовый": ["откат", "обнал", "безнал", "аренда", "инвест-портфель", "пассивный доход", "недвижка"],
+        "общий": ["продвинутый", "комп", "сетевой", "зыринг", "клёво", "фишка", "прикольно", "месседж"]
+    },
+    "51-65": {
+        "финансовый": ["вклад", "сберкнижка", "пенсионные", "госзайм", "кредитка", "подорожание", "квитанция"],
+        "общий": ["молодежь", "интернеты", "компьютерщик", "наркоманы", "мобильник", "клавиши"]
+    },
+    "66-80": {
+        "финансовый": ["сбережения", "книжка", "пенсия", "накопления", "ссуда", "сотка", "пятак", "получка"],
+        "общий": ["телевизер", "нонче", "намедни", "давеча", "милок", "антиресно", "покуда", "давненько"]
+    }
+})
+
+# Типичные опечатки и ошибки
+COMMON_ERRORS = freeze_catalog({
+    "age": {  # Ошибки связанные с возрастом
+        "18-25": {  # молодежь: быстрый набор, игнорирование знаков препинания и заглавных букв
+            "punctuation_omission": 0.7,  # частое опускание знаков препинания
+            "abbreviations": 0.6,         # сокращения слов
+            "letter_repetition": 0.4,     # повторение букв для эмфазы
+            "phoneticization": 0.5        # фонетическое написание (шо, чо)
+        },
+        "26-35": {
+            "typos": 0.4,                # обычные опечатки
+            "punctuation_omission": 0.5,  # иногда опускание знаков препинания
+            "autocompletion_errors": 0.6  # ошибки автозамены
+        },
+        "36-50": {
+            "typos": 0.3,                # меньше опечаток
+            "run_on_sentences": 0.4       # длинные предложения без знаков препинания
+        },
+        "51-65": {
+            "spacing_errors": 0.5,        # проблемы с пробелами
+            "caps_lock": 0.3,             # случайный КАПС
+            "punctuation_excess": 0.4     # избыток знаков препинания!!!!
+        },
+        "66-80": {
+            "spacing_errors": 0.7,        # серьезные проблемы с пробелами
+            "caps_lock": 0.6,             # частый КАПС
+            "punctuation_excess": 0.7,    # избыток знаков препинания!!!!!!!
+            "repetition": 0.5             # повторение фраз
         }
-
-        # Слова-паразиты по возрастным группам
-        self.filler_words_by_age = {
-            "18-25": ["типа", "короче", "прикинь", "реально", "вообще", "капец", "блин", "походу", "имхо"],
-            "26-35": ["собственно", "как бы", "в принципе", "фактически", "буквально", "объективно", "чисто"],
-            "36-50": ["так сказать", "в общем-то", "собственно говоря", "по сути", "значит", "видите ли", "скажем так"],
-            "51-65": ["знаете ли", "понимаете", "надо сказать", "откровенно говоря", "если позволите"],
-            "66-80": ["стало быть", "вот", "значится", "видите как", "не побоюсь этого слова", "истинно"]
+    },
+    "device": {  # Ошибки связанные с устройством
+        "mobile": {  # мобильная клавиатура
+            "typos": 0.6,                # больше опечаток
+            "autocorrect_fails": 0.7,     # ошибки автозамены
+            "abbreviations": 0.5,         # сокращения слов
+            "brevity": 0.8                # краткость сообщений
+        },
+        "desktop": {  # обычная клавиатура
+            "typos": 0.3,                # меньше опечаток
+            "autocorrect_fails": 0.2,     # меньше ошибок автозамены
+            "verbosity": 0.6              # более многословные ответы
         }
-
-        # Поколенческий сленг
-        self.generational_slang = {
-            "18-25": {
-                "финансовый": ["крипта", "донатить", "скам", "застейкать", "холдить", "задонатить", "байнуть", "го на аирдроп", "изи", "хайпануть"],
-                "общий": ["краш", "чилить", "кринж", "рофл", "зашквар", "чекать", "агриться", "токсик", "хейтить", "флексить", "рилток"]
-            },
-            "26-35": {
-                "финансовый": ["профит", "кэшбек", "инвестить", "стартап", "венчур", "инфлуенсер", "монетизировать", "хакатон"],
-                "общий": ["лайфхак", "хейтер", "топчик", "форсить", "зафейлить", "лол", "жиза", "хапнуть", "стартапер"]
-            },
-            "36-50": {
-                "финансовый": ["откат", "обнал", "безнал", "аренда", "инвест-портфель", "пассивный доход", "недвижка"],
-                "общий": ["продвинутый", "комп", "сетевой", "зыринг", "клёво", "фишка", "прикольно", "месседж"]
-            },
-            "51-65": {
-                "финансовый": ["вклад", "сберкнижка", "пенсионные", "госзайм", "кредитка", "подорожание", "квитанция"],
-                "общий": ["молодежь", "интернеты", "компьютерщик", "наркоманы", "мобильник", "клавиши"]
-            },
-            "66-80": {
-                "финансовый": ["сбережения", "книжка", "пенсия", "накопления", "ссуда", "сотка", "пятак", "получка"],
-                "общий": ["телевизер", "нонче", "намедни", "давеча", "милок", "антиресно", "покуда", "давненько"]
-            }
+    },
+    "education": {  # Ошибки связанные с образованием
+        "Начальное образование": {
+            "grammar_errors": 0.8,         # грамматические ошибки
+            "spelling_errors": 0.8,        # орфографические ошибки
+            "syntax_errors": 0.7,          # синтаксические ошибки
+            "simple_vocabulary": 0.9       # простой словарный запас
+        },
+        "Среднее образование": {
+            "grammar_errors": 0.6,         # грамматические ошибки
+            "spelling_errors": 0.5,        # орфографические ошибки
+            "syntax_errors": 0.5           # синтаксические ошибки
+        },
+        "Среднее специальное": {
+            "grammar_errors": 0.5,         # грамматические ошибки
+            "spelling_errors": 0.4,        # орфографические ошибки
+            "jargon": 0.6                 # профессиональный жаргон
+        },
+        "Высшее": {  # общее для всех видов высшего
+            "grammar_errors": 0.3,         # меньше грамматических ошибок
+            "spelling_errors": 0.3,        # меньше орфографических ошибок
+            "complex_sentences": 0.6       # сложные предложения
+        },
+        "Ученая степень": {
+            "grammar_errors": 0.2,         # мало грамматических ошибок
+            "spelling_errors": 0.2,        # мало орфографических ошибок
+            "complex_vocabulary": 0.8,     # сложный словарный запас
+            "formality": 0.7               # формальный стиль
         }
+    }
+})
+
+# Типы устройств, с которых персона отвечает (выбираются равновероятно)
+DEVICE_TYPES = freeze_catalog(["mobile", "desktop"])
+
+# Примеры грамматических ошибок
+GRAMMAR_ERROR_PATTERNS = freeze_catalog({
+    "case_errors": [  # ошибки в падежах
+        (r'\b(о|об|при|в|на|за|под|над|перед|с) ([а-яА-Я]+)([^а-яА-Я]|$)', r'\1 \2е\3'),  # некорректный предложный падеж
+        (r'\b(к|по|благодаря) ([а-яА-Я]+)([^а-яА-Я]|$)', r'\1 \2у\3')  # некорректный дательный падеж
+    ],
+    "verb_errors": [  # ошибки в глаголах
+        (r'\b(я) ([а-яА-Я]+)(ешь|ете|ишь|ите)([^а-яА-Я]|$)', r'\1 \2у\4'),  # некорректное спряжение
+        (r'\b(они) ([а-яА-Я]+)(у|ю|м)([^а-яА-Я]|$)', r'\1 \2ут\4')  # некорректное спряжение
+    ],
+    "gender_errors": [  # ошибки в согласовании по роду
+        (r'\b(он) ([а-яА-Я]+)(ла|лась)([^а-яА-Я]|$)', r'\1 \2л\4'),
+        (r'\b(она) ([а-яА-Я]+)(л|лся)([^а-яА-Я]|$)', r'\1 \2ла\4')
+    ]
+})
+
+# Словарь исправлений орфографических ошибок (для применения)
+SPELLING_ERROR_PATTERNS = freeze_catalog({
+    # Типичные ошибки в русском языке
+    "ться-тся": [(r'ться', 'тся'), (r'тся', 'ться')],
+    "жи-ши": [(r'жы', 'жи'), (r'шы', 'ши')],
+    "ча-ща": [(r'чя', 'ча'), (r'щя', 'ща')],
+    "чу-щу": [(r'чю', 'чу'), (r'щю', 'щу')],
+    "безударные гласные": [
+        (r'изв[ие]ни', 'извини'), (r'к[ао]мпания', 'компания'), (r'инт[ие]ресно', 'интересно'),
+        (r'инт[ие]ресует', 'интересует'), (r'выт[ие]рпеть', 'вытерпеть')
+    ],
+    "парные согласные": [
+        (r'сколь[зс]кий', 'скользкий'), (r'ни[зс]кий', 'низкий'),
+        (r'вла[сз]ть', 'власть'), (r'ло[шж]ка', 'ложка')
+    ],
+    "непроизносимые согласные": [
+        (r'чу[вс]ств', 'чувств'), (r'сер[д]це', 'сердце'),
+        (r'со[л]нце', 'солнце'), (r'праз[д]ник', 'праздник')
+    ],
+    "двойные согласные": [
+        (r'ра[с]{1,2}каз', 'рассказ'), (r'ка[с]{1,2}а', 'касса'),
+        (r'ко[л]{1,2}ектив', 'коллектив'), (r'ко[м]{1,2}ентарий', 'комментарий')
+    ]
+})
 
-        # Типичные опечатки и ошибки
-        self.common_errors = {
-            "age": {  # Ошибки связанные с возрастом
-                "18-25": {  # молодежь: быстрый набор, игнорирование знаков препинания и заглавных букв
-                    "punctuation_omission": 0.7,  # частое опускание знаков препинания
-                    "abbreviations": 0.6,         # сокращения слов
-                    "letter_repetition": 0.4,     # повторение букв для эмфазы
-                    "phoneticization": 0.5        # фонетическое написание (шо, чо)
-                },
-                "26-35": {
-                    "typos": 0.4,                # обычные опечатки
-                    "punctuation_omission": 0.5,  # иногда опускание знаков препинания
-                    "autocompletion_errors": 0.6  # ошибки автозамены
-                },
-                "36-50": {
-                    "typos": 0.3,                # меньше опечаток
-                    "run_on_sentences": 0.4       # длинные предложения без знаков препинания
-                },
-                "51-65": {
-                    "spacing_errors": 0.5,        # проблемы с пробелами
-                    "caps_lock": 0.3,             # случайный КАПС
-                    "punctuation_excess": 0.4     # избыток знаков препинания!!!!
-                },
-                "66-80": {
-                    "spacing_errors": 0.7,        # серьезные проблемы с пробелами
-                    "caps_lock": 0.6,             # частый КАПС
-                    "punctuation_excess": 0.7,    # избыток знаков препинания!!!!!!!
-                    "repetition": 0.5             # повторение фраз
-                }
-            },
-            "device": {  # Ошибки связанные с устройством
-                "mobile": {  # мобильная клавиатура
-                    "typos": 0.6,                # больше опечаток
-                    "autocorrect_fails": 0.7,     # ошибки автозамены
-                    "abbreviations": 0.5,         # сокращения слов
-                    "brevity": 0.8                # краткость сообщений
-                },
-                "desktop": {  # обычная клавиатура
-                    "typos": 0.3,                # меньше опечаток
-                    "autocorrect_fails": 0.2,     # меньше ошибок автозамены
-                    "verbosity": 0.6              # более многословные ответы
-                }
-            },
-            "education": {  # Ошибки связанные с образованием
-                "Начальное образование": {
-                    "grammar_errors": 0.8,         # грамматические ошибки
-                    "spelling_errors": 0.8,        # орфографические ошибки
-                    "syntax_errors": 0.7,          # синтаксические ошибки
-                    "simple_vocabulary": 0.9       # простой словарный запас
-                },
-                "Среднее образование": {
-                    "grammar_errors": 0.6,         # грамматические ошибки
-                    "spelling_errors": 0.5,        # орфографические ошибки
-                    "syntax_errors": 0.5           # синтаксические ошибки
-                },
-                "Среднее специальное": {
-                    "grammar_errors": 0.5,         # грамматические ошибки
-                    "spelling_errors": 0.4,        # орфографические ошибки
-                    "jargon": 0.6                 # профессиональный жаргон
-                },
-                "Высшее": {  # общее для всех видов высшего
-                    "grammar_errors": 0.3,         # меньше грамматических ошибок
-                    "spelling_errors": 0.3,        # меньше орфографических ошибок
-                    "complex_sentences": 0.6       # сложные предложения
-                },
-                "Ученая степень": {
-                    "grammar_errors": 0.2,         # мало грамматических ошибок
-                    "spelling_errors": 0.2,        # мало орфографических ошибок
-                    "complex_vocabulary": 0.8,     # сложный словарный запас
-                    "formality": 0.7               # формальный стиль
-                }
-            }
-        }
 
-        # Примеры грамматических ошибок
-        self.grammar_error_patterns = {
-            "case_errors": [  # ошибки в падежах
-                (r'\b(о|об|при|в|на|за|под|над|перед|с) ([а-яА-Я]+)([^а-яА-Я]|$)', r'\1 \2е\3'),  # некорректный предложный падеж
-                (r'\b(к|по|благодаря) ([а-яА-Я]+)([^а-яА-Я]|$)', r'\1 \2у\3')  # некорректный дательный падеж
-            ],
-            "verb_errors": [  # ошибки в глаголах
-                (r'\b(я) ([а-яА-Я]+)(ешь|ете|ишь|ите)([^а-яА-Я]|$)', r'\1 \2у\4'),  # некорректное спряжение
-                (r'\b(они) ([а-яА-Я]+)(у|ю|м)([^а-яА-Я]|$)', r'\1 \2ут\4')  # некорректное спряжение
-            ],
-            "gender_errors": [  # ошибки в согласовании по роду
-                (r'\b(он) ([а-яА-Я]+)(ла|лась)([^а-яА-Я]|$)', r'\1 \2л\4'),
-                (r'\b(она) ([а-яА-Я]+)(л|лся)([^а-яА-Я]|$)', r'\1 \2ла\4')
-            ]
-        }
+class LinguisticVariation:
+    """Класс для моделирования лингвистических вариаций в речи"""
 
-        # Словарь исправлений орфографических ошибок (для применения)
-        self.spelling_error_patterns = {
-            # Типичные ошибки в русском языке
-            "ться-тся": [(r'ться', 'тся'), (r'тся', 'ться')],
-            "жи-ши": [(r'жы', 'жи'), (r'шы', 'ши')],
-            "ча-ща": [(r'чя', 'ча'), (r'щя', 'ща')],
-            "чу-щу": [(r'чю', 'чу'), (r'щю', 'щу')],
-            "безударные гласные": [
-                (r'изв[ие]ни', 'извини'), (r'к[ао]мпания', 'компания'), (r'инт[ие]ресно', 'интересно'),
-                (r'инт[ие]ресует', 'интересует'), (r'выт[ие]рпеть', 'вытерпеть')
-            ],
-            "парные согласные": [
-                (r'сколь[зс]кий', 'скользкий'), (r'ни[зс]кий', 'низкий'),
-                (r'вла[сз]ть', 'власть'), (r'ло[шж]ка', 'ложка')
-            ],
-            "непроизносимые согласные": [
-                (r'чу[вс]ств', 'чувств'), (r'сер[д]це', 'сердце'),
-                (r'со[л]нце', 'солнце'), (r'праз[д]ник', 'праздник')
-            ],
-            "двойные согласные": [
-                (r'ра[с]{1,2}каз', 'рассказ'), (r'ка[с]{1,2}а', 'касса'),
-                (r'ко[л]{1,2}ектив', 'коллектив'), (r'ко[м]{1,2}ентарий', 'комментарий')
-            ]
-        }
+    def __init__(self):
+        """Инициализация моделей лингвистических вариаций"""
+        # Статические каталоги создаются один раз при импорте модуля и общие для всех экземпляров
+        self.regional_speech_patterns = REGIONAL_SPEECH_PATTERNS
+        self.filler_words_by_age = FILLER_WORDS_BY_AGE
+        self.generational_slang = GENERATIONAL_SLANG
+        self.common_errors = COMMON_ERRORS
+        self.device_types = DEVICE_TYPES
+        self.grammar_error_patterns = GRAMMAR_ERROR_PATTERNS
+        self.spelling_error_patterns = SPELLING_ERROR_PATTERNS
 
     def get_age_group(self, age: int) -> str:
         """Определение возрастной группы по возрасту"""
@@ -1362,12 +1841,37 @@ class LinguisticVariation:
         else:
             return "66-80"
 
-    def generate_linguistic_profile(self, persona: Dict) -> Dict:
+    def generate_linguistic_profile(self, persona: Dict, rng: Optional[random.Random] = None) -> Dict:
         """
         Создание лингвистического профиля для персоны
 
         Args:
             persona: Словарь с данными персоны
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
+
+        Returns:
+            Словарь с лингвистическим профилем
+        """
+        rng = rng or random
+        age_group = self.get_age_group(persona.get('Возраст', 30))
+        edu_type = self._education_type(persona.get('Образование', 'Высшее (бакалавр)'))
+
+        # Тип устройства (здесь предполагаем случайно)
+        device_type = rng.choice(self.device_types)
+
+        # Общий уровень ошибок (0-1) - зависит от образования и возраста
+        total_error_level = self._base_error_level(age_group, edu_type) * rng.uniform(0.8, 1.2)
+
+        return self.assemble_linguistic_profile(persona, device_type, total_error_level)
+
+    def assemble_linguistic_profile(self, persona: Dict, device_type: str, total_error_level: float) -> Dict:
+        """
+        Сборка лингвистического профиля по демографии персоны и выбранным случайным параметрам
+
+        Args:
+            persona: Словарь с данными персоны
+            device_type: Тип устройства ("mobile" или "desktop")
+            total_error_level: Общий уровень ошибок до ограничения диапазоном
 
         Returns:
             Словарь с лингвистическим профилем
@@ -1386,15 +1890,15 @@ class LinguisticVariation:
             "education": education,
 
             # Региональные особенности речи
-            "regional_words": self.regional_speech_patterns.get(region, {}).get("words", []),
-            "regional_expressions": self.regional_speech_patterns.get(region, {}).get("expressions", []),
+            "regional_words": list(self.regional_speech_patterns.get(region, {}).get("words", [])),
+            "regional_expressions": list(self.regional_speech_patterns.get(region, {}).get("expressions", [])),
 
             # Слова-паразиты по возрасту
-            "filler_words": self.filler_words_by_age.get(age_group, self.filler_words_by_age["36-50"]),
+            "filler_words": list(self.filler_words_by_age.get(age_group, self.filler_words_by_age["36-50"])),
 
             # Поколенческий сленг
-            "financial_slang": self.generational_slang.get(age_group, {}).get("финансовый", []),
-            "general_slang": self.generational_slang.get(age_group, {}).get("общий", []),
+            "financial_slang": list(self.generational_slang.get(age_group, {}).get("финансовый", [])),
+            "general_slang": list(self.generational_slang.get(age_group, {}).get("общий", [])),
 
             # Профиль ошибок
             "error_profile": {}
@@ -1405,22 +1909,10 @@ class LinguisticVariation:
         age_errors = self.common_errors["age"].get(age_group, self.common_errors["age"]["36-50"])
 
         # Образовательные ошибки
-        # Упрощаем типы образования до базовых категорий
-        if "Высшее" in education or "высшее" in education:
-            edu_type = "Высшее"
-        elif "Ученая степень" in education:
-            edu_type = "Ученая степень"
-        elif "специальное" in education:
-            edu_type = "Среднее специальное"
-        elif "Среднее" in education:
-            edu_type = "Среднее образование"
-        else:
-            edu_type = "Начальное образование"
-
+        edu_type = self._education_type(education)
         edu_errors = self.common_errors["education"].get(edu_type, self.common_errors["education"]["Среднее образование"])
 
-        # Ошибки устройства (здесь предполагаем случайно)
-        device_type = random.choice(["mobile", "desktop"])
+        # Ошибки устройства
         device_errors = self.common_errors["device"].get(device_type, self.common_errors["device"]["desktop"])
 
         # Объединяем профили ошибок с приоритетом образовательных
@@ -1432,8 +1924,25 @@ class LinguisticVariation:
 
         profile["error_profile"] = error_profile
         profile["device_type"] = device_type
+        profile["total_error_level"] = max(0.1, min(0.9, total_error_level))
 
-        # Общий уровень ошибок (0-1) - зависит от образования и возраста
+        return profile
+
+    def _education_type(self, education: str) -> str:
+        """Упрощение типа образования до базовой категории"""
+        if "Высшее" in education or "высшее" in education:
+            return "Высшее"
+        elif "Ученая степень" in education:
+            return "Ученая степень"
+        elif "специальное" in education:
+            return "Среднее специальное"
+        elif "Среднее" in education:
+            return "Среднее образование"
+        else:
+            return "Начальное образование"
+
+    def _base_error_level(self, age_group: str, edu_type: str) -> float:
+        """Базовый уровень ошибок с приоритетом образования (до случайной вариации)"""
         education_factor = {
             "Начальное образование": 0.8,
             "Среднее образование": 0.6,
@@ -1450,23 +1959,56 @@ class LinguisticVariation:
         else:
             age_factor = 0.3
 
-        # Вычисляем общий уровень ошибок с приоритетом образования
-        total_error_level = (education_factor * 0.7 + age_factor * 0.3) * random.uniform(0.8, 1.2)
-        profile["total_error_level"] = max(0.1, min(0.9, total_error_level))
+        return education_factor * 0.7 + age_factor * 0.3
 
-        return profile
+    def generate_linguistic_batch(self, ages: np.ndarray, education_codes: np.ndarray,
+                                  education_levels: Sequence[str],
+                                  rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Пакетная генерация случайных параметров лингвистического профиля
+        (распределения совпадают с generate_linguistic_profile)
+
+        Args:
+            ages: Возраст каждой персоны
+            education_codes: Индексы уровней образования
+            education_levels: Названия уровней образования (справочник для индексов)
+            rng: Генератор случайных чисел NumPy
 
-    def apply_linguistic_profile_to_prompt(self, prompt: str, linguistic_profile: Dict) -> str:
+        Returns:
+            Кортеж (индексы типа устройства в device_types, общий уровень ошибок)
         """
-        Добавление инструкций по лингвистическому профилю в промпт
+        n = len(ages)
+        age_groups = list(self.filler_words_by_age.keys())
+        age_values, age_inverse = np.unique(ages, return_inverse=True)
+        age_group_idx = np.array([age_groups.index(self.get_age_group(int(a))) for a in age_values])[age_inverse]
+
+        # Базовый уровень ошибок для каждой пары (возрастная группа, образование)
+        base_table = np.array([
+            [self._base_error_level(group, self._education_type(education)) for education in education_levels]
+            for group in age_groups
+        ])
+
+        device = rng.integers(0, len(self.device_types), size=n)
+        base = base_table[age_group_idx, education_codes] if n else np.zeros(0)
+        error_level = np.clip(base * rng.uniform(0.8, 1.2, size=n), 0.1, 0.9)
+
+        return device.astype(np.int8), error_level.astype(np.float32)
+
+    def render_linguistic_profile(self, linguistic_profile: Dict, rng: Optional[random.Random] = None,
+                                  local_traits: bool = False) -> str:
+        """
+        Блок инструкций по лингвистическому профилю
 
         Args:
-            prompt: Исходный промпт
             linguistic_profile: Словарь с лингвистическим профилем
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
+            local_traits: Региональные выражения, слова-паразиты и ошибки добавляются в ответ
+                локально (LinguisticPostProcessor), поэтому инструкции по ним не включаются
 
         Returns:
-            Модифицированный промпт
+            Текст блока (пустая строка, если в профиле нет особенностей речи)
         """
+        rng = rng or random
         # Извлекаем данные из профиля
         region = linguistic_profile.get("region", "Москва")
         age_group = linguistic_profile.get("age_group", "36-50")
@@ -1481,21 +2023,21 @@ class LinguisticVariation:
 
         # Формируем инструкцию по применению регионализмов
         regionalism_instruction = ""
-        if regional_words or regional_expressions:
+        if (regional_words or regional_expressions) and not local_traits:
             regionalism_instruction = f"""
 РЕГИОНАЛЬНЫЕ ОСОБЕННОСТИ РЕЧИ (Регион: {region}):
-- Можешь иногда использовать региональные слова: {', '.join(random.sample(regional_words, k=min(3, len(regional_words))))}
-- Можешь использовать региональные выражения: {', '.join(random.sample(regional_expressions, k=min(2, len(regional_expressions))))}
+- Можешь иногда использовать региональные слова: {', '.join(rng.sample(regional_words, k=min(3, len(regional_words))))}
+- Можешь использовать региональные выражения: {', '.join(rng.sample(regional_expressions, k=min(2, len(regional_expressions))))}
 """
 
         # Формируем инструкцию по словам-паразитам
         fillers_instruction = ""
-        if filler_words:
+        if filler_words and not local_traits:
             # Определяем рекомендуемую частоту использования
             filler_frequency = "часто" if total_error_level > 0.6 else "иногда" if total_error_level > 0.3 else "редко"
             fillers_instruction = f"""
 СЛОВА-ПАРАЗИТЫ (Возрастная группа: {age_group}):
-- {filler_frequency} используй слова-паразиты: {', '.join(random.sample(filler_words, k=min(4, len(filler_words))))}
+- {filler_frequency} используй слова-паразиты: {', '.join(rng.sample(filler_words, k=min(4, len(filler_words))))}
 """
 
         # Формируем инструкцию по сленгу
@@ -1504,9 +2046,9 @@ class LinguisticVariation:
             slang_frequency = "часто" if age_group in ["18-25", "26-35"] else "иногда" if age_group == "36-50" else "редко"
             slang_samples = []
             if financial_slang:
-                slang_samples.append(f"финансовый сленг: {', '.join(random.sample(financial_slang, k=min(3, len(financial_slang))))}")
+                slang_samples.append(f"финансовый сленг: {', '.join(rng.sample(financial_slang, k=min(3, len(financial_slang))))}")
             if general_slang:
-                slang_samples.append(f"общий сленг: {', '.join(random.sample(general_slang, k=min(3, len(general_slang))))}")
+                slang_samples.append(f"общий сленг: {', '.join(rng.sample(general_slang, k=min(3, len(general_slang))))}")
 
             slang_instruction = f"""
 ПОКОЛЕНЧЕСКИЙ СЛЕНГ (Возрастная группа: {age_group}):
@@ -1515,7 +2057,14 @@ class LinguisticVariation:
 
         # Формируем инструкцию по ошибкам и опечаткам
         errors_instruction = ""
-        if error_profile:
+        if error_profile and local_traits:
+            # Ошибки добавляются локально, в промпте остается только длина ответа
+            length_advice = "Пиши короче (как с телефона)" if device_type == "mobile" else "Можешь писать подробнее (как с компьютера)"
+            errors_instruction = f"""
+ОСОБЕННОСТИ ПИСЬМА:
+- {length_advice}
+"""
+        elif error_profile:
             # Определяем рекомендации по ошибкам на основе общего уровня
             if total_error_level > 0.7:
                 error_description = "много разных ошибок и опечаток"
@@ -1568,6 +2117,22 @@ class LinguisticVariation:
 {slang_instruction}
 {errors_instruction}
 """
+        return linguistic_instructions
+
+    def apply_linguistic_profile_to_prompt(self, prompt: str, linguistic_profile: Dict,
+                                           rng: Optional[random.Random] = None) -> str:
+        """
+        Добавление инструкций по лингвистическому профилю в промпт
+
+        Args:
+            prompt: Исходный промпт
+            linguistic_profile: Словарь с лингвистическим профилем
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
+
+        Returns:
+            Модифицированный промпт
+        """
+        linguistic_instructions = self.render_linguistic_profile(linguistic_profile, rng=rng)
 
         # Добавляем инструкции в промпт
         if "ОБЩИЕ ПРАВИЛА ОТВЕТА" in prompt:
@@ -1578,410 +2143,693 @@ class LinguisticVariation:
         return prompt
 
 
-class LifeContextFactors:
-    """Класс для моделирования жизненного контекста и событий, влияющих на финансовое поведение"""
+# Раскладка ЙЦУКЕН: опечатка заменяет букву соседней клавишей того же ряда
+KEYBOARD_ROWS_RU = ("йцукенгшщзхъ", "фывапролджэ", "ячсмитьбю")
 
-    def __init__(self):
-        """Инициализация моделей жизненного контекста"""
-        # Жизненные события, влияющие на финансы
-        self.life_events = {
-            "свадьба": {
-                "description": "Недавняя свадьба или подготовка к ней",
-                "financial_impact": "Крупные расходы, возможно общий бюджет с партнером, изменение финансовых приоритетов",
-                "relevant_topics": ["накопления", "кредиты", "планирование", "страхование"],
-                "age_relevance": {"min": 18, "max": 65, "peak": [25, 35]},
-                "family_status_relevance": ["Холост/Не замужем", "В отношениях", "Гражданский брак"]
-            },
-            "рождение_ребенка": {
-                "description": "Недавнее рождение ребенка или ожидание рождения",
-                "financial_impact": "Увеличение расходов, декретный отпуск, изменение бюджета, долгосрочное планирование",
-                "relevant_topics": ["накопления", "страхование", "детские вклады", "ипотека", "материнский капитал"],
-                "age_relevance": {"min": 20, "max": 45, "peak": [25, 35]},
-                "family_status_relevance": ["Женат/Замужем", "Гражданский брак"]
-            },
-            "потеря_работы": {
-                "description": "Недавняя потеря работы или риск ее потери",
-                "financial_impact": "Снижение доходов, использование сбережений, поиск подработок, возможное реструктурирование кредитов",
-                "relevant_topics": ["накопления", "кредиты", "рефинансирование", "социальные выплаты"],
-                "age_relevance": {"min": 18, "max": 65, "peak": [30, 50]},
-                "family_status_relevance": None  # релевантно для всех
-            },
-            "переезд": {
-                "description": "Недавний переезд или планирование переезда в другой город/страну",
-                "financial_impact": "Крупные расходы, изменение стоимости жизни, смена банков, вопросы с переводом денег",
-                "relevant_topics": ["накопления", "ипотека", "переводы", "валюта"],
-                "age_relevance": {"min": 18, "max": 45, "peak": [22, 35]},
-                "family_status_relevance": None  # релевантно для всех
-            },
-            "получение_наследства": {
-                "description": "Недавнее получение наследства или ожидание его получения",
-                "financial_impact": "Увеличение капитала, вопросы инвестирования, налоговые вопросы",
-                "relevant_topics": ["инвестиции", "налоги", "недвижимость", "вклады"],
-                "age_relevance": {"min": 30, "max": 80, "peak": [40, 60]},
-                "family_status_relevance": None  # релевантно для всех
-            },
-            "развод": {
-                "description": "Недавний развод или процесс развода",
-                "financial_impact": "Раздел имущества, изменение финансовых обязательств, отдельный бюджет, алименты",
-                "relevant_topics": ["раздел имущества", "алименты", "кредиты", "ипотека"],
-                "age_relevance": {"min": 25, "max": 60, "peak": [30, 45]},
-                "family_status_relevance": ["Разведен/Разведена"]
-            },
-            "покупка_жилья": {
-                "description": "Недавняя покупка жилья или активный поиск для покупки",
-                "financial_impact": "Крупные расходы, ипотека, вопросы страхования жилья, коммунальные платежи",
-                "relevant_topics": ["ипотека", "страхование", "налоги", "кредиты", "накопления"],
-                "age_relevance": {"min": 25, "max": 60, "peak": [30, 45]},
-                "family_status_relevance": None  # релевантно для всех
-            },
-            "старт_бизнеса": {
-                "description": "Недавний старт собственного бизнеса или подготовка к нему",
-                "financial_impact": "Инвестиции в бизнес, бизнес-кредиты, изменение структуры доходов и расходов",
-                "relevant_topics": ["бизнес-кредиты", "инвестиции", "налоги", "расчетный счет"],
-                "age_relevance": {"min": 25, "max": 55, "peak": [30, 45]},
-                "family_status_relevance": None  # релевантно для всех
-            },
-            "болезнь": {
-                "description": "Серьезное заболевание у себя или члена семьи",
-                "financial_impact": "Расходы на лечение, потеря трудоспособности, вопросы страхования",
-                "relevant_topics": ["медицинское страхование", "накопления", "кредиты", "социальные выплаты"],
-                "age_relevance": {"min": 30, "max": 80, "peak": [50, 70]},
-                "family_status_relevance": None  # релевантно для всех
-            },
-            "выход_на_пенсию": {
-                "description": "Недавний выход на пенсию или подготовка к нему",
-                "financial_impact": "Изменение структуры доходов, использование пенсионных накоплений, консервативный подход к инвестициям",
-                "relevant_topics": ["пенсия", "накопления", "инвестиции", "социальные выплаты"],
-                "age_relevance": {"min": 50, "max": 80, "peak": [55, 65]},
-                "family_status_relevance": None  # релевантно для всех
-            }
-        }
+# Сокращения и фонетическое написание (полная форма -> сокращенная)
+WORD_ABBREVIATIONS = {
+    "спасибо": "спс", "пожалуйста": "пж", "сейчас": "щас", "что": "чо", "чего": "чё", "конечно": "конеш",
+    "вообще": "ваще", "нормально": "норм", "информация": "инфа", "человек": "чел", "кстати": "кст",
+    "может быть": "мб", "сообщение": "смс", "тысяч": "тыщ", "только": "тока"
+}
 
-        # Сезонные факторы, влияющие на финансы
-        self.seasonal_factors = {
-            "новый_год": {
-                "description": "Период перед новогодними праздниками",
-                "months": [11, 12],  # ноябрь-декабрь
-                "financial_impact": "Увеличение трат на подарки и праздники, премии, планирование бюджета на следующий год",
-                "relevant_topics": ["кредиты", "накопления", "акции", "бонусы", "скидки"]
-            },
-            "лето_отпуск": {
-                "description": "Летний период отпусков",
-                "months": [5, 6, 7, 8],  # май-август
-                "financial_impact": "Траты на отпуск, путешествия, детский отдых, подготовка к школе в конце сезона",
-                "relevant_topics": ["накопления", "карты", "валюта", "мобильный банк", "страхование"]
-            },
-            "черная_пятница": {
-                "description": "Период распродаж 'Черная пятница'",
-                "months": [11],  # ноябрь
-                "financial_impact": "Увеличение импульсивных покупок, охота за скидками, возможность приобрести запланированные покупки дешевле",
-                "relevant_topics": ["кредитные карты", "рассрочка", "кэшбэк", "акции", "бонусы"]
-            },
-            "начало_учебного_года": {
-                "description": "Подготовка к учебному году",
-                "months": [7, 8],  # июль-август
-                "financial_impact": "Траты на подготовку детей к школе/вузу, оплата обучения, покупка техники и принадлежностей",
-                "relevant_topics": ["накопления", "кредиты", "рассрочка", "образовательные кредиты"]
-            },
-            "отопительный_сезон": {
-                "description": "Начало отопительного сезона",
-                "months": [9, 10],  # сентябрь-октябрь
-                "financial_impact": "Увеличение коммунальных платежей, возможная задолженность",
-                "relevant_topics": ["коммунальные платежи", "субсидии", "автоплатежи"]
-            },
-            "дачный_сезон": {
-                "description": "Дачный/садовый сезон",
-                "months": [4, 5, 6, 7, 8, 9],  # апрель-сентябрь
-                "financial_impact": "Траты на дачу/сад, сезонные работы, заготовки",
-                "relevant_topics": ["накопления", "кредиты на строительство/ремонт", "страхование имущества"]
-            },
-            "налоговый_период": {
-                "description": "Период уплаты налогов",
-                "months": [10, 11],  # октябрь-ноябрь
-                "financial_impact": "Уплата имущественных налогов, подача деклараций, налоговые вычеты",
-                "relevant_topics": ["налоги", "налоговые вычеты", "страхование", "инвестиции"]
-            }
-        }
+# Частота ошибок при вероятности 1.0 в профиле ошибок и уровне ошибок 1.0
+POSTPROCESS_RATES = {
+    "typos": 0.02,               # доля букв с опечаткой
+    "letter_repetition": 0.03,   # доля гласных с повтором
+    "punctuation_omission": 0.6, # доля пропущенных запятых, точек с запятой и двоеточий
+    "punctuation_excess": 0.8,   # доля повторенных знаков в конце предложения
+    "spacing_errors": 0.12,      # доля пробелов, которые пропадают или удваиваются
+    "caps_lock": 0.1,            # доля слов капсом
+    "spelling_errors": 0.8,      # доля слов из словаря ошибок, написанных с ошибкой
+    "grammar_errors": 0.15,      # доля совпадений шаблонов грамматических ошибок
+    "abbreviations": 0.7         # доля сокращаемых слов
+}
 
-        # Текущая экономическая ситуация (обновляется извне)
-        self.current_economic_situation = {
-            "инфляция": {
-                "level": "высокая",  # высокая/умеренная/низкая
-                "description": "Высокий уровень инфляции влияет на стоимость товаров и услуг, обесценивает накопления без процентов",
-                "financial_impact": "Поиск способов сохранения сбережений, инвестиции для защиты от инфляции"
-            },
-            "ключевая_ставка": {
-                "level": "повышенная",  # повышенная/сниженная/стабильная
-                "description": "Центральный банк поддерживает повышенную ключевую ставку",
-                "financial_impact": "Высокие ставки по вкладам и кредитам, выгодность сбережений, дорогие кредиты"
-            },
-            "курс_валют": {
-                "level": "нестабильный",  # растущий/падающий/стабильный/нестабильный
-                "description": "Курс валют подвержен частым колебаниям",
-                "financial_impact": "Риски при валютных операциях, вопросы сохранения сбережений в разных валютах"
-            },
-            "кредитная_доступность": {
-                "level": "умеренная",  # высокая/умеренная/низкая
-                "description": "Банки умеренно строги при выдаче кредитов, требуют хорошую кредитную историю",
-                "financial_impact": "Более тщательная проверка заемщиков, потребность в хорошей кредитной истории"
-            }
-        }
+# Частота слов-паразитов в начале предложения (по общему уровню ошибок, как в инструкции промпта)
+FILLER_SENTENCE_RATES = ((0.6, 0.35), (0.3, 0.2), (0.0, 0.1))
 
-        # Культурные особенности отношений к деньгам в разных поколениях
-        self.generational_money_attitudes = {
-            "18-25": {  # Поколение Z
-                "key_values": ["Цифровая нативность", "Экологичность", "Индивидуализм", "Стартапы", "Фриланс"],
-                "money_attitudes": [
-                    "Предпочтение цифровых финансовых инструментов",
-                    "Открытость к новым финансовым технологиям и криптовалютам",
-                    "Стремление к пассивному доходу и финансовой независимости с ранних лет",
-                    "Скептицизм к традиционным финансовым институтам",
-                    "Приоритет финансовой свободы и опыта над материальными ценностями",
-                    "Готовность инвестировать в экологичные/этичные проекты",
-                    "Стремление к ранним инвестициям даже с небольшими суммами"
-                ]
-            },
-            "26-35": {  # Миллениалы
-                "key_values": ["Баланс работы и жизни", "Опыт vs Вещи", "Социальные сети", "Аренда vs Покупка"],
-                "money_attitudes": [
-                    "Высокая закредитованность, особенно образовательные кредиты",
-                    "Откладывание крупных покупок (жилье, автомобиль) на более поздний срок",
-                    "Предпочтение кредитных карт с бонусами/кешбэком",
-                    "Готовность платить за уникальный опыт и впечатления",
-                    "Ориентация на множественные источники дохода",
-                    "Интерес к цифровым инвестициям и финтех-сервисам",
-                    "Относительная финансовая грамотность при менее стабильной карьере"
-                ]
-            },
-            "36-50": {  # Поколение X
-                "key_values": ["Стабильность", "Карьера", "Семья", "Независимость"],
-                "money_attitudes": [
-                    "Серьезное отношение к финансовому планированию",
-                    "Более традиционный подход к инвестициям (недвижимость, банки)",
-                    "Сочетание цифровых и традиционных финансовых инструментов",
-                    "Акцент на образовании детей и пенсионных накоплениях",
-                    "Склонность к умеренному риску в инвестициях",
-                    "Более высокая стоимость активов, но и больше финансовых обязательств",
-                    "Стремление к финансовой независимости"
-                ]
-            },
-            "51-65": {  # Бумеры
-                "key_values": ["Стабильная карьера", "Материальное благополучие", "Отложенная награда"],
-                "money_attitudes": [
-                    "Осторожное отношение к кредитам и долгам",
-                    "Предпочтение традиционных финансовых институтов (банки, брокеры)",
-                    "Консервативный подход к инвестициям, ориентация на безопасность",
-                    "Накопления для выхода на пенсию как важный приоритет",
-                    "Ценность материальных активов (недвижимость, автомобили)",
-                    "Меньший интерес к цифровым финансовым инструментам",
-                    "Склонность хранить наличные 'на черный день'"
-                ]
-            },
-            "66-80": {  # Старшее поколение
-                "key_values": ["Экономность", "Традиции", "Стабильность", "Планирование"],
-                "money_attitudes": [
-                    "Высокое недоверие к финансовым институтам из-за исторического опыта",
-                    "Предпочтение хранить сбережения 'под матрасом' или в виде материальных ценностей",
-                    "Минимальное использование кредитов, ориентация на жизнь по средствам",
-                    "Скептицизм к новым финансовым инструментам и цифровым технологиям",
-                    "Приоритет финансовой безопасности над доходностью",
-                    "Готовность помогать детям и внукам финансово",
-                    "Режим экономии как устоявшаяся привычка"
-                ]
-            }
-        }
+# Начало предложения (начало текста или после конца предложения)
+SENTENCE_START_RE = re.compile(r"(^|[.!?…]\s+)([А-ЯЁA-Z])")
 
-        # Семейные финансовые традиции
-        self.family_financial_traditions = {
-            "традиционная_модель": {
-                "description": "Традиционное распределение финансовых ролей в семье",
-                "patterns": [
-                    "Мужчина - основной добытчик, женщина распоряжается семейным бюджетом",
-                    "Общий бюджет, совместное принятие крупных финансовых решений",
-                    "Откладывание денег 'на черный день' как обязательная практика",
-                    "Стремление избегать кредитов, жить по средствам",
-                    "Стремление к покупке недвижимости как основы благосостояния"
-                ]
-            },
-            "современная_модель": {
-                "description": "Современное распределение финансовых ролей в семье",
-                "patterns": [
-                    "Равное участие партнеров в формировании бюджета",
-                    "Раздельные и общие счета одновременно (личные расходы и общие траты)",
-                    "Плановые инвестиции и осознанное использование кредитных продуктов",
-                    "Долгосрочное финансовое планирование с использованием цифровых инструментов",
-                    "Более гибкий подход к крупным приобретениям (могут предпочесть аренду покупке)"
-                ]
-            },
-            "партнерская_модель": {
-                "description": "Полностью раздельный подход к финансам в партнерстве",
-                "patterns": [
-                    "Полностью раздельные бюджеты, счета и финансовые решения",
-                    "Пропорциональное или равное разделение общих расходов",
-                    "Сохранение финансовой независимости каждого партнера",
-                    "Формальные договоренности о совместном имуществе",
-                    "Индивидуальные финансовые цели наряду с общими"
-                ]
-            },
-            "расширенная_семья": {
-                "description": "Финансовые отношения в расширенной семье (с участием старшего поколения)",
-                "patterns": [
-                    "Финансовая поддержка старшего поколения (родителей)",
-                    "Финансовая помощь от старшего поколения (в крупных приобретениях)",
-                    "Общие семейные активы и предприятия",
-                    "Советы и финансовый опыт передаются от старших к младшим",
-                    "Взаимная финансовая поддержка в кризисные периоды",
-                    "Приоритет благосостояния всей семьи над личными финансовыми целями"
-                ]
-            }
-        }
 
-        # Специфические финансовые практики в России
-        self.specific_financial_practices = {
-            "национальные_особенности": [
-                "Хранение сбережений в разных валютах для диверсификации",
-                "Предпочтение наличных для ежедневных расходов и 'заначек'",
-                "Инвестиции в недвижимость как основной способ сохранения капитала",
-                "Культура одалживания денег у родственников и друзей вместо микрозаймов",
-                "Практика 'занять до зарплаты' среди близких",
-                "Традиция создания 'кубышки на черный день'",
-                "Приоритет трат на образование детей над личными накоплениями",
-                "Выбор банка по совету знакомых или 'где получают зарплату'",
-                "Активное использование социальных льгот и налоговых вычетов",
-                "Высокая чувствительность к банковским/валютным кризисам из-за исторического опыта"
-            ],
-            "региональные_особенности": {
-                "Москва": [
-                    "Активное использование инвестиционных инструментов",
-                    "Высокая закредитованность для поддержания статуса",
-                    "Привычка к безналичной оплате и цифровым сервисам",
-                    "Финансовое планирование с учетом высокой стоимости жизни"
-                ],
-                "Санкт-Петербург": [
-                    "Баланс между современными финансовыми инструментами и традиционными подходами",
-                    "Более экономный подход по сравнению с Москвой при схожем уровне финансовой грамотности",
-                    "Популярность банковских услуг с кэшбэком за культурные мероприятия"
-                ],
-                "Регионы": [
-                    "Более консервативное отношение к финансовым инструментам",
-                    "Меньшее проникновение цифровых финансовых сервисов",
-                    "Более выраженная практика самообеспечения (подсобное хозяйство, заготовки)",
-                    "Выше доля наличных расчетов и 'серых' доходов",
-                    "Большее значение имеют социальные выплаты и льготы"
-                ]
-            },
-            "возрастные_особенности": {
-                "Молодежь": [
-                    "Активное использование кешбэк-сервисов и бонусных программ",
-                    "Интерес к инвестициям в криптовалюты и стартапы",
-                    "Приоритет мобильности и впечатлений над накоплениями",
-                    "Активное привлечение кредитов на образование и развитие"
-                ],
-                "Среднее поколение": [
-                    "Балансирование между помощью родителям и вложениями в детей",
-                    "Активное использование ипотечных продуктов",
-                    "Формирование накоплений 'на пенсию' из-за недоверия к пенсионной системе",
-                    "Диверсификация доходов через подработки и инвестиции"
-                ],
-                "Старшее поколение": [
-                    "Хранение наличных дома и в банковских ячейках",
-                    "Недоверие к банковской системе из-за опыта дефолтов",
-                    "Минимизация использования цифровых финансовых услуг",
-                    "Финансовая помощь детям и внукам как приоритет"
-                ]
-            }
-        }
+class LinguisticPostProcessor:
+    """
+    Детерминированная постобработка ответа по лингвистическому профилю персоны
 
-        # Модели социальной желательности в финансовых вопросах
-        self.social_desirability_patterns = {
-            "завышение_доходов": {
-                "description": "Тенденция завышать свои доходы в разговоре",
-                "examples": [
-                    "Округление зарплаты вверх",
-                    "Включение нерегулярных премий/бонусов в 'обычный доход'",
-                    "Упоминание 'прошлых высоких доходов' как актуальных",
-                    "Преувеличение размера инвестиций или их доходности"
-                ]
-            },
-            "сокрытие_долгов": {
-                "description": "Тенденция скрывать или преуменьшать долги",
-                "examples": [
-                    "Упоминание только одного кредита при наличии нескольких",
-                    "Называние кредита 'временной мерой' вне зависимости от ситуации",
-                    "Оправдание кредитов 'выгодными условиями' даже при высоких ставках",
-                    "Преуменьшение суммы долга или срока кредита"
-                ]
-            },
-            "демонстрация_финансовой_грамотности": {
-                "description": "Стремление показать более высокий уровень финансовой грамотности",
-                "examples": [
-                    "Использование профессиональных терминов без полного понимания их значения",
-                    "Утверждение об активном инвестировании при наличии лишь минимальных сбережений",
-                    "Заявления о строгом финансовом планировании без фактической его реализации",
-                    "Упоминание сложных финансовых инструментов для произведения впечатления"
-                ]
-            },
-            "рационализация_импульсивных_трат": {
-                "description": "Представление импульсивных трат как рациональных решений",
-                "examples": [
-                    "Объяснение дорогих покупок как 'инвестиций в качество'",
-                    "Оправдание незапланированных трат 'уникальной возможностью' или 'огромной скидкой'",
-                    "Представление эмоциональных покупок как 'заботы о себе' или 'заслуженной награды'",
-                    "Преуменьшение частоты и объема импульсивных трат"
-                ]
-            },
-            "скрытие_финансовой_помощи": {
-                "description": "Сокрытие получаемой финансовой помощи от родителей/партнера",
-                "examples": [
-                    "Представление подарков от родителей как заработанных средств",
-                    "Умалчивание о том, что родители помогли с первоначальным взносом по ипотеке",
-                    "Приписывание себе единоличной оплаты крупных покупок при фактическом софинансировании",
-                    "Представление помощи как 'временного возвратного займа'"
-                ]
-            },
-            "преувеличение_финансовой_независимости": {
-                "description": "Преувеличение степени своей финансовой независимости и успешности",
-                "examples": [
-                    "Заявления о полной финансовой независимости при фактической поддержке от родителей/партнера",
-                    "Преувеличение своей роли в семейных финансовых решениях",
-                    "Создание образа финансово успешного человека при наличии значительных долгов",
-                    "Утверждения о том, что 'деньги не главное' при фактическом стремлении к высоким доходам"
-                ]
-            }
-        }
+    Вместо инструкций в промпте опечатки, ошибки, слова-паразиты и региональные выражения
+    добавляются в готовый текст: шаблоны компилируются один раз, шум на уровне символов
+    применяется векторно (NumPy), а одинаковый генератор случайных чисел дает одинаковый результат.
+    """
 
-    def get_age_group(self, age: int) -> str:
-        """Определение возрастной группы по возрасту"""
-        if age <= 25:
-            return "18-25"
-        elif age <= 35:
-            return "26-35"
-        elif age <= 50:
-            return "36-50"
-        elif age <= 65:
-            return "51-65"
-        else:
-            return "66-80"
+    _compiled = False
+    _compile_lock = threading.Lock()
 
-    def get_region_type(self, region: str) -> str:
-        """Определение типа региона"""
-        if region in ["Москва"]:
+    def __init__(self):
+        """Шаблоны ошибок компилируются при создании первого экземпляра и общие для всех экземпляров"""
+        with LinguisticPostProcessor._compile_lock:
+            if not LinguisticPostProcessor._compiled:
+                LinguisticPostProcessor._compile()
+                LinguisticPostProcessor._compiled = True
+
+    @classmethod
+    def _compile(cls) -> None:
+        """Компиляция шаблонов ошибок из каталогов LinguisticVariation"""
+        # Орфографические ошибки: правильное написание -> ошибочное (шаблоны словаря записаны как ошибка -> исправление)
+        misspellings = {}
+        for pairs in SPELLING_ERROR_PATTERNS.values():
+            for pattern, correct in pairs:
+                wrong = cls._misspell(pattern, correct)
+                if wrong and wrong != correct:
+                    misspellings.setdefault(correct, wrong)
+        cls.misspellings = MappingProxyType(misspellings)
+        cls.misspelling_re = re.compile(
+            "|".join(re.escape(correct) for correct in sorted(misspellings, key=len, reverse=True)),
+            re.IGNORECASE
+        )
+
+        cls.grammar_patterns = tuple(
+            (re.compile(pattern), replacement)
+            for patterns in GRAMMAR_ERROR_PATTERNS.values()
+            for pattern, replacement in patterns
+        )
+
+        cls.abbreviation_re = re.compile(
+            r"\b(" + "|".join(re.escape(word) for word in sorted(WORD_ABBREVIATIONS, key=len, reverse=True)) + r")\b",
+            re.IGNORECASE
+        )
+        cls.word_re = re.compile(r"\b[А-Яа-яЁё]{4,}\b")
+
+        # Таблица соседних клавиш: для каждой буквы - сосед слева и справа (в начале и конце ряда - единственный)
+        neighbours = {}
+        for row in KEYBOARD_ROWS_RU:
+            for k, letter in enumerate(row):
+                left = row[k - 1] if k > 0 else row[k + 1]
+                right = row[k + 1] if k + 1 < len(row) else row[k - 1]
+                neighbours[letter] = (left, right)
+        letters = sorted(neighbours)
+        cls._key_codes = np.array([ord(letter) for letter in letters], dtype=np.uint32)
+        cls._key_left = np.array([ord(neighbours[letter][0]) for letter in letters], dtype=np.uint32)
+        cls._key_right = np.array([ord(neighbours[letter][1]) for letter in letters], dtype=np.uint32)
+
+        cls._vowels = np.array([ord(c) for c in "аеёиоуыэюяАЕЁИОУЫЭЮЯ"], dtype=np.uint32)
+        cls._omittable = np.array([ord(c) for c in ",;:"], dtype=np.uint32)
+        cls._terminal = np.array([ord(c) for c in "!?"], dtype=np.uint32)
+
+    @staticmethod
+    def _misspell(pattern: str, correct: str) -> str:
+        """
+        Ошибочное написание по шаблону словаря ошибок
+
+        Args:
+            pattern: Шаблон ошибки (например, 'к[ао]мпания' или 'жы')
+            correct: Правильное написание
+
+        Returns:
+            Ошибочное написание (пустая строка, если шаблон не разобран)
+        """
+        match = re.fullmatch(r"([^\[\]]*)\[([^\]]+)\](\{1,2\})?([^\[\]]*)", pattern)
+        if match is None:
+            # Шаблон без вариантов - это и есть ошибочное написание
+            return pattern if re.fullmatch(r"[А-Яа-яЁё]+", pattern) else ""
+
+        prefix, variants, doubled, suffix = match.groups()
+        if doubled:
+            # Двойная согласная пишется одинарной
+            return prefix + variants + suffix
+        if len(variants) == 1:
+            # Непроизносимая согласная пропускается
+            return prefix + suffix
+        # Безударная гласная или парная согласная заменяется другим вариантом
+        used = correct[len(prefix)] if len(correct) > len(prefix) else ""
+        other = [variant for variant in variants if variant != used]
+        return prefix + other[0] + suffix if other else ""
+
+    @staticmethod
+    def _rate(error_profile: Dict[str, float], traits: Sequence[str], level: float, base: float) -> float:
+        """Частота ошибки: максимальная вероятность признаков профиля * уровень ошибок * базовая частота"""
+        return max((error_profile.get(trait, 0.0) for trait in traits), default=0.0) * level * base
+
+    def process(self, text: str, linguistic_profile: Dict,
+                rng: Optional[random.Random] = None) -> Tuple[str, Dict[str, int]]:
+        """
+        Применение лингвистического профиля к тексту ответа
+
+        Args:
+            text: Текст ответа
+            linguistic_profile: Словарь с лингвистическим профилем персоны
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
+
+        Returns:
+            Кортеж (обработанный текст, количество правок по типам)
+        """
+        rng = rng or random
+        stats = Counter()
+        if not text or not linguistic_profile:
+            return text, dict(stats)
+
+        error_profile = linguistic_profile.get("error_profile", {})
+        level = linguistic_profile.get("total_error_level", 0.3)
+        np_rng = np.random.default_rng(rng.getrandbits(64))
+
+        text = self._insert_phrases(text, linguistic_profile, level, rng, stats)
+        text = self._apply_word_errors(text, error_profile, level, rng, stats)
+        text = self._apply_char_noise(text, error_profile, level, np_rng, stats)
+
+        return text, {name: count for name, count in stats.items() if count}
+
+    def _insert_phrases(self, text: str, linguistic_profile: Dict, level: float,
+                        rng: random.Random, stats: Counter) -> str:
+        """Слова-паразиты и региональное выражение в начале предложений"""
+        filler_words = linguistic_profile.get("filler_words", [])
+        expressions = linguistic_profile.get("regional_expressions", [])
+        filler_rate = next(rate for threshold, rate in FILLER_SENTENCE_RATES if level > threshold or threshold == 0.0)
+
+        starts = list(SENTENCE_START_RE.finditer(text))
+        # Региональное выражение - не больше одного на ответ
+        regional_at = rng.randrange(len(starts)) if expressions and starts and rng.random() < 0.5 else -1
+
+        def insert(match):
+            k = insert.count
+            insert.count += 1
+            phrase = ""
+            if k == regional_at:
+                phrase = rng.choice(expressions)
+                stats["regional"] += 1
+            elif filler_words and rng.random() < filler_rate:
+                phrase = rng.choice(filler_words)
+                stats["fillers"] += 1
+            if not phrase:
+                return match.group(0)
+            return f"{match.group(1)}{phrase[0].upper()}{phrase[1:]}, {match.group(2).lower()}"
+
+        insert.count = 0
+        return SENTENCE_START_RE.sub(insert, text)
+
+    @staticmethod
+    def _keep_case(original: str, replacement: str) -> str:
+        """Заглавная первая буква замены, если исходное слово начиналось с заглавной"""
+        return replacement[0].upper() + replacement[1:] if original[:1].isupper() else replacement
+
+    @staticmethod
+    def _substitute(pattern: re.Pattern, text: str, rate: float, make: Callable, rng: random.Random,
+                    stats: Counter, stat: str) -> str:
+        """Замена совпадений шаблона с заданной частотой (каждое совпадение - отдельное испытание)"""
+        if rate <= 0:
+            return text
+
+        def replace(match):
+            if rng.random() < rate:
+                stats[stat] += 1
+                return make(match)
+            return match.group(0)
+
+        return pattern.sub(replace, text)
+
+    def _apply_word_errors(self, text: str, error_profile: Dict[str, float], level: float,
+                           rng: random.Random, stats: Counter) -> str:
+        """Ошибки на уровне слов: орфография, грамматика, сокращения, капс"""
+        rate = self._rate(error_profile, ("spelling_errors",), level, POSTPROCESS_RATES["spelling_errors"])
+        text = self._substitute(self.misspelling_re, text, rate,
+                                lambda m: self._keep_case(m.group(0), self.misspellings[m.group(0).lower()]),
+                                rng, stats, "spelling")
+
+        rate = self._rate(error_profile, ("grammar_errors",), level, POSTPROCESS_RATES["grammar_errors"])
+        for pattern, replacement in self.grammar_patterns:
+            text = self._substitute(pattern, text, rate, lambda m, r=replacement: m.expand(r), rng, stats, "grammar")
+
+        rate = self._rate(error_profile, ("abbreviations", "phoneticization"), level,
+                          POSTPROCESS_RATES["abbreviations"])
+        text = self._substitute(self.abbreviation_re, text, rate,
+                                lambda m: self._keep_case(m.group(0), WORD_ABBREVIATIONS[m.group(0).lower()]),
+                                rng, stats, "abbreviations")
+
+        rate = self._rate(error_profile, ("caps_lock",), level, POSTPROCESS_RATES["caps_lock"])
+        return self._substitute(self.word_re, text, rate, lambda m: m.group(0).upper(), rng, stats, "caps_lock")
+
+    def _apply_char_noise(self, text: str, error_profile: Dict[str, float], level: float,
+                          np_rng: np.random.Generator, stats: Counter) -> str:
+        """Шум на уровне символов: опечатки, повтор букв, пунктуация, пробелы (векторно)"""
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).copy()
+        n = len(codes)
+        draws = np_rng.random((5, n))
+        counts = np.ones(n, dtype=np.int64)
+
+        # Опечатки: соседняя клавиша того же ряда
+        rate = self._rate(error_profile, ("typos", "autocorrect_fails", "autocompletion_errors"), level,
+                          POSTPROCESS_RATES["typos"])
+        key_idx = np.minimum(np.searchsorted(self._key_codes, codes), len(self._key_codes) - 1)
+        typo = (self._key_codes[key_idx] == codes) & (draws[0] < rate)
+        if typo.any():
+            left = draws[1] < 0.5
+            codes[typo] = np.where(left, self._key_left[key_idx], self._key_right[key_idx])[typo]
+            stats["typos"] += int(typo.sum())
+
+        # Повтор гласных для эмфазы
+        rate = self._rate(error_profile, ("letter_repetition",), level, POSTPROCESS_RATES["letter_repetition"])
+        repeated = np.isin(codes, self._vowels) & (draws[2] < rate)
+        counts[repeated] = 2 + (draws[1][repeated] < 0.3)
+        stats["letter_repetition"] += int(repeated.sum())
+
+        # Пропуск знаков препинания внутри предложения
+        rate = self._rate(error_profile, ("punctuation_omission", "run_on_sentences"), level,
+                          POSTPROCESS_RATES["punctuation_omission"])
+        omitted = np.isin(codes, self._omittable) & (draws[3] < rate)
+        counts[omitted] = 0
+        stats["punctuation_omission"] += int(omitted.sum())
+
+        # Избыток знаков в конце предложения
+        rate = self._rate(error_profile, ("punctuation_excess",), level, POSTPROCESS_RATES["punctuation_excess"])
+        excess = np.isin(codes, self._terminal) & (draws[3] < rate)
+        counts[excess] = 2 + (draws[1][excess] * 4).astype(np.int64)
+        stats["punctuation_excess"] += int(excess.sum())
+
+        # Пропущенные и двойные пробелы
+        rate = self._rate(error_profile, ("spacing_errors",), level, POSTPROCESS_RATES["spacing_errors"])
+        spacing = (codes == ord(" ")) & (draws[4] < rate)
+        counts[spacing] = np.where(draws[1][spacing] < 0.5, 0, 2)
+        stats["spacing"] += int(spacing.sum())
+
+        return np.repeat(codes, counts).tobytes().decode("utf-32-le")
+
+
+# Каталоги жизненного контекста (LifeContextFactors)
+# Жизненные события, влияющие на финансы
+LIFE_EVENTS = freeze_catalog({
+    "свадьба": {
+        "description": "Недавняя свадьба или подготовка к ней",
+        "financial_impact": "Крупные расходы, возможно общий бюджет с партнером, изменение финансовых приоритетов",
+        "relevant_topics": ["накопления", "кредиты", "планирование", "страхование"],
+        "age_relevance": {"min": 18, "max": 65, "peak": [25, 35]},
+        "family_status_relevance": ["Холост/Не замужем", "В отношениях", "Гражданский брак"]
+    },
+    "рождение_ребенка": {
+        "description": "Недавнее рождение ребенка или ожидание рождения",
+        "financial_impact": "Увеличение расходов, декретный отпуск, изменение бюджета, долгосрочное планирование",
+        "relevant_topics": ["накопления", "страхование", "детские вклады", "ипотека", "материнский капитал"],
+        "age_relevance": {"min": 20, "max": 45, "peak": [25, 35]},
+        "family_status_relevance": ["Женат/Замужем", "Гражданский брак"]
+    },
+    "потеря_работы": {
+        "description": "Недавняя потеря работы или риск ее потери",
+        "financial_impact": "Снижение доходов, использование сбережений, поиск подработок, возможное реструктурирование кредитов",
+        "relevant_topics": ["накопления", "кредиты", "рефинансирование", "социальные выплаты"],
+        "age_relevance": {"min": 18, "max": 65, "peak": [30, 50]},
+        "family_status_relevance": None  # релевантно для всех
+    },
+    "переезд": {
+        "description": "Недавний переезд или планирование переезда в другой город/страну",
+        "financial_impact": "Крупные расходы, изменение стоимости жизни, смена банков, вопросы с переводом денег",
+        "relevant_topics": ["накопления", "ипотека", "переводы", "валюта"],
+        "age_relevance": {"min": 18, "max": 45, "peak": [22, 35]},
+        "family_status_relevance": None  # релевантно для всех
+    },
+    "получение_наследства": {
+        "description": "Недавнее получение наследства или ожидание его получения",
+        "financial_impact": "Увеличение капитала, вопросы инвестирования, налоговые вопросы",
+        "relevant_topics": ["инвестиции", "налоги", "недвижимость", "вклады"],
+        "age_relevance": {"min": 30, "max": 80, "peak": [40, 60]},
+        "family_status_relevance": None  # релевантно для всех
+    },
+    "развод": {
+        "description": "Недавний развод или процесс развода",
+        "financial_impact": "Раздел имущества, изменение финансовых обязательств, отдельный бюджет, алименты",
+        "relevant_topics": ["раздел имущества", "алименты", "кредиты", "ипотека"],
+        "age_relevance": {"min": 25, "max": 60, "peak": [30, 45]},
+        "family_status_relevance": ["Разведен/Разведена"]
+    },
+    "покупка_жилья": {
+        "description": "Недавняя покупка жилья или активный поиск для покупки",
+        "financial_impact": "Крупные расходы, ипотека, вопросы страхования жилья, коммунальные платежи",
+        "relevant_topics": ["ипотека", "страхование", "налоги", "кредиты", "накопления"],
+        "age_relevance": {"min": 25, "max": 60, "peak": [30, 45]},
+        "family_status_relevance": None  # релевантно для всех
+    },
+    "старт_бизнеса": {
+        "description": "Недавний старт собственного бизнеса или подготовка к нему",
+        "financial_impact": "Инвестиции в бизнес, бизнес-кредиты, изменение структуры доходов и расходов",
+        "relevant_topics": ["бизнес-кредиты", "инвестиции", "налоги", "расчетный счет"],
+        "age_relevance": {"min": 25, "max": 55, "peak": [30, 45]},
+        "family_status_relevance": None  # релевантно для всех
+    },
+    "болезнь": {
+        "description": "Серьезное заболевание у себя или члена семьи",
+        "financial_impact": "Расходы на лечение, потеря трудоспособности, вопросы страхования",
+        "relevant_topics": ["медицинское страхование", "накопления", "кредиты", "социальные выплаты"],
+        "age_relevance": {"min": 30, "max": 80, "peak": [50, 70]},
+        "family_status_relevance": None  # релевантно для всех
+    },
+    "выход_на_пенсию": {
+        "description": "Недавний выход на пенсию или подготовка к нему",
+        "financial_impact": "Изменение структуры доходов, использование пенсионных накоплений, консервативный подход к инвестициям",
+        "relevant_topics": ["пенсия", "накопления", "инвестиции", "социальные выплаты"],
+        "age_relevance": {"min": 50, "max": 80, "peak": [55, 65]},
+        "family_status_relevance": None  # релевантно для всех
+    }
+})
+
+# Сезонные факторы, влияющие на финансы
+SEASONAL_FACTORS = freeze_catalog({
+    "новый_год": {
+        "description": "Период перед новогодними праздниками",
+        "months": [11, 12],  # ноябрь-декабрь
+        "financial_impact": "Увеличение трат на подарки и праздники, премии, планирование бюджета на следующий год",
+        "relevant_topics": ["кредиты", "накопления", "акции", "бонусы", "скидки"]
+    },
+    "лето_отпуск": {
+        "description": "Летний период отпусков",
+        "months": [5, 6, 7, 8],  # май-август
+        "financial_impact": "Траты на отпуск, путешествия, детский отдых, подготовка к школе в конце сезона",
+        "relevant_topics": ["накопления", "карты", "валюта", "мобильный банк", "страхование"]
+    },
+    "черная_пятница": {
+        "description": "Период распродаж 'Черная пятница'",
+        "months": [11],  # ноябрь
+        "financial_impact": "Увеличение импульсивных покупок, охота за скидками, возможность приобрести запланированные покупки дешевле",
+        "relevant_topics": ["кредитные карты", "рассрочка", "кэшбэк", "акции", "бонусы"]
+    },
+    "начало_учебного_года": {
+        "description": "Подготовка к учебному году",
+        "months": [7, 8],  # июль-август
+        "financial_impact": "Траты на подготовку детей к школе/вузу, оплата обучения, покупка техники и принадлежностей",
+        "relevant_topics": ["накопления", "кредиты", "рассрочка", "образовательные кредиты"]
+    },
+    "отопительный_сезон": {
+        "description": "Начало отопительного сезона",
+        "months": [9, 10],  # сентябрь-октябрь
+        "financial_impact": "Увеличение коммунальных платежей, возможная задолженность",
+        "relevant_topics": ["коммунальные платежи", "субсидии", "автоплатежи"]
+    },
+    "дачный_сезон": {
+        "description": "Дачный/садовый сезон",
+        "months": [4, 5, 6, 7, 8, 9],  # апрель-сентябрь
+        "financial_impact": "Траты на дачу/сад, сезонные работы, заготовки",
+        "relevant_topics": ["накопления", "кредиты на строительство/ремонт", "страхование имущества"]
+    },
+    "налоговый_период": {
+        "description": "Период уплаты налогов",
+        "months": [10, 11],  # октябрь-ноябрь
+        "financial_impact": "Уплата имущественных налогов, подача деклараций, налоговые вычеты",
+        "relevant_topics": ["налоги", "налоговые вычеты", "страхование", "инвестиции"]
+    }
+})
+
+# Текущая экономическая ситуация (обновляется извне)
+CURRENT_ECONOMIC_SITUATION = freeze_catalog({
+    "инфляция": {
+        "level": "высокая",  # высокая/умеренная/низкая
+        "description": "Высокий уровень инфляции влияет на стоимость товаров и услуг, обесценивает накопления без процентов",
+        "financial_impact": "Поиск способов сохранения сбережений, инвестиции для защиты от инфляции"
+    },
+    "ключевая_ставка": {
+        "level": "повышенная",  # повышенная/сниженная/стабильная
+        "description": "Центральный банк поддерживает повышенную ключевую ставку",
+        "financial_impact": "Высокие ставки по вкладам и кредитам, выгодность сбережений, дорогие кредиты"
+    },
+    "курс_валют": {
+        "level": "нестабильный",  # растущий/падающий/стабильный/нестабильный
+        "description": "Курс валют подвержен частым колебаниям",
+        "financial_impact": "Риски при валютных операциях, вопросы сохранения сбережений в разных валютах"
+    },
+    "кредитная_доступность": {
+        "level": "умеренная",  # высокая/умеренная/низкая
+        "description": "Банки умеренно строги при выдаче кредитов, требуют хорошую кредитную историю",
+        "financial_impact": "Более тщательная проверка заемщиков, потребность в хорошей кредитной истории"
+    }
+})
+
+# Культурные особенности отношений к деньгам в разных поколениях
+GENERATIONAL_MONEY_ATTITUDES = freeze_catalog({
+    "18-25": {  # Поколение Z
+        "key_values": ["Цифровая нативность", "Экологичность", "Индивидуализм", "Стартапы", "Фриланс"],
+        "money_attitudes": [
+            "Предпочтение цифровых финансовых инструментов",
+            "Открытость к новым финансовым технологиям и криптовалютам",
+            "Стремление к пассивному доходу и финансовой независимости с ранних лет",
+            "Скептицизм к традиционным финансовым институтам",
+            "Приоритет финансовой свободы и опыта над материальными ценностями",
+            "Готовность инвестировать в экологичные/этичные проекты",
+            "Стремление к ранним инвестициям даже с небольшими суммами"
+        ]
+    },
+    "26-35": {  # Миллениалы
+        "key_values": ["Баланс работы и жизни", "Опыт vs Вещи", "Социальные сети", "Аренда vs Покупка"],
+        "money_attitudes": [
+            "Высокая закредитованность, особенно образовательные кредиты",
+            "Откладывание крупных покупок (жилье, автомобиль) на более поздний срок",
+            "Предпочтение кредитных карт с бонусами/кешбэком",
+            "Готовность платить за уникальный опыт и впечатления",
+            "Ориентация на множественные источники дохода",
+            "Интерес к цифровым инвестициям и финтех-сервисам",
+            "Относительная финансовая грамотность при менее стабильной карьере"
+        ]
+    },
+    "36-50": {  # Поколение X
+        "key_values": ["Стабильность", "Карьера", "Семья", "Независимость"],
+        "money_attitudes": [
+            "Серьезное отношение к финансовому планированию",
+            "Более традиционный подход к инвестициям (недвижимость, банки)",
+            "Сочетание цифровых и традиционных финансовых инструментов",
+            "Акцент на образовании детей и пенсионных накоплениях",
+            "Склонность к умеренному риску в инвестициях",
+            "Более высокая стоимость активов, но и больше финансовых обязательств",
+            "Стремление к финансовой независимости"
+        ]
+    },
+    "51-65": {  # Бумеры
+        "key_values": ["Стабильная карьера", "Материальное благополучие", "Отложенная награда"],
+        "money_attitudes": [
+            "Осторожное отношение к кредитам и долгам",
+            "Предпочтение традиционных финансовых институтов (банки, брокеры)",
+            "Консервативный подход к инвестициям, ориентация на безопасность",
+            "Накопления для выхода на пенсию как важный приоритет",
+            "Ценность материальных активов (недвижимость, автомобили)",
+            "Меньший интерес к цифровым финансовым инструментам",
+            "Склонность хранить наличные 'на черный день'"
+        ]
+    },
+    "66-80": {  # Старшее поколение
+        "key_values": ["Экономность", "Традиции", "Стабильность", "Планирование"],
+        "money_attitudes": [
+            "Высокое недоверие к финансовым институтам из-за исторического опыта",
+            "Предпочтение хранить сбережения 'под матрасом' или в виде материальных ценностей",
+            "Минимальное использование кредитов, ориентация на жизнь по средствам",
+            "Скептицизм к новым финансовым инструментам и цифровым технологиям",
+            "Приоритет финансовой безопасности над доходностью",
+            "Готовность помогать детям и внукам финансово",
+            "Режим экономии как устоявшаяся привычка"
+        ]
+    }
+})
+
+# Семейные финансовые традиции
+FAMILY_FINANCIAL_TRADITIONS = freeze_catalog({
+    "традиционная_модель": {
+        "description": "Традиционное распределение финансовых ролей в семье",
+        "patterns": [
+            "Мужчина - основной добытчик, женщина распоряжается семейным бюджетом",
+            "Общий бюджет, совместное принятие крупных финансовых решений",
+            "Откладывание денег 'на черный день' как обязательная практика",
+            "Стремление избегать кредитов, жить по средствам",
+            "Стремление к покупке недвижимости как основы благосостояния"
+        ]
+    },
+    "современная_модель": {
+        "description": "Современное распределение финансовых ролей в семье",
+        "patterns": [
+            "Равное участие партнеров в формировании бюджета",
+            "Раздельные и общие счета одновременно (личные расходы и общие траты)",
+            "Плановые инвестиции и осознанное использование кредитных продуктов",
+            "Долгосрочное финансовое планирование с использованием цифровых инструментов",
+            "Более гибкий подход к крупным приобретениям (могут предпочесть аренду покупке)"
+        ]
+    },
+    "партнерская_модель": {
+        "description": "Полностью раздельный подход к финансам в партнерстве",
+        "patterns": [
+            "Полностью раздельные бюджеты, счета и финансовые решения",
+            "Пропорциональное или равное разделение общих расходов",
+            "Сохранение финансовой независимости каждого партнера",
+            "Формальные договоренности о совместном имуществе",
+            "Индивидуальные финансовые цели наряду с общими"
+        ]
+    },
+    "расширенная_семья": {
+        "description": "Финансовые отношения в расширенной семье (с участием старшего поколения)",
+        "patterns": [
+            "Финансовая поддержка старшего поколения (родителей)",
+            "Финансовая помощь от старшего поколения (в крупных приобретениях)",
+            "Общие семейные активы и предприятия",
+            "Советы и финансовый опыт передаются от старших к младшим",
+            "Взаимная финансовая поддержка в кризисные периоды",
+            "Приоритет благосостояния всей семьи над личными финансовыми целями"
+        ]
+    }
+})
+
+# Специфические финансовые практики в России
+SPECIFIC_FINANCIAL_PRACTICES = freeze_catalog({
+    "национальные_особенности": [
+        "Хранение сбережений в разных валютах для диверсификации",
+        "Предпочтение наличных для ежедневных расходов и 'заначек'",
+        "Инвестиции в недвижимость как основной способ сохранения капитала",
+        "Культура одалживания денег у родственников и друзей вместо микрозаймов",
+        "Практика 'занять до зарплаты' среди близких",
+        "Традиция создания 'кубышки на черный день'",
+        "Приоритет трат на образование детей над личными накоплениями",
+        "Выбор банка по совету знакомых или 'где получают зарплату'",
+        "Активное использование социальных льгот и налоговых вычетов",
+        "Высокая чувствительность к банковским/валютным кризисам из-за исторического опыта"
+    ],
+    "региональные_особенности": {
+        "Москва": [
+            "Активное использование инвестиционных инструментов",
+            "Высокая закредитованность для поддержания статуса",
+            "Привычка к безналичной оплате и цифровым сервисам",
+            "Финансовое планирование с учетом высокой стоимости жизни"
+        ],
+        "Санкт-Петербург": [
+            "Баланс между современными финансовыми инструментами и традиционными подходами",
+            "Более экономный подход по сравнению с Москвой при схожем уровне финансовой грамотности",
+            "Популярность банковских услуг с кэшбэком за культурные мероприятия"
+        ],
+        "Регионы": [
+            "Более консервативное отношение к финансовым инструментам",
+            "Меньшее проникновение цифровых финансовых сервисов",
+            "Более выраженная практика самообеспечения (подсобное хозяйство, заготовки)",
+            "Выше доля наличных расчетов и 'серых' доходов",
+            "Большее значение имеют социальные выплаты и льготы"
+        ]
+    },
+    "возрастные_особенности": {
+        "Молодежь": [
+            "Активное использование кешбэк-сервисов и бонусных программ",
+            "Интерес к инвестициям в криптовалюты и стартапы",
+            "Приоритет мобильности и впечатлений над накоплениями",
+            "Активное привлечение кредитов на образование и развитие"
+        ],
+        "Среднее поколение": [
+            "Балансирование между помощью родителям и вложениями в детей",
+            "Активное использование ипотечных продуктов",
+            "Формирование накоплений 'на пенсию' из-за недоверия к пенсионной системе",
+            "Диверсификация доходов через подработки и инвестиции"
+        ],
+        "Старшее поколение": [
+            "Хранение наличных дома и в банковских ячейках",
+            "Недоверие к банковской системе из-за опыта дефолтов",
+            "Минимизация использования цифровых финансовых услуг",
+            "Финансовая помощь детям и внукам как приоритет"
+        ]
+    }
+})
+
+# Модели социальной желательности в финансовых вопросах
+SOCIAL_DESIRABILITY_PATTERNS = freeze_catalog({
+    "завышение_доходов": {
+        "description": "Тенденция завышать свои доходы в разговоре",
+        "examples": [
+            "Округление зарплаты вверх",
+            "Включение нерегулярных премий/бонусов в 'обычный доход'",
+            "Упоминание 'прошлых высоких доходов' как актуальных",
+            "Преувеличение размера инвестиций или их доходности"
+        ]
+    },
+    "сокрытие_долгов": {
+        "description": "Тенденция скрывать или преуменьшать долги",
+        "examples": [
+            "Упоминание только одного кредита при наличии нескольких",
+            "Называние кредита 'временной мерой' вне зависимости от ситуации",
+            "Оправдание кредитов 'выгодными условиями' даже при высоких ставках",
+            "Преуменьшение суммы долга или срока кредита"
+        ]
+    },
+    "демонстрация_финансовой_грамотности": {
+        "description": "Стремление показать более высокий уровень финансовой грамотности",
+        "examples": [
+            "Использование профессиональных терминов без полного понимания их значения",
+            "Утверждение об активном инвестировании при наличии лишь минимальных сбережений",
+            "Заявления о строгом финансовом планировании без фактической его реализации",
+            "Упоминание сложных финансовых инструментов для произведения впечатления"
+        ]
+    },
+    "рационализация_импульсивных_трат": {
+        "description": "Представление импульсивных трат как рациональных решений",
+        "examples": [
+            "Объяснение дорогих покупок как 'инвестиций в качество'",
+            "Оправдание незапланированных трат 'уникальной возможностью' или 'огромной скидкой'",
+            "Представление эмоциональных покупок как 'заботы о себе' или 'заслуженной награды'",
+            "Преуменьшение частоты и объема импульсивных трат"
+        ]
+    },
+    "скрытие_финансовой_помощи": {
+        "description": "Сокрытие получаемой финансовой помощи от родителей/партнера",
+        "examples": [
+            "Представление подарков от родителей как заработанных средств",
+            "Умалчивание о том, что родители помогли с первоначальным взносом по ипотеке",
+            "Приписывание себе единоличной оплаты крупных покупок при фактическом софинансировании",
+            "Представление помощи как 'временного возвратного займа'"
+        ]
+    },
+    "преувеличение_финансовой_независимости": {
+        "description": "Преувеличение степени своей финансовой независимости и успешности",
+        "examples": [
+            "Заявления о полной финансовой независимости при фактической поддержке от родителей/партнера",
+            "Преувеличение своей роли в семейных финансовых решениях",
+            "Создание образа финансово успешного человека при наличии значительных долгов",
+            "Утверждения о том, что 'деньги не главное' при фактическом стремлении к высоким доходам"
+        ]
+    }
+})
+
+
+class LifeContextFactors:
+    """Класс для моделирования жизненного контекста и событий, влияющих на финансовое поведение"""
+
+    def __init__(self):
+        """Инициализация моделей жизненного контекста"""
+        # Статические каталоги создаются один раз при импорте модуля и общие для всех экземпляров
+        self.life_events = LIFE_EVENTS
+        self.seasonal_factors = SEASONAL_FACTORS
+        self.current_economic_situation = CURRENT_ECONOMIC_SITUATION
+        self.generational_money_attitudes = GENERATIONAL_MONEY_ATTITUDES
+        self.family_financial_traditions = FAMILY_FINANCIAL_TRADITIONS
+        self.specific_financial_practices = SPECIFIC_FINANCIAL_PRACTICES
+        self.social_desirability_patterns = SOCIAL_DESIRABILITY_PATTERNS
+
+    def get_age_group(self, age: int) -> str:
+        """Определение возрастной группы по возрасту"""
+        if age <= 25:
+            return "18-25"
+        elif age <= 35:
+            return "26-35"
+        elif age <= 50:
+            return "36-50"
+        elif age <= 65:
+            return "51-65"
+        else:
+            return "66-80"
+
+    def get_region_type(self, region: str) -> str:
+        """Определение типа региона"""
+        if region in ["Москва"]:
             return "Москва"
         elif region in ["Санкт-Петербург"]:
             return "Санкт-Петербург"
         else:
             return "Регионы"
 
-    def get_relevant_life_events(self, persona: Dict) -> List[Dict]:
+    def get_relevant_life_events(self, persona: Dict, rng: Optional[random.Random] = None) -> List[Dict]:
         """
         Определение релевантных жизненных событий для персоны
 
         Args:
             persona: Словарь с данными персоны
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
             Список словарей с релевантными жизненными событиями
         """
+        rng = rng or random
         age = persona.get('Возраст', 30)
         family_status = persona.get('Семейное положение', 'Не указано')
 
@@ -2042,7 +2890,7 @@ class LifeContextFactors:
 
         for event_name, probability in event_probabilities.items():
             # С определенной вероятностью считаем событие активным
-            if random.random() < probability:
+            if rng.random() < probability:
                 active_events.append({
                     "name": event_name,
                     "description": self.life_events[event_name]["description"],
@@ -2099,16 +2947,18 @@ class LifeContextFactors:
 
         return self.generational_money_attitudes.get(age_group, self.generational_money_attitudes["36-50"])
 
-    def get_family_financial_tradition(self, persona: Dict) -> Dict:
+    def get_family_financial_tradition(self, persona: Dict, rng: Optional[random.Random] = None) -> Dict:
         """
         Определение семейной финансовой традиции для персоны
 
         Args:
             persona: Словарь с данными персоны
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
             Словарь с семейной финансовой традицией
         """
+        rng = rng or random
         age = persona.get('Возраст', 30)
         family_status = persona.get('Семейное положение', 'Не указано')
 
@@ -2163,7 +3013,7 @@ class LifeContextFactors:
         # Выбираем модель на основе вероятностей
         models = list(normalized_probabilities.keys())
         weights = list(normalized_probabilities.values())
-        selected_model = random.choices(models, weights=weights, k=1)[0]
+        selected_model = rng.choices(models, weights=weights, k=1)[0]
 
         return {
             "model": selected_model,
@@ -2171,16 +3021,18 @@ class LifeContextFactors:
             "patterns": self.family_financial_traditions[selected_model]["patterns"]
         }
 
-    def get_specific_financial_practices(self, persona: Dict) -> Dict:
+    def get_specific_financial_practices(self, persona: Dict, rng: Optional[random.Random] = None) -> Dict:
         """
         Получение специфических финансовых практик для персоны
 
         Args:
             persona: Словарь с данными персоны
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
             Словарь со специфическими финансовыми практиками
         """
+        rng = rng or random
         age = persona.get('Возраст', 30)
         region = persona.get('Регион', 'Москва')
 
@@ -2188,7 +3040,7 @@ class LifeContextFactors:
         region_type = self.get_region_type(region)
 
         # Определяем, какие национальные особенности актуальны (выбираем случайные)
-        national_practices = random.sample(
+        national_practices = rng.sample(
             self.specific_financial_practices["национальные_особенности"],
             k=min(3, len(self.specific_financial_practices["национальные_особенности"]))
         )
@@ -2202,11 +3054,11 @@ class LifeContextFactors:
             age_category = "Старшее поколение"
 
         age_practices = self.specific_financial_practices["возрастные_особенности"].get(age_category, [])
-        age_practices = random.sample(age_practices, k=min(2, len(age_practices)))
+        age_practices = rng.sample(age_practices, k=min(2, len(age_practices)))
 
         # Определяем региональные особенности
         regional_practices = self.specific_financial_practices["региональные_особенности"].get(region_type, [])
-        regional_practices = random.sample(regional_practices, k=min(2, len(regional_practices)))
+        regional_practices = rng.sample(regional_practices, k=min(2, len(regional_practices)))
 
         return {
             "national": national_practices,
@@ -2214,16 +3066,18 @@ class LifeContextFactors:
             "age_specific": age_practices
         }
 
-    def get_social_desirability_biases(self, persona: Dict) -> List[Dict]:
+    def get_social_desirability_biases(self, persona: Dict, rng: Optional[random.Random] = None) -> List[Dict]:
         """
         Определение склонностей к социально желательным ответам для персоны
 
         Args:
             persona: Словарь с данными персоны
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
             Список словарей с патернами социальной желательности
         """
+        rng = rng or random
         age = persona.get('Возраст', 30)
         income = persona.get('Доход', 'Не указано')
         literacy_level = persona.get('Финансовый профиль', {}).get('Уровень финансовой грамотности', 'средний')
@@ -2270,9 +3124,9 @@ class LifeContextFactors:
 
         for pattern_name, pattern_info in self.social_desirability_patterns.items():
             # Для каждого паттерна определяем, будет ли он применяться
-            if random.random() < social_desirability_probability * 0.7:  # Немного снижаем для реалистичности
+            if rng.random() < social_desirability_probability * 0.7:  # Немного снижаем для реалистичности
                 # Выбираем примеры проявления паттерна
-                examples = random.sample(
+                examples = rng.sample(
                     pattern_info["examples"],
                     k=min(2, len(pattern_info["examples"]))
                 )
@@ -2281,44 +3135,74 @@ class LifeContextFactors:
                     "name": pattern_name,
                     "description": pattern_info["description"],
                     "examples": examples,
-                    "strength": random.uniform(0.3, 0.8)  # Сила проявления
+                    "strength": rng.uniform(0.3, 0.8)  # Сила проявления
                 })
 
         # Ограничиваем количество паттернов для реалистичности
         if len(selected_patterns) > 3:
-            selected_patterns = random.sample(selected_patterns, k=3)
+            selected_patterns = rng.sample(selected_patterns, k=3)
 
         return selected_patterns
 
-    def apply_life_context_to_prompt(self, prompt: str, persona: Dict, question: Dict = None) -> str:
+    def build_life_context(self, persona: Dict, rng: Optional[random.Random] = None) -> Dict:
         """
-        Добавление информации о жизненном контексте в промпт
+        Выбор жизненного контекста персоны: события, традиции, практики и паттерны ответов
+
+        Результат фиксируется на всю серию вопросов персоны, чтобы ее ответы не противоречили
+        друг другу из-за случайного выбора контекста для каждого вопроса.
 
         Args:
-            prompt: Исходный промпт
             persona: Словарь с данными персоны
-            question: Словарь с вопросом (опционально)
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
-            Модифицированный промпт
+            Словарь жизненного контекста (для render_life_context)
         """
+        rng = rng or random
         # Определяем жизненные события
-        life_events = self.get_relevant_life_events(persona)
+        life_events = self.get_relevant_life_events(persona, rng=rng)
+
+        # Определяем семейную финансовую традицию
+        family_tradition = self.get_family_financial_tradition(persona, rng=rng)
+
+        # Определяем специфические финансовые практики
+        specific_practices = self.get_specific_financial_practices(persona, rng=rng)
 
-        # Определяем сезонные факторы
-        seasonal_factors = self.get_current_seasonal_factors()
+        # Определяем паттерны социальной желательности
+        social_desirability = self.get_social_desirability_biases(persona, rng=rng)
 
         # Определяем культурные отношения к деньгам в зависимости от поколения
         generational_attitudes = self.get_generational_money_attitudes(persona)
+        money_attitudes = generational_attitudes.get("money_attitudes", []) if generational_attitudes else []
 
-        # Определяем семейную финансовую традицию
-        family_tradition = self.get_family_financial_tradition(persona)
+        return {
+            "life_events": life_events,
+            "seasonal_factors": self.get_current_seasonal_factors(),
+            "age_group": self.get_age_group(persona.get('Возраст', 30)),
+            "generational_attitudes": rng.sample(money_attitudes, k=min(3, len(money_attitudes)))
+            if generational_attitudes else None,
+            "family_tradition": family_tradition,
+            "family_patterns": rng.sample(family_tradition['patterns'], k=min(2, len(family_tradition['patterns'])))
+            if family_tradition else [],
+            "specific_practices": specific_practices,
+            "social_desirability": social_desirability
+        }
 
-        # Определяем специфические финансовые практики
-        specific_practices = self.get_specific_financial_practices(persona)
+    def render_life_context(self, life_context: Dict) -> str:
+        """
+        Блок жизненного контекста для промпта
 
-        # Определяем паттерны социальной желательности
-        social_desirability = self.get_social_desirability_biases(persona)
+        Args:
+            life_context: Словарь жизненного контекста (результат build_life_context)
+
+        Returns:
+            Текст блока
+        """
+        life_events = life_context["life_events"]
+        seasonal_factors = life_context["seasonal_factors"]
+        family_tradition = life_context["family_tradition"]
+        specific_practices = life_context["specific_practices"]
+        social_desirability = life_context["social_desirability"]
 
         # Формируем блок с жизненным контекстом для промпта
         life_context_block = "\nЖИЗНЕННЫЙ КОНТЕКСТ И ФИНАНСОВЫЕ ОСОБЕННОСТИ:"
@@ -2342,18 +3226,15 @@ class LifeContextFactors:
                 life_context_block += f"\n- {key.replace('_', ' ').capitalize()}: {info['level']} - {info['financial_impact']}"
 
         # Добавляем информацию о поколенческих отношениях к деньгам
-        if generational_attitudes:
-            age_group = self.get_age_group(persona.get('Возраст', 30))
-            life_context_block += f"\n\nПОКОЛЕНЧЕСКИЕ ОСОБЕННОСТИ (группа {age_group} лет):"
-            attitudes = random.sample(generational_attitudes.get("money_attitudes", []), k=min(3, len(generational_attitudes.get("money_attitudes", []))))
-            for attitude in attitudes:
+        if life_context["generational_attitudes"] is not None:
+            life_context_block += f"\n\nПОКОЛЕНЧЕСКИЕ ОСОБЕННОСТИ (группа {life_context['age_group']} лет):"
+            for attitude in life_context["generational_attitudes"]:
                 life_context_block += f"\n- {attitude}"
 
         # Добавляем информацию о семейных финансовых традициях
         if family_tradition:
             life_context_block += f"\n\nСЕМЕЙНАЯ ФИНАНСОВАЯ МОДЕЛЬ: {family_tradition['description']}"
-            patterns = random.sample(family_tradition['patterns'], k=min(2, len(family_tradition['patterns'])))
-            for pattern in patterns:
+            for pattern in life_context["family_patterns"]:
                 life_context_block += f"\n- {pattern}"
 
         # Добавляем информацию о специфических финансовых практиках
@@ -2374,6 +3255,24 @@ class LifeContextFactors:
                 if pattern['examples']:
                     life_context_block += f"\n  Пример: {pattern['examples'][0]}"
 
+        return life_context_block
+
+    def apply_life_context_to_prompt(self, prompt: str, persona: Dict, question: Dict = None,
+                                     rng: Optional[random.Random] = None) -> str:
+        """
+        Добавление информации о жизненном контексте в промпт
+
+        Args:
+            prompt: Исходный промпт
+            persona: Словарь с данными персоны
+            question: Словарь с вопросом (опционально)
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
+
+        Returns:
+            Модифицированный промпт
+        """
+        life_context_block = self.render_life_context(self.build_life_context(persona, rng=rng))
+
         # Добавляем блок в промпт перед общими правилами
         if "ОБЩИЕ ПРАВИЛА ОТВЕТА" in prompt:
             prompt = prompt.replace("ОБЩИЕ ПРАВИЛА ОТВЕТА", f"{life_context_block}\n\nОБЩИЕ ПРАВИЛА ОТВЕТА")
@@ -2383,93 +3282,163 @@ class LifeContextFactors:
         return prompt
 
 
+# Каталоги непоследовательности ответов (Inconsistency)
+# Типы непоследовательностей
+INCONSISTENCY_TYPES = freeze_catalog({
+    "изменение_уверенности": {
+        "description": "Изменение степени уверенности в информации при переформулировке вопроса",
+        "examples": [
+            "Изначально: 'Я точно знаю, что...' → После: 'Мне кажется, что...'",
+            "Изначально: 'Не уверен, но...' → После: 'Я абсолютно уверен, что...'"
+        ]
+    },
+    "противоречивые_утверждения": {
+        "description": "Противоречивые утверждения при обсуждении одной темы",
+        "examples": [
+            "Изначально: 'Я никогда не беру кредиты' → После: 'У меня есть небольшой кредит'",
+            "Изначально: 'Я всегда сравниваю цены' → После: 'Обычно покупаю не задумываясь'"
+        ]
+    },
+    "изменение_предпочтений": {
+        "description": "Изменение предпочтений при смене контекста вопроса",
+        "examples": [
+            "Изначально: 'Доходность важнее надежности' → После: 'Безопасность вклада для меня на первом месте'",
+            "Изначально: 'Я предпочитаю наличные' → После: 'Обычно расплачиваюсь картой'"
+        ]
+    },
+    "разная_финансовая_грамотность": {
+        "description": "Проявление разного уровня финансовой грамотности в разных темах",
+        "examples": [
+            "Точное использование терминологии при обсуждении кредитов, но путаница в инвестиционных терминах",
+            "Уверенное рассуждение о банковских картах, но примитивное понимание страховых продуктов"
+        ]
+    },
+    "противоречия_в_финансовом_поведении": {
+        "description": "Заявленные принципы противоречат описанному поведению",
+        "examples": [
+            "Изначально: 'Я строго контролирую расходы' → После: 'Часто не помню, на что потратил деньги'",
+            "Изначально: 'Всегда откладываю 10% дохода' → После: 'Никогда не получается накопить'"
+        ]
+    }
+})
+
+# Факторы, влияющие на уровень непоследовательности
+INCONSISTENCY_FACTORS = freeze_catalog({
+    "усталость": {
+        "description": "Снижение качества и последовательности ответов при длительном опросе",
+        "effects": [
+            "Более короткие ответы в конце опроса",
+            "Рост противоречий при усталости",
+            "Снижение внимания к деталям вопроса"
+        ]
+    },
+    "сложность_темы": {
+        "description": "Более противоречивые ответы в сложных финансовых темах",
+        "effects": [
+            "Больше противоречий в темах за пределами компетенции",
+            "Использование шаблонных фраз при непонимании вопроса",
+            "Выдача уверенных, но неточных суждений"
+        ]
+    },
+    "формулировка_вопроса": {
+        "description": "Различные ответы на схожие вопросы с разной формулировкой",
+        "effects": [
+            "Разные ответы на положительно и отрицательно сформулированные вопросы",
+            "Влияние предложенных вариантов ответа на мнение",
+            "Противоречивые ответы при изменении контекста вопроса"
+        ]
+    }
+})
+
+
 class Inconsistency:
     """Класс для моделирования непоследовательности в ответах"""
 
     def __init__(self):
         """Инициализация параметров непоследовательности"""
-        # Типы непоследовательностей
-        self.inconsistency_types = {
-            "изменение_уверенности": {
-                "description": "Изменение степени уверенности в информации при переформулировке вопроса",
-                "examples": [
-                    "Изначально: 'Я точно знаю, что...' → После: 'Мне кажется, что...'",
-                    "Изначально: 'Не уверен, но...' → После: 'Я абсолютно уверен, что...'"
-                ]
-            },
-            "противоречивые_утверждения": {
-                "description": "Противоречивые утверждения при обсуждении одной темы",
-                "examples": [
-                    "Изначально: 'Я никогда не беру кредиты' → После: 'У меня есть небольшой кредит'",
-                    "Изначально: 'Я всегда сравниваю цены' → После: 'Обычно покупаю не задумываясь'"
-                ]
-            },
-            "изменение_предпочтений": {
-                "description": "Изменение предпочтений при смене контекста вопроса",
-                "examples": [
-                    "Изначально: 'Доходность важнее надежности' → После: 'Безопасность вклада для меня на первом месте'",
-                    "Изначально: 'Я предпочитаю наличные' → После: 'Обычно расплачиваюсь картой'"
-                ]
-            },
-            "разная_финансовая_грамотность": {
-                "description": "Проявление разного уровня финансовой грамотности в разных темах",
-                "examples": [
-                    "Точное использование терминологии при обсуждении кредитов, но путаница в инвестиционных терминах",
-                    "Уверенное рассуждение о банковских картах, но примитивное понимание страховых продуктов"
-                ]
-            },
-            "противоречия_в_финансовом_поведении": {
-                "description": "Заявленные принципы противоречат описанному поведению",
-                "examples": [
-                    "Изначально: 'Я строго контролирую расходы' → После: 'Часто не помню, на что потратил деньги'",
-                    "Изначально: 'Всегда откладываю 10% дохода' → После: 'Никогда не получается накопить'"
-                ]
-            }
-        }
+        # Статические каталоги создаются один раз при импорте модуля и общие для всех экземпляров
+        self.inconsistency_types = INCONSISTENCY_TYPES
+        self.inconsistency_factors = INCONSISTENCY_FACTORS
 
-        # Факторы, влияющие на уровень непоследовательности
-        self.inconsistency_factors = {
-            "усталость": {
-                "description": "Снижение качества и последовательности ответов при длительном опросе",
-                "effects": [
-                    "Более короткие ответы в конце опроса",
-                    "Рост противоречий при усталости",
-                    "Снижение внимания к деталям вопроса"
-                ]
-            },
-            "сложность_темы": {
-                "description": "Более противоречивые ответы в сложных финансовых темах",
-                "effects": [
-                    "Больше противоречий в темах за пределами компетенции",
-                    "Использование шаблонных фраз при непонимании вопроса",
-                    "Выдача уверенных, но неточных суждений"
-                ]
-            },
-            "формулировка_вопроса": {
-                "description": "Различные ответы на схожие вопросы с разной формулировкой",
-                "effects": [
-                    "Разные ответы на положительно и отрицательно сформулированные вопросы",
-                    "Влияние предложенных вариантов ответа на мнение",
-                    "Противоречивые ответы при изменении контекста вопроса"
-                ]
-            }
-        }
-
-    def generate_inconsistency_profile(self, persona: Dict) -> Dict:
+    def generate_inconsistency_profile(self, persona: Dict, rng: Optional[random.Random] = None) -> Dict:
         """
         Создание профиля непоследовательности для персоны
 
         Args:
             persona: Словарь с данными персоны
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
             Словарь с профилем непоследовательности
         """
+        rng = rng or random
         # Извлекаем релевантные характеристики персоны
         age = persona.get('Возраст', 30)
         literacy_level = persona.get('Финансовый профиль', {}).get('Уровень финансовой грамотности', 'средний')
 
-        # Базовый уровень непоследовательности (0-1)
+        # Рассчитываем итоговый уровень с некоторой случайностью
+        inconsistency_level = self._base_inconsistency_level(age, literacy_level) * rng.uniform(0.8, 1.2)
+
+        # Выбираем типы непоследовательности, которые будут характерны для персоны
+        # Вероятность выбора каждого типа зависит от общего уровня непоследовательности
+        type_strengths = {}
+
+        for type_name in self.inconsistency_types:
+            # Чем выше общий уровень, тем больше типов может быть выбрано
+            if rng.random() < inconsistency_level * 0.7:
+                # Присваиваем каждому типу случайную силу
+                strength = rng.uniform(inconsistency_level * 0.5, inconsistency_level * 1.5)
+                # Ограничиваем значение
+                type_strengths[type_name] = min(0.9, max(0.1, strength))
+
+        # Убедимся, что хотя бы один тип выбран для реалистичности
+        if not type_strengths:
+            random_type = rng.choice(list(self.inconsistency_types.keys()))
+            type_strengths[random_type] = inconsistency_level
+
+        # Профиль усталости (для моделирования ухудшения качества ответов)
+        fatigue_rate = rng.uniform(0.05, 0.15)  # Скорость нарастания усталости
+        max_fatigue = rng.uniform(0.6, 0.9)  # Максимальный уровень усталости
+
+        return self.assemble_inconsistency_profile(inconsistency_level, type_strengths, fatigue_rate, max_fatigue)
+
+    def assemble_inconsistency_profile(self, inconsistency_level: float, type_strengths: Dict[str, float],
+                                       fatigue_rate: float, max_fatigue: float) -> Dict:
+        """
+        Сборка профиля непоследовательности из выбранных случайных параметров
+
+        Args:
+            inconsistency_level: Общий уровень непоследовательности
+            type_strengths: Сила каждого выбранного типа непоследовательности
+            fatigue_rate: Скорость нарастания усталости
+            max_fatigue: Максимальный уровень усталости
+
+        Returns:
+            Словарь с профилем непоследовательности
+        """
+        selected_types = {
+            type_name: {
+                "description": self.inconsistency_types[type_name]["description"],
+                "examples": list(self.inconsistency_types[type_name]["examples"]),
+                "strength": strength
+            }
+            for type_name, strength in type_strengths.items()
+        }
+
+        fatigue_profile = {
+            "fatigue_rate": fatigue_rate,
+            "current_fatigue": 0.0,  # Текущий уровень усталости
+            "max_fatigue": max_fatigue
+        }
+
+        return {
+            "overall_level": inconsistency_level,
+            "types": selected_types,
+            "fatigue_profile": fatigue_profile
+        }
+
+    def _base_inconsistency_level(self, age: int, literacy_level: str) -> float:
+        """Базовый уровень непоследовательности (0-1) до случайной вариации"""
         base_inconsistency = 0.4  # Средний уровень непоследовательности
 
         # Корректируем в зависимости от возраста (U-образная кривая)
@@ -2490,104 +3459,123 @@ class Inconsistency:
             # Высокая грамотность - ниже непоследовательность
             literacy_factor = -0.2
 
-        # Рассчитываем итоговый уровень с некоторой случайностью
-        inconsistency_level = base_inconsistency + age_factor + literacy_factor
-        inconsistency_level = min(0.9, max(0.1, inconsistency_level)) * random.uniform(0.8, 1.2)
+        return min(0.9, max(0.1, base_inconsistency + age_factor + literacy_factor))
 
-        # Выбираем типы непоследовательности, которые будут характерны для персоны
-        # Вероятность выбора каждого типа зависит от общего уровня непоследовательности
-        selected_types = {}
+    def generate_inconsistency_batch(self, ages: np.ndarray, literacy_codes: np.ndarray,
+                                     literacy_levels: Sequence[str],
+                                     rng: np.random.Generator) -> Dict[str, np.ndarray]:
+        """
+        Пакетная генерация параметров профиля непоследовательности
+        (распределения совпадают с generate_inconsistency_profile)
 
-        for type_name, type_info in self.inconsistency_types.items():
-            # Чем выше общий уровень, тем больше типов может быть выбрано
-            if random.random() < inconsistency_level * 0.7:
-                # Присваиваем каждому типу случайную силу
-                strength = random.uniform(inconsistency_level * 0.5, inconsistency_level * 1.5)
-                # Ограничиваем значение
-                strength = min(0.9, max(0.1, strength))
+        Args:
+            ages: Возраст каждой персоны
+            literacy_codes: Индексы уровней финансовой грамотности
+            literacy_levels: Названия уровней грамотности (справочник для индексов)
+            rng: Генератор случайных чисел NumPy
 
-                selected_types[type_name] = {
-                    "description": type_info["description"],
-                    "examples": type_info["examples"],
-                    "strength": strength
-                }
+        Returns:
+            Словарь массивов: overall_level (N), type_strength (N x число типов, 0 - тип не выбран),
+            fatigue_rate (N), max_fatigue (N)
+        """
+        n = len(ages)
+        num_types = len(self.inconsistency_types)
 
-        # Убедимся, что хотя бы один тип выбран для реалистичности
-        if not selected_types:
-            random_type = random.choice(list(self.inconsistency_types.keys()))
-            selected_types[random_type] = {
-                "description": self.inconsistency_types[random_type]["description"],
-                "examples": self.inconsistency_types[random_type]["examples"],
-                "strength": inconsistency_level
-            }
+        age_values, age_inverse = np.unique(ages, return_inverse=True)
+        base_table = np.array([
+            [self._base_inconsistency_level(int(age), level) for level in literacy_levels] for age in age_values
+        ])
+        base = base_table[age_inverse, literacy_codes] if n else np.zeros(0)
+        level = base * rng.uniform(0.8, 1.2, size=n)
 
-        # Создаем профиль усталости (для моделирования ухудшения качества ответов)
-        fatigue_profile = {
-            "fatigue_rate": random.uniform(0.05, 0.15),  # Скорость нарастания усталости
-            "current_fatigue": 0.0,  # Текущий уровень усталости
-            "max_fatigue": random.uniform(0.6, 0.9)  # Максимальный уровень усталости
-        }
+        selected = rng.random((n, num_types)) < level[:, None] * 0.7
+        strength = np.clip(rng.uniform(level[:, None] * 0.5, level[:, None] * 1.5, size=(n, num_types)), 0.1, 0.9)
+        strength = np.where(selected, strength, 0.0)
+
+        # Хотя бы один тип: при пустом выборе берется случайный тип с силой, равной общему уровню
+        empty = np.flatnonzero(~selected.any(axis=1))
+        strength[empty, rng.integers(0, num_types, size=len(empty))] = level[empty]
 
         return {
-            "overall_level": inconsistency_level,
-            "types": selected_types,
-            "fatigue_profile": fatigue_profile
+            "overall_level": level.astype(np.float32),
+            "type_strength": strength.astype(np.float32),
+            "fatigue_rate": rng.uniform(0.05, 0.15, size=n).astype(np.float32),
+            "max_fatigue": rng.uniform(0.6, 0.9, size=n).astype(np.float32)
         }
 
-    def update_fatigue(self, inconsistency_profile: Dict, question_index: int = 0) -> Dict:
+    def fatigue_schedule(self, inconsistency_profile: Dict, num_questions: int) -> List[Tuple[float, float]]:
         """
-        Обновление уровня усталости на основе количества вопросов
+        График усталости для серии вопросов
+
+        Усталость накапливается с каждым вопросом (после вопроса j она растет на fatigue_rate * (j + 1)
+        до max_fatigue), а общий уровень непоследовательности растет на половину текущей усталости.
+        Профиль не изменяется, поэтому график можно использовать из нескольких потоков.
 
         Args:
             inconsistency_profile: Профиль непоследовательности
-            question_index: Индекс текущего вопроса
+            num_questions: Количество вопросов
 
         Returns:
-            Обновленный профиль непоследовательности
+            Список пар (усталость, общий уровень непоследовательности) для каждого вопроса
         """
+        overall_level = inconsistency_profile.get("overall_level", 0.4)
         fatigue_profile = inconsistency_profile.get("fatigue_profile", {})
 
         if not fatigue_profile:
-            return inconsistency_profile
+            return [(0.0, overall_level)] * num_questions
 
         # Извлекаем параметры
         fatigue_rate = fatigue_profile.get("fatigue_rate", 0.1)
-        current_fatigue = fatigue_profile.get("current_fatigue", 0.0)
+        fatigue = fatigue_profile.get("current_fatigue", 0.0)
         max_fatigue = fatigue_profile.get("max_fatigue", 0.8)
 
-        # Увеличиваем усталость с каждым вопросом
-        new_fatigue = min(max_fatigue, current_fatigue + fatigue_rate * (question_index + 1))
+        schedule = []
+        for question_index in range(num_questions):
+            # Увеличиваем усталость с каждым вопросом
+            fatigue = min(max_fatigue, fatigue + fatigue_rate * (question_index + 1))
+            # Корректируем общий уровень непоследовательности с учетом усталости
+            overall_level = min(0.9, overall_level + fatigue * 0.5)
+            schedule.append((fatigue, overall_level))
+
+        return schedule
+
+    def update_fatigue(self, inconsistency_profile: Dict, question_index: int = 0) -> Dict:
+        """
+        Профиль непоследовательности с учетом усталости к указанному вопросу
 
-        # Обновляем профиль
-        inconsistency_profile["fatigue_profile"]["current_fatigue"] = new_fatigue
+        Args:
+            inconsistency_profile: Профиль непоследовательности (не изменяется)
+            question_index: Индекс текущего вопроса
 
-        # Корректируем общий уровень непоследовательности с учетом усталости
-        base_level = inconsistency_profile.get("overall_level", 0.4)
-        fatigue_factor = new_fatigue * 0.5  # Влияние усталости на общий уровень
+        Returns:
+            Новый профиль непоследовательности
+        """
+        if not inconsistency_profile.get("fatigue_profile"):
+            return inconsistency_profile
 
-        inconsistency_profile["overall_level"] = min(0.9, base_level + fatigue_factor)
+        fatigue, overall_level = self.fatigue_schedule(inconsistency_profile, question_index + 1)[-1]
 
-        return inconsistency_profile
+        updated_profile = dict(inconsistency_profile)
+        updated_profile["fatigue_profile"] = dict(inconsistency_profile["fatigue_profile"], current_fatigue=fatigue)
+        updated_profile["overall_level"] = overall_level
+        return updated_profile
 
-    def apply_inconsistency_to_prompt(self, prompt: str, inconsistency_profile: Dict, question_index: int = 0) -> str:
+    def render_inconsistency(self, inconsistency_profile: Dict, fatigue: float, overall_level: float,
+                             rng: Optional[random.Random] = None) -> str:
         """
-        Добавление инструкций по непоследовательности в промпт
+        Блок инструкций по непоследовательности для вопроса
 
         Args:
-            prompt: Исходный промпт
             inconsistency_profile: Профиль непоследовательности
-            question_index: Индекс вопроса в последовательности (для моделирования усталости)
+            fatigue: Уровень усталости к вопросу (из fatigue_schedule)
+            overall_level: Общий уровень непоследовательности к вопросу (из fatigue_schedule)
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
-            Модифицированный промпт
+            Текст блока
         """
-        # Обновляем профиль с учетом усталости
-        updated_profile = self.update_fatigue(inconsistency_profile, question_index)
-
-        # Извлекаем параметры
-        overall_level = updated_profile.get("overall_level", 0.4)
-        types = updated_profile.get("types", {})
-        fatigue = updated_profile.get("fatigue_profile", {}).get("current_fatigue", 0.0)
+        rng = rng or random
+        types = inconsistency_profile.get("types", {})
 
         # Формируем инструкцию по непоследовательности
         inconsistency_instruction = "\n\nНЕПОСЛЕДОВАТЕЛЬНОСТЬ В ОТВЕТАХ:"
@@ -2598,8 +3586,8 @@ class Inconsistency:
             inconsistency_instruction += "\n- Характерные типы непоследовательности:"
             for type_name, type_info in types.items():
                 inconsistency_instruction += f"\n  • {type_info['description']} (сила: {type_info['strength']:.2f})"
-                if random.random() < 0.5 and type_info['examples']:  # Не всегда добавляем пример
-                    example = random.choice(type_info['examples'])
+                if rng.random() < 0.5 and type_info['examples']:  # Не всегда добавляем пример
+                    example = rng.choice(type_info['examples'])
                     inconsistency_instruction += f"\n    Пример: {example}"
 
         # Добавляем информацию об усталости, если она значительна
@@ -2616,6 +3604,25 @@ class Inconsistency:
             elif fatigue > 0.4:
                 inconsistency_instruction += "\n  • Ответы могут быть менее развернутыми из-за усталости"
 
+        return inconsistency_instruction
+
+    def apply_inconsistency_to_prompt(self, prompt: str, inconsistency_profile: Dict, question_index: int = 0,
+                                      rng: Optional[random.Random] = None) -> str:
+        """
+        Добавление инструкций по непоследовательности в промпт
+
+        Args:
+            prompt: Исходный промпт
+            inconsistency_profile: Профиль непоследовательности (не изменяется)
+            question_index: Индекс вопроса в последовательности (для моделирования усталости)
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
+
+        Returns:
+            Модифицированный промпт
+        """
+        fatigue, overall_level = self.fatigue_schedule(inconsistency_profile, question_index + 1)[-1]
+        inconsistency_instruction = self.render_inconsistency(inconsistency_profile, fatigue, overall_level, rng=rng)
+
         # Добавляем инструкцию в промпт
         if "ОБЩИЕ ПРАВИЛА ОТВЕТА" in prompt:
             prompt = prompt.replace("ОБЩИЕ ПРАВИЛА ОТВЕТА", f"{inconsistency_instruction}\n\nОБЩИЕ ПРАВИЛА ОТВЕТА")
@@ -2625,51 +3632,446 @@ class Inconsistency:
         return prompt
 
 
-class EnhancedFinancialRespondent:
-    """Расширенный класс для генерации реалистичных ответов с учетом всех дополнительных факторов"""
+# Порядок разделов (слотов) промпта
+PROMPT_SLOTS = (
+    "intro", "persona", "reviews_context", "question", "literacy",
+    "cognitive_biases", "emotions", "linguistics", "life_context", "inconsistency",
+    "rules", "vocabulary", "behavior", "answer"
+)
 
-    def __init__(self, marketplace):
+# Статические части промпта
+PROMPT_INTRO = (
+    "Ты симулируешь обычного человека, отвечающего на вопрос о финансах или банковских услугах. Тебе нужно ответить максимально реалистично, с учетом своих характеристик и уровня финансовой грамотности.\n\n"
+    "ХАРАКТЕРИСТИКИ РЕСПОНДЕНТА:\n"
+)
+
+PROMPT_RULES_TEMPLATE = (
+    "ОБЩИЕ ПРАВИЛА ОТВЕТА:\n"
+    "1. Отвечай от первого лица, как будто ты действительно этот человек\n"
+    "2. Учитывай все демографические характеристики и уровень финансовой грамотности\n"
+    "3. Используй стиль речи и словарный запас, соответствующие твоему образованию и уровню знаний\n"
+    "4. Будь максимально реалистичным в ответе\n"
+    '5. Не старайся отвечать как эксперт, даже если твой уровень грамотности "эксперт" - отвечай как обычный человек с хорошими знаниями\n'
+    "6. Твоя точность информации должна соответствовать твоему уровню знаний (точность ~{accuracy}%)\n"
+    "7. Твоя уверенность в ответе должна соответствовать твоему профилю (уверенность ~{confidence}%)\n"
+    "8. Уровень детализации ответа должен соответствовать твоему уровню знаний (детализация ~{detail}%)\n"
+    "9. Используй свой жизненный опыт и финансовые паттерны поведения в ответе\n"
+)
+
+# Инструкции по ответу для каждого уровня финансовой грамотности
+LITERACY_INSTRUCTIONS = {
+    "отсутствие знаний": (
+        "- Используй простой, бытовой язык без финансовых терминов",
+        "- Можешь путать финансовые понятия и термины",
+        "- Можешь демонстрировать финансовые заблуждения, указанные в профиле",
+        "- Признавай незнание многих финансовых тем",
+        '- Говори неуверенно, используй фразы типа "мне кажется", "насколько я знаю"',
+        "- Можешь полагаться на слухи и мнения знакомых вместо фактов",
+        "- Не вдавайся в детали финансовых продуктов",
+    ),
+    "начинающий": (
+        "- Используй простые финансовые термины, но можешь иногда их путать",
+        "- Можешь иметь некоторые заблуждения о финансовых продуктах",
+        "- Показывай базовое понимание дебетовых карт и вкладов",
+        "- Можешь выражать неуверенность в сложных финансовых вопросах",
+        "- Проявляй осторожность к новым финансовым инструментам",
+        "- Опирайся больше на личный опыт, чем на знания",
+        "- Интересуйся деталями, но не все понимай",
+    ),
+    "средний": (
+        "- Демонстрируй нормальное понимание распространенных финансовых продуктов",
+        "- Можешь использовать базовую финансовую терминологию",
+        "- Имеешь представление о кредитах, вкладах, дебетовых и кредитных картах",
+        "- Проявляй разумную осторожность в финансовых решениях",
+        "- Можешь задавать уточняющие вопросы по сложным продуктам",
+        "- Говори с умеренной уверенностью в рамках своих знаний",
+        "- Можешь делиться практическим опытом использования финансовых продуктов",
+    ),
+    "продвинутый": (
+        "- Используй грамотную финансовую терминологию",
+        "- Демонстрируй хорошее понимание различных финансовых продуктов",
+        "- Можешь сравнивать разные продукты и их характеристики",
+        "- Говори уверенно в рамках своих знаний",
+        "- Учитывай нюансы финансовых решений",
+        "- Рассматривай долгосрочные последствия финансовых решений",
+        "- Можешь упоминать различные банки и их продукты",
+    ),
+    "эксперт": (
+        "- Используй профессиональную финансовую терминологию",
+        "- Демонстрируй глубокое понимание финансовых продуктов и рынков",
+        "- Можешь давать детальный анализ условий и последствий",
+        "- Учитывай тонкости и исключения в правилах",
+        "- Говори уверенно и авторитетно",
+        "- Можешь упоминать законодательство в финансовой сфере",
+        "- Рассматривай комплексный подход к финансовым решениям",
+    ),
+}
+
+# Профили промпта: полный и компактный (сокращенные разделы для экономии входных токенов)
+PROMPT_PROFILES = ("full", "compact")
+
+PROMPT_INTRO_COMPACT = (
+    "Ты обычный человек и реалистично отвечаешь на вопрос о финансах или банках "
+    "в соответствии со своим профилем и уровнем финансовой грамотности.\n"
+    "ХАРАКТЕРИСТИКИ РЕСПОНДЕНТА:\n"
+)
+
+# Общие правила компактного профиля (без повторов инструкций по грамотности)
+PROMPT_RULES_COMPACT_TEMPLATE = (
+    "ОБЩИЕ ПРАВИЛА ОТВЕТА:\n"
+    "1. Отвечай от первого лица как обычный человек с этим профилем, не как эксперт\n"
+    "2. Точность ~{accuracy}%, уверенность ~{confidence}%, детализация ~{detail}%\n"
+    "3. Опирайся на свой жизненный опыт и финансовые паттерны поведения\n"
+)
+
+# Компактный профиль: количество инструкций по грамотности и пунктов списка подряд в разделе
+COMPACT_LITERACY_INSTRUCTIONS = 4
+COMPACT_MAX_BULLETS = 3
+
+# Строки с примерами, которые не включаются в компактный промпт
+COMPACT_DROPPED_PREFIXES = ("- Пример:", "Пример:")
+
+# Подсказки эмоционального окраса ответа по модели финансового поведения
+BEHAVIOR_PROMPT_HINTS = {
+    "избегающий риска": "\nВ своем ответе проявляй осторожность и консервативный подход к финансовым вопросам.",
+    "импульсивный": "\nВ своем ответе можешь проявлять спонтанность и эмоциональность в отношении финансовых решений.",
+    "статусный": "\nВ своем ответе можешь упоминать престижные или премиальные аспекты банковского обслуживания."
+}
+
+
+class PromptCompiler:
+    """
+    Сборка промпта из именованных разделов (слотов) вместо последовательных вставок в строку
+
+    Статические разделы (вступление, инструкции по грамотности, общие правила) готовятся один раз
+    для каждого уровня грамотности и профиля промпта; промпт собирается одним join в порядке PROMPT_SLOTS.
+    """
+
+    slots = PROMPT_SLOTS
+
+    def __init__(self, knowledge_base):
         """
-        Инициализация с компонентами для создания реалистичных ответов
+        Создание сборщика промптов
 
         Args:
-            marketplace: Экземпляр RespondentsMarketplace
+            knowledge_base: Экземпляр FinancialKnowledgeBase
         """
-        self.marketplace = marketplace
-        self.cognitive_biases = CognitiveBiases()
-        self.emotional_factors = EmotionalFactors()
-        self.linguistic_variation = LinguisticVariation()
-        self.life_context = LifeContextFactors()
-        self.inconsistency = Inconsistency()
-
-        # Хранение истории ответов для каждой персоны
-        self.response_history = {}
+        self.knowledge_base = knowledge_base
+        # Разделы рендерятся при первом обращении к уровню и профилю
+        self._static_sections = {}
 
-    def enhance_persona(self, persona: Dict) -> Dict:
+    def _render_static_sections(self, literacy_level: str, profile: str = "full") -> Dict[str, str]:
         """
-        Расширение данных персоны дополнительными атрибутами
+        Статические разделы промпта для уровня грамотности
 
         Args:
-            persona: Исходный словарь с персоной
+            literacy_level: Уровень финансовой грамотности
+            profile: Профиль промпта ('full' или 'compact')
+
+        Returns:
+            Словарь {слот: текст}
+        """
+        literacy_info = self.knowledge_base.get_literacy_level_info(literacy_level)
+        scores = {
+            "accuracy": int(literacy_info.get("accuracy", 0.7) * 100),
+            "confidence": int(literacy_info.get("confidence", 0.7) * 100),
+            "detail": int(literacy_info.get("detail_level", 0.5) * 100)
+        }
+
+        if profile == "compact":
+            instructions = "\n".join(LITERACY_INSTRUCTIONS.get(literacy_level, ())[:COMPACT_LITERACY_INSTRUCTIONS])
+            return {
+                "intro": PROMPT_INTRO_COMPACT,
+                "literacy": f"ИНСТРУКЦИИ ПО ГРАМОТНОСТИ:\n{instructions}\n" if instructions else "",
+                "rules": PROMPT_RULES_COMPACT_TEMPLATE.format(**scores),
+                "answer": "ОТВЕТ ОТ ЛИЦА РЕСПОНДЕНТА:"
+            }
+
+        instructions = "\n".join(LITERACY_INSTRUCTIONS.get(literacy_level, ()))
+        return {
+            "intro": PROMPT_INTRO,
+            "literacy": f"ИНСТРУКЦИИ ПО ОТВЕТУ В СООТВЕТСТВИИ С ФИНАНСОВОЙ ГРАМОТНОСТЬЮ:\n{instructions}\n\n",
+            "rules": PROMPT_RULES_TEMPLATE.format(**scores),
+            "answer": "\n\nОТВЕТ ОТ ЛИЦА РЕСПОНДЕНТА:"
+        }
+
+    def static_sections(self, literacy_level: str, profile: str = "full") -> Dict[str, str]:
+        """
+        Статические разделы промпта для уровня грамотности (из кэша)
+
+        Args:
+            literacy_level: Уровень финансовой грамотности
+            profile: Профиль промпта ('full' или 'compact')
+
+        Returns:
+            Словарь {слот: текст}
+        """
+        sections = self._static_sections.get((literacy_level, profile))
+        if sections is None:
+            sections = self._render_static_sections(literacy_level, profile)
+            self._static_sections[(literacy_level, profile)] = sections
+        return sections
+
+    def compile(self, sections: Dict[str, str]) -> str:
+        """
+        Сборка промпта из разделов
+
+        Args:
+            sections: Словарь {слот: текст}; отсутствующие слоты пропускаются
+
+        Returns:
+            Текст промпта
+        """
+        return "".join([sections.get(slot, "") for slot in self.slots])
+
+    def section_sizes(self, sections: Dict[str, str]) -> Dict[str, Dict[str, int]]:
+        """
+        Размеры непустых разделов промпта в байтах (UTF-8) и токенах (оценка estimate_tokens)
+
+        Args:
+            sections: Словарь {слот: текст}
+
+        Returns:
+            Словарь {слот: {"bytes": ..., "tokens": ...}} в порядке слотов
+        """
+        sizes = {}
+        for slot in self.slots:
+            text = sections.get(slot)
+            if text:
+                size_bytes, size_tokens = _text_size(text)
+                sizes[slot] = {"bytes": size_bytes, "tokens": size_tokens}
+        return sizes
+
+
+@lru_cache(maxsize=4096)
+def _text_size(text: str) -> Tuple[int, int]:
+    """Размер текста в байтах UTF-8 и токенах (статические разделы и разделы сессии повторяются)"""
+    return len(text.encode("utf-8")), estimate_tokens(text)
+
+
+@lru_cache(maxsize=8192)
+def compact_prompt_text(text: str) -> str:
+    """
+    Сокращение раздела промпта для компактного профиля
+
+    Убираются отступы, пустые и повторяющиеся строки, строки с примерами, а длинные списки
+    ограничиваются COMPACT_MAX_BULLETS пунктами подряд.
+
+    Args:
+        text: Текст раздела
+
+    Returns:
+        Сокращенный текст (строки разделены одним переводом строки)
+    """
+    lines = []
+    seen = set()
+    bullets = 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line in seen or line.startswith(COMPACT_DROPPED_PREFIXES):
+            continue
+        bullets = bullets + 1 if line.startswith(("- ", "• ")) else 0
+        if bullets > COMPACT_MAX_BULLETS:
+            continue
+        seen.add(line)
+        lines.append(line)
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+class PersonaSession:
+    """
+    Сессия персоны для серии вопросов: создается один раз на персону и хранит зафиксированный
+    жизненный контекст, заранее подготовленные блоки промпта и график усталости
+    """
+
+    def __init__(self, respondent, persona: Dict, num_questions: int = 1, rng: Optional[random.Random] = None):
+        """
+        Подготовка сессии
+
+        Args:
+            respondent: Экземпляр EnhancedFinancialRespondent
+            persona: Словарь персоны (расширенный, если используется расширенная генерация)
+            num_questions: Количество вопросов в серии (для графика усталости)
+            rng: Генератор случайных чисел персоны (random.Random; по умолчанию - глобальный модуль random)
+        """
+        rng = rng or random
+        self.respondent = respondent
+        self.persona = persona
+        self.compact = respondent.marketplace.prompting_params.get("prompt_profile") == "compact"
+
+        financial_profile = persona.get('Финансовый профиль', {})
+        self.emotional_factors = dict(financial_profile.get('Эмоциональные факторы', {}))
+        self.inconsistency_profile = persona.get('Профиль непоследовательности', {})
+
+        # Характеристики персоны не зависят от вопроса
+        self.persona_text = respondent.marketplace._format_persona_for_prompt(persona, compact=self.compact)
+
+        # Когнитивные искажения: каждое следующее искажение вставляется в начало раздела
+        bias_blocks = [
+            respondent.cognitive_biases.render_bias(bias_name, bias_strength, rng=rng)
+            for bias_name, bias_strength in financial_profile.get('Когнитивные искажения', {}).items()
+        ]
+        bias_blocks = [block for block in bias_blocks if block]
+        self.bias_section = (
+            "КОГНИТИВНЫЕ ИСКАЖЕНИЯ:\n" + "\n".join(reversed(bias_blocks)) + "\n\n" if bias_blocks else ""
+        )
+
+        linguistic_profile = persona.get('Лингвистический профиль', {})
+        local_traits = bool(respondent.marketplace.prompting_params.get("local_postprocessing"))
+        self.linguistic_section = (
+            respondent.linguistic_variation.render_linguistic_profile(
+                linguistic_profile, rng=rng, local_traits=local_traits
+            ) + "\n"
+            if linguistic_profile else ""
+        )
+
+        self.life_context = respondent.life_context.build_life_context(persona, rng=rng)
+        self.life_context_section = respondent.life_context.render_life_context(self.life_context) + "\n\n"
+
+        if self.compact:
+            self.bias_section = compact_prompt_text(self.bias_section)
+            self.linguistic_section = compact_prompt_text(self.linguistic_section)
+            self.life_context_section = compact_prompt_text(self.life_context_section)
+
+        # График усталости только читается, поэтому сессию можно использовать из нескольких потоков
+        self.fatigue_schedule = tuple(
+            respondent.inconsistency.fatigue_schedule(self.inconsistency_profile, num_questions)
+        ) if self.inconsistency_profile else ()
+
+    def fatigue_at(self, question_index: int) -> Tuple[float, float]:
+        """
+        Усталость и общий уровень непоследовательности к вопросу
+
+        Args:
+            question_index: Индекс вопроса в серии
+
+        Returns:
+            Пара (усталость, общий уровень непоследовательности)
+        """
+        if question_index < len(self.fatigue_schedule):
+            return self.fatigue_schedule[question_index]
+        return self.respondent.inconsistency.fatigue_schedule(self.inconsistency_profile, question_index + 1)[-1]
+
+    def build_sections(self, question: Dict, question_index: int = 0,
+                       rng: Optional[random.Random] = None) -> Dict[str, str]:
+        """
+        Разделы промпта для вопроса (слоты PromptCompiler)
+
+        Args:
+            question: Словарь с вопросом
+            question_index: Индекс вопроса в серии
+            rng: Генератор случайных чисел задачи (random.Random; по умолчанию - глобальный модуль random)
+
+        Returns:
+            Словарь {слот: текст}
+        """
+        respondent = self.respondent
+        sections = respondent.marketplace._base_prompt_sections(self.persona, question, persona_text=self.persona_text)
+
+        # Эмоциональные факторы зависят от темы вопроса
+        emotion_blocks = [
+            respondent.emotional_factors.render_emotion(emotion_name, emotion_strength, question.get('topic'), rng=rng)
+            for emotion_name, emotion_strength in self.emotional_factors.items()
+        ]
+        emotion_blocks = [block for block in emotion_blocks if block]
+        emotion_section = (
+            "ЭМОЦИОНАЛЬНЫЕ ФАКТОРЫ:\n" + "\n".join(reversed(emotion_blocks)) + "\n\n" if emotion_blocks else ""
+        )
+
+        inconsistency_section = ""
+        if self.inconsistency_profile:
+            fatigue, overall_level = self.fatigue_at(question_index)
+            inconsistency_section = respondent.inconsistency.render_inconsistency(
+                self.inconsistency_profile, fatigue, overall_level, rng=rng
+            ) + "\n\n"
+
+        if self.compact:
+            emotion_section = compact_prompt_text(emotion_section)
+            inconsistency_section = compact_prompt_text(inconsistency_section)
+
+        sections["cognitive_biases"] = self.bias_section
+        sections["emotions"] = emotion_section
+        sections["linguistics"] = self.linguistic_section
+        sections["life_context"] = self.life_context_section
+        sections["inconsistency"] = inconsistency_section
+        return sections
+
+    def build_prompt(self, question: Dict, question_index: int = 0, rng: Optional[random.Random] = None) -> str:
+        """
+        Сборка промпта для вопроса из подготовленных разделов
+
+        Args:
+            question: Словарь с вопросом
+            question_index: Индекс вопроса в серии
+            rng: Генератор случайных чисел задачи (random.Random; по умолчанию - глобальный модуль random)
+
+        Returns:
+            Промпт
+        """
+        return self.respondent.marketplace.prompt_compiler.compile(self.build_sections(question, question_index, rng))
+
+
+# Поля, которые добавляет EnhancedFinancialRespondent.enhance_persona (на верхнем уровне и в финансовом профиле)
+PERSONA_ENHANCEMENT_FIELDS = ("Лингвистический профиль", "Профиль непоследовательности")
+PROFILE_ENHANCEMENT_FIELDS = ("Когнитивные искажения", "Эмоциональные факторы")
+
+# Максимальное количество сессий персон в кэше EnhancedFinancialRespondent (вытесняются давно не использованные)
+PERSONA_SESSION_CACHE_SIZE = 1024
+
+
+class EnhancedFinancialRespondent:
+    """Расширенный класс для генерации реалистичных ответов с учетом всех дополнительных факторов"""
+
+    def __init__(self, marketplace):
+        """
+        Инициализация с компонентами для создания реалистичных ответов
+
+        Args:
+            marketplace: Экземпляр RespondentsMarketplace
+        """
+        self.marketplace = marketplace
+        self.cognitive_biases = CognitiveBiases()
+        self.emotional_factors = EmotionalFactors()
+        self.linguistic_variation = LinguisticVariation()
+        self.life_context = LifeContextFactors()
+        self.inconsistency = Inconsistency()
+        self.postprocessor = LinguisticPostProcessor()
+
+        # Хранение истории ответов для каждой персоны
+        self.response_history = {}
+
+        # Сессии персон для generate_realistic_answer (LRU, не более PERSONA_SESSION_CACHE_SIZE):
+        # persona_id -> (словарь персоны, настройки промпта, отпечаток персоны, сессия)
+        self.sessions = OrderedDict()
+        self._sessions_lock = threading.Lock()
+
+    def enhance_persona(self, persona: Dict, rng: Optional[random.Random] = None) -> Dict:
+        """
+        Расширение данных персоны дополнительными атрибутами
+
+        Args:
+            persona: Исходный словарь с персоной
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
             Расширенный словарь персоны
         """
+        rng = rng or random
         # Создаем копию, чтобы не модифицировать оригинал
         enhanced_persona = persona.copy()
 
         # Добавляем когнитивные искажения
         literacy_level = persona.get('Финансовый профиль', {}).get('Уровень финансовой грамотности', 'средний')
-        cognitive_biases = self.cognitive_biases.get_random_biases(num_biases=3, literacy_level=literacy_level)
+        cognitive_biases = self.cognitive_biases.get_random_biases(num_biases=3, literacy_level=literacy_level, rng=rng)
 
         # Добавляем эмоциональные факторы
-        emotional_factors = self.emotional_factors.get_random_emotions(num_emotions=3)
+        emotional_factors = self.emotional_factors.get_random_emotions(num_emotions=3, rng=rng)
 
         # Создаем лингвистический профиль
-        linguistic_profile = self.linguistic_variation.generate_linguistic_profile(persona)
+        linguistic_profile = self.linguistic_variation.generate_linguistic_profile(persona, rng=rng)
 
         # Создаем профиль непоследовательности
-        inconsistency_profile = self.inconsistency.generate_inconsistency_profile(persona)
+        inconsistency_profile = self.inconsistency.generate_inconsistency_profile(persona, rng=rng)
 
         # Расширяем финансовый профиль
         if 'Финансовый профиль' not in enhanced_persona:
@@ -2682,7 +4084,146 @@ class EnhancedFinancialRespondent:
 
         return enhanced_persona
 
-    def generate_enhanced_prompt(self, enhanced_persona: Dict, question: Dict, question_index: int = 0) -> str:
+    @staticmethod
+    def base_fingerprint(persona: Dict) -> str:
+        """
+        Хэш базовых (редактируемых) полей персоны без полей, добавляемых enhance_persona
+
+        Args:
+            persona: Словарь с персоной (исходной или расширенной)
+
+        Returns:
+            Шестнадцатеричный SHA-256
+        """
+        base = {k: v for k, v in persona.items() if k not in PERSONA_ENHANCEMENT_FIELDS}
+        if isinstance(base.get('Финансовый профиль'), dict):
+            base['Финансовый профиль'] = {
+                k: v for k, v in base['Финансовый профиль'].items() if k not in PROFILE_ENHANCEMENT_FIELDS
+            }
+        return hashlib.sha256(
+            json.dumps(base, ensure_ascii=False, sort_keys=True, cls=NumpyEncoder).encode("utf-8")
+        ).hexdigest()
+
+    def enhance_persona_memoized(self, persona: Dict, previous: Optional[Dict] = None, reroll: bool = False,
+                                 rng: Optional[random.Random] = None) -> Dict:
+        """
+        Расширение персоны с повторным использованием уже выбранных профилей
+
+        Если у предыдущей версии персоны те же базовые поля и она уже расширена, ее искажения, эмоции,
+        лингвистический профиль и профиль непоследовательности переносятся без повторной случайной выборки.
+
+        Args:
+            persona: Исходный словарь с персоной
+            previous: Предыдущая расширенная версия персоны (например, из прошлого перезапуска редактора)
+            reroll: Выбрать профили заново, даже если базовые поля не изменились
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
+
+        Returns:
+            Расширенный словарь персоны
+        """
+        previous_profile = (previous or {}).get('Финансовый профиль', {})
+        reusable = (
+            not reroll and previous is not None
+            and all(previous.get(field) for field in PERSONA_ENHANCEMENT_FIELDS)
+            and all(previous_profile.get(field) for field in PROFILE_ENHANCEMENT_FIELDS)
+            and self.base_fingerprint(previous) == self.base_fingerprint(persona)
+        )
+        if not reusable:
+            return self.enhance_persona(persona, rng=rng)
+
+        enhanced_persona = dict(persona)
+        enhanced_persona['Финансовый профиль'] = dict(persona.get('Финансовый профиль', {}))
+        for field in PROFILE_ENHANCEMENT_FIELDS:
+            enhanced_persona['Финансовый профиль'][field] = previous_profile[field]
+        for field in PERSONA_ENHANCEMENT_FIELDS:
+            enhanced_persona[field] = previous[field]
+        return enhanced_persona
+
+    def enhance_cohort(self, columns: Dict[str, np.ndarray], rng: np.random.Generator) -> Dict[str, np.ndarray]:
+        """
+        Пакетное расширение когорты: профили искажений, эмоций, лингвистики и непоследовательности
+        вычисляются сразу для всей когорты с теми же распределениями, что и в enhance_persona
+
+        Args:
+            columns: Колонки когорты (PersonaCohort.columns): age, education, literacy
+            rng: Генератор случайных чисел NumPy
+
+        Returns:
+            Словарь дополнительных колонок когорты
+        """
+        mp = self.marketplace
+        n = len(columns["age"])
+        literacy = columns["literacy"].astype(np.intp)
+
+        bias_idx, bias_strength = self.cognitive_biases.get_random_biases_batch(
+            literacy, mp.financial_literacy_levels, rng, num_biases=3
+        )
+        emotion_idx, emotion_strength = self.emotional_factors.get_random_emotions_batch(n, rng, num_emotions=3)
+        device, error_level = self.linguistic_variation.generate_linguistic_batch(
+            columns["age"], columns["education"].astype(np.intp), mp.education_levels, rng
+        )
+        inconsistency = self.inconsistency.generate_inconsistency_batch(
+            columns["age"], literacy, mp.financial_literacy_levels, rng
+        )
+
+        return {
+            "bias_idx": bias_idx.astype(np.int8),
+            "bias_strength": bias_strength,
+            "emotion_idx": emotion_idx.astype(np.int8),
+            "emotion_strength": emotion_strength,
+            "device": device,
+            "error_level": error_level,
+            "inconsistency_level": inconsistency["overall_level"],
+            "inconsistency_strength": inconsistency["type_strength"],
+            "fatigue_rate": inconsistency["fatigue_rate"],
+            "max_fatigue": inconsistency["max_fatigue"]
+        }
+
+    def apply_cohort_enhancement(self, persona: Dict, columns: Dict[str, np.ndarray], k: int) -> Dict:
+        """
+        Добавление в словарь персоны профилей, заранее вычисленных enhance_cohort
+
+        Args:
+            persona: Словарь персоны (изменяется на месте)
+            columns: Колонки когорты, включая колонки enhance_cohort
+            k: Индекс персоны в когорте
+
+        Returns:
+            Расширенный словарь персоны
+        """
+        bias_names = list(self.cognitive_biases.financial_biases.keys())
+        emotion_names = list(self.emotional_factors.financial_emotions.keys())
+        inconsistency_types = list(self.inconsistency.inconsistency_types.keys())
+
+        financial_profile = persona.setdefault('Финансовый профиль', {})
+        financial_profile['Когнитивные искажения'] = {
+            bias_names[b]: float(strength)
+            for b, strength in zip(columns["bias_idx"][k], columns["bias_strength"][k]) if b >= 0
+        }
+        financial_profile['Эмоциональные факторы'] = {
+            emotion_names[e]: float(strength)
+            for e, strength in zip(columns["emotion_idx"][k], columns["emotion_strength"][k]) if e >= 0
+        }
+
+        persona['Лингвистический профиль'] = self.linguistic_variation.assemble_linguistic_profile(
+            persona,
+            self.linguistic_variation.device_types[columns["device"][k]],
+            float(columns["error_level"][k])
+        )
+        persona['Профиль непоследовательности'] = self.inconsistency.assemble_inconsistency_profile(
+            float(columns["inconsistency_level"][k]),
+            {
+                inconsistency_types[t]: float(strength)
+                for t, strength in enumerate(columns["inconsistency_strength"][k]) if strength > 0
+            },
+            float(columns["fatigue_rate"][k]),
+            float(columns["max_fatigue"][k])
+        )
+
+        return persona
+
+    def generate_enhanced_prompt(self, enhanced_persona: Dict, question: Dict, question_index: int = 0,
+                                 rng: Optional[random.Random] = None) -> str:
         """
         Генерация улучшенного промпта с учетом всех дополнительных факторов
 
@@ -2690,54 +4231,111 @@ class EnhancedFinancialRespondent:
             enhanced_persona: Расширенный словарь персоны
             question: Словарь с вопросом
             question_index: Индекс вопроса в последовательности (для моделирования усталости)
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
 
         Returns:
             Улучшенный промпт
         """
-        # Генерируем базовый промпт через стандартный метод маркетплейса
-        base_prompt = self.marketplace._generate_enhanced_prompt(enhanced_persona, question)
+        # Разовая сессия; для серии вопросов одной персоны используйте create_session
+        session = self.create_session(enhanced_persona, question_index + 1, rng=rng)
+        return session.build_prompt(question, question_index, rng=rng)
 
-        # Извлекаем дополнительные профили
-        cognitive_biases = enhanced_persona.get('Финансовый профиль', {}).get('Когнитивные искажения', {})
-        emotional_factors = enhanced_persona.get('Финансовый профиль', {}).get('Эмоциональные факторы', {})
-        linguistic_profile = enhanced_persona.get('Лингвистический профиль', {})
-        inconsistency_profile = enhanced_persona.get('Профиль непоследовательности', {})
+    def create_session(self, persona: Dict, num_questions: int = 1,
+                       rng: Optional[random.Random] = None) -> PersonaSession:
+        """
+        Создание сессии персоны для серии вопросов
 
-        enhanced_prompt = base_prompt
+        Args:
+            persona: Словарь персоны (расширенный, если используется расширенная генерация)
+            num_questions: Количество вопросов в серии
+            rng: Генератор случайных чисел персоны (random.Random; по умолчанию - глобальный модуль random)
 
-        # Применяем когнитивные искажения
-        for bias_name, bias_strength in cognitive_biases.items():
-            enhanced_prompt = self.cognitive_biases.apply_bias_to_prompt(
-                enhanced_prompt, bias_name, bias_strength
-            )
+        Returns:
+            PersonaSession
+        """
+        return PersonaSession(self, persona, num_questions, rng=rng)
 
-        # Применяем эмоциональные факторы
-        for emotion_name, emotion_strength in emotional_factors.items():
-            enhanced_prompt = self.emotional_factors.apply_emotion_to_prompt(
-                enhanced_prompt, emotion_name, emotion_strength, question.get('topic')
-            )
+    def get_session(self, persona_id: str, persona: Dict, num_questions: int = 1,
+                    rng: Optional[random.Random] = None) -> PersonaSession:
+        """
+        Сессия персоны для generate_realistic_answer: создается при первом вопросе персоны
+        и используется для остальных ее вопросов (в том числе из других потоков)
 
-        # Применяем лингвистические вариации
-        if linguistic_profile:
-            enhanced_prompt = self.linguistic_variation.apply_linguistic_profile_to_prompt(
-                enhanced_prompt, linguistic_profile
-            )
+        Сессия пересоздается при изменении персоны или настроек промпта (профиль, локальная постобработка).
+        Отпечаток персоны вычисляется один раз: для того же словаря персоны он не пересчитывается,
+        поэтому измененную персону нужно передавать новым словарем.
 
-        # Применяем жизненный контекст
-        enhanced_prompt = self.life_context.apply_life_context_to_prompt(
-            enhanced_prompt, enhanced_persona, question
-        )
+        Args:
+            persona_id: Уникальный идентификатор персоны
+            persona: Словарь с данными персоны
+            num_questions: Количество вопросов в серии
+            rng: Генератор случайных чисел персоны (расширение профиля и блоки промпта)
 
-        # Применяем непоследовательность с учетом истории ответов
-        if inconsistency_profile:
-            enhanced_prompt = self.inconsistency.apply_inconsistency_to_prompt(
-                enhanced_prompt, inconsistency_profile, question_index
-            )
+        Returns:
+            PersonaSession
+        """
+        params = self.marketplace.prompting_params
+        settings = (params.get("prompt_profile", "full"), bool(params.get("local_postprocessing")))
+
+        with self._sessions_lock:
+            cached = self.sessions.get(persona_id)
+            if cached is not None and cached[0] is persona and cached[1] == settings:
+                self.sessions.move_to_end(persona_id)
+                return cached[3]
+
+        fingerprint = hashlib.sha256(
+            json.dumps(persona, ensure_ascii=False, sort_keys=True, cls=NumpyEncoder).encode("utf-8")
+        ).hexdigest()
+
+        with self._sessions_lock:
+            cached = self.sessions.get(persona_id)
+            if cached is not None and cached[1:3] == (settings, fingerprint):
+                # Та же персона в новом словаре: запоминаем словарь, чтобы не хэшировать его снова
+                self.sessions[persona_id] = (persona, settings, fingerprint, cached[3])
+                self.sessions.move_to_end(persona_id)
+                return cached[3]
+
+            # Проверяем, есть ли у нас уже расширенная версия персоны
+            if not persona.get('Финансовый профиль', {}).get('Когнитивные искажения'):
+                enhanced_persona = self.enhance_persona(copy.deepcopy(persona), rng=rng)
+            else:
+                enhanced_persona = persona
+
+            session = self.create_session(enhanced_persona, num_questions, rng=rng)
+            self.sessions[persona_id] = (persona, settings, fingerprint, session)
+            self.sessions.move_to_end(persona_id)
+            while len(self.sessions) > PERSONA_SESSION_CACHE_SIZE:
+                self.sessions.popitem(last=False)
+            return session
+
+    def postprocess_answer(self, answer: str, persona: Dict, rng: Optional[random.Random] = None,
+                           enabled: Optional[bool] = None) -> str:
+        """
+        Локальная постобработка ответа по лингвистическому профилю
 
-        return enhanced_prompt
+        Args:
+            answer: Текст ответа
+            persona: Словарь с данными персоны (расширенный)
+            rng: Генератор случайных чисел постобработки (random.Random; по умолчанию - глобальный модуль random)
+            enabled: Применять ли постобработку (по умолчанию - по local_postprocessing в prompting_params)
+
+        Returns:
+            Обработанный ответ
+        """
+        if enabled is None:
+            enabled = bool(self.marketplace.prompting_params.get("local_postprocessing"))
+        linguistic_profile = persona.get('Лингвистический профиль')
+        if not enabled or not linguistic_profile:
+            return answer
+
+        answer, stats = self.postprocessor.process(answer, linguistic_profile, rng=rng)
+        self.marketplace.spend_ledger.record_postprocess(stats)
+        return answer
 
     def generate_realistic_answer(self, persona_id: str, persona: Dict, question: Dict,
-                                 question_index: int = 0, **kwargs) -> str:
+                                 question_index: int = 0, rng: Optional[random.Random] = None,
+                                 enhance_rng: Optional[random.Random] = None,
+                                 postprocess_rng: Optional[random.Random] = None, **kwargs) -> str:
         """
         Генерация реалистичного ответа с учетом всех факторов
 
@@ -2746,35 +4344,37 @@ class EnhancedFinancialRespondent:
             persona: Словарь с данными персоны
             question: Словарь с вопросом
             question_index: Индекс вопроса в последовательности
+            rng: Генератор случайных чисел задачи (промпт и температура)
+            enhance_rng: Генератор случайных чисел персоны (расширение профиля и блоки промпта)
+            postprocess_rng: Генератор случайных чисел локальной постобработки ответа
             **kwargs: Дополнительные параметры для метода generate_answer
 
         Returns:
             Сгенерированный ответ
         """
-        # Проверяем, есть ли у нас уже расширенная версия персоны
-        if not persona.get('Финансовый профиль', {}).get('Когнитивные искажения'):
-            enhanced_persona = self.enhance_persona(persona)
-        else:
-            enhanced_persona = persona
+        # Сессия персоны: расширенный профиль и контекст общие для всех ее вопросов
+        session = self.get_session(persona_id, persona, question_index + 1, rng=enhance_rng)
+        enhanced_persona = session.persona
 
         # Проверяем, есть ли история ответов для этой персоны
         if persona_id not in self.response_history:
             self.response_history[persona_id] = []
 
         # Генерируем улучшенный промпт
-        enhanced_prompt = self.generate_enhanced_prompt(
-            enhanced_persona,
-            question,
-            question_index
-        )
+        compiler = self.marketplace.prompt_compiler
+        sections = session.build_sections(question, question_index, rng=rng)
+        enhanced_prompt = compiler.compile(sections)
+        self.marketplace.spend_ledger.record_prompt_sections(compiler.section_sizes(sections))
 
         # Генерируем ответ с использованием улучшенного промпта
         answer = self.marketplace.generate_answer(
             enhanced_persona,
             question,
             **kwargs,
+            rng=rng,
             _enhanced_prompt=enhanced_prompt  # Передаем готовый промпт
         )
+        answer = self.postprocess_answer(answer, enhanced_persona, rng=postprocess_rng)
 
         # Сохраняем ответ в историю для этой персоны
         self.response_history[persona_id].append({
@@ -2799,1582 +4399,6388 @@ class EnhancedFinancialRespondent:
 
     def reset_history(self, persona_id: str = None) -> None:
         """
-        Сброс истории ответов персоны или всех персон
+        Сброс истории ответов и сессий персоны или всех персон
 
         Args:
             persona_id: Уникальный идентификатор персоны (если None, сбрасывается вся история)
         """
         if persona_id is None:
             self.response_history = {}
-        elif persona_id in self.response_history:
-            self.response_history[persona_id] = []
+            self.sessions = OrderedDict()
+        else:
+            if persona_id in self.response_history:
+                self.response_history[persona_id] = []
+            self.sessions.pop(persona_id, None)
 
 
-class RespondentsMarketplace:
-    """Маркетплейс для генерации ответов респондентов с разным уровнем финансовой грамотности"""
+class SpendLedger:
+    """Потокобезопасный учет токенов и расходов запуска с контролем бюджета"""
 
-    def __init__(self, api_key_claude: Optional[str] = None, api_key_openai: Optional[str] = None):
+    def __init__(self, pricing: Optional[Dict[str, Dict]] = None, hard_budget: Optional[float] = None,
+                 soft_budget: Optional[float] = None):
         """
-        Инициализация маркетплейса респондентов
+        Инициализация журнала расходов
 
         Args:
-            api_key_claude: API ключ для Anthropic Claude
-            api_key_openai: API ключ для OpenAI (опционально)
+            pricing: Таблица цен моделей (USD за 1 млн токенов), по умолчанию MODEL_PRICING
+            hard_budget: Жесткий бюджет в USD: запрос не отправляется, если его оценка не помещается в остаток,
+                а запуск останавливается, когда фактические расходы достигают бюджета
+            soft_budget: Мягкий бюджет в USD: при превышении выдается предупреждение
         """
-        # Проверяем, что хотя бы один ключ API предоставлен
-        if not api_key_claude and not api_key_openai:
-            raise ValueError("Необходим хотя бы один API ключ (Claude или OpenAI)")
+        self.pricing = pricing if pricing is not None else MODEL_PRICING
+        self.hard_budget = hard_budget
+        self.soft_budget = soft_budget
+
+        self._lock = threading.Condition()
+        self._entries = {}
+        self._sections = {}
+        self._postprocess = Counter()
+        self._reserved = 0.0
+        self._in_flight = 0
+        self.total_cost = 0.0
+        self.budget_stopped = False
+        self.skipped_requests = 0
+
+    def price(self, model: str, input_tokens: int, output_tokens: int, cached_tokens: int = 0,
+              cache_write_tokens: int = 0) -> float:
+        """
+        Стоимость запроса по таблице цен (неизвестные модели не тарифицируются)
 
-        self.api_key_claude = api_key_claude
-        self.api_key_openai = api_key_openai
+        Args:
+            model: Название модели
+            input_tokens: Входные токены (без кэшированных)
+            output_tokens: Выходные токены
+            cached_tokens: Входные токены, прочитанные из кэша провайдера
+            cache_write_tokens: Входные токены, записанные в кэш провайдера (Claude)
 
-        if api_key_claude:
-            self.client_claude = anthropic.Anthropic(api_key=self.api_key_claude)
-        else:
-            self.client_claude = None
+        Returns:
+            Стоимость в USD
+        """
+        pricing = self.pricing.get(model)
+        if not pricing:
+            return 0.0
+        return (input_tokens * pricing["input"]
+                + output_tokens * pricing["output"]
+                + cached_tokens * pricing.get("cached_input", pricing["input"])
+                + cache_write_tokens * pricing.get("cache_write_input", pricing["input"])) / 1_000_000
+
+    def record(self, provider: str, model: str, input_tokens: int, output_tokens: int,
+               cached_tokens: int = 0, cache_write_tokens: int = 0) -> float:
+        """
+        Учет фактического использования токенов одним запросом
 
-        if api_key_openai:
-            self.client_openai = openai.OpenAI(api_key=self.api_key_openai)
-        else:
-            self.client_openai = None
+        Args:
+            provider: Провайдер ('claude' или 'openai')
+            model: Название модели
+            input_tokens: Входные токены (без кэшированных)
+            output_tokens: Выходные токены
+            cached_tokens: Входные токены, прочитанные из кэша провайдера
+            cache_write_tokens: Входные токены, записанные в кэш провайдера (Claude)
 
-        # Справочники для генерации общих демографических данных
-        self.regions = [
-            "Москва", "Санкт-Петербург", "Центральный", "Северо-Западный",
-            "Южный", "Северо-Кавказский", "Приволжский", "Уральский",
-            "Сибирский", "Дальневосточный"
-        ]
+        Returns:
+            Стоимость запроса в USD
+        """
+        cost = self.price(model, input_tokens, output_tokens, cached_tokens, cache_write_tokens)
+
+        with self._lock:
+            entry = self._entries.setdefault((provider, model), {
+                "provider": provider,
+                "model": model,
+                "requests": 0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "cached_tokens": 0,
+                "cache_write_tokens": 0,
+                "cost": 0.0
+            })
+            entry["requests"] += 1
+            entry["input_tokens"] += input_tokens
+            entry["output_tokens"] += output_tokens
+            entry["cached_tokens"] += cached_tokens
+            entry["cache_write_tokens"] += cache_write_tokens
+            entry["cost"] += cost
+            self.total_cost += cost
+            if self.hard_budget is not None and self.total_cost >= self.hard_budget:
+                self.budget_stopped = True
+            self._lock.notify_all()
+
+        return cost
+
+    def record_prompt_sections(self, section_sizes: Dict[str, Dict[str, int]]) -> None:
+        """
+        Учет размеров разделов промпта (входные токены по разделам, оценка estimate_tokens)
 
-        self.cities = {
-            "Москва": ["Москва"],
-            "Санкт-Петербург": ["Санкт-Петербург"],
-            "Центральный": ["Воронеж", "Тула", "Ярославль", "Рязань", "Тверь", "Владимир", "Брянск"],
-            "Северо-Западный": ["Калининград", "Псков", "Петрозаводск", "Мурманск", "Архангельск"],
-            "Южный": ["Ростов-на-Дону", "Краснодар", "Волгоград", "Севастополь", "Симферополь"],
-            "Северо-Кавказский": ["Ставрополь", "Махачкала", "Владикавказ", "Грозный", "Нальчик"],
-            "Приволжский": ["Нижний Новгород", "Казань", "Самара", "Уфа", "Пермь", "Саратов"],
-            "Уральский": ["Екатеринбург", "Челябинск", "Тюмень", "Сургут"],
-            "Сибирский": ["Новосибирск", "Омск", "Красноярск", "Иркутск", "Томск", "Кемерово"],
-            "Дальневосточный": ["Владивосток", "Хабаровск", "Якутск", "Благовещенск", "Южно-Сахалинск"]
-        }
+        Args:
+            section_sizes: Размеры разделов промпта (PromptCompiler.section_sizes)
+        """
+        with self._lock:
+            for slot, size in section_sizes.items():
+                if not isinstance(size, dict):
+                    continue
+                entry = self._sections.setdefault(slot, {"section": slot, "prompts": 0, "tokens": 0, "bytes": 0})
+                entry["prompts"] += 1
+                entry["tokens"] += size.get("tokens", 0)
+                entry["bytes"] += size.get("bytes", 0)
+
+    def record_postprocess(self, stats: Dict[str, int]) -> None:
+        """
+        Учет правок локальной постобработки ответов
 
-        self.professions = [
-            "IT-специалист", "Аналитик/Data Scientist", "Менеджер среднего звена",
-            "Руководитель высшего звена", "Врач/медработник", "Учитель/преподаватель",
-            "Инженер", "Дизайнер/художник", "Предприниматель", "Маркетолог/PR",
-            "Юрист/адвокат", "Бухгалтер/финансист", "Рабочий", "Государственный служащий",
-            "Студент", "Пенсионер", "Временно безработный", "Фрилансер",
-            "Военнослужащий", "Полицейский/охранник", "Научный сотрудник", "Продавец/кассир"
-        ]
+        Args:
+            stats: Количество правок по типам (LinguisticPostProcessor.process)
+        """
+        with self._lock:
+            self._postprocess.update(stats)
+            self._postprocess["answers"] += 1
 
-        self.education_levels = [
-            "Среднее образование", "Среднее специальное", "Неоконченное высшее",
-            "Высшее (бакалавр)", "Высшее (специалист)", "Высшее (магистр)",
-            "Два и более высших образования", "Ученая степень", "Начальное образование"
-        ]
+    def reserve(self, estimated_cost: float, required_cost: Optional[float] = None) -> bool:
+        """
+        Резервирование бюджета перед отправкой запроса
 
-        self.family_statuses = [
-            "Холост/Не замужем", "Женат/Замужем", "Гражданский брак",
-            "Разведен/Разведена", "Вдовец/Вдова", "В отношениях (не проживают вместе)"
-        ]
+        Запрос отправляется, если в остаток бюджета за вычетом резервов выполняющихся запросов помещается
+        его обязательная часть (входные токены), поэтому запросы у границы бюджета не выстраиваются в очередь.
+        Если она помещается только без учета резервов, запрос ждет завершения выполняющихся запросов
+        (они могут обойтись дешевле оценки), иначе пропускается только он. Запуск останавливается,
+        когда фактические расходы достигают жесткого бюджета (см. record).
 
-        self.income_brackets = [
-            "Менее 15 000 ₽", "15 000 - 30 000 ₽", "30 000 - 60 000 ₽",
-            "60 000 - 100 000 ₽", "100 000 - 150 000 ₽", "150 000 - 250 000 ₽",
-            "250 000 - 500 000 ₽", "Более 500 000 ₽", "Предпочитаю не отвечать"
-        ]
+        Args:
+            estimated_cost: Оценка стоимости запроса в USD
+            required_cost: Минимальная стоимость запроса в USD (по умолчанию равна оценке)
 
-        self.hobby_options = [
-            "Спорт/фитнес", "Чтение", "Кино/сериалы", "Музыка", "Путешествия",
-            "Кулинария", "Рыбалка/охота", "Рукоделие", "Компьютерные игры", "Садоводство",
-            "Фотография", "Коллекционирование", "Танцы", "Рисование", "Волонтерство",
-            "Домашние животные", "Настольные игры", "Активный отдых на природе",
-            "Посещение театров/музеев", "Блогинг/влогинг", "Техническое творчество"
-        ]
+        Returns:
+            True, если запрос можно отправлять
+        """
+        required_cost = estimated_cost if required_cost is None else required_cost
+        with self._lock:
+            while self.hard_budget is not None:
+                if self.budget_stopped:
+                    break
+                remaining = self.hard_budget - self.total_cost
+                if required_cost <= remaining - self._reserved:
+                    break
+                if self._in_flight and required_cost <= remaining:
+                    # Выполняющиеся запросы могут обойтись дешевле оценки: ждем их завершения
+                    self._lock.wait()
+                    continue
+                self.skipped_requests += 1
+                return False
+
+            if self.budget_stopped:
+                self.skipped_requests += 1
+                return False
+
+            self._reserved += estimated_cost
+            self._in_flight += 1
+            return True
 
-        # Уровни финансовой грамотности
-        self.financial_literacy_levels = [
-            "отсутствие знаний", "начинающий", "средний", "продвинутый", "эксперт"
-        ]
+    def record_skipped(self, count: int) -> None:
+        """Учет запросов, пропущенных без резервирования (например, отмененных задач очереди)"""
+        with self._lock:
+            self.skipped_requests += count
+
+    def release(self, estimated_cost: float) -> None:
+        """Снятие резерва после завершения запроса (фактические расходы учитываются через record)"""
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            # Без запросов в работе резерв обнуляется (не накапливаем погрешность округления)
+            self._reserved = max(0.0, self._reserved - estimated_cost) if self._in_flight else 0.0
+            self._lock.notify_all()
+
+    @property
+    def soft_budget_exceeded(self) -> bool:
+        """Превышен ли мягкий бюджет"""
+        return self.soft_budget is not None and self.total_cost > self.soft_budget
+
+    def summary(self) -> Dict:
+        """
+        Сводка расходов для отображения и экспорта
 
-        # Финансовое отношение к риску
-        self.risk_attitudes = [
-            "избегающий риска", "умеренный", "склонный к риску"
-        ]
+        Returns:
+            Словарь с итогами и разбивкой по провайдерам, моделям и разделам промпта
+        """
+        with self._lock:
+            models = [dict(entry) for entry in self._entries.values()]
+            sections = [dict(self._sections[slot]) for slot in PROMPT_SLOTS if slot in self._sections]
+            postprocess = dict(self._postprocess)
+            total_cost = self.total_cost
 
-        # Отношение к банкам
-        self.bank_trust_levels = [
-            "низкое", "среднее", "высокое"
-        ]
+        # Доля раздела во входных токенах промптов
+        section_tokens = sum(section["tokens"] for section in sections)
+        for section in sections:
+            section["share"] = section["tokens"] / section_tokens if section_tokens else 0.0
 
-        # Отношение к кредитам
-        self.loan_attitudes = [
-            "негативное", "нейтральное", "позитивное"
-        ]
+        return {
+            "currency": "USD",
+            "total_cost": total_cost,
+            "input_tokens": sum(m["input_tokens"] for m in models),
+            "output_tokens": sum(m["output_tokens"] for m in models),
+            "cached_tokens": sum(m["cached_tokens"] for m in models),
+            "cache_write_tokens": sum(m["cache_write_tokens"] for m in models),
+            "requests": sum(m["requests"] for m in models),
+            "hard_budget": self.hard_budget,
+            "soft_budget": self.soft_budget,
+            "soft_budget_exceeded": self.soft_budget_exceeded,
+            "budget_stopped": self.budget_stopped,
+            "skipped_requests": self.skipped_requests,
+            "models": models,
+            "prompt_sections": sections,
+            "postprocess": postprocess
+        }
 
-        # Модели финансового поведения
-        self.financial_behaviors = [
-            "избегающий риска", "импульсивный", "прагматичный",
-            "осознанный минималист", "статусный"
-        ]
 
-        # Банковские продукты
-        self.bank_products = [
-            "дебетовые карты", "кредитные карты", "потребительские кредиты",
-            "ипотека", "вклады", "накопительные счета", "инвестиционные продукты"
-        ]
+def _persona_values_match(left, right, tolerance: float = 1e-6) -> bool:
+    """
+    Рекурсивное сравнение значений персон (числа с плавающей точкой - с допуском)
 
-        # База знаний о финансах
-        self.knowledge_base = FinancialKnowledgeBase()
+    Args:
+        left: Первое значение
+        right: Второе значение
+        tolerance: Допустимое относительное расхождение чисел
 
-        # Анализатор отзывов о банках
-        self.reviews_analyzer = BankReviewsAnalyzer()
+    Returns:
+        True, если значения совпадают
+    """
+    if isinstance(left, dict) and isinstance(right, dict):
+        return left.keys() == right.keys() and all(_persona_values_match(left[k], right[k], tolerance) for k in left)
+    if isinstance(left, (list, tuple)) and isinstance(right, (list, tuple)):
+        return len(left) == len(right) and all(_persona_values_match(a, b, tolerance) for a, b in zip(left, right))
+    if isinstance(left, float) or isinstance(right, float):
+        return isinstance(left, (int, float)) and isinstance(right, (int, float)) and \
+            math.isclose(left, right, rel_tol=tolerance, abs_tol=tolerance)
+    return type(left) == type(right) and left == right
+
+
+def _as_list(value) -> list:
+    """Значение ячейки столбца-списка: список, массив Parquet, JSON-строка CSV или пустая ячейка"""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return list(value)
+    if isinstance(value, str):
+        value = value.strip()
+        if not value:
+            return []
+        parsed = json.loads(value)
+        return list(parsed) if isinstance(parsed, (list, tuple)) else [parsed]
+    if isinstance(value, float) and math.isnan(value):
+        return []
+    return [value]
+
+
+def _table_errors(label: str, values: Sequence, invalid: np.ndarray) -> str:
+    """Сообщение о недопустимых значениях столбца (первые значения и номера строк)"""
+    rows = np.flatnonzero(invalid)
+    examples = sorted({str(values[k]) for k in rows[:20]})[:5]
+    return (f"Столбец '{label}': недопустимые значения {', '.join(examples)} "
+            f"(строки {', '.join(str(k + 1) for k in rows[:5])}{'...' if len(rows) > 5 else ''})")
+
+
+def _encode_label_column(label: str, values: Sequence, lookup: Dict[str, int], errors: List[str]) -> np.ndarray:
+    """Коды значений справочника для столбца таблицы (ошибки добавляются в errors)"""
+    codes = pd.Series(values, dtype=object).map(lookup)
+    invalid = codes.isna().to_numpy()
+    if invalid.any():
+        errors.append(_table_errors(label, values, invalid))
+    return codes.fillna(0).to_numpy(dtype=np.int64)
+
+
+def _encode_list_column(label: str, lists: Sequence[list], width: int, errors: List[str],
+                        lookup: Optional[Dict[str, int]] = None, fill=-1, dtype=np.int64) -> np.ndarray:
+    """
+    Матрица (N x width) кодов или чисел для столбца-списка (короткие списки дополняются fill)
 
-        # Параметры для промптов
-        self.prompting_params = {
-            "temperature_min": 0.3,
-            "temperature_max": 0.85,
-            "max_tokens": 1500,
-            "prompt_data": {},
-            "use_reviews_data": False
-        }
+    Args:
+        label: Подпись столбца (для сообщений об ошибках)
+        lists: Списки значений по строкам
+        width: Ширина матрицы
+        errors: Список, в который добавляются сообщения об ошибках
+        lookup: Справочник значение -> код (None - значения числовые)
+        fill: Значение для пустых позиций
+        dtype: Тип матрицы
 
-        # Доступные LLM модели
-        self.claude_models = ["claude-3-5-sonnet-20241022", "claude-3-5-haiku-20241022", "claude-3-opus-20240229"]
-        self.openai_models = ["gpt-4o", "gpt-4-turbo", "gpt-3.5-turbo"]
+    Returns:
+        Матрица значений
+    """
+    n = len(lists)
+    lengths = np.fromiter((len(values) for values in lists), dtype=np.int64, count=n)
+    result = np.full((n, width), fill, dtype=dtype)
+
+    too_long = lengths > width
+    if too_long.any():
+        errors.append(_table_errors(label, [len(values) for values in lists], too_long) +
+                      f" - не более {width} элементов")
+        return result
 
-        # Маппинг типов вопросов на аспекты финансов
-        self.financial_topic_mapping = {
-            "кредиты": ["кредит", "займ", "ипотек", "потребит", "рассрочк"],
-            "карты": ["карт", "дебет", "кэшбэк", "кешбэк", "бонус", "лимит"],
-            "вклады": ["вклад", "депозит", "накопи", "процент", "сбережени"],
-            "инвестиции": ["инвест", "акци", "облигаци", "брокер", "фонд", "пиф", "бирж"],
-            "общие": ["банк", "финанс", "деньг", "платеж", "перевод", "комисси"],
-            "онлайн-сервисы": ["приложени", "сайт", "онлайн", "личный кабинет", "мобильн"]
-        }
+    flat = pd.Series([value for values in lists for value in values], dtype=object)
+    if lookup is not None:
+        flat = flat.map(lookup)
+        invalid = flat.isna().to_numpy()
+        if invalid.any():
+            rows = np.repeat(np.arange(n), lengths)[invalid]
+            errors.append(_table_errors(label, [lists[k] for k in range(n)], np.isin(np.arange(n), rows)))
+            return result
+    flat = pd.to_numeric(flat, errors="coerce")
+    if flat.isna().any():
+        errors.append(f"Столбец '{label}': ожидаются числа")
+        return result
 
-        # Кэш для API-ответов
-        self.response_cache = {}
+    rows = np.repeat(np.arange(n), lengths)
+    positions = np.arange(len(flat)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    result[rows, positions] = flat.to_numpy()
+    return result
 
-        # Счетчик использованных токенов
-        self.tokens_used = {
-            "claude": 0,
-            "openai": 0
-        }
 
-        # Инициализация расширенного генератора респондентов
-        self.enhanced_respondent = EnhancedFinancialRespondent(self)
+def _decode_list_column(codes: np.ndarray, labels: Sequence) -> List[list]:
+    """Списки значений справочника по матрице кодов (-1 - пустая позиция)"""
+    if not len(codes):
+        return []
+    labels = np.asarray(labels, dtype=object)
+    mask = codes >= 0
+    values = labels[codes[mask]]
+    return [chunk.tolist() for chunk in np.split(values, np.cumsum(mask.sum(axis=1))[:-1])]
 
-    def generate_persona(self, weighted: bool = True) -> Dict:
-        """
-        Генерация случайной персоны с уровнем финансовой грамотности
 
-        Args:
-            weighted: Использовать взвешенное распределение для реалистичности
+class PersonaCohort(Sequence):
+    """
+    Колоночное представление когорты персон
 
-        Returns:
-            Dictionary с атрибутами персоны
+    Атрибуты хранятся в массивах NumPy (индексы категорий в справочниках маркетплейса и базы знаний,
+    примеры из каталогов - по индексу), а словарь персоны в привычном формате собирается заново при каждом
+    обращении к элементу и не хранится. Когорта ведет себя как список словарей (len, индексация, итерация).
+    Персоны, которые нельзя без потерь закодировать в колонки (например, с произвольными полями),
+    хранятся словарями в отдельной таблице замен.
+
+    Элементы когорты - копии только для чтения: изменения словаря (cohort[k][...] = x) в когорту
+    не попадают, персона заменяется через set_persona или update_column.
+    """
+
+    # Колонки дополнительных факторов (заполняются EnhancedFinancialRespondent.enhance_cohort)
+    enhancement_columns = (
+        "bias_idx", "bias_strength", "emotion_idx", "emotion_strength", "device", "error_level",
+        "inconsistency_level", "inconsistency_strength", "fatigue_rate", "max_fatigue"
+    )
+
+    # Атрибуты, редактируемые в таблице когорты: подпись столбца -> (колонка, справочник маркетплейса)
+    editable_columns = {
+        "Пол": ("gender", "gender_options"),
+        "Профессия": ("profession", "professions"),
+        "Образование": ("education", "education_levels"),
+        "Семейное положение": ("family_status", "family_statuses"),
+        "Доход": ("income", "income_brackets"),
+        "Уровень финансовой грамотности": ("literacy", "financial_literacy_levels"),
+        "Доверие к банкам": ("trust", "bank_trust_levels"),
+        "Отношение к кредитам": ("loan", "loan_attitudes"),
+        "Отношение к риску": ("risk", "risk_attitudes"),
+        "Модель финансового поведения": ("behavior", "financial_behaviors")
+    }
+
+    # Числовые атрибуты таблицы: подпись столбца -> (колонка, минимум, максимум)
+    numeric_columns = {
+        "Возраст": ("age", 18, 80),
+        "Количество детей": ("children", 0, 8)
+    }
+
+    # Столбцы параметров расширения в табличном формате панели (задаются все или ни одного)
+    enhancement_table_columns = (
+        "Когнитивные искажения", "Сила искажений", "Эмоциональные факторы", "Сила эмоций", "Устройство",
+        "Уровень ошибок", "Уровень непоследовательности", "Типы непоследовательности", "Сила непоследовательности",
+        "Скорость усталости", "Максимальная усталость"
+    )
+
+    # Столбец табличного формата с персонами из таблицы замен (словарь персоны целиком в JSON)
+    override_column = "Персона вне справочников"
+
+    def __init__(self, marketplace, columns: Dict[str, np.ndarray], enhance: bool = True,
+                 overrides: Optional[Dict[int, Dict]] = None):
         """
-        # Пол с реалистичным распределением
-        gender = random.choices(
-            ["Мужской", "Женский"],
-            weights=[0.48, 0.52] if weighted else None
-        )[0]
+        Инициализация когорты
 
-        # Возраст с реалистичным распределением по возрастным группам
-        age_groups = [(18, 24), (25, 34), (35, 44), (45, 54), (55, 65), (66, 80)]
-        age_weights = [0.12, 0.22, 0.21, 0.18, 0.15, 0.12] if weighted else None
+        Args:
+            marketplace: Экземпляр RespondentsMarketplace (справочники и база знаний)
+            columns: Колонки когорты (массивы одинаковой длины по первой оси)
+            enhance: Расширять ли персоны дополнительными факторами при сборке словаря
+            overrides: Персоны, хранящиеся словарями вместо колонок (индекс -> словарь)
+        """
+        self.marketplace = marketplace
+        self.columns = columns
+        self.enhance = enhance
+        self._size = len(columns["age"])
+        self._overrides = dict(overrides or {})
+        self._lookups = {}
+
+    @classmethod
+    def from_personas(cls, marketplace, personas: Sequence[Dict]) -> "PersonaCohort":
+        """
+        Кодирование списка словарей персон в колоночную когорту
 
-        age_group = random.choices(age_groups, weights=age_weights)[0]
-        age = random.randint(age_group[0], age_group[1])
+        Персоны, которые не удается восстановить из колонок без потерь, сохраняются как есть.
 
-        # Регион с учетом распределения населения
-        region_weights = [0.15, 0.10, 0.13, 0.05, 0.05, 0.05, 0.13, 0.12, 0.12, 0.10] if weighted else None
-        region = random.choices(self.regions, weights=region_weights)[0]
+        Args:
+            marketplace: Экземпляр RespondentsMarketplace
+            personas: Последовательность словарей персон (или готовая когорта)
 
-        # Выбор города на основе региона
-        city = random.choice(self.cities.get(region, ["Не указан"]))
+        Returns:
+            PersonaCohort с теми же персонами
+        """
+        if isinstance(personas, PersonaCohort):
+            return personas
 
-        # Доход, коррелирующий с возрастом, с нормальным распределением
-        if age < 25:
-            income_idx = min(max(0, int(np.random.normal(1, 1))), len(self.income_brackets)-1)
-        elif age < 35:
-            income_idx = min(max(0, int(np.random.normal(3, 1.5))), len(self.income_brackets)-1)
-        elif age < 45:
-            income_idx = min(max(0, int(np.random.normal(4, 1.5))), len(self.income_brackets)-1)
-        elif age < 55:
-            income_idx = min(max(0, int(np.random.normal(3, 2))), len(self.income_brackets)-1)
-        else:
-            income_idx = min(max(0, int(np.random.normal(2, 1.5))), len(self.income_brackets)-1)
+        personas = list(personas)
+        enhance = bool(personas) and all('Профиль непоследовательности' in p for p in personas)
 
-        income = self.income_brackets[income_idx]
+        # Пустая когорта задает типы и ширину колонок
+        template = marketplace.generate_cohort(0, enhance=enhance).columns
+        columns = {}
+        for name, column in template.items():
+            fill = -1 if column.dtype.kind == "i" and column.ndim == 2 else 0
+            columns[name] = np.full((len(personas),) + column.shape[1:], fill, dtype=column.dtype)
 
-        # Уровень образования, коррелирующий с возрастом
-        if age < 22:
-            edu_options = self.education_levels[:3]
-            edu_weights = [0.4, 0.4, 0.2]
-        elif age < 30:
-            edu_options = self.education_levels[:6]
-            edu_weights = [0.1, 0.2, 0.1, 0.3, 0.2, 0.1]
-        else:
-            edu_options = self.education_levels
-            edu_weights = [0.10, 0.25, 0.05, 0.25, 0.20, 0.10, 0.03, 0.01, 0.01]
+        cohort = cls(marketplace, columns, enhance=enhance)
+        for k, persona in enumerate(personas):
+            cohort.set_persona(k, persona)
 
-        education = random.choices(edu_options, weights=edu_weights[:len(edu_options)])[0]
+        return cohort
 
-        # Семейное положение, коррелирующее с возрастом
-        if age < 25:
-            family_weights = [0.7, 0.05, 0.2, 0.01, 0.01, 0.03]
-        elif age < 35:
-            family_weights = [0.3, 0.35, 0.25, 0.05, 0.01, 0.04]
-        elif age < 55:
-            family_weights = [0.15, 0.5, 0.15, 0.1, 0.05, 0.05]
-        else:
-            family_weights = [0.1, 0.4, 0.05, 0.2, 0.2, 0.05]
+    @property
+    def nbytes(self) -> int:
+        """Объем памяти колонок когорты в байтах (без таблицы замен)"""
+        return sum(column.nbytes for column in self.columns.values())
 
-        family_status = random.choices(self.family_statuses, weights=family_weights)[0]
+    def __len__(self) -> int:
+        return self._size
 
-        # Количество детей - коррелирует с возрастом и семейным положением
-        max_children = max(0, min(5, int((age - 18) / 5)))
+    def __getitem__(self, index):
+        """Персона по индексу (копия: изменения вносятся через set_persona)"""
+        if isinstance(index, slice):
+            return [self[k] for k in range(*index.indices(self._size))]
 
-        if "Холост" in family_status or age < 22:
-            children_weights = [0.9] + [0.1/max(1, max_children)] * max_children
-        elif "Гражданский брак" in family_status:
-            children_weights = [0.6] + [0.4/max(1, max_children)] * max_children
-        elif "Разведен" in family_status:
-            children_weights = [0.3] + [0.7/max(1, max_children)] * max_children
-        else:
-            children_weights = [0.2] + [0.8/max(1, max_children)] * max_children
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("Индекс персоны вне диапазона когорты")
 
-        num_children = random.choices(
-            range(0, max_children + 1),
-            weights=children_weights[:max_children+1]
-        )[0]
+        if index in self._overrides:
+            return copy.deepcopy(self._overrides[index])
+        return self._build_persona(index)
 
-        # Выбор 1-3 хобби
-        num_hobbies = random.choices([1, 2, 3], weights=[0.2, 0.5, 0.3])[0]
-        hobbies = random.sample(self.hobby_options, num_hobbies)
+    def set_persona(self, index: int, persona: Dict) -> None:
+        """
+        Замена персоны в когорте (кодируется в колонки, если это возможно без потерь)
 
-        # Финансовая грамотность - коррелирует с возрастом, образованием и доходом
-        # Базовый показатель на основе образования
-        education_factor = {
-            "Начальное образование": 0.1,
-            "Среднее образование": 0.3,
-            "Среднее специальное": 0.4,
-            "Неоконченное высшее": 0.5,
-            "Высшее (бакалавр)": 0.6,
-            "Высшее (специалист)": 0.7,
-            "Высшее (магистр)": 0.8,
-            "Два и более высших образования": 0.9,
-            "Ученая степень": 0.95
-        }.get(education, 0.5)
+        Args:
+            index: Индекс персоны в когорте
+            persona: Словарь персоны
+        """
+        if not 0 <= index < self._size:
+            raise IndexError("Индекс персоны вне диапазона когорты")
 
-        # Фактор возраста (опыт)
-        age_factor = min(1.0, max(0.1, (age - 18) / 40))
+        self._overrides.pop(index, None)
+        try:
+            self._encode_persona(index, persona)
+            encoded = _persona_values_match(self._build_persona(index), persona)
+        except (KeyError, ValueError, IndexError, TypeError, AttributeError, OverflowError):
+            encoded = False
+
+        if not encoded:
+            self._overrides[index] = persona
+
+    def to_dicts(self) -> List[Dict]:
+        """Сборка всех персон в виде списка словарей"""
+        return [self[k] for k in range(self._size)]
+
+    def _lookup(self, name: str, values: Sequence[str]) -> Dict[str, int]:
+        """Обратный индекс справочника (значение -> первый индекс), строится один раз"""
+        if name not in self._lookups:
+            lookup = {}
+            for idx, value in enumerate(values):
+                lookup.setdefault(value, idx)
+            self._lookups[name] = lookup
+        return self._lookups[name]
+
+    def _encode_persona(self, k: int, persona: Dict) -> None:
+        """Запись персоны в строку k колонок когорты (KeyError/ValueError, если значение вне справочников)"""
+        mp = self.marketplace
+        kb = mp.knowledge_base
+        c = self.columns
+        tables = mp._cohort_tables()
+
+        def encode_list(name, indices):
+            if len(indices) > c[name].shape[1]:
+                raise ValueError(f"Слишком много элементов в колонке {name}")
+            c[name][k] = -1
+            c[name][k, :len(indices)] = indices
+
+        fin = persona["Финансовый профиль"]
+        attitudes = fin["Отношение к финансам"]
+        knowledge = fin["Финансовые знания"]
+
+        region = mp.regions.index(persona["Регион"])
+        c["gender"][k] = mp.gender_options.index(persona["Пол"])
+        c["age"][k] = persona["Возраст"]
+        c["region"][k] = region
+        c["city"][k] = tables["city_offsets"][region] + mp.cities.get(persona["Регион"], ["Не указан"]).index(persona["Город"])
+        c["profession"][k] = mp.professions.index(persona["Профессия"])
+        c["education"][k] = mp.education_levels.index(persona["Образование"])
+        c["family_status"][k] = mp.family_statuses.index(persona["Семейное положение"])
+        c["children"][k] = persona["Количество детей"]
+        c["income"][k] = mp.income_brackets.index(persona["Доход"])
+        encode_list("hobbies", [mp.hobby_options.index(h) for h in persona["Увлечения"]])
+
+        c["literacy"][k] = mp.financial_literacy_levels.index(fin["Уровень финансовой грамотности"])
+        c["products"][k] = [bool(fin["Используемые продукты"][product]) for product in PERSONA_PRODUCT_NAMES]
+        c["trust"][k] = mp.bank_trust_levels.index(attitudes["Доверие к банкам"])
+        c["loan"][k] = mp.loan_attitudes.index(attitudes["Отношение к кредитам"])
+        c["risk"][k] = mp.risk_attitudes.index(attitudes["Отношение к риску"])
+        c["behavior"][k] = mp.financial_behaviors.index(attitudes["Модель финансового поведения"])
+
+        vocabulary = self._lookup("vocabulary", kb._flat_vocabulary)
+        misconceptions = self._lookup("misconceptions", kb._flat_misconceptions)
+        goals = self._lookup("goals", kb._flat_goals)
+        encode_list("vocabulary", [vocabulary[t] for t in knowledge["Словарный запас"]])
+        encode_list("misconceptions", [misconceptions[t] for t in knowledge["Заблуждения"]])
+        encode_list("goals", [goals[t] for t in fin["Финансовые цели"]])
+
+        if not self.enhance:
+            return
 
-        # Фактор дохода
-        income_factor = {
-            "Менее 15 000 ₽": 0.2,
-            "15 000 - 30 000 ₽": 0.3,
-            "30 000 - 60 000 ₽": 0.5,
-            "60 000 - 100 000 ₽": 0.7,
-            "100 000 - 150 000 ₽": 0.8,
-            "150 000 - 250 000 ₽": 0.9,
-            "250 000 - 500 000 ₽": 0.95,
-            "Более 500 000 ₽": 1.0,
-            "Предпочитаю не отвечать": 0.5
-        }.get(income, 0.5)
+        respondent = mp.enhanced_respondent
+        biases = fin["Когнитивные искажения"]
+        emotions = fin["Эмоциональные факторы"]
+        linguistic = persona["Лингвистический профиль"]
+        inconsistency = persona["Профиль непоследовательности"]
+
+        bias_names = self._lookup("biases", list(respondent.cognitive_biases.financial_biases))
+        emotion_names = self._lookup("emotions", list(respondent.emotional_factors.financial_emotions))
+        type_names = self._lookup("inconsistency", list(respondent.inconsistency.inconsistency_types))
+
+        encode_list("bias_idx", [bias_names[b] for b in biases])
+        c["bias_strength"][k] = 0.0
+        c["bias_strength"][k, :len(biases)] = list(biases.values())
+        encode_list("emotion_idx", [emotion_names[e] for e in emotions])
+        c["emotion_strength"][k] = 0.0
+        c["emotion_strength"][k, :len(emotions)] = list(emotions.values())
+
+        c["device"][k] = respondent.linguistic_variation.device_types.index(linguistic["device_type"])
+        c["error_level"][k] = linguistic["total_error_level"]
+
+        c["inconsistency_level"][k] = inconsistency["overall_level"]
+        c["inconsistency_strength"][k] = 0.0
+        for type_name, type_info in inconsistency["types"].items():
+            c["inconsistency_strength"][k, type_names[type_name]] = type_info["strength"]
+        c["fatigue_rate"][k] = inconsistency["fatigue_profile"]["fatigue_rate"]
+        c["max_fatigue"][k] = inconsistency["fatigue_profile"]["max_fatigue"]
+
+    def to_pandas(self, indices: Optional[Sequence[int]] = None) -> pd.DataFrame:
+        """
+        Плоская таблица базовых атрибутов когорты (без сборки словарей)
 
-        # Расчет общего уровня с некоторой случайностью
-        literacy_score = (education_factor * 0.4 + age_factor * 0.3 + income_factor * 0.3) * random.uniform(0.7, 1.3)
+        Args:
+            indices: Индексы персон (по умолчанию - вся когорта); индекс таблицы - индексы персон
 
-        # Определение уровня финансовой грамотности
-        if literacy_score < 0.25:
-            financial_literacy = "отсутствие знаний"
-        elif literacy_score < 0.45:
-            financial_literacy = "начинающий"
-        elif literacy_score < 0.7:
-            financial_literacy = "средний"
-        elif literacy_score < 0.9:
-            financial_literacy = "продвинутый"
+        Returns:
+            pandas DataFrame с одной строкой на персону
+        """
+        mp = self.marketplace
+        if indices is None:
+            c = self.columns
+            overrides = list(self._overrides)
         else:
-            financial_literacy = "эксперт"
+            indices = np.asarray(indices, dtype=np.int64)
+            c = {name: column[indices] for name, column in self.columns.items()}
+            overrides = [k for k in indices.tolist() if k in self._overrides]
+        product_names = list(PERSONA_PRODUCT_NAMES)
+
+        data = {
+            "Пол": pd.Categorical.from_codes(c["gender"], mp.gender_options),
+            "Возраст": c["age"],
+            "Регион": pd.Categorical.from_codes(c["region"], mp.regions),
+            "Город": np.asarray(mp._flat_cities, dtype=object)[c["city"]],
+            "Профессия": pd.Categorical.from_codes(c["profession"], mp.professions),
+            "Образование": pd.Categorical.from_codes(c["education"], mp.education_levels),
+            "Семейное положение": pd.Categorical.from_codes(c["family_status"], mp.family_statuses),
+            "Количество детей": c["children"],
+            "Доход": pd.Categorical.from_codes(c["income"], mp.income_brackets),
+            "Уровень финансовой грамотности": pd.Categorical.from_codes(c["literacy"], mp.financial_literacy_levels),
+            "Доверие к банкам": pd.Categorical.from_codes(c["trust"], mp.bank_trust_levels),
+            "Отношение к кредитам": pd.Categorical.from_codes(c["loan"], mp.loan_attitudes),
+            "Отношение к риску": pd.Categorical.from_codes(c["risk"], mp.risk_attitudes),
+            "Модель финансового поведения": pd.Categorical.from_codes(c["behavior"], mp.financial_behaviors)
+        }
+        for k, product in enumerate(product_names):
+            data[product] = c["products"][:, k]
+
+        df = pd.DataFrame(data, index=indices)
+
+        # Персоны из таблицы замен могут содержать значения вне справочников
+        if overrides:
+            df = df.astype(object)
+            for k in overrides:
+                persona = self._overrides[k]
+                fin = persona.get("Финансовый профиль", {})
+                attitudes = fin.get("Отношение к финансам", {})
+                row = {key: persona.get(key) for key in
+                       ("Пол", "Возраст", "Регион", "Город", "Профессия", "Образование",
+                        "Семейное положение", "Количество детей", "Доход")}
+                row["Уровень финансовой грамотности"] = fin.get("Уровень финансовой грамотности")
+                row.update({key: attitudes.get(key) for key in
+                            ("Доверие к банкам", "Отношение к кредитам", "Отношение к риску",
+                             "Модель финансового поведения")})
+                row.update({product: bool(fin.get("Используемые продукты", {}).get(product, False))
+                            for product in product_names})
+                df.loc[k, list(row)] = list(row.values())
+
+        return df
+
+    def to_arrow(self):
+        """
+        Таблица Apache Arrow с базовыми атрибутами когорты (категории - словарное кодирование)
 
-        # Опыт использования финансовых продуктов - зависит от уровня грамотности
-        literacy_idx = self.financial_literacy_levels.index(financial_literacy)
+        Returns:
+            pyarrow.Table
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ValueError("Для экспорта в Arrow необходим пакет pyarrow")
 
-        financial_products = {}
+        return pa.Table.from_pandas(self.to_pandas(), preserve_index=False)
 
-        # Дебетовая карта - есть почти у всех
-        financial_products["Дебетовая карта"] = random.random() < (0.5 + literacy_idx * 0.1)
+    def _table_catalogs(self) -> Dict[str, Tuple[str, Sequence[str]]]:
+        """Столбцы-списки табличного формата: подпись -> (колонка когорты, справочник значений)"""
+        mp = self.marketplace
+        kb = mp.knowledge_base
+        return {
+            "Увлечения": ("hobbies", mp.hobby_options),
+            "Словарный запас": ("vocabulary", kb._flat_vocabulary),
+            "Заблуждения": ("misconceptions", kb._flat_misconceptions),
+            "Финансовые цели": ("goals", kb._flat_goals)
+        }
 
-        # Кредитная карта - растет с уровнем грамотности
-        financial_products["Кредитная карта"] = random.random() < (0.1 + literacy_idx * 0.15)
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Полная плоская таблица когорты для экспорта панели (см. save_cohort)
 
-        # Потребительский кредит - умеренный рост с грамотностью
-        financial_products["Потребительский кредит"] = random.random() < (0.15 + literacy_idx * 0.1)
+        К столбцам to_pandas добавляются списки увлечений, знаний и целей, а для расширенной когорты -
+        компактные параметры профилей (искажения, эмоции, устройство, непоследовательность), из которых
+        профили восстанавливаются без повторной случайной выборки. Персоны из таблицы замен
+        выгружаются по известным полям и целиком в столбце override_column (только если они есть).
 
-        # Ипотека - зависит от возраста и дохода
-        has_mortgage_chance = 0.01
-        if 25 <= age <= 50:
-            has_mortgage_chance += 0.15
-        if income_idx >= 3:  # Доход от 60 000
-            has_mortgage_chance += 0.15
-        financial_products["Ипотека"] = random.random() < has_mortgage_chance
+        Returns:
+            pandas DataFrame с одной строкой на персону
+        """
+        respondent = self.marketplace.enhanced_respondent
+        c = self.columns
+        df = self.to_pandas()
+
+        table = {label: _decode_list_column(c[name], labels) for label, (name, labels) in self._table_catalogs().items()}
+
+        enhanced = self.enhance and "bias_idx" in c
+        if enhanced:
+            bias_names = list(respondent.cognitive_biases.financial_biases)
+            emotion_names = list(respondent.emotional_factors.financial_emotions)
+            type_names = list(respondent.inconsistency.inconsistency_types)
+            has_type = c["inconsistency_strength"] > 0
+            table.update({
+                "Когнитивные искажения": _decode_list_column(c["bias_idx"], bias_names),
+                "Сила искажений": [row[codes >= 0].tolist() for row, codes in zip(c["bias_strength"], c["bias_idx"])],
+                "Эмоциональные факторы": _decode_list_column(c["emotion_idx"], emotion_names),
+                "Сила эмоций": [row[codes >= 0].tolist() for row, codes in zip(c["emotion_strength"], c["emotion_idx"])],
+                "Устройство": np.asarray(respondent.linguistic_variation.device_types, dtype=object)[c["device"]],
+                "Уровень ошибок": c["error_level"],
+                "Уровень непоследовательности": c["inconsistency_level"],
+                "Типы непоследовательности": _decode_list_column(
+                    np.where(has_type, np.arange(len(type_names)), -1), type_names),
+                "Сила непоследовательности": [row[row > 0].tolist() for row in c["inconsistency_strength"]],
+                "Скорость усталости": c["fatigue_rate"],
+                "Максимальная усталость": c["max_fatigue"]
+            })
+
+        # Персоны из таблицы замен
+        for k, persona in self._overrides.items():
+            fin = persona.get("Финансовый профиль", {})
+            knowledge = fin.get("Финансовые знания", {})
+            row = {
+                "Увлечения": list(persona.get("Увлечения", [])),
+                "Словарный запас": list(knowledge.get("Словарный запас", [])),
+                "Заблуждения": list(knowledge.get("Заблуждения", [])),
+                "Финансовые цели": list(fin.get("Финансовые цели", []))
+            }
+            if enhanced:
+                linguistic = persona.get("Лингвистический профиль", {})
+                inconsistency = persona.get("Профиль непоследовательности", {})
+                types = inconsistency.get("types", {})
+                row.update({
+                    "Когнитивные искажения": list(fin.get("Когнитивные искажения", {})),
+                    "Сила искажений": list(fin.get("Когнитивные искажения", {}).values()),
+                    "Эмоциональные факторы": list(fin.get("Эмоциональные факторы", {})),
+                    "Сила эмоций": list(fin.get("Эмоциональные факторы", {}).values()),
+                    "Устройство": linguistic.get("device_type"),
+                    "Уровень ошибок": linguistic.get("total_error_level"),
+                    "Уровень непоследовательности": inconsistency.get("overall_level"),
+                    "Типы непоследовательности": list(types),
+                    "Сила непоследовательности": [info.get("strength") for info in types.values()],
+                    "Скорость усталости": inconsistency.get("fatigue_profile", {}).get("fatigue_rate"),
+                    "Максимальная усталость": inconsistency.get("fatigue_profile", {}).get("max_fatigue")
+                })
+            for label, value in row.items():
+                if not isinstance(table[label], list):
+                    table[label] = list(table[label])
+                table[label][k] = value
+
+        for label, values in table.items():
+            df[label] = values if isinstance(values, np.ndarray) else pd.Series(values, index=df.index, dtype=object)
+
+        if self._overrides:
+            df[self.override_column] = pd.Series(
+                [json.dumps(self._overrides[k], ensure_ascii=False, cls=NumpyEncoder) if k in self._overrides
+                 else None for k in range(self._size)],
+                index=df.index, dtype=object
+            )
+        return df
 
-        # Вклад - растет с грамотностью
-        financial_products["Вклад"] = random.random() < (0.05 + literacy_idx * 0.2)
+    @classmethod
+    def from_frame(cls, marketplace, df: pd.DataFrame, seed: Optional[int] = None) -> "PersonaCohort":
+        """
+        Проверка и векторное кодирование плоской таблицы панели в когорту (формат to_frame)
 
-        # Инвестиции - в основном у продвинутых и экспертов
-        financial_products["Инвестиции"] = random.random() < (0.01 + (literacy_idx ** 2) * 0.05)
+        Обязательны демографические столбцы, уровень грамотности и отношение к финансам. Отсутствующие
+        продукты считаются неиспользуемыми, отсутствующие знания и цели выбираются из пулов уровня,
+        а если нет столбцов расширения, профили выбираются заново (как в generate_cohort).
+        Строки с заполненным столбцом override_column не проверяются по справочникам: персона
+        восстанавливается из JSON и попадает в таблицу замен.
 
-        # Страховые продукты - умеренный рост с грамотностью
-        financial_products["Страхование"] = random.random() < (0.05 + literacy_idx * 0.15)
+        Args:
+            marketplace: Экземпляр RespondentsMarketplace
+            df: Таблица панели
+            seed: Зерно для выборки недостающих знаний и профилей
 
-        # Отношение к финансам - коррелирует с уровнем грамотности
+        Returns:
+            PersonaCohort
 
-        # Доверие к банкам
-        if financial_literacy in ["отсутствие знаний", "начинающий"]:
-            trust_weights = [0.5, 0.3, 0.2]
-        elif financial_literacy == "средний":
-            trust_weights = [0.3, 0.5, 0.2]
+        Raises:
+            ValueError: Если нет обязательных столбцов или значения вне справочников и диапазонов
+        """
+        if cls.override_column in df.columns:
+            overrides = {}
+            for k, value in enumerate(df[cls.override_column].tolist()):
+                if not isinstance(value, str) or not value.strip():
+                    continue
+                try:
+                    persona = json.loads(value)
+                except ValueError as e:
+                    raise ValueError(f"Столбец '{cls.override_column}', строка {k + 1}: некорректный JSON ({e})")
+                if not isinstance(persona, dict):
+                    raise ValueError(f"Столбец '{cls.override_column}', строка {k + 1}: ожидается объект персоны")
+                overrides[k] = persona
+
+            df = df.drop(columns=cls.override_column)
+            if overrides:
+                is_override = np.zeros(len(df), dtype=bool)
+                is_override[list(overrides)] = True
+                regular = cls.from_frame(marketplace, df[~is_override], seed=seed)
+                columns = {
+                    name: np.full((len(df),) + column.shape[1:],
+                                  -1 if column.dtype.kind == "i" and column.ndim == 2 else 0, dtype=column.dtype)
+                    for name, column in regular.columns.items()
+                }
+                for name, column in regular.columns.items():
+                    columns[name][~is_override] = column
+                return cls(marketplace, columns, enhance=regular.enhance, overrides=overrides)
+
+        required = ["Регион", "Город"] + list(cls.editable_columns) + list(cls.numeric_columns)
+        missing = [label for label in required if label not in df.columns]
+        if missing:
+            raise ValueError(f"В таблице панели отсутствуют столбцы: {', '.join(missing)}")
+
+        present = [label for label in cls.enhancement_table_columns if label in df.columns]
+        if present and len(present) != len(cls.enhancement_table_columns):
+            absent = [label for label in cls.enhancement_table_columns if label not in df.columns]
+            raise ValueError(f"Столбцы расширения заданы не полностью, отсутствуют: {', '.join(absent)}")
+
+        n = len(df)
+        rng = spawn_generator(seed, RNG_STREAM_PERSONA)
+        template = marketplace.generate_cohort(0, enhance=True).columns
+        columns = {
+            name: np.full((n,) + column.shape[1:], -1 if column.dtype.kind == "i" and column.ndim == 2 else 0,
+                          dtype=column.dtype)
+            for name, column in template.items()
+        }
+        cohort = cls(marketplace, columns, enhance=True)
+        errors = []
+
+        # Справочные значения
+        for label, (name, options) in cls.editable_columns.items():
+            columns[name][:] = _encode_label_column(
+                label, df[label].tolist(), cohort._lookup(name, getattr(marketplace, options)), errors)
+
+        regions = df["Регион"].tolist()
+        region_codes = _encode_label_column("Регион", regions, cohort._lookup("region", marketplace.regions), errors)
+        columns["region"][:] = region_codes
+        city_lookup = {
+            (region, city): offset + j
+            for region, offset in zip(marketplace.regions, marketplace._cohort_tables()["city_offsets"])
+            for j, city in enumerate(marketplace.cities.get(region, ["Не указан"]))
+        }
+        city_keys = list(zip(regions, df["Город"].tolist()))
+        columns["city"][:] = _encode_label_column(
+            "Город", [f"{region} / {city}" for region, city in city_keys],
+            {f"{region} / {city}": idx for (region, city), idx in city_lookup.items()}, errors)
+
+        # Числа
+        for label, (name, low, high) in cls.numeric_columns.items():
+            values = pd.to_numeric(df[label], errors="coerce").to_numpy(dtype=float)
+            invalid = np.isnan(values) | (values != np.round(values)) | (values < low) | (values > high)
+            if invalid.any():
+                errors.append(_table_errors(label, df[label].tolist(), invalid) + f" - ожидается целое от {low} до {high}")
+            columns[name][:] = np.where(invalid, low, values).astype(columns[name].dtype)
+
+        for j, product in enumerate(PERSONA_PRODUCT_NAMES):
+            if product in df.columns:
+                values = df[product].replace({"True": True, "False": False, "true": True, "false": False})
+                columns["products"][:, j] = values.fillna(False).astype(bool).to_numpy()
+
+        # Списки
+        catalogs = cohort._table_catalogs()
+        for label, (name, labels) in catalogs.items():
+            if label in df.columns:
+                columns[name][:] = _encode_list_column(
+                    label, [_as_list(v) for v in df[label].tolist()], columns[name].shape[1], errors,
+                    lookup=cohort._lookup(name, labels))
+
+        if errors:
+            raise ValueError("Таблица панели не прошла проверку:\n" + "\n".join(errors))
+
+        kb = marketplace.knowledge_base
+        literacy = columns["literacy"].astype(np.intp)
+        if "Словарный запас" not in df.columns:
+            columns["vocabulary"][:] = kb.sample_vocabulary_batch(literacy, rng, columns["vocabulary"].shape[1])
+        if "Заблуждения" not in df.columns:
+            columns["misconceptions"][:] = kb.sample_misconceptions_batch(literacy, rng, columns["misconceptions"].shape[1])
+        if "Финансовые цели" not in df.columns:
+            columns["goals"][:] = kb.sample_goals_batch(n, rng, columns["goals"].shape[1])
+
+        # Профили расширения: из таблицы без повторной выборки или заново для всей панели
+        respondent = marketplace.enhanced_respondent
+        if not present:
+            columns.update(respondent.enhance_cohort(columns, rng))
         else:
-            trust_weights = [0.2, 0.3, 0.5]
+            lists = {label: [_as_list(v) for v in df[label].tolist()] for label in cls.enhancement_table_columns
+                     if label.startswith(("Когнитивные", "Сила", "Эмоциональные", "Типы"))}
+            width = columns["bias_idx"].shape[1]
+            columns["bias_idx"][:] = _encode_list_column(
+                "Когнитивные искажения", lists["Когнитивные искажения"], width, errors,
+                lookup=cohort._lookup("biases", list(respondent.cognitive_biases.financial_biases)))
+            columns["bias_strength"][:] = _encode_list_column(
+                "Сила искажений", lists["Сила искажений"], width, errors, fill=0.0, dtype=np.float32)
+            width = columns["emotion_idx"].shape[1]
+            columns["emotion_idx"][:] = _encode_list_column(
+                "Эмоциональные факторы", lists["Эмоциональные факторы"], width, errors,
+                lookup=cohort._lookup("emotions", list(respondent.emotional_factors.financial_emotions)))
+            columns["emotion_strength"][:] = _encode_list_column(
+                "Сила эмоций", lists["Сила эмоций"], width, errors, fill=0.0, dtype=np.float32)
+
+            # Сила непоследовательности хранится по позиции типа
+            type_names = list(respondent.inconsistency.inconsistency_types)
+            width = len(type_names)
+            type_idx = _encode_list_column(
+                "Типы непоследовательности", lists["Типы непоследовательности"], width, errors,
+                lookup=cohort._lookup("inconsistency", type_names))
+            strengths = _encode_list_column(
+                "Сила непоследовательности", lists["Сила непоследовательности"], width, errors,
+                fill=0.0, dtype=np.float32)
+            rows, positions = np.nonzero(type_idx >= 0)
+            columns["inconsistency_strength"][:] = 0.0
+            columns["inconsistency_strength"][rows, type_idx[rows, positions]] = strengths[rows, positions]
+
+            columns["device"][:] = _encode_label_column(
+                "Устройство", df["Устройство"].tolist(),
+                cohort._lookup("device", respondent.linguistic_variation.device_types), errors)
+            for label, name in (("Уровень ошибок", "error_level"), ("Уровень непоследовательности", "inconsistency_level"),
+                                ("Скорость усталости", "fatigue_rate"), ("Максимальная усталость", "max_fatigue")):
+                values = pd.to_numeric(df[label], errors="coerce").to_numpy(dtype=float)
+                if np.isnan(values).any():
+                    errors.append(_table_errors(label, df[label].tolist(), np.isnan(values)) + " - ожидается число")
+                columns[name][:] = np.nan_to_num(values)
+
+            if errors:
+                raise ValueError("Таблица панели не прошла проверку:\n" + "\n".join(errors))
+
+        return cohort
+
+    def fingerprint(self) -> str:
+        """
+        Хэш содержимого когорты (колонки и таблица замен) без сборки словарей персон
+
+        Returns:
+            Шестнадцатеричный SHA-256
+        """
+        digest = hashlib.sha256()
+        for name in sorted(self.columns):
+            column = np.ascontiguousarray(self.columns[name])
+            digest.update(f"{name}:{column.dtype.str}:{column.shape}".encode("utf-8"))
+            digest.update(column.tobytes())
+        digest.update(json.dumps(
+            sorted(self._overrides.items()), ensure_ascii=False, sort_keys=True, cls=NumpyEncoder
+        ).encode("utf-8"))
+        return digest.hexdigest()
+
+    def filter_mask(self, filters: Dict[str, Sequence[str]],
+                    age_range: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """
+        Маска персон для фильтров таблицы когорты (по кодам колонок, без сборки таблицы всей когорты)
 
-        bank_trust = random.choices(self.bank_trust_levels, weights=trust_weights)[0]
+        Args:
+            filters: Подпись справочного столбца (или "Регион") -> допустимые значения (пустой список - без фильтра)
+            age_range: Диапазон возраста включительно (None - без фильтра)
 
-        # Отношение к кредитам
-        if financial_literacy in ["отсутствие знаний"]:
-            loan_weights = [0.6, 0.3, 0.1]
-        elif financial_literacy == "начинающий":
-            loan_weights = [0.4, 0.4, 0.2]
-        elif financial_literacy == "средний":
-            loan_weights = [0.3, 0.4, 0.3]
-        else:
-            loan_weights = [0.2, 0.4, 0.4]
+        Returns:
+            Булев массив длины когорты
+        """
+        mask = np.ones(self._size, dtype=bool)
+        for label, values in filters.items():
+            if not values:
+                continue
+            name, options = ("region", "regions") if label == "Регион" else self.editable_columns[label]
+            lookup = self._lookup(name, getattr(self.marketplace, options))
+            mask &= np.isin(self.columns[name], [lookup[value] for value in values if value in lookup])
+        if age_range is not None:
+            mask &= (self.columns["age"] >= age_range[0]) & (self.columns["age"] <= age_range[1])
+
+        # Персоны из таблицы замен проверяются по своим значениям (их может не быть в справочниках)
+        if self._overrides:
+            rows = self.to_pandas(sorted(self._overrides))
+            selected = np.ones(len(rows), dtype=bool)
+            for label, values in filters.items():
+                if values:
+                    selected &= rows[label].astype(str).isin(values).to_numpy()
+            if age_range is not None:
+                ages = pd.to_numeric(rows["Возраст"], errors="coerce").to_numpy(dtype=float)
+                selected &= (ages >= age_range[0]) & (ages <= age_range[1])
+            mask[rows.index.to_numpy()] = selected
+
+        return mask
+
+    def update_column(self, label: str, indices: Sequence[int], values: Sequence,
+                      rng: Optional[np.random.Generator] = None) -> int:
+        """
+        Массовое изменение одного атрибута у группы персон (по подписи столбца из to_pandas)
 
-        loan_attitude = random.choices(self.loan_attitudes, weights=loan_weights)[0]
+        Для персон в колонках значения записываются кодами напрямую, без сборки словарей. При смене
+        уровня финансовой грамотности словарный запас и заблуждения выбираются заново из пулов нового уровня.
 
-        # Отношение к риску - коррелирует с возрастом и доходом
-        if age > 60:
-            risk_weights = [0.7, 0.2, 0.1]
-        elif age > 40:
-            risk_weights = [0.4, 0.4, 0.2]
+        Args:
+            label: Подпись столбца (см. editable_columns и PERSONA_PRODUCT_NAMES)
+            indices: Индексы персон в когорте
+            values: Новые значения (одно значение для всех персон или по значению на персону)
+            rng: Генератор случайных чисел NumPy для новой выборки знаний
+
+        Returns:
+            Количество измененных персон
+
+        Raises:
+            ValueError: Если атрибут не редактируется или значение вне справочника/диапазона
+        """
+        mp = self.marketplace
+        indices = np.asarray(indices, dtype=np.intp).reshape(-1)
+        values = np.asarray(values, dtype=object).reshape(-1)
+        if len(values) == 1:
+            values = np.repeat(values, len(indices))
+        if len(values) != len(indices):
+            raise ValueError("Количество значений не совпадает с количеством персон")
+        if len(indices) and (indices.min() < 0 or indices.max() >= self._size):
+            raise IndexError("Индекс персоны вне диапазона когорты")
+
+        # Значения в колонках когорты
+        if label in self.editable_columns:
+            name, options = self.editable_columns[label]
+            lookup = self._lookup(name, getattr(mp, options))
+            unknown = sorted({str(v) for v in values if v not in lookup})
+            if unknown:
+                raise ValueError(f"Недопустимые значения для '{label}': {', '.join(unknown)}")
+            codes = np.array([lookup[v] for v in values], dtype=np.intp)
+        elif label in self.numeric_columns:
+            name, low, high = self.numeric_columns[label]
+            codes = values.astype(np.int64)
+            if len(codes) and (codes.min() < low or codes.max() > high):
+                raise ValueError(f"Значение '{label}' должно быть от {low} до {high}")
+        elif label in PERSONA_PRODUCT_NAMES:
+            name = "products"
+            codes = values.astype(bool)
         else:
-            risk_weights = [0.3, 0.4, 0.3]
+            raise ValueError(f"Атрибут '{label}' нельзя изменять в таблице")
 
-        # Корректировка на основе дохода
-        if income_idx >= 5:  # Высокий доход
-            risk_weights = [max(0.1, risk_weights[0] - 0.2), risk_weights[1], min(0.6, risk_weights[2] + 0.2)]
+        is_override = np.fromiter((k in self._overrides for k in indices.tolist()), dtype=bool, count=len(indices))
+        rows, row_codes = indices[~is_override], codes[~is_override]
 
-        risk_attitude = random.choices(self.risk_attitudes, weights=risk_weights)[0]
+        if name == "products":
+            self.columns["products"][rows, PERSONA_PRODUCT_NAMES.index(label)] = row_codes
+        else:
+            self.columns[name][rows] = row_codes
+
+        if name == "literacy" and len(rows):
+            # Пулы знаний зависят от уровня грамотности
+            kb = mp.knowledge_base
+            rng = rng or np.random.default_rng()
+            self.columns["vocabulary"][rows] = kb.sample_vocabulary_batch(
+                row_codes, rng, self.columns["vocabulary"].shape[1])
+            self.columns["misconceptions"][rows] = kb.sample_misconceptions_batch(
+                row_codes, rng, self.columns["misconceptions"].shape[1])
+
+        # Персоны из таблицы замен изменяем через словарь
+        for k, value in zip(indices[is_override].tolist(), values[is_override].tolist()):
+            persona = copy.deepcopy(self._overrides[k])
+            fin = persona.setdefault("Финансовый профиль", {})
+            if name == "products":
+                fin.setdefault("Используемые продукты", {})[label] = bool(value)
+            elif name in ("trust", "loan", "risk", "behavior"):
+                fin.setdefault("Отношение к финансам", {})[label] = value
+            elif name == "literacy":
+                fin[label] = value
+            else:
+                persona[label] = int(value) if label in self.numeric_columns else value
+            self.set_persona(k, persona)
 
-        # Модель финансового поведения
-        if risk_attitude == "избегающий риска":
-            behavior_weights = [0.5, 0.1, 0.2, 0.2, 0.0]
-        elif risk_attitude == "умеренный":
-            behavior_weights = [0.2, 0.2, 0.3, 0.2, 0.1]
-        else:  # склонный к риску
-            behavior_weights = [0.1, 0.3, 0.2, 0.1, 0.3]
+        return len(indices)
 
-        financial_behavior = random.choices(self.financial_behaviors, weights=behavior_weights)[0]
+    def _build_persona(self, k: int) -> Dict:
+        """Сборка словаря персоны из колонок когорты"""
+        mp = self.marketplace
+        kb = mp.knowledge_base
+        c = self.columns
 
-        # Используем базу знаний для обогащения данных
-        financial_vocabulary = self.knowledge_base.get_vocabulary_for_level(financial_literacy, 15)
-        financial_misconceptions = self.knowledge_base.get_misconceptions_for_level(financial_literacy)
-        behavior_patterns = self.knowledge_base.get_behavior_patterns(financial_behavior)
-        financial_goals = self.knowledge_base.get_random_financial_goals(2)
+        financial_literacy = mp.financial_literacy_levels[c["literacy"][k]]
+        financial_behavior = mp.financial_behaviors[c["behavior"][k]]
 
-        # Сборка полной персоны
         persona = {
-            "Пол": gender,
-            "Возраст": age,
-            "Регион": region,
-            "Город": city,
-            "Профессия": random.choice(self.professions),
-            "Образование": education,
-            "Семейное положение": family_status,
-            "Количество детей": num_children,
-            "Доход": income,
-            "Увлечения": hobbies,
+            "Пол": mp.gender_options[c["gender"][k]],
+            "Возраст": int(c["age"][k]),
+            "Регион": mp.regions[c["region"][k]],
+            "Город": mp._flat_cities[c["city"][k]],
+            "Профессия": mp.professions[c["profession"][k]],
+            "Образование": mp.education_levels[c["education"][k]],
+            "Семейное положение": mp.family_statuses[c["family_status"][k]],
+            "Количество детей": int(c["children"][k]),
+            "Доход": mp.income_brackets[c["income"][k]],
+            "Увлечения": [mp.hobby_options[h] for h in c["hobbies"][k] if h >= 0],
             "Финансовый профиль": {
                 "Уровень финансовой грамотности": financial_literacy,
-                "Используемые продукты": financial_products,
+                "Используемые продукты": {
+                    product: bool(c["products"][k, j]) for j, product in enumerate(PERSONA_PRODUCT_NAMES)
+                },
                 "Отношение к финансам": {
-                    "Доверие к банкам": bank_trust,
-                    "Отношение к кредитам": loan_attitude,
-                    "Отношение к риску": risk_attitude,
+                    "Доверие к банкам": mp.bank_trust_levels[c["trust"][k]],
+                    "Отношение к кредитам": mp.loan_attitudes[c["loan"][k]],
+                    "Отношение к риску": mp.risk_attitudes[c["risk"][k]],
                     "Модель финансового поведения": financial_behavior
                 },
                 "Финансовые знания": {
-                    "Словарный запас": financial_vocabulary,
-                    "Заблуждения": financial_misconceptions
+                    "Словарный запас": [kb._flat_vocabulary[t] for t in c["vocabulary"][k] if t >= 0],
+                    "Заблуждения": [kb._flat_misconceptions[t] for t in c["misconceptions"][k] if t >= 0]
                 },
-                "Финансовые цели": financial_goals,
-                "Поведенческие паттерны": behavior_patterns
+                "Финансовые цели": [kb._flat_goals[t] for t in c["goals"][k] if t >= 0],
+                "Поведенческие паттерны": kb.get_behavior_patterns(financial_behavior)
             }
         }
 
-        # Улучшаем персону дополнительными факторами
-        enhanced_persona = self.enhanced_respondent.enhance_persona(persona)
+        if self.enhance:
+            if "bias_idx" in c:
+                persona = mp.enhanced_respondent.apply_cohort_enhancement(persona, c, k)
+            else:
+                persona = mp.enhanced_respondent.enhance_persona(persona)
 
-        return enhanced_persona
+        return persona
 
-    def load_questions(self, file_data) -> List[Dict]:
-        """
-        Загрузка вопросов из Excel файла
 
-        Args:
-            file_data: Данные Excel файла с вопросами
+class AnswerStore(Sequence):
+    """
+    Колоночное хранилище ответов
 
-        Returns:
-            Список словарей с вопросами
-        """
-        try:
-            df = pd.read_excel(file_data)
-
-            # Проверка наличия обязательного столбца
-            if 'question' not in df.columns:
-                raise ValueError("В файле отсутствует обязательный столбец 'question'")
-
-            questions = []
-
-            for idx, row in df.iterrows():
-                # Определение финансовой темы вопроса
-                question_text = row['question'].lower()
-                financial_topic = "общие"  # По умолчанию
-
-                for topic, keywords in self.financial_topic_mapping.items():
-                    if any(keyword in question_text for keyword in keywords):
-                        financial_topic = topic
-                        break
-
-                question = {
-                    "id": row.get('id', idx + 1),
-                    "text": row['question'],
-                    "type": row.get('type', 'open'),
-                    "topic": row.get('topic', financial_topic),
-                    "options": str(row.get('options', '')).split(',') if pd.notna(row.get('options')) else [],
-                    "context": row.get('context', '')
-                }
-                questions.append(question)
+    Атрибуты ответов хранятся в параллельных массивах NumPy, тексты - в общем буфере UTF-8 (по смещениям),
+    а вопросы - один раз в таблице вопросов (ответ ссылается на индекс вопроса). Хранилище ведет себя как
+    список словарей ответов в прежнем формате, поддерживает быстрый поиск по респонденту и вопросу
+    и передачу данных в pandas и Arrow без копирования массивов.
+    """
 
-            return questions
-        except Exception as e:
-            raise ValueError(f"Ошибка при загрузке вопросов: {str(e)}")
+    # Числовые колонки: название -> тип
+    column_types = {
+        "id": np.int64,
+        "persona_id": np.int32,
+        "question_idx": np.int32,
+        "model": np.int16,
+        "provider": np.int8,
+        "latency": np.float32,
+        "input_tokens": np.int32,
+        "output_tokens": np.int32,
+        "length": np.int32,
+        "error": np.bool_,
+        "skipped": np.bool_,
+        "timestamp": "datetime64[us]"
+    }
 
-    def load_bank_reviews(self, file_data) -> bool:
+    # Поля словаря ответа, которые хранятся в колонках
+    known_fields = {
+        "id", "persona_id", "question", "text", "timestamp", "error", "skipped",
+        "model", "provider", "latency", "input_tokens", "output_tokens"
+    }
+
+    def __init__(self, questions: Optional[Sequence[Dict]] = None, capacity: int = 1024):
         """
-        Загрузка и анализ отзывов о банках
+        Инициализация пустого хранилища
 
         Args:
-            file_data: Данные Excel файла с отзывами
+            questions: Вопросы опроса (таблица вопросов; неизвестные вопросы добавляются по мере появления)
+            capacity: Начальный размер массивов
+        """
+        self.questions = []
+        # Индексы вопросов: по ID и (для вопросов без ID) по содержимому
+        self._question_index = {}
+        self._anonymous_questions = {}
+        self.models = []
+        self.providers = []
+        self._model_index = {}
+        self._provider_index = {}
+
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in self.column_types.items()}
+        self._offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self._buffer = bytearray()
+        self._size = 0
+        self._extras = {}
+        self._indexes = {}
+
+        for question in questions or []:
+            self._intern_question(question)
+
+    @classmethod
+    def from_answers(cls, answers: Sequence[Dict], questions: Optional[Sequence[Dict]] = None) -> "AnswerStore":
+        """
+        Построение хранилища из списка словарей ответов
+
+        Args:
+            answers: Последовательность словарей ответов (или готовое хранилище)
+            questions: Вопросы опроса
 
         Returns:
-            True если загрузка прошла успешно, иначе False
+            AnswerStore с теми же ответами
         """
-        try:
-            self.reviews_analyzer.load_reviews(file_data)
+        if isinstance(answers, AnswerStore):
+            return answers
 
-            # Извлекаем данные для улучшения промптов
-            self.prompting_params["prompt_data"] = self.reviews_analyzer.extract_prompting_data()
-            self.prompting_params["use_reviews_data"] = True
+        store = cls(questions, capacity=max(1, len(answers)))
+        store.extend(answers)
+        return store
 
-            st.success(f"Загружено и проанализировано {len(self.reviews_analyzer.reviews_data)} отзывов о банках")
-            return True
-        except Exception as e:
-            st.error(f"Ошибка при загрузке отзывов о банках: {str(e)}")
-            return False
+    def _intern_question(self, question: Dict) -> int:
+        """
+        Индекс вопроса в таблице вопросов (вопрос добавляется при первом появлении)
 
-    def _format_persona_for_prompt(self, persona: Dict) -> str:
+        Вопросы с ID различаются по ID, вопросы без ID - по содержимому.
+
+        Raises:
+            ValueError: Если под одним ID встречаются вопросы с разным текстом
         """
-        Форматирование персоны для использования в промпте
+        question_id = question.get("id")
+        if question_id is None:
+            key = json.dumps(question, ensure_ascii=False, sort_keys=True, cls=NumpyEncoder)
+            index = self._anonymous_questions
+        else:
+            key, index = question_id, self._question_index
+
+        if key not in index:
+            index[key] = len(self.questions)
+            self.questions.append(question)
+        elif question_id is not None and self.questions[index[key]].get("text") != question.get("text"):
+            raise ValueError(f"Разные вопросы с одинаковым ID {question_id}: "
+                             f"'{self.questions[index[key]].get('text')}' и '{question.get('text')}'")
+        return index[key]
+
+    @staticmethod
+    def _intern(value: str, values: List[str], index: Dict[str, int]) -> int:
+        """Словарное кодирование строки"""
+        if value not in index:
+            index[value] = len(values)
+            values.append(value)
+        return index[value]
+
+    def _reserve(self, size: int) -> None:
+        """Увеличение емкости массивов (удвоением)"""
+        capacity = len(self.columns["id"])
+        if size <= capacity:
+            return
+
+        capacity = max(size, capacity * 2)
+        for name, column in self.columns.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self.columns[name] = grown
+
+        offsets = np.zeros(capacity + 1, dtype=np.int64)
+        offsets[:self._size + 1] = self._offsets[:self._size + 1]
+        self._offsets = offsets
+
+    def append(self, answer: Dict) -> None:
+        """
+        Добавление ответа
 
         Args:
-            persona: Словарь с данными персоны
+            answer: Словарь ответа (формат generate_prompt_answer)
+        """
+        self._reserve(self._size + 1)
+        k = self._size
+        c = self.columns
+
+        text = answer.get("text", "")
+        encoded = text.encode("utf-8")
+        try:
+            self._buffer.extend(encoded)
+        except BufferError:
+            # Буфер экспортирован в Arrow без копирования - продолжаем запись в его копию
+            self._buffer = bytearray(self._buffer)
+            self._buffer.extend(encoded)
+
+        c["id"][k] = answer.get("id", k + 1)
+        c["persona_id"][k] = answer.get("persona_id", 0)
+        c["question_idx"][k] = self._intern_question(answer.get("question", {}))
+        c["model"][k] = self._intern(answer.get("model") or "", self.models, self._model_index)
+        c["provider"][k] = self._intern(answer.get("provider") or "", self.providers, self._provider_index)
+        c["latency"][k] = answer.get("latency", 0.0)
+        c["input_tokens"][k] = answer.get("input_tokens", 0)
+        c["output_tokens"][k] = answer.get("output_tokens", 0)
+        c["length"][k] = len(text)
+        c["error"][k] = bool(answer.get("error", False))
+        c["skipped"][k] = bool(answer.get("skipped", False))
+        c["timestamp"][k] = np.datetime64(answer["timestamp"], "us") if answer.get("timestamp") else np.datetime64("NaT")
+        self._offsets[k + 1] = len(self._buffer)
+
+        extras = {key: value for key, value in answer.items() if key not in self.known_fields}
+        if extras:
+            self._extras[k] = extras
+
+        self._size += 1
+        self._indexes = {}
+
+    def extend(self, answers: Sequence[Dict]) -> None:
+        """Добавление нескольких ответов"""
+        for answer in answers:
+            self.append(answer)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[k] for k in range(*index.indices(self._size))]
+
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("Индекс ответа вне диапазона хранилища")
+
+        c = self.columns
+        answer = {
+            "id": int(c["id"][index]),
+            "persona_id": int(c["persona_id"][index]),
+            "question": self.questions[c["question_idx"][index]],
+            "text": self.text(index),
+            "timestamp": self.timestamp(index)
+        }
+        if c["error"][index]:
+            answer["error"] = True
+        if c["skipped"][index]:
+            answer["skipped"] = True
+        if self.models[c["model"][index]]:
+            answer["model"] = self.models[c["model"][index]]
+        if self.providers[c["provider"][index]]:
+            answer["provider"] = self.providers[c["provider"][index]]
+            answer["latency"] = float(c["latency"][index])
+            answer["input_tokens"] = int(c["input_tokens"][index])
+            answer["output_tokens"] = int(c["output_tokens"][index])
+        answer.update(self._extras.get(index, {}))
+
+        return answer
+
+    def text(self, k: int) -> str:
+        """Текст ответа k"""
+        return self._buffer[self._offsets[k]:self._offsets[k + 1]].decode("utf-8")
+
+    def timestamp(self, k: int) -> str:
+        """Время ответа k в формате ISO (пустая строка, если не задано)"""
+        value = self.columns["timestamp"][k]
+        return value.astype(datetime).isoformat() if not np.isnat(value) else ""
+
+    def column(self, name: str) -> np.ndarray:
+        """Представление колонки без копирования (только заполненная часть)"""
+        return self.columns[name][:self._size]
+
+    def _index(self, name: str, keys: Callable[[], np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """Отсортированный индекс по ключам (строится лениво и сбрасывается при добавлении ответов)"""
+        if name not in self._indexes:
+            keys = keys()
+            order = np.argsort(keys, kind="stable")
+            self._indexes[name] = (order, keys[order])
+        return self._indexes[name]
+
+    def rows_for_persona(self, persona_id: int) -> np.ndarray:
+        """Индексы ответов респондента (в порядке хранения)"""
+        order, keys = self._index("persona", lambda: self.column("persona_id"))
+        return order[np.searchsorted(keys, persona_id, "left"):np.searchsorted(keys, persona_id, "right")]
+
+    def rows_for_question(self, question_id) -> np.ndarray:
+        """Индексы ответов на вопрос (в порядке хранения)"""
+        if question_id not in self._question_index:
+            return np.zeros(0, dtype=np.intp)
+        question_idx = self._question_index[question_id]
+        order, keys = self._index("question", lambda: self.column("question_idx"))
+        return order[np.searchsorted(keys, question_idx, "left"):np.searchsorted(keys, question_idx, "right")]
+
+    def find(self, persona_id: int, question_id) -> Optional[int]:
+        """
+        Индекс ответа респондента на вопрос
+
+        Args:
+            persona_id: ID респондента (с 1)
+            question_id: ID вопроса
 
         Returns:
-            Строка с отформатированной информацией о персоне
+            Индекс первого такого ответа или None
         """
-        # Базовая демографическая информация
-        basic_info = [
-            f"Пол: {persona['Пол']}",
-            f"Возраст: {persona['Возраст']}",
-            f"Город: {persona['Город']} ({persona['Регион']})",
-            f"Профессия: {persona['Профессия']}",
-            f"Образование: {persona['Образование']}",
-            f"Семейное положение: {persona['Семейное положение']}",
-            f"Количество детей: {persona['Количество детей']}",
-            f"Доход: {persona['Доход']}"
-        ]
+        if question_id not in self._question_index:
+            return None
+        width = max(1, len(self.questions))
+        key = np.int64(persona_id) * width + self._question_index[question_id]
+        order, sorted_keys = self._index(
+            f"pair_{width}", lambda: self.column("persona_id").astype(np.int64) * width + self.column("question_idx")
+        )
+        pos = np.searchsorted(sorted_keys, key)
+        if pos < len(sorted_keys) and sorted_keys[pos] == key:
+            return int(order[pos])
+        return None
+
+    def sort_by_id(self) -> None:
+        """Упорядочивание ответов по ID (буфер текстов перестраивается в новом порядке)"""
+        order = np.argsort(self.column("id"), kind="stable")
+        if np.array_equal(order, np.arange(self._size)):
+            return
 
-        if 'Увлечения' in persona and persona['Увлечения']:
-            basic_info.append(f"Увлечения: {', '.join(persona['Увлечения'])}")
+        starts, ends = self._offsets[:self._size][order], self._offsets[1:self._size + 1][order]
+        self._buffer = bytearray().join(bytes(self._buffer[a:b]) for a, b in zip(starts, ends))
+        self._offsets[1:self._size + 1] = np.cumsum(ends - starts)
 
-        # Финансовый профиль
-        financial_profile = []
-        if 'Финансовый профиль' in persona:
-            fp = persona['Финансовый профиль']
+        for name, column in self.columns.items():
+            column[:self._size] = column[:self._size][order]
 
-            financial_profile.append(f"Уровень финансовой грамотности: {fp.get('Уровень финансовой грамотности', 'средний')}")
+        position = np.empty(self._size, dtype=np.intp)
+        position[order] = np.arange(self._size)
+        self._extras = {int(position[k]): extras for k, extras in self._extras.items()}
+        self._indexes = {}
 
-            # Используемые продукты
-            products_used = []
-            for product, used in fp.get('Используемые продукты', {}).items():
-                if used:
-                    products_used.append(product)
+    def to_pandas(self) -> pd.DataFrame:
+        """
+        Таблица ответов для аналитики (числовые колонки передаются без копирования)
 
-            if products_used:
-                financial_profile.append(f"Используемые финансовые продукты: {', '.join(products_used)}")
-            else:
-                financial_profile.append("Не использует банковские продукты")
+        Returns:
+            pandas DataFrame с одной строкой на ответ
+        """
+        question_ids = np.array([q.get("id") for q in self.questions], dtype=object)
+        data = {
+            "id": self.column("id"),
+            "persona_id": self.column("persona_id"),
+            "question_id": question_ids[self.column("question_idx")] if self.questions else np.zeros(0, dtype=object),
+            "text": [self.text(k) for k in range(self._size)],
+            "model": pd.Categorical.from_codes(self.column("model"), self.models or [""]),
+            "provider": pd.Categorical.from_codes(self.column("provider"), self.providers or [""]),
+            "latency": self.column("latency"),
+            "input_tokens": self.column("input_tokens"),
+            "output_tokens": self.column("output_tokens"),
+            "length": self.column("length"),
+            "error": self.column("error"),
+            "skipped": self.column("skipped"),
+            "timestamp": self.column("timestamp")
+        }
+        return pd.DataFrame(data, copy=False)
 
-            # Отношение к финансам
-            if 'Отношение к финансам' in fp:
-                for key, value in fp['Отношение к финансам'].items():
-                    financial_profile.append(f"{key}: {value}")
+    def to_arrow(self):
+        """
+        Таблица Apache Arrow с ответами (тексты и числовые колонки передаются без копирования)
 
-            # Финансовые цели
-            if 'Финансовые цели' in fp and fp['Финансовые цели']:
-                financial_profile.append(f"Финансовые цели: {', '.join(fp['Финансовые цели'])}")
+        Returns:
+            pyarrow.Table
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ValueError("Для экспорта в Arrow необходим пакет pyarrow")
 
-        # Собираем все вместе
-        formatted_persona = "БАЗОВАЯ ИНФОРМАЦИЯ:\n" + "\n".join(basic_info)
-        formatted_persona += "\n\nФИНАНСОВЫЙ ПРОФИЛЬ:\n" + "\n".join(financial_profile)
+        text = pa.LargeStringArray.from_buffers(
+            self._size, pa.py_buffer(self._offsets[:self._size + 1]), pa.py_buffer(self._buffer)
+        )
+        question_ids = pa.array([str(q.get("id")) for q in self.questions], type=pa.string())
+
+        return pa.table({
+            "id": self.column("id"),
+            "persona_id": self.column("persona_id"),
+            "question_id": pa.DictionaryArray.from_arrays(pa.array(self.column("question_idx")), question_ids),
+            "text": text,
+            "model": pa.DictionaryArray.from_arrays(pa.array(self.column("model")), pa.array(self.models or [""])),
+            "provider": pa.DictionaryArray.from_arrays(pa.array(self.column("provider")), pa.array(self.providers or [""])),
+            "latency": self.column("latency"),
+            "input_tokens": self.column("input_tokens"),
+            "output_tokens": self.column("output_tokens"),
+            "length": self.column("length"),
+            "error": self.column("error"),
+            "skipped": self.column("skipped"),
+            "timestamp": self.column("timestamp")
+        })
 
-        # Добавляем поведенческие паттерны, если есть
-        if 'Финансовый профиль' in persona and 'Поведенческие паттерны' in persona['Финансовый профиль']:
-            patterns = persona['Финансовый профиль']['Поведенческие паттерны']
-            if patterns:
-                formatted_persona += "\n\nПОВЕДЕНЧЕСКИЕ ПАТТЕРНЫ:\n" + "\n".join([f"- {p}" for p in patterns])
 
-        # Добавляем заблуждения, если необходимо
-        if ('Финансовый профиль' in persona and 'Финансовые знания' in persona['Финансовый профиль'] and
-            'Заблуждения' in persona['Финансовый профиль']['Финансовые знания']):
+class FakeLLMClient:
+    """Локальная имитация клиента Anthropic для тестирования без обращения к API"""
 
-            misconceptions = persona['Финансовый профиль']['Финансовые знания']['Заблуждения']
-            if misconceptions:
-                formatted_persona += "\n\nВОЗМОЖНЫЕ ФИНАНСОВЫЕ ЗАБЛУЖДЕНИЯ:\n" + "\n".join([f"- {m}" for m in misconceptions])
+    def __init__(self, latency: float = 0.0):
+        """
+        Инициализация фейкового клиента
 
-        return formatted_persona
+        Args:
+            latency: Искусственная задержка ответа в секундах (для имитации сетевого ввода-вывода)
+        """
+        self.latency = latency
+        self.messages = SimpleNamespace(create=self._create_message, stream=self._stream_message)
 
-    def _generate_enhanced_prompt(self, persona: Dict, question: Dict) -> str:
+    def _create_message(self, model: str, max_tokens: int, temperature: float, messages: List[Dict], **kwargs):
         """
-        Генерация базового промпта с учетом финансовой грамотности
+        Формирование детерминированного ответа в формате Anthropic Messages API
 
         Args:
-            persona: Словарь с данными персоны
-            question: Словарь с вопросом
+            model: Название модели
+            max_tokens: Максимальное количество токенов ответа
+            temperature: Температура генерации
+            messages: Список сообщений
 
         Returns:
-            Строка с подготовленным промптом
+            Объект, совместимый с ответом anthropic.Anthropic().messages.create
         """
-        # Форматируем данные о персоне
-        persona_str = self._format_persona_for_prompt(persona)
-
-        # Получаем уровень финансовой грамотности
-        literacy_level = persona.get('Финансовый профиль', {}).get('Уровень финансовой грамотности', 'средний')
+        if self.latency:
+            time.sleep(self.latency)
+        return self._build_message(model, max_tokens, messages)
 
-        # Получаем параметры для уровня грамотности
-        literacy_info = self.knowledge_base.get_literacy_level_info(literacy_level)
+    def _stream_message(self, model: str, max_tokens: int, temperature: float, messages: List[Dict], **kwargs):
+        """
+        Потоковый вариант _create_message: задержка распределяется между фрагментами текста
 
-        # Словарный запас для уровня
-        vocab_examples = persona.get('Финансовый профиль', {}).get('Финансовые знания', {}).get('Словарный запас', [])
+        Returns:
+            Контекст, совместимый с anthropic.Anthropic().messages.stream
+        """
+        return FakeMessageStream(self._build_message(model, max_tokens, messages), self.latency)
+
+    @staticmethod
+    def _build_message(model: str, max_tokens: int, messages: List[Dict]):
+        """Детерминированный ответ по тексту промпта (без задержки)"""
+        prompt = messages[-1]["content"] if messages else ""
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+        # Длина ответа зависит от промпта, чтобы распределение длин было правдоподобным
+        num_sentences = 1 + int(digest[:2], 16) % 5
+        phrases = [
+            "Честно говоря, я об этом особо не задумывался.",
+            "Мне кажется, всё зависит от условий банка.",
+            "Обычно я пользуюсь картой и стараюсь не брать кредиты.",
+            "Знакомые советовали сравнивать предложения разных банков.",
+            "Если проценты нормальные, то почему бы и нет.",
+            "Я бы сначала почитал отзывы в интернете."
+        ]
+        sentences = [phrases[int(digest[i * 2:i * 2 + 2], 16) % len(phrases)] for i in range(num_sentences)]
+        text = " ".join(sentences)
 
-        # Определяем тему вопроса
-        question_topic = question.get('topic', 'общие')
-        if question_topic not in self.financial_topic_mapping:
-            question_topic = "общие"
+        usage = SimpleNamespace(
+            input_tokens=max(1, len(prompt) // 4),
+            output_tokens=min(max_tokens, max(1, len(text) // 4))
+        )
+        return SimpleNamespace(content=[SimpleNamespace(text=text)], usage=usage, model=model)
 
-        # Добавляем контекстную информацию из отзывов о банках, если доступно
-        context_from_reviews = ""
-        if self.prompting_params["use_reviews_data"]:
-            prompt_data = self.prompting_params["prompt_data"]
 
-            relevant_terms = []
-            if question_topic in prompt_data.get("categorized_terms", {}):
-                relevant_terms = prompt_data["categorized_terms"][question_topic][:5]
-            else:
-                relevant_terms = prompt_data.get("banking_terms", [])[:5]
+class FakeMessageStream:
+    """Потоковый ответ FakeLLMClient (контекстный менеджер с text_stream и get_final_message)"""
 
-            # Добавляем релевантные проблемы из отзывов
-            relevant_issues = prompt_data.get("common_issues", [])[:3]
+    def __init__(self, message, latency: float = 0.0):
+        self._message = message
+        self._latency = latency
 
-            if relevant_terms or relevant_issues:
-                context_from_reviews = "\nКОНТЕКСТ ИЗ ОТЗЫВОВ КЛИЕНТОВ БАНКОВ:\n"
+    def __enter__(self):
+        return self
 
-                if relevant_terms:
-                    context_from_reviews += f"Часто упоминаемые термины: {', '.join(relevant_terms)}\n"
+    def __exit__(self, *exc_info):
+        return False
 
-                if relevant_issues:
-                    context_from_reviews += f"Типичные проблемы: {'; '.join(relevant_issues)}\n"
+    @property
+    def text_stream(self):
+        """Текст ответа по словам"""
+        words = self._message.content[0].text.split(" ")
+        for k, word in enumerate(words):
+            if self._latency:
+                time.sleep(self._latency / len(words))
+            yield word if k == 0 else " " + word
 
-        # Вероятность точного ответа на основе уровня грамотности
-        accuracy_level = literacy_info.get("accuracy", 0.7)
-        confidence_level = literacy_info.get("confidence", 0.7)
-        detail_level = literacy_info.get("detail_level", 0.5)
+    def get_final_message(self):
+        return self._message
 
-        # Составляем инструкции для разных уровней финансовой грамотности
-        literacy_instructions = ""
 
-        if literacy_level == "отсутствие знаний":
-            literacy_instructions = """
-            - Используй простой, бытовой язык без финансовых терминов
-            - Можешь путать финансовые понятия и термины
-            - Можешь демонстрировать финансовые заблуждения, указанные в профиле
-            - Признавай незнание многих финансовых тем
-            - Говори неуверенно, используй фразы типа "мне кажется", "насколько я знаю"
-            - Можешь полагаться на слухи и мнения знакомых вместо фактов
-            - Не вдавайся в детали финансовых продуктов
-            """
-        elif literacy_level == "начинающий":
-            literacy_instructions = """
-            - Используй простые финансовые термины, но можешь иногда их путать
-            - Можешь иметь некоторые заблуждения о финансовых продуктах
-            - Показывай базовое понимание дебетовых карт и вкладов
-            - Можешь выражать неуверенность в сложных финансовых вопросах
-            - Проявляй осторожность к новым финансовым инструментам
-            - Опирайся больше на личный опыт, чем на знания
-            - Интересуйся деталями, но не все понимай
-            """
-        elif literacy_level == "средний":
-            literacy_instructions = """
-            - Демонстрируй нормальное понимание распространенных финансовых продуктов
-            - Можешь использовать базовую финансовую терминологию
-            - Имеешь представление о кредитах, вкладах, дебетовых и кредитных картах
-            - Проявляй разумную осторожность в финансовых решениях
-            - Можешь задавать уточняющие вопросы по сложным продуктам
-            - Говори с умеренной уверенностью в рамках своих знаний
-            - Можешь делиться практическим опытом использования финансовых продуктов
-            """
-        elif literacy_level == "продвинутый":
-            literacy_instructions = """
-            - Используй грамотную финансовую терминологию
-            - Демонстрируй хорошее понимание различных финансовых продуктов
-            - Можешь сравнивать разные продукты и их характеристики
-            - Говори уверенно в рамках своих знаний
-            - Учитывай нюансы финансовых решений
-            - Рассматривай долгосрочные последствия финансовых решений
-            - Можешь упоминать различные банки и их продукты
-            """
-        elif literacy_level == "эксперт":
-            literacy_instructions = """
-            - Используй профессиональную финансовую терминологию
-            - Демонстрируй глубокое понимание финансовых продуктов и рынков
-            - Можешь давать детальный анализ условий и последствий
-            - Учитывай тонкости и исключения в правилах
-            - Говори уверенно и авторитетно
-            - Можешь упоминать законодательство в финансовой сфере
-            - Рассматривай комплексный подход к финансовым решениям
-            """
-
-        # Формируем основной промпт
-        base_prompt = f"""Ты симулируешь обычного человека, отвечающего на вопрос о финансах или банковских услугах. Тебе нужно ответить максимально реалистично, с учетом своих характеристик и уровня финансовой грамотности.
-
-ХАРАКТЕРИСТИКИ РЕСПОНДЕНТА:
-{persona_str}
-{context_from_reviews}
-
-ВОПРОС:
-{question["text"]}
-
-ИНСТРУКЦИИ ПО ОТВЕТУ В СООТВЕТСТВИИ С ФИНАНСОВОЙ ГРАМОТНОСТЬЮ:
-{literacy_instructions}
-
-ОБЩИЕ ПРАВИЛА ОТВЕТА:
-1. Отвечай от первого лица, как будто ты действительно этот человек
-2. Учитывай все демографические характеристики и уровень финансовой грамотности
-3. Используй стиль речи и словарный запас, соответствующие твоему образованию и уровню знаний
-4. Будь максимально реалистичным в ответе
-5. Не старайся отвечать как эксперт, даже если твой уровень грамотности "эксперт" - отвечай как обычный человек с хорошими знаниями
-6. Твоя точность информации должна соответствовать твоему уровню знаний (точность ~{int(accuracy_level*100)}%)
-7. Твоя уверенность в ответе должна соответствовать твоему профилю (уверенность ~{int(confidence_level*100)}%)
-8. Уровень детализации ответа должен соответствовать твоему уровню знаний (детализация ~{int(detail_level*100)}%)
-9. Используй свой жизненный опыт и финансовые паттерны поведения в ответе
-"""
+# Параметры HTTP-пула общих клиентов API (один пул на провайдера и ключ, а не на маркетплейс)
+API_CLIENT_SETTINGS = {
+    "max_connections": 64,            # Верхняя граница одновременных соединений клиента
+    "max_keepalive_connections": 32,  # Сколько соединений держать открытыми между запросами
+    "keepalive_expiry": 120.0,        # Время жизни простаивающего соединения, с
+    "connect_timeout": 10.0,
+    "read_timeout": 600.0,
+    "http2": False,                   # HTTP/2 требует пакет h2
+    "prewarm": True                   # Открывать соединение в фоне сразу после создания клиента
+}
 
-        # Добавляем примеры словарного запаса для подсказки
-        if vocab_examples:
-            base_prompt += f"\nПРИМЕРЫ ФИНАНСОВЫХ ТЕРМИНОВ, КОТОРЫЕ ТЫ МОЖЕШЬ ИСПОЛЬЗОВАТЬ:\n{', '.join(vocab_examples)}\n"
+# Адреса API по умолчанию (переопределяются переменными окружения SDK)
+API_DEFAULT_BASE_URLS = {
+    "claude": ("ANTHROPIC_BASE_URL", "https://api.anthropic.com"),
+    "openai": ("OPENAI_BASE_URL", "https://api.openai.com/v1")
+}
 
-        # Добавляем подсказку для эмоционального окраса ответа
-        behavior = persona.get('Финансовый профиль', {}).get('Отношение к финансам', {}).get('Модель финансового поведения', 'прагматичный')
 
-        if behavior == "избегающий риска":
-            base_prompt += "\nВ своем ответе проявляй осторожность и консервативный подход к финансовым вопросам."
-        elif behavior == "импульсивный":
-            base_prompt += "\nВ своем ответе можешь проявлять спонтанность и эмоциональность в отношении финансовых решений."
-        elif behavior == "статусный":
-            base_prompt += "\nВ своем ответе можешь упоминать престижные или премиальные аспекты банковского обслуживания."
+class ApiClientRegistry:
+    """
+    Общий для процесса реестр клиентов Anthropic/OpenAI
 
-        base_prompt += "\n\nОТВЕТ ОТ ЛИЦА РЕСПОНДЕНТА:"
+    Клиенты создаются один раз на ключ (провайдер, хэш API ключа, базовый адрес) и используются
+    всеми маркетплейсами, сессиями и заданиями процесса, поэтому соединения с API остаются
+    открытыми между запусками и не требуют повторного TLS-рукопожатия.
+    """
 
-        return base_prompt
+    def __init__(self, settings: Optional[Dict] = None):
+        """
+        Инициализация реестра
 
-    def generate_answer(self, persona: Dict, question: Dict,
-                        model: str = None, api_preference: str = None,
-                        temperature: Optional[float] = None,
-                        _enhanced_prompt: Optional[str] = None) -> str:
+        Args:
+            settings: Параметры HTTP-пула (по умолчанию - API_CLIENT_SETTINGS)
         """
-        Генерация ответа через выбранное API
+        self.settings = dict(API_CLIENT_SETTINGS)
+        self.settings.update(settings or {})
+        self._clients = {}
+        self._http_pools = {}
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    @staticmethod
+    def client_key(provider: str, api_key: str, base_url: Optional[str] = None) -> Tuple[str, str, str]:
+        """
+        Ключ клиента в реестре (сам API ключ в реестре не хранится)
 
         Args:
-            persona: Словарь с данными персоны
-            question: Словарь с вопросом
-            model: Конкретная модель для использования (опционально)
-            api_preference: Предпочтительное API ('claude' или 'openai')
-            temperature: Температура для генерации (опционально)
-            _enhanced_prompt: Готовый промпт (для внутреннего использования)
+            provider: Провайдер ('claude' или 'openai')
+            api_key: API ключ
+            base_url: Базовый адрес API (по умолчанию - из окружения или адрес провайдера)
 
         Returns:
-            Сгенерированный ответ
+            Кортеж (провайдер, хэш ключа, базовый адрес)
+        """
+        if provider not in API_DEFAULT_BASE_URLS:
+            raise ValueError(f"Неизвестный провайдер API: {provider}")
+        env_var, default_url = API_DEFAULT_BASE_URLS[provider]
+        base_url = (base_url or os.environ.get(env_var) or default_url).rstrip("/")
+        key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+        return provider, key_hash, base_url
+
+    def get(self, provider: str, api_key: str, base_url: Optional[str] = None):
         """
-        # Создаем уникальный ключ для кэша ответов
-        cache_key = f"{json.dumps(persona, sort_keys=True)}_{json.dumps(question, sort_keys=True)}_{model}_{api_preference}_{temperature}"
+        Получение общего клиента API (создается при первом обращении)
 
-        # Возвращаем кэшированный ответ, если доступен
-        if cache_key in self.response_cache:
-            return self.response_cache[cache_key]
+        Args:
+            provider: Провайдер ('claude' или 'openai')
+            api_key: API ключ
+            base_url: Базовый адрес API (опционально)
 
-        # Используем предоставленный промпт или генерируем новый
-        if _enhanced_prompt:
-            prompt = _enhanced_prompt
+        Returns:
+            Клиент anthropic.Anthropic или openai.OpenAI
+        """
+        key = self.client_key(provider, api_key, base_url)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._stats["reused"] += 1
+                return client
+
+            client, http_pool = self._create_client(provider, api_key, key[2])
+            self._clients[key] = client
+            self._http_pools[key] = http_pool
+            self._stats["created"] += 1
+
+        if self.settings["prewarm"]:
+            threading.Thread(
+                target=self._prewarm, args=(client, http_pool, key[2]), name=f"prewarm-{provider}", daemon=True
+            ).start()
+        return client
+
+    def _create_client(self, provider: str, api_key: str, base_url: str) -> Tuple[Any, Any]:
+        """Создание клиента SDK с собственным настроенным HTTP-пулом (возвращает клиент и пул)"""
+        import httpx
+
+        settings = self.settings
+        http2 = settings["http2"]
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("Пакет h2 не установлен, клиенты API используют HTTP/1.1")
+            http2 = False
+
+        # DefaultHttpxClient сохраняет настройки транспорта SDK, меняем только пул и таймауты
+        sdk = anthropic if provider == "claude" else openai
+        http_client = sdk.DefaultHttpxClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings["max_connections"],
+                max_keepalive_connections=settings["max_keepalive_connections"],
+                keepalive_expiry=settings["keepalive_expiry"]
+            ),
+            timeout=httpx.Timeout(settings["read_timeout"], connect=settings["connect_timeout"])
+        )
+
+        if provider == "claude":
+            client = sdk.Anthropic(api_key=api_key, base_url=base_url, http_client=http_client)
         else:
-            # Используем расширенную генерацию промпта через EnhancedFinancialRespondent
-            prompt = self.enhanced_respondent.generate_enhanced_prompt(persona, question)
+            client = sdk.OpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+        return client, http_client
 
-        # Определяем уровень финансовой грамотности для настройки температуры
-        literacy_level = persona.get('Финансовый профиль', {}).get('Уровень финансовой грамотности', 'средний')
+    def _prewarm(self, client, http_client, base_url: str) -> None:
+        """Открытие соединения с API заранее (DNS, TCP и TLS), чтобы первый запрос не ждал рукопожатия"""
+        try:
+            # Ответ не важен: соединение после запроса возвращается в пул и остается открытым. Запрос
+            # отправляется с заголовками SDK (включая авторизацию), как и обычные запросы клиента
+            headers = {**client.default_headers, **client.auth_headers}
+            http_client.head(base_url, headers={name: value for name, value in headers.items() if isinstance(value, str)},
+                             timeout=self.settings["connect_timeout"])
+            with self._lock:
+                self._stats["prewarmed"] += 1
+        except Exception as e:
+            logger.warning(f"Не удалось заранее открыть соединение с {base_url}: {e}")
 
-        # Устанавливаем температуру на основе уровня грамотности, если не указана явно
-        if temperature is None:
-            literacy_levels = ["отсутствие знаний", "начинающий", "средний", "продвинутый", "эксперт"]
-            literacy_index = literacy_levels.index(literacy_level) if literacy_level in literacy_levels else 2
+    def configure(self, **settings) -> None:
+        """
+        Изменение параметров HTTP-пула (применяется к клиентам, созданным после вызова)
 
-            # Более низкая температура для экспертов (более структурированные ответы)
-            # Более высокая для низкой грамотности (более случайные ответы)
-            temperature = self.prompting_params["temperature_max"] - (literacy_index * 0.1)
+        Args:
+            **settings: Параметры из API_CLIENT_SETTINGS
+        """
+        unknown = set(settings) - set(API_CLIENT_SETTINGS)
+        if unknown:
+            raise ValueError(f"Неизвестные параметры клиентов API: {', '.join(sorted(unknown))}")
+        with self._lock:
+            self.settings.update(settings)
 
-            # Добавляем немного случайности
-            temperature = min(1.0, max(0.1, temperature + random.uniform(-0.1, 0.1)))
+    def stats(self) -> Dict:
+        """
+        Статистика реестра
 
-        # Ограничиваем температуру диапазоном 0.0-1.0 для совместимости с API
-        temperature = min(1.0, max(0.0, temperature))
+        Returns:
+            Словарь с количеством клиентов и повторных использований
+        """
+        with self._lock:
+            return {"clients": len(self._clients), **self._stats}
+
+    def close(self) -> None:
+        """Закрытие всех клиентов и их соединений"""
+        with self._lock:
+            http_pools = list(self._http_pools.values())
+            self._clients.clear()
+            self._http_pools.clear()
+        for http_pool in http_pools:
+            try:
+                http_pool.close()
+            except Exception:
+                pass
 
-        # Определяем, какое API использовать
-        use_claude = True  # По умолчанию используем Claude, если доступен
 
-        if api_preference == "openai" and self.client_openai:
-            use_claude = False
-        elif api_preference == "claude" and self.client_claude:
-            use_claude = True
-        elif self.client_claude is None and self.client_openai:
-            use_claude = False
+# Общий реестр клиентов API процесса
+API_CLIENTS = ApiClientRegistry()
 
-        max_retries = 3
-        result = None
 
-        for retry in range(max_retries):
-            try:
-                if use_claude:
-                    # Используем Claude API
-                    # Определяем модель Claude
-                    claude_model = model if model in self.claude_models else self.claude_models[0]
+def _streamlit_api_clients() -> ApiClientRegistry:
+    """Реестр клиентов для интерфейса (Streamlit кэширует его между перезапусками скрипта)"""
+    return ApiClientRegistry()
 
-                    response = self.client_claude.messages.create(
-                        model=claude_model,
-                        max_tokens=self.prompting_params["max_tokens"],
-                        temperature=temperature,
-                        messages=[{"role": "user", "content": prompt}]
-                    )
 
-                    result = response.content[0].text
+# Маппинг типов вопросов на аспекты финансов (ключевые слова - начала слов в нижнем регистре)
+FINANCIAL_TOPIC_MAPPING = freeze_catalog({
+    "кредиты": ["кредит", "займ", "ипотек", "потребит", "рассрочк"],
+    "карты": ["карт", "дебет", "кэшбэк", "кешбэк", "бонус", "лимит"],
+    "вклады": ["вклад", "депозит", "накопи", "процент", "сбережени"],
+    "инвестиции": ["инвест", "акци", "облигаци", "брокер", "фонд", "пиф", "бирж"],
+    "общие": ["банк", "финанс", "деньг", "платеж", "перевод", "комисси"],
+    "онлайн-сервисы": ["приложени", "сайт", "онлайн", "личный кабинет", "мобильн"]
+})
 
-                    # Обновляем счетчик токенов
-                    if hasattr(response, 'usage') and response.usage:
-                        self.tokens_used["claude"] += response.usage.input_tokens + response.usage.output_tokens
-                else:
-                    # Используем OpenAI API
-                    # Определяем модель OpenAI
-                    openai_model = model if model in self.openai_models else self.openai_models[0]
 
-                    response = self.client_openai.chat.completions.create(
-                        model=openai_model,
-                        max_tokens=self.prompting_params["max_tokens"],
-                        temperature=temperature,
-                        messages=[{"role": "user", "content": prompt}]
-                    )
+# Однопроходный поиск ключевых слов тем: опережающая проверка находит совпадения во всех позициях,
+# длинные ключевые слова проверяются раньше коротких
+TOPIC_KEYWORD_RANK = MappingProxyType({
+    keyword: rank for rank, keywords in reversed(list(enumerate(FINANCIAL_TOPIC_MAPPING.values())))
+    for keyword in keywords
+})
+TOPIC_NAMES = tuple(FINANCIAL_TOPIC_MAPPING)
+TOPIC_KEYWORD_RE = re.compile(
+    "(?=(" + "|".join(re.escape(k) for k in sorted(TOPIC_KEYWORD_RANK, key=len, reverse=True)) + "))"
+)
 
-                    result = response.choices[0].message.content
 
-                    # Обновляем счетчик токенов
-                    if hasattr(response, 'usage') and response.usage:
-                        self.tokens_used["openai"] += response.usage.prompt_tokens + response.usage.completion_tokens
+def classify_question_topic(question_text: str) -> str:
+    """
+    Определение финансовой темы вопроса по ключевым словам
 
-                # Кэшируем ответ
-                self.response_cache[cache_key] = result
+    Args:
+        question_text: Текст вопроса
 
-                return result
+    Returns:
+        Название темы из FINANCIAL_TOPIC_MAPPING (первая по порядку тема, ключевое слово которой встречается в тексте)
+    """
+    ranks = [TOPIC_KEYWORD_RANK[match.group(1)] for match in TOPIC_KEYWORD_RE.finditer(str(question_text).lower())]
+    return TOPIC_NAMES[min(ranks)] if ranks else "общие"
 
-            except Exception as e:
-                if retry < max_retries - 1:
-                    # Экспоненциальная задержка перед повторной попыткой
-                    wait_time = 2 ** retry
-                    st.warning(f"Повторная попытка через {wait_time} секунд...")
-                    time.sleep(wait_time)
 
-                    # Если ошибка связана с API Claude, попробуем OpenAI, и наоборот
-                    if use_claude and self.client_openai:
-                        use_claude = False
-                        st.warning(f"Ошибка с Claude API, переключаемся на OpenAI: {str(e)}")
-                    elif not use_claude and self.client_claude:
-                        use_claude = True
-                        st.warning(f"Ошибка с OpenAI API, переключаемся на Claude: {str(e)}")
-                else:
-                    error_msg = f"""
-                    Невозможно сгенерировать ответ после {max_retries} попыток.
-                    Технические детали: {str(e)}
+# Поддерживаемые форматы файла вопросов (по расширению)
+QUESTION_FILE_FORMATS = {
+    ".xlsx": "xlsx", ".xlsm": "xlsx", ".xls": "xls",
+    ".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".parquet": "parquet"
+}
 
-                    Возможные причины:
-                    1. Неверный API-ключ
-                    2. Проблемы с подключением
-                    3. Временные ограничения сервиса
+# Столбцы файла вопросов ('question' обязателен, 'text' - его синоним)
+QUESTION_COLUMNS = ("id", "question", "text", "type", "topic", "options", "context")
 
-                    Пожалуйста, проверьте:
-                    - Корректность API-ключа
-                    - Наличие доступа к сервису
-                    - Текущий статус сервиса API
-                    """
-                    return error_msg
+# Количество таблиц вопросов, хранимых в кэше процесса
+QUESTION_CACHE_SIZE = 16
 
-        return "Не удалось сгенерировать ответ после нескольких попыток."
 
-    def generate_realistic_answer(self, persona_id: str, persona: Dict, question: Dict,
-                                 question_index: int = 0, **kwargs) -> str:
-        """
-        Генерация реалистичного ответа с учетом всех факторов
+class FrozenQuestion(dict):
+    """Вопрос в таблице вопросов: обычный словарь для чтения и сериализации, но без изменения на месте"""
 
-        Args:
-            persona_id: Уникальный идентификатор персоны
-            persona: Словарь с данными персоны
-            question: Словарь с вопросом
-            question_index: Индекс вопроса в последовательности
-            **kwargs: Дополнительные параметры для метода generate_answer
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Вопрос из таблицы вопросов нельзя изменять; используйте dict(question)")
 
-        Returns:
-            Сгенерированный ответ
-        """
-        return self.enhanced_respondent.generate_realistic_answer(
-            persona_id, persona, question, question_index, **kwargs
-        )
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    update = pop = popitem = clear = setdefault = _readonly
 
-    def run_generation_batch(self, personas, questions, max_workers=3, api_preference=None, use_enhanced=True):
-        """
-        Обработка пакета персон и вопросов с параллельным выполнением
+    def __reduce__(self):
+        # Стандартная распаковка словаря вызывает __setitem__, поэтому передаем содержимое в конструктор
+        return FrozenQuestion, (dict(self),)
 
-        Args:
-            personas: Список словарей с персонами
-            questions: Список словарей с вопросами
-            max_workers: Максимальное количество параллельных рабочих процессов
-            api_preference: Предпочтительное API ('claude' или 'openai')
-            use_enhanced: Использовать ли улучшенное генерирование ответов
+
+class QuestionTable(tuple):
+    """
+    Проверенная неизменяемая таблица вопросов
+
+    Ведет себя как последовательность словарей вопросов и дополнительно хранит хэш содержимого
+    исходного файла, по которому таблица кэшируется.
+    """
+
+    def __new__(cls, questions: Sequence[Dict], content_hash: Optional[str] = None, source_format: Optional[str] = None):
+        table = super().__new__(cls, (FrozenQuestion(q) for q in questions))
+        table.content_hash = content_hash
+        table.source_format = source_format
+        return table
+
+    def __getnewargs__(self):
+        return tuple(self), self.content_hash, self.source_format
+
+    def to_pandas(self) -> pd.DataFrame:
+        """
+        Таблица вопросов в виде DataFrame
 
         Returns:
-            Список словарей с ответами
+            DataFrame со столбцами id, text, type, topic, options, context
         """
-        all_answers = []
-        total_items = len(personas) * len(questions)
-        completed = 0
+        return pd.DataFrame(list(self), columns=["id", "text", "type", "topic", "options", "context"])
 
-        # Настройка отображения прогресса через Streamlit
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        status_text.text("Генерация ответов: 0%")
 
-        # Функция для генерации одного ответа с обновлением прогресса
-        def generate_one_answer(args):
-            i, persona, j, question, question_idx = args
-            try:
-                # Используем улучшенную генерацию ответов, если запрошено
-                if use_enhanced:
-                    answer_text = self.generate_realistic_answer(
-                        str(i), persona, question, question_idx,
-                        api_preference=api_preference
-                    )
-                else:
-                    answer_text = self.generate_answer(
-                        persona, question, api_preference=api_preference
-                    )
+class QuestionTableCache:
+    """Кэш разобранных таблиц вопросов по хэшу содержимого файла (LRU, потокобезопасный)"""
 
-                answer = {
-                    "id": i * len(questions) + j + 1,
-                    "persona_id": i + 1,
-                    "question": question,
-                    "text": answer_text,
-                    "timestamp": datetime.now().isoformat()
-                }
+    def __init__(self, max_entries: int = QUESTION_CACHE_SIZE):
+        """
+        Args:
+            max_entries: Максимальное количество хранимых таблиц
+        """
+        self.max_entries = max_entries
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[QuestionTable]:
+        with self._lock:
+            table = self._tables.pop(key, None)
+            if table is not None:
+                # Перемещаем в конец как недавно использованную
+                self._tables[key] = table
+            return table
+
+    def put(self, key: Tuple[str, str], table: QuestionTable) -> None:
+        with self._lock:
+            self._tables.pop(key, None)
+            self._tables[key] = table
+            while len(self._tables) > self.max_entries:
+                self._tables.pop(next(iter(self._tables)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tables.clear()
+
+
+# Общий кэш таблиц вопросов процесса
+QUESTION_TABLES = QuestionTableCache()
+
+
+def _streamlit_question_tables() -> QuestionTableCache:
+    """Кэш таблиц вопросов для интерфейса (Streamlit кэширует его между перезапусками скрипта)"""
+    return QuestionTableCache()
+
+
+def _read_file_source(file_data) -> Tuple[bytes, Optional[str]]:
+    """Содержимое загружаемого файла и его имя (путь, загруженный файл Streamlit, файловый объект или байты)"""
+    if isinstance(file_data, (str, os.PathLike)):
+        with open(file_data, "rb") as f:
+            return f.read(), os.fspath(file_data)
+    if isinstance(file_data, (bytes, bytearray)):
+        return bytes(file_data), None
+
+    name = getattr(file_data, "name", None)
+    if hasattr(file_data, "getvalue"):
+        return file_data.getvalue(), name
+    if hasattr(file_data, "seek"):
+        file_data.seek(0)
+    return file_data.read(), name
+
+
+def _detect_file_format(data: bytes, name: Optional[str], file_format: Optional[str],
+                        formats: Dict[str, str] = QUESTION_FILE_FORMATS) -> str:
+    """Формат файла: явно заданный, по расширению имени или по сигнатуре содержимого (из списка formats)"""
+    supported = set(formats.values())
+    if file_format:
+        file_format = file_format.lower().lstrip(".")
+        if file_format not in supported:
+            raise ValueError(f"Неподдерживаемый формат файла: {file_format}")
+        return file_format
+
+    if name:
+        extension = os.path.splitext(str(name))[1].lower()
+        if extension in formats:
+            return formats[extension]
+
+    signatures = ((b"PK\x03\x04", "xlsx"), (b"PAR1", "parquet"), (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "xls"))
+    for signature, detected in signatures:
+        if data.startswith(signature) and detected in supported:
+            return detected
+    raise ValueError(f"Не удалось определить формат файла; поддерживаются: {', '.join(sorted(formats))}")
+
+
+def _read_question_columns(data: bytes, file_format: str) -> Dict[str, list]:
+    """
+    Чтение столбцов файла вопросов
 
-                return answer, 1
-            except Exception as e:
-                error_answer = {
-                    "id": i * len(questions) + j + 1,
-                    "persona_id": i + 1,
-                    "question": question,
-                    "text": f"ОШИБКА: {str(e)}",
-                    "timestamp": datetime.now().isoformat(),
-                    "error": True
-                }
-                return error_answer, 1
+    Args:
+        data: Содержимое файла
+        file_format: Формат ('xlsx', 'xls', 'csv', 'jsonl' или 'parquet')
 
-        # Подготовка задач для параллельной обработки
-        tasks = []
-        for i, persona in enumerate(personas):
-            for j, question in enumerate(questions):
-                # Добавляем индекс вопроса для моделирования эффекта усталости
-                question_idx = j
-                tasks.append((i, persona, j, question, question_idx))
+    Returns:
+        Словарь {имя столбца: список значений} (читаются только столбцы из QUESTION_COLUMNS)
+    """
+    if file_format == "xlsx":
+        try:
+            import openpyxl
+        except ImportError:
+            raise ValueError("Для загрузки Excel необходим пакет openpyxl")
 
-        # Запуск параллельной обработки
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_task = {executor.submit(generate_one_answer, task): task for task in tasks}
+        # Потоковое чтение: строки листа не загружаются в память целиком
+        workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = [str(cell).strip() if cell is not None else "" for cell in next(rows, ())]
+            wanted = [(i, column) for i, column in enumerate(header) if column in QUESTION_COLUMNS]
+            columns = {column: [] for _, column in wanted}
+            for row in rows:
+                for i, column in wanted:
+                    columns[column].append(row[i] if i < len(row) else None)
+        finally:
+            workbook.close()
+        return columns
+
+    if file_format == "jsonl":
+        columns = defaultdict(list)
+        count = 0
+        for line_no, line in enumerate(data.decode("utf-8-sig").splitlines(), 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError(f"Строка {line_no}: ожидается JSON-объект")
+            for column in QUESTION_COLUMNS:
+                if column in record:
+                    # Столбец, впервые встреченный в середине файла, дополняем пустыми значениями
+                    values = columns[column]
+                    values.extend([None] * (count - len(values)))
+                    values.append(record[column])
+            count += 1
+        return {column: values + [None] * (count - len(values)) for column, values in columns.items()}
+
+    if file_format == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Для загрузки Parquet необходим пакет pyarrow")
+
+        parquet_file = pq.ParquetFile(io.BytesIO(data))
+        names = [column for column in QUESTION_COLUMNS if column in parquet_file.schema_arrow.names]
+        table = parquet_file.read(columns=names)
+        return {column: table.column(column).to_pylist() for column in names}
+
+    if file_format == "csv":
+        text = data.decode("utf-8-sig")
+        first_line = text.split("\n", 1)[0]
+        delimiter = max((",", ";", "\t"), key=first_line.count)
+        df = pd.read_csv(io.StringIO(text), sep=delimiter, usecols=lambda c: str(c).strip() in QUESTION_COLUMNS)
+    else:
+        df = pd.read_excel(io.BytesIO(data))
+        df = df[[c for c in df.columns if str(c).strip() in QUESTION_COLUMNS]]
+
+    df.columns = [str(c).strip() for c in df.columns]
+    return {column: df[column].tolist() for column in df.columns}
+
+
+def _is_blank(value) -> bool:
+    """Пустая ячейка: None, NaN или строка из пробелов"""
+    if value is None:
+        return True
+    if isinstance(value, float):
+        return math.isnan(value)
+    if isinstance(value, str):
+        return not value.strip()
+    return bool(pd.isna(value)) if np.isscalar(value) else False
+
+
+def _question_id(value, default: int):
+    """Идентификатор вопроса: целые числа из Excel/CSV (в том числе 1.0 и '1') приводятся к int"""
+    if _is_blank(value):
+        return default
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value.strip())
+    return value
+
+
+def build_question_table(columns: Dict[str, list], content_hash: Optional[str] = None,
+                         source_format: Optional[str] = None) -> QuestionTable:
+    """
+    Проверка столбцов файла вопросов и построение таблицы вопросов
 
-            for future in concurrent.futures.as_completed(future_to_task):
-                answer, progress_increment = future.result()
-                all_answers.append(answer)
+    Args:
+        columns: Словарь {имя столбца: список значений}
+        content_hash: Хэш содержимого исходного файла
+        source_format: Формат исходного файла
 
-                # Обновление прогресса
-                completed += progress_increment
-                progress_percentage = completed/total_items
-                progress_bar.progress(progress_percentage)
-                status_text.text(f"Генерация ответов: {int(progress_percentage*100)}%")
+    Returns:
+        QuestionTable
 
-        # Сортировка ответов по ID
-        all_answers.sort(key=lambda x: x["id"])
+    Raises:
+        ValueError: Если нет столбца 'question', есть вопросы без текста или повторяющиеся id
+    """
+    text_column = "question" if "question" in columns else "text" if "text" in columns else None
+    if text_column is None:
+        raise ValueError("В файле отсутствует обязательный столбец 'question'")
+
+    num_rows = len(columns[text_column])
+    empty = [None] * num_rows
+    ids, texts, types, topics, options, contexts = (
+        columns.get(name, empty) for name in ("id", text_column, "type", "topic", "options", "context")
+    )
+
+    questions = []
+    seen_ids = set()
+    for idx in range(num_rows):
+        if _is_blank(texts[idx]):
+            # Полностью пустые строки (например, в конце листа) пропускаем
+            if all(_is_blank(values[idx]) for values in columns.values()):
+                continue
+            raise ValueError(f"У вопроса в строке {idx + 1} отсутствует текст")
+
+        text = str(texts[idx]).strip()
+        question_id = _question_id(ids[idx], idx + 1)
+        if question_id in seen_ids:
+            raise ValueError(f"Повторяющийся id вопроса: {question_id}")
+        seen_ids.add(question_id)
+
+        raw_options = options[idx]
+        if _is_blank(raw_options):
+            question_options = ()
+        elif isinstance(raw_options, (list, tuple, np.ndarray)):
+            question_options = tuple(str(option) for option in raw_options)
+        else:
+            question_options = tuple(str(raw_options).split(','))
+
+        questions.append({
+            "id": question_id,
+            "text": text,
+            "type": "open" if _is_blank(types[idx]) else str(types[idx]).strip(),
+            "topic": classify_question_topic(text) if _is_blank(topics[idx]) else str(topics[idx]).strip(),
+            "options": question_options,
+            "context": "" if _is_blank(contexts[idx]) else str(contexts[idx])
+        })
 
-        return all_answers
+    if not questions:
+        raise ValueError("В файле нет ни одного вопроса")
 
-    def analyze_results(self, personas: List[Dict], questions: List[Dict], answers: List[Dict]) -> Dict:
-        """
-        Формирование аналитического отчета
+    return QuestionTable(questions, content_hash=content_hash, source_format=source_format)
 
-        Args:
-            personas: Список словарей с персонами
-            questions: Список словарей с вопросами
-            answers: Список словарей с ответами
 
-        Returns:
-            Словарь с аналитическим отчетом
-        """
-        try:
-            # Базовая статистика
-            report = {
-                "Общая статистика": {
-                    "Количество респондентов": len(personas),
-                    "Количество вопросов": len(questions),
-                    "Количество ответов": len(answers),
-                    "API токенов использовано (Claude)": self.tokens_used["claude"],
-                    "API токенов использовано (OpenAI)": self.tokens_used["openai"]
-                },
-                "Демографический состав": {
-                    "Пол": {},
-                    "Возраст": {
-                        "Средний": float(np.mean([p["Возраст"] for p in personas])),
-                        "Медианный": float(np.median([p["Возраст"] for p in personas])),
-                        "Минимальный": int(min([p["Возраст"] for p in personas])),
-                        "Максимальный": int(max([p["Возраст"] for p in personas]))
-                    },
-                    "Регионы": {},
-                    "Города": {},
-                    "Профессии": {},
-                    "Образование": {},
-                    "Семейное положение": {},
-                    "Доход": {},
-                    "Дети": {
-                        "Среднее количество": float(np.mean([p.get("Количество детей", 0) for p in personas])),
-                        "Распределение": {}
-                    }
-                },
-                "Финансовые характеристики": {
-                    "Уровни финансовой грамотности": {},
-                    "Доверие к банкам": {},
-                    "Отношение к кредитам": {},
-                    "Отношение к риску": {},
-                    "Модели финансового поведения": {},
-                    "Используемые финансовые продукты": {}
-                },
-                "Аналитика ответов": [],
-                "Качество данных": {
-                    "Ошибки генерации": sum(1 for a in answers if a.get("error", False)),
-                    "Успешность": float((len(answers) - sum(1 for a in answers if a.get("error", False))) / len(answers) * 100) if answers else 0
-                }
-            }
+def load_questions(file_data, file_format: Optional[str] = None) -> QuestionTable:
+    """
+    Загрузка вопросов из файла Excel, CSV, JSONL или Parquet (не требует экземпляра маркетплейса)
 
-            # Подсчет демографических характеристик
-            for key in ["Пол", "Регион", "Город", "Профессия", "Образование", "Семейное положение", "Доход"]:
-                value_counts = pd.Series([p.get(key, "Не указано") for p in personas]).value_counts()
-                report["Демографический состав"][key if key != "Город" else "Города"] = {
-                    str(k): int(v) for k, v in value_counts.items()
-                }
+    Разобранная таблица кэшируется по хэшу содержимого, поэтому повторная загрузка того же файла
+    (например, при перезапуске скрипта Streamlit) не разбирает его заново.
 
-            # Распределение детей
-            children_counts = pd.Series([p.get("Количество детей", 0) for p in personas]).value_counts()
-            report["Демографический состав"]["Дети"]["Распределение"] = {
-                str(k): int(v) for k, v in children_counts.items()
-            }
+    Args:
+        file_data: Путь к файлу, загруженный файл, файловый объект или байты
+        file_format: Формат файла (по умолчанию определяется по расширению или содержимому)
 
-            # Подсчет финансовых характеристик
-            literacy_counts = pd.Series([
-                p.get("Финансовый профиль", {}).get("Уровень финансовой грамотности", "средний")
-                for p in personas
-            ]).value_counts()
+    Returns:
+        Неизменяемая таблица вопросов (последовательность словарей с вопросами)
+    """
+    try:
+        data, name = _read_file_source(file_data)
+        file_format = _detect_file_format(data, name, file_format)
+        key = (hashlib.sha256(data).hexdigest(), file_format)
+
+        table = QUESTION_TABLES.get(key)
+        if table is None:
+            table = build_question_table(_read_question_columns(data, file_format), key[0], file_format)
+            QUESTION_TABLES.put(key, table)
+        return table
+    except Exception as e:
+        raise ValueError(f"Ошибка при загрузке вопросов: {str(e)}")
 
-            report["Финансовые характеристики"]["Уровни финансовой грамотности"] = {
-                str(k): int(v) for k, v in literacy_counts.items()
-            }
 
-            trust_counts = pd.Series([
-                p.get("Финансовый профиль", {}).get("Отношение к финансам", {}).get("Доверие к банкам", "среднее")
-                for p in personas
-            ]).value_counts()
+# Форматы файлов панели респондентов (по расширению)
+COHORT_FILE_FORMATS = {".parquet": "parquet", ".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
 
-            report["Финансовые характеристики"]["Доверие к банкам"] = {
-                str(k): int(v) for k, v in trust_counts.items()
-            }
 
-            loan_counts = pd.Series([
-                p.get("Финансовый профиль", {}).get("Отношение к финансам", {}).get("Отношение к кредитам", "нейтральное")
-                for p in personas
-            ]).value_counts()
+def save_cohort(cohort: "PersonaCohort", target=None, file_format: Optional[str] = None) -> bytes:
+    """
+    Экспорт когорты в Parquet, CSV или JSONL (формат таблицы - PersonaCohort.to_frame)
 
-            report["Финансовые характеристики"]["Отношение к кредитам"] = {
-                str(k): int(v) for k, v in loan_counts.items()
-            }
+    Args:
+        cohort: Когорта персон
+        target: Путь к файлу (опционально; по расширению определяется формат)
+        file_format: Формат ('parquet', 'csv' или 'jsonl')
 
-            risk_counts = pd.Series([
-                p.get("Финансовый профиль", {}).get("Отношение к финансам", {}).get("Отношение к риску", "умеренный")
-                for p in personas
-            ]).value_counts()
+    Returns:
+        Содержимое файла
+    """
+    if file_format is None:
+        extension = os.path.splitext(str(target or ""))[1].lower()
+        file_format = COHORT_FILE_FORMATS.get(extension, "parquet")
+    if file_format not in set(COHORT_FILE_FORMATS.values()):
+        raise ValueError(f"Неподдерживаемый формат панели: {file_format}")
+
+    df = cohort.to_frame()
+    list_labels = [label for label in df.columns if df[label].dtype == object and
+                   len(df) and isinstance(df[label].iloc[0], list)]
+
+    if file_format == "parquet":
+        if importlib.util.find_spec("pyarrow") is None:
+            raise ValueError("Для экспорта в Parquet необходим пакет pyarrow")
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False)
+        data = buffer.getvalue()
+    elif file_format == "csv":
+        # Списки в CSV записываются JSON-строками
+        for label in list_labels:
+            df[label] = [json.dumps(values, ensure_ascii=False) for values in df[label]]
+        data = df.to_csv(index=False).encode("utf-8")
+    else:
+        data = df.to_json(orient="records", lines=True, force_ascii=False).encode("utf-8")
 
-            report["Финансовые характеристики"]["Отношение к риску"] = {
-                str(k): int(v) for k, v in risk_counts.items()
-            }
+    if target is not None:
+        with open(target, "wb") as f:
+            f.write(data)
+    return data
 
-            behavior_counts = pd.Series([
-                p.get("Финансовый профиль", {}).get("Отношение к финансам", {}).get("Модель финансового поведения", "прагматичный")
-                for p in personas
-            ]).value_counts()
 
-            report["Финансовые характеристики"]["Модели финансового поведения"] = {
-                str(k): int(v) for k, v in behavior_counts.items()
-            }
+def load_cohort(marketplace, file_data, file_format: Optional[str] = None,
+                seed: Optional[int] = None) -> "PersonaCohort":
+    """
+    Импорт панели респондентов из Parquet, CSV или JSONL с проверкой схемы (см. PersonaCohort.from_frame)
 
-            # Подсчет используемых финансовых продуктов
-            products_usage = {}
-            for persona in personas:
-                fp = persona.get("Финансовый профиль", {})
-                products = fp.get("Используемые продукты", {})
+    Args:
+        marketplace: Экземпляр RespondentsMarketplace
+        file_data: Путь к файлу, загруженный файл, файловый объект или байты
+        file_format: Формат файла (по умолчанию определяется автоматически)
+        seed: Зерно для выборки недостающих знаний и профилей
 
-                for product, used in products.items():
-                    if product not in products_usage:
-                        products_usage[product] = {"Используют": 0, "Не используют": 0}
+    Returns:
+        PersonaCohort
+    """
+    data, name = _read_file_source(file_data)
+    file_format = _detect_file_format(data, name, file_format, COHORT_FILE_FORMATS)
 
-                    if used:
-                        products_usage[product]["Используют"] += 1
-                    else:
-                        products_usage[product]["Не используют"] += 1
+    if file_format == "parquet":
+        try:
+            df = pd.read_parquet(io.BytesIO(data))
+        except ImportError:
+            raise ValueError("Для загрузки Parquet необходим пакет pyarrow")
+    elif file_format == "csv":
+        df = pd.read_csv(io.BytesIO(data), encoding="utf-8-sig")
+    else:
+        df = pd.read_json(io.BytesIO(data), orient="records", lines=True, dtype=False)
 
-            report["Финансовые характеристики"]["Используемые финансовые продукты"] = products_usage
+    return PersonaCohort.from_frame(marketplace, df, seed=seed)
 
-            # Анализ ответов для каждого вопроса
-            for question in questions:
-                question_answers = [
-                    ans for ans in answers
-                    if ans["question"]["id"] == question["id"] and not ans.get("error", False)
-                ]
 
-                question_analysis = {
-                    "Вопрос": question["text"],
-                    "Тип вопроса": question["type"],
-                    "Тема": question.get("topic", "общие"),
-                    "Количество ответов": len(question_answers),
-                    "Средняя длина ответа (символы)": int(np.mean([len(a["text"]) for a in question_answers]) if question_answers else 0),
-                    "Медианная длина ответа": int(np.median([len(a["text"]) for a in question_answers]) if question_answers else 0)
-                }
+# Версия формата снимка окружения (увеличивается при несовместимых изменениях)
+SNAPSHOT_VERSION = 1
 
-                # Анализ для вопросов с вариантами ответов
-                if question["type"] in ["single", "multiple"] and question["options"]:
-                    option_counts = {}
-                    for option in question["options"]:
-                        option = option.strip()
-                        if not option:
-                            continue
-                        count = sum(1 for a in question_answers if option.lower() in a["text"].lower())
-                        option_counts[option] = count
+# Поля анализа отзывов, сохраняемые в снимке (результат _analyze_reviews)
+SNAPSHOT_REVIEW_FIELDS = ("banks", "common_issues", "sentiment_by_bank", "frequent_terms", "topics")
 
-                    question_analysis["Распределение ответов"] = option_counts
+# Базовый каталог снимков, доступных из интерфейса (переопределяется переменной окружения)
+SNAPSHOT_BASE_DIR = os.environ.get("SYNTHETICA_SNAPSHOT_DIR", "snapshots")
 
-                report["Аналитика ответов"].append(question_analysis)
 
-            # Текстовый анализ - вычисление среднего настроения и сложности ответов
-            if answers:
-                try:
-                    # Средняя длина слов в ответах
-                    word_counts = [len(a["text"].split()) for a in answers if not a.get("error", False)]
-                    report["Аналитика текста"] = {
-                        "Средняя длина ответа (слова)": float(np.mean(word_counts)) if word_counts else 0,
-                        "Медианная длина ответа (слова)": float(np.median(word_counts)) if word_counts else 0,
-                        "Максимальная длина ответа (слова)": max(word_counts) if word_counts else 0,
-                        "Минимальная длина ответа (слова)": min(word_counts) if word_counts else 0
-                    }
-                except Exception as e:
-                    st.warning(f"Ошибка в текстовом анализе: {e}")
+def resolve_snapshot_path(name: str, base_dir: Optional[str] = None) -> str:
+    """
+    Путь каталога снимка внутри базового каталога снимков
 
-            return report
-        except Exception as e:
-            st.error(f"Ошибка при анализе результатов: {str(e)}")
-            # Возвращаем базовый отчет в случае ошибки
-            return {
-                "Общая статистика": {
-                    "Количество респондентов": len(personas),
-                    "Количество вопросов": len(questions),
-                    "Ошибка анализа": str(e)
-                }
-            }
+    Args:
+        name: Имя каталога снимка относительно базового каталога
+        base_dir: Базовый каталог (по умолчанию SNAPSHOT_BASE_DIR)
 
-    def export_to_excel(self, personas: List[Dict], questions: List[Dict], answers: List[Dict]) -> io.BytesIO:
-        """
-        Экспорт результатов в Excel файл
+    Returns:
+        Абсолютный путь каталога снимка
 
-        Args:
-            personas: Список словарей с персонами
-            questions: Список словарей с вопросами
-            answers: Список словарей с ответами
+    Raises:
+        ValueError: Если имя пустое, абсолютное, содержит '..' или выходит за пределы базового каталога
+    """
+    name = (name or "").strip()
+    if not name:
+        raise ValueError("Не указано имя снимка")
+    if os.path.isabs(name) or os.path.splitdrive(name)[0]:
+        raise ValueError(f"Имя снимка должно быть относительным путем: {name}")
+    if ".." in re.split(r"[\\/]", name):
+        raise ValueError(f"Имя снимка не может содержать '..': {name}")
+    base = os.path.realpath(base_dir or SNAPSHOT_BASE_DIR)
+    path = os.path.realpath(os.path.join(base, name))
+    # Символические ссылки внутри базового каталога не должны уводить за его пределы
+    if os.path.commonpath([base, path]) != base or path == base:
+        raise ValueError(f"Снимок должен находиться внутри каталога {base}")
+    return path
+
+
+def _write_snapshot_file(path: str, write: Callable) -> None:
+    """
+    Запись файла снимка через временный файл с атомарной заменой
 
-        Returns:
+    Старый файл не перезаписывается на месте, поэтому массивы, отображенные в память из предыдущего
+    снимка по тому же пути, остаются доступными.
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def save_marketplace_snapshot(marketplace, path: str, cohort: Optional["PersonaCohort"] = None,
+                              questions: Optional[Sequence[Dict]] = None) -> Dict:
+    """
+    Сохранение состояния маркетплейса для быстрого запуска на другой машине или воркере
+
+    Снимок - каталог с manifest.json (параметры промптов, таблица вопросов, результаты анализа отзывов,
+    состояние генераторов случайных чисел, история длины ответов), колонками когорты в формате .npy
+    (по файлу на колонку, загружаются отображением в память), отзывами в Parquet и кэшем ответов в JSONL.
+    API ключи в снимок не попадают.
+
+    Args:
+        marketplace: Экземпляр RespondentsMarketplace
+        path: Каталог снимка (создается при необходимости)
+        cohort: Когорта персон (опционально)
+        questions: Таблица вопросов (опционально)
+
+    Returns:
+        Манифест снимка
+    """
+    os.makedirs(path, exist_ok=True)
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "created": datetime.now().isoformat(),
+        "prompting_params": marketplace.prompting_params,
+        "tokens_used": marketplace.tokens_used,
+        "output_token_history": {key: list(values) for key, values in marketplace.output_token_history.items()},
+        "rng": {"random": random.getstate(), "numpy": np.random.get_state(legacy=False)},
+        "questions": None,
+        "reviews": None,
+        "cohort": None,
+        "response_cache": None
+    }
+
+    if questions is not None:
+        manifest["questions"] = {
+            "records": [dict(q) for q in questions],
+            "content_hash": getattr(questions, "content_hash", None),
+            "source_format": getattr(questions, "source_format", None)
+        }
+
+    analyzer = marketplace.reviews_analyzer
+    if analyzer.reviews_data is not None:
+        reviews = {field: getattr(analyzer, field) for field in SNAPSHOT_REVIEW_FIELDS}
+        if importlib.util.find_spec("pyarrow") is not None:
+            reviews["file"] = "reviews.parquet"
+            _write_snapshot_file(os.path.join(path, reviews["file"]),
+                                 lambda f: analyzer.reviews_data.to_parquet(f, index=False))
+        else:
+            # Без pyarrow отзывы сохраняются построчным JSON
+            reviews["file"] = "reviews.jsonl"
+            _write_snapshot_file(os.path.join(path, reviews["file"]), lambda f: f.write(
+                analyzer.reviews_data.to_json(orient="records", lines=True, force_ascii=False).encode("utf-8")))
+        manifest["reviews"] = reviews
+
+    if cohort is not None:
+        cohort = PersonaCohort.from_personas(marketplace, cohort)
+        os.makedirs(os.path.join(path, "cohort"), exist_ok=True)
+        columns = {}
+        for name, column in cohort.columns.items():
+            column = np.ascontiguousarray(column)
+            _write_snapshot_file(os.path.join(path, "cohort", f"{name}.npy"),
+                                 lambda f: np.save(f, column, allow_pickle=False))
+            columns[name] = {"dtype": column.dtype.str, "shape": list(column.shape)}
+        manifest["cohort"] = {
+            "size": len(cohort),
+            "enhance": cohort.enhance,
+            "columns": columns,
+            "overrides": sorted(cohort._overrides.items())
+        }
+
+    if marketplace.response_cache:
+        cache_items = list(marketplace.response_cache.items())
+        manifest["response_cache"] = {"file": "response_cache.jsonl", "entries": len(cache_items)}
+        _write_snapshot_file(os.path.join(path, "response_cache.jsonl"), lambda f: f.writelines(
+            json.dumps([key, value], ensure_ascii=False, cls=NumpyEncoder).encode("utf-8") + b"\n"
+            for key, value in cache_items))
+
+    # Манифест записывается последним: каталог без манифеста не считается снимком
+    _write_snapshot_file(os.path.join(path, "manifest.json"), lambda f: f.write(
+        json.dumps(manifest, ensure_ascii=False, indent=1, cls=NumpyEncoder).encode("utf-8")))
+    return manifest
+
+
+def load_marketplace_snapshot(path: str, marketplace=None, restore_rng: bool = True,
+                              **marketplace_kwargs) -> Tuple["RespondentsMarketplace", Optional["PersonaCohort"],
+                                                             Optional[QuestionTable]]:
+    """
+    Восстановление маркетплейса, когорты и таблицы вопросов из снимка (см. save_marketplace_snapshot)
+
+    Колонки когорты отображаются в память в режиме копирования при записи: загрузка не читает
+    файлы целиком, а изменения когорты (редактор, update_column) не затрагивают снимок.
+
+    Args:
+        path: Каталог снимка
+        marketplace: Экземпляр RespondentsMarketplace для восстановления (по умолчанию создается новый)
+        restore_rng: Восстанавливать ли состояние глобальных генераторов random и numpy.random
+        **marketplace_kwargs: Аргументы RespondentsMarketplace для нового экземпляра (API ключи и т.п.)
+
+    Returns:
+        Кортеж (маркетплейс, когорта или None, таблица вопросов или None)
+
+    Raises:
+        ValueError: Если каталог не является снимком или снимок несовместим с текущей версией
+    """
+    manifest_path = os.path.join(path, "manifest.json")
+    if not os.path.isfile(manifest_path):
+        raise ValueError(f"Снимок не найден: {manifest_path}")
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Неподдерживаемая версия снимка: {manifest.get('version')} (ожидается {SNAPSHOT_VERSION})")
+
+    if marketplace is None:
+        marketplace = RespondentsMarketplace(**marketplace_kwargs)
+
+    marketplace.prompting_params.update(manifest["prompting_params"])
+    marketplace.tokens_used.update(manifest["tokens_used"])
+    for key, values in manifest["output_token_history"].items():
+        marketplace.output_token_history[key].extend(values)
+
+    if restore_rng:
+        state = manifest["rng"]["random"]
+        random.setstate((state[0], tuple(state[1]), state[2]))
+        np.random.set_state(manifest["rng"]["numpy"])
+
+    questions = None
+    if manifest["questions"] is not None:
+        info = manifest["questions"]
+        questions = QuestionTable(info["records"], info["content_hash"], info["source_format"])
+        if info["content_hash"] is not None:
+            # Повторная загрузка исходного файла вопросов возьмет таблицу из кэша
+            QUESTION_TABLES.put((info["content_hash"], info["source_format"]), questions)
+
+    if manifest["reviews"] is not None:
+        reviews = manifest["reviews"]
+        analyzer = marketplace.reviews_analyzer
+        for field in SNAPSHOT_REVIEW_FIELDS:
+            setattr(analyzer, field, reviews[field])
+        analyzer.common_issues = [tuple(issue) for issue in analyzer.common_issues]
+        reviews_path = os.path.join(path, reviews["file"])
+        if reviews["file"].endswith(".parquet"):
+            try:
+                analyzer.reviews_data = pd.read_parquet(reviews_path)
+            except ImportError:
+                raise ValueError("Для загрузки отзывов из снимка необходим пакет pyarrow")
+        else:
+            analyzer.reviews_data = pd.read_json(reviews_path, orient="records", lines=True, dtype=False)
+
+    cohort = None
+    if manifest["cohort"] is not None:
+        info = manifest["cohort"]
+        # Коды колонок - индексы в справочниках, поэтому схема должна совпадать с текущей версией
+        template = marketplace.generate_cohort(0, enhance=info["enhance"]).columns
+        schema = {name: (column.dtype.str, list(column.shape[1:])) for name, column in template.items()}
+        saved = {name: (column["dtype"], column["shape"][1:]) for name, column in info["columns"].items()}
+        if saved != schema:
+            raise ValueError("Колонки когорты в снимке не совпадают со схемой текущей версии приложения")
+
+        columns = {}
+        for name, column in info["columns"].items():
+            # Пустой массив нельзя отобразить в память
+            mmap_mode = "c" if info["size"] else None
+            columns[name] = np.load(os.path.join(path, "cohort", f"{name}.npy"), mmap_mode=mmap_mode,
+                                    allow_pickle=False)
+        cohort = PersonaCohort(marketplace, columns, enhance=info["enhance"],
+                               overrides={int(k): persona for k, persona in info["overrides"]})
+
+    if manifest["response_cache"] is not None:
+        with open(os.path.join(path, manifest["response_cache"]["file"]), "r", encoding="utf-8") as f:
+            for line in f:
+                key, value = json.loads(line)
+                marketplace.response_cache[key] = value
+
+    return marketplace, cohort, questions
+
+
+class RespondentsMarketplace:
+    """Маркетплейс для генерации ответов респондентов с разным уровнем финансовой грамотности"""
+
+    # Минимальное количество задач, начиная с которого промпты строятся в пуле процессов
+    prompt_pool_min_tasks = 1000
+
+    def __init__(self, api_key_claude: Optional[str] = None, api_key_openai: Optional[str] = None,
+                 use_fake_llm: bool = False, prompt_only: bool = False):
+        """
+        Инициализация маркетплейса респондентов
+
+        Args:
+            api_key_claude: API ключ для Anthropic Claude
+            api_key_openai: API ключ для OpenAI (опционально)
+            use_fake_llm: Использовать локальный фейковый LLM вместо реальных API (для тестирования)
+            prompt_only: Создать экземпляр без API клиентов (только для построения промптов)
+        """
+        # Проверяем, что хотя бы один ключ API предоставлен
+        if not api_key_claude and not api_key_openai and not use_fake_llm and not prompt_only:
+            raise ValueError("Необходим хотя бы один API ключ (Claude или OpenAI)")
+
+        self.api_key_claude = api_key_claude
+        self.api_key_openai = api_key_openai
+        self.use_fake_llm = use_fake_llm
+
+        if use_fake_llm:
+            self.client_claude = FakeLLMClient()
+        elif api_key_claude and not prompt_only:
+            # Клиенты берутся из общего реестра: соединения переиспользуются между маркетплейсами
+            self.client_claude = API_CLIENTS.get("claude", self.api_key_claude)
+        else:
+            self.client_claude = None
+
+        if api_key_openai and not use_fake_llm and not prompt_only:
+            self.client_openai = API_CLIENTS.get("openai", self.api_key_openai)
+        else:
+            self.client_openai = None
+
+        # Справочники для генерации общих демографических данных
+        self.regions = [
+            "Москва", "Санкт-Петербург", "Центральный", "Северо-Западный",
+            "Южный", "Северо-Кавказский", "Приволжский", "Уральский",
+            "Сибирский", "Дальневосточный"
+        ]
+
+        self.cities = {
+            "Москва": ["Москва"],
+            "Санкт-Петербург": ["Санкт-Петербург"],
+            "Центральный": ["Воронеж", "Тула", "Ярославль", "Рязань", "Тверь", "Владимир", "Брянск"],
+            "Северо-Западный": ["Калининград", "Псков", "Петрозаводск", "Мурманск", "Архангельск"],
+            "Южный": ["Ростов-на-Дону", "Краснодар", "Волгоград", "Севастополь", "Симферополь"],
+            "Северо-Кавказский": ["Ставрополь", "Махачкала", "Владикавказ", "Грозный", "Нальчик"],
+            "Приволжский": ["Нижний Новгород", "Казань", "Самара", "Уфа", "Пермь", "Саратов"],
+            "Уральский": ["Екатеринбург", "Челябинск", "Тюмень", "Сургут"],
+            "Сибирский": ["Новосибирск", "Омск", "Красноярск", "Иркутск", "Томск", "Кемерово"],
+            "Дальневосточный": ["Владивосток", "Хабаровск", "Якутск", "Благовещенск", "Южно-Сахалинск"]
+        }
+
+        self.professions = [
+            "IT-специалист", "Аналитик/Data Scientist", "Менеджер среднего звена",
+            "Руководитель высшего звена", "Врач/медработник", "Учитель/преподаватель",
+            "Инженер", "Дизайнер/художник", "Предприниматель", "Маркетолог/PR",
+            "Юрист/адвокат", "Бухгалтер/финансист", "Рабочий", "Государственный служащий",
+            "Студент", "Пенсионер", "Временно безработный", "Фрилансер",
+            "Военнослужащий", "Полицейский/охранник", "Научный сотрудник", "Продавец/кассир"
+        ]
+
+        self.education_levels = [
+            "Среднее образование", "Среднее специальное", "Неоконченное высшее",
+            "Высшее (бакалавр)", "Высшее (специалист)", "Высшее (магистр)",
+            "Два и более высших образования", "Ученая степень", "Начальное образование"
+        ]
+
+        self.family_statuses = [
+            "Холост/Не замужем", "Женат/Замужем", "Гражданский брак",
+            "Разведен/Разведена", "Вдовец/Вдова", "В отношениях (не проживают вместе)"
+        ]
+
+        self.income_brackets = [
+            "Менее 15 000 ₽", "15 000 - 30 000 ₽", "30 000 - 60 000 ₽",
+            "60 000 - 100 000 ₽", "100 000 - 150 000 ₽", "150 000 - 250 000 ₽",
+            "250 000 - 500 000 ₽", "Более 500 000 ₽", "Предпочитаю не отвечать"
+        ]
+
+        self.hobby_options = [
+            "Спорт/фитнес", "Чтение", "Кино/сериалы", "Музыка", "Путешествия",
+            "Кулинария", "Рыбалка/охота", "Рукоделие", "Компьютерные игры", "Садоводство",
+            "Фотография", "Коллекционирование", "Танцы", "Рисование", "Волонтерство",
+            "Домашние животные", "Настольные игры", "Активный отдых на природе",
+            "Посещение театров/музеев", "Блогинг/влогинг", "Техническое творчество"
+        ]
+
+        # Уровни финансовой грамотности
+        self.financial_literacy_levels = [
+            "отсутствие знаний", "начинающий", "средний", "продвинутый", "эксперт"
+        ]
+
+        # Финансовое отношение к риску
+        self.risk_attitudes = [
+            "избегающий риска", "умеренный", "склонный к риску"
+        ]
+
+        # Отношение к банкам
+        self.bank_trust_levels = [
+            "низкое", "среднее", "высокое"
+        ]
+
+        # Отношение к кредитам
+        self.loan_attitudes = [
+            "негативное", "нейтральное", "позитивное"
+        ]
+
+        # Модели финансового поведения
+        self.financial_behaviors = [
+            "избегающий риска", "импульсивный", "прагматичный",
+            "осознанный минималист", "статусный"
+        ]
+
+        # Банковские продукты
+        self.bank_products = [
+            "дебетовые карты", "кредитные карты", "потребительские кредиты",
+            "ипотека", "вклады", "накопительные счета", "инвестиционные продукты"
+        ]
+
+        # Распределения для генерации персон (общие для поштучной и пакетной генерации).
+        # Условные таблицы по возрасту задаются списками (верхняя граница возраста не включительно, параметры),
+        # последняя строка с границей None действует для всех остальных возрастов
+        self.gender_options = ["Мужской", "Женский"]
+        self.gender_weights = [0.48, 0.52]
+
+        self.age_groups = [(18, 24), (25, 34), (35, 44), (45, 54), (55, 65), (66, 80)]
+        self.age_group_weights = [0.12, 0.22, 0.21, 0.18, 0.15, 0.12]
+
+        self.region_weights = [0.15, 0.10, 0.13, 0.05, 0.05, 0.05, 0.13, 0.12, 0.12, 0.10]
+
+        # Доход: (граница возраста, среднее и стандартное отклонение индекса категории дохода)
+        self.income_by_age = [(25, 1, 1), (35, 3, 1.5), (45, 4, 1.5), (55, 3, 2), (None, 2, 1.5)]
+
+        # Образование: (граница возраста, веса первых уровней образования)
+        self.education_by_age = [
+            (22, [0.4, 0.4, 0.2]),
+            (30, [0.1, 0.2, 0.1, 0.3, 0.2, 0.1]),
+            (None, [0.10, 0.25, 0.05, 0.25, 0.20, 0.10, 0.03, 0.01, 0.01])
+        ]
+
+        # Семейное положение: (граница возраста, веса семейных статусов)
+        self.family_by_age = [
+            (25, [0.7, 0.05, 0.2, 0.01, 0.01, 0.03]),
+            (35, [0.3, 0.35, 0.25, 0.05, 0.01, 0.04]),
+            (55, [0.15, 0.5, 0.15, 0.1, 0.05, 0.05]),
+            (None, [0.1, 0.4, 0.05, 0.2, 0.2, 0.05])
+        ]
+
+        # Вероятность отсутствия детей в зависимости от семейного положения (по вхождению подстроки)
+        self.no_children_weights = [("Холост", 0.9), ("Гражданский брак", 0.6), ("Разведен", 0.3)]
+        self.no_children_default_weight = 0.2
+
+        self.hobby_count_weights = [0.2, 0.5, 0.3]
+
+        # Вклад образования и дохода в финансовую грамотность
+        self.education_literacy_factors = {
+            "Начальное образование": 0.1,
+            "Среднее образование": 0.3,
+            "Среднее специальное": 0.4,
+            "Неоконченное высшее": 0.5,
+            "Высшее (бакалавр)": 0.6,
+            "Высшее (специалист)": 0.7,
+            "Высшее (магистр)": 0.8,
+            "Два и более высших образования": 0.9,
+            "Ученая степень": 0.95
+        }
+        self.income_literacy_factors = {
+            "Менее 15 000 ₽": 0.2,
+            "15 000 - 30 000 ₽": 0.3,
+            "30 000 - 60 000 ₽": 0.5,
+            "60 000 - 100 000 ₽": 0.7,
+            "100 000 - 150 000 ₽": 0.8,
+            "150 000 - 250 000 ₽": 0.9,
+            "250 000 - 500 000 ₽": 0.95,
+            "Более 500 000 ₽": 1.0,
+            "Предпочитаю не отвечать": 0.5
+        }
+
+        # Пороги показателя грамотности для уровней (по возрастанию)
+        self.literacy_thresholds = [0.25, 0.45, 0.7, 0.9]
+
+        # Отношение к финансам в зависимости от уровня грамотности
+        self.trust_weights_by_literacy = {
+            "отсутствие знаний": [0.5, 0.3, 0.2],
+            "начинающий": [0.5, 0.3, 0.2],
+            "средний": [0.3, 0.5, 0.2],
+            "продвинутый": [0.2, 0.3, 0.5],
+            "эксперт": [0.2, 0.3, 0.5]
+        }
+        self.loan_weights_by_literacy = {
+            "отсутствие знаний": [0.6, 0.3, 0.1],
+            "начинающий": [0.4, 0.4, 0.2],
+            "средний": [0.3, 0.4, 0.3],
+            "продвинутый": [0.2, 0.4, 0.4],
+            "эксперт": [0.2, 0.4, 0.4]
+        }
+
+        # Отношение к риску: (граница возраста, веса); для высокого дохода склонность к риску выше
+        self.risk_by_age = [(41, [0.3, 0.4, 0.3]), (61, [0.4, 0.4, 0.2]), (None, [0.7, 0.2, 0.1])]
+        self.high_income_risk_idx = 5
+
+        self.behavior_weights_by_risk = {
+            "избегающий риска": [0.5, 0.1, 0.2, 0.2, 0.0],
+            "умеренный": [0.2, 0.2, 0.3, 0.2, 0.1],
+            "склонный к риску": [0.1, 0.3, 0.2, 0.1, 0.3]
+        }
+
+        # Кэш таблиц накопленных весов для пакетной генерации (см. _cohort_tables)
+        self._cohort_tables_cache = {}
+
+        # База знаний о финансах
+        self.knowledge_base = FinancialKnowledgeBase()
+
+        # Сборщик промптов (статические разделы готовятся для каждого уровня грамотности)
+        self.prompt_compiler = PromptCompiler(self.knowledge_base)
+
+        # Анализатор отзывов о банках
+        self.reviews_analyzer = BankReviewsAnalyzer()
+
+        # Параметры для промптов
+        self.prompting_params = {
+            "temperature_min": 0.3,
+            "temperature_max": 0.85,
+            "max_tokens": 1500,
+            "prompt_data": {},
+            "use_reviews_data": False,
+            "prompt_profile": "full",
+            # Опечатки, слова-паразиты и региональные выражения добавляются в ответ локально, а не через промпт
+            "local_postprocessing": False,
+            # Потоковые ответы провайдера (частичный текст передается в partial_answer_callback)
+            "stream_responses": False
+        }
+
+        # Доступные LLM модели
+        self.claude_models = ["claude-3-5-sonnet-20241022", "claude-3-5-haiku-20241022", "claude-3-opus-20240229"]
+        self.openai_models = ["gpt-4o", "gpt-4-turbo", "gpt-3.5-turbo"]
+
+        # Маппинг типов вопросов на аспекты финансов (общий каталог)
+        self.financial_topic_mapping = FINANCIAL_TOPIC_MAPPING
+
+        # Кэш для API-ответов
+        self.response_cache = {}
+
+        # Счетчик использованных токенов
+        self.tokens_used = {
+            "claude": 0,
+            "openai": 0
+        }
+
+        # Журнал расходов текущего запуска (пересоздается в run_generation_batch)
+        self.spend_ledger = SpendLedger()
+        self._usage_lock = threading.Lock()
+        # Сумма оценок estimate_tokens и фактических входных токенов выполненных запросов (поправка оценки)
+        self._input_token_calibration = [0, 0]
+        # Использование токенов последним запросом текущего потока (для колонок хранилища ответов)
+        self._request_usage = threading.local()
+        # Обработчик частичного текста потоковых ответов (ID ответа, текст) и ID ответа запроса текущего потока
+        self.partial_answer_callback = None
+        self._stream_task = threading.local()
+        # Обработчик сообщений о ходе генерации (уровень, текст), например лента ответов интерфейса
+        self.notice_callback = None
+
+        # История длины ответов (выходные токены) по сегментам "грамотность|тип вопроса"
+        self.output_token_history = defaultdict(lambda: deque(maxlen=500))
+
+        # Инициализация расширенного генератора респондентов
+        self.enhanced_respondent = EnhancedFinancialRespondent(self)
+
+    @staticmethod
+    def _age_row(table: List[Tuple], age: int) -> Tuple:
+        """Строка условной таблицы для возраста (первая строка, граница которой больше возраста)"""
+        for row in table:
+            if row[0] is None or age < row[0]:
+                return row
+        return table[-1]
+
+    def _no_children_weight(self, family_status: str, age: int) -> float:
+        """Вероятность отсутствия детей в зависимости от семейного положения и возраста"""
+        if age < 22:
+            return self.no_children_weights[0][1]
+        for status_part, weight in self.no_children_weights:
+            if status_part in family_status:
+                return weight
+        return self.no_children_default_weight
+
+    def generate_persona(self, weighted: bool = True, rng: Optional[random.Random] = None) -> Dict:
+        """
+        Генерация случайной персоны с уровнем финансовой грамотности
+
+        Args:
+            weighted: Использовать взвешенное распределение для реалистичности
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
+
+        Returns:
+            Dictionary с атрибутами персоны
+        """
+        rng = rng or random
+        # Пол с реалистичным распределением
+        gender = rng.choices(
+            self.gender_options,
+            weights=self.gender_weights if weighted else None
+        )[0]
+
+        # Возраст с реалистичным распределением по возрастным группам
+        age_weights = self.age_group_weights if weighted else None
+
+        age_group = rng.choices(self.age_groups, weights=age_weights)[0]
+        age = rng.randint(age_group[0], age_group[1])
+
+        # Регион с учетом распределения населения
+        region_weights = self.region_weights if weighted else None
+        region = rng.choices(self.regions, weights=region_weights)[0]
+
+        # Выбор города на основе региона
+        city = rng.choice(self.cities.get(region, ["Не указан"]))
+
+        # Доход, коррелирующий с возрастом, с нормальным распределением
+        _, income_mean, income_std = self._age_row(self.income_by_age, age)
+        income_idx = min(max(0, int(rng.gauss(income_mean, income_std))), len(self.income_brackets)-1)
+
+        income = self.income_brackets[income_idx]
+
+        # Уровень образования, коррелирующий с возрастом
+        _, edu_weights = self._age_row(self.education_by_age, age)
+        edu_options = self.education_levels[:len(edu_weights)]
+
+        education = rng.choices(edu_options, weights=edu_weights)[0]
+
+        # Семейное положение, коррелирующее с возрастом
+        _, family_weights = self._age_row(self.family_by_age, age)
+
+        family_status = rng.choices(self.family_statuses, weights=family_weights)[0]
+
+        # Количество детей - коррелирует с возрастом и семейным положением
+        max_children = max(0, min(5, int((age - 18) / 5)))
+
+        no_children_weight = self._no_children_weight(family_status, age)
+        children_weights = [no_children_weight] + [(1 - no_children_weight)/max(1, max_children)] * max_children
+
+        num_children = rng.choices(
+            range(0, max_children + 1),
+            weights=children_weights[:max_children+1]
+        )[0]
+
+        # Выбор 1-3 хобби
+        num_hobbies = rng.choices([1, 2, 3], weights=self.hobby_count_weights)[0]
+        hobbies = rng.sample(self.hobby_options, num_hobbies)
+
+        # Финансовая грамотность - коррелирует с возрастом, образованием и доходом
+        # Базовый показатель на основе образования
+        education_factor = self.education_literacy_factors.get(education, 0.5)
+
+        # Фактор возраста (опыт)
+        age_factor = min(1.0, max(0.1, (age - 18) / 40))
+
+        # Фактор дохода
+        income_factor = self.income_literacy_factors.get(income, 0.5)
+
+        # Расчет общего уровня с некоторой случайностью
+        literacy_score = (education_factor * 0.4 + age_factor * 0.3 + income_factor * 0.3) * rng.uniform(0.7, 1.3)
+
+        # Определение уровня финансовой грамотности
+        literacy_idx = sum(literacy_score >= threshold for threshold in self.literacy_thresholds)
+        financial_literacy = self.financial_literacy_levels[literacy_idx]
+
+        # Опыт использования финансовых продуктов - зависит от уровня грамотности
+        financial_products = {}
+
+        # Дебетовая карта - есть почти у всех
+        financial_products["Дебетовая карта"] = rng.random() < (0.5 + literacy_idx * 0.1)
+
+        # Кредитная карта - растет с уровнем грамотности
+        financial_products["Кредитная карта"] = rng.random() < (0.1 + literacy_idx * 0.15)
+
+        # Потребительский кредит - умеренный рост с грамотностью
+        financial_products["Потребительский кредит"] = rng.random() < (0.15 + literacy_idx * 0.1)
+
+        # Ипотека - зависит от возраста и дохода
+        has_mortgage_chance = 0.01
+        if 25 <= age <= 50:
+            has_mortgage_chance += 0.15
+        if income_idx >= 3:  # Доход от 60 000
+            has_mortgage_chance += 0.15
+        financial_products["Ипотека"] = rng.random() < has_mortgage_chance
+
+        # Вклад - растет с грамотностью
+        financial_products["Вклад"] = rng.random() < (0.05 + literacy_idx * 0.2)
+
+        # Инвестиции - в основном у продвинутых и экспертов
+        financial_products["Инвестиции"] = rng.random() < (0.01 + (literacy_idx ** 2) * 0.05)
+
+        # Страховые продукты - умеренный рост с грамотностью
+        financial_products["Страхование"] = rng.random() < (0.05 + literacy_idx * 0.15)
+
+        # Отношение к финансам - коррелирует с уровнем грамотности
+
+        # Доверие к банкам
+        bank_trust = rng.choices(self.bank_trust_levels, weights=self.trust_weights_by_literacy[financial_literacy])[0]
+
+        # Отношение к кредитам
+        loan_attitude = rng.choices(self.loan_attitudes, weights=self.loan_weights_by_literacy[financial_literacy])[0]
+
+        # Отношение к риску - коррелирует с возрастом и доходом
+        _, risk_weights = self._age_row(self.risk_by_age, age)
+
+        # Корректировка на основе дохода
+        if income_idx >= self.high_income_risk_idx:  # Высокий доход
+            risk_weights = [max(0.1, risk_weights[0] - 0.2), risk_weights[1], min(0.6, risk_weights[2] + 0.2)]
+
+        risk_attitude = rng.choices(self.risk_attitudes, weights=risk_weights)[0]
+
+        # Модель финансового поведения
+        behavior_weights = self.behavior_weights_by_risk[risk_attitude]
+
+        financial_behavior = rng.choices(self.financial_behaviors, weights=behavior_weights)[0]
+
+        # Используем базу знаний для обогащения данных
+        financial_vocabulary = self.knowledge_base.get_vocabulary_for_level(financial_literacy, 15, rng=rng)
+        financial_misconceptions = self.knowledge_base.get_misconceptions_for_level(financial_literacy, rng=rng)
+        behavior_patterns = self.knowledge_base.get_behavior_patterns(financial_behavior, rng=rng)
+        financial_goals = self.knowledge_base.get_random_financial_goals(2, rng=rng)
+
+        # Сборка полной персоны
+        persona = {
+            "Пол": gender,
+            "Возраст": age,
+            "Регион": region,
+            "Город": city,
+            "Профессия": rng.choice(self.professions),
+            "Образование": education,
+            "Семейное положение": family_status,
+            "Количество детей": num_children,
+            "Доход": income,
+            "Увлечения": hobbies,
+            "Финансовый профиль": {
+                "Уровень финансовой грамотности": financial_literacy,
+                "Используемые продукты": financial_products,
+                "Отношение к финансам": {
+                    "Доверие к банкам": bank_trust,
+                    "Отношение к кредитам": loan_attitude,
+                    "Отношение к риску": risk_attitude,
+                    "Модель финансового поведения": financial_behavior
+                },
+                "Финансовые знания": {
+                    "Словарный запас": financial_vocabulary,
+                    "Заблуждения": financial_misconceptions
+                },
+                "Финансовые цели": financial_goals,
+                "Поведенческие паттерны": behavior_patterns
+            }
+        }
+
+        # Улучшаем персону дополнительными факторами
+        enhanced_persona = self.enhanced_respondent.enhance_persona(persona, rng=rng)
+
+        return enhanced_persona
+
+    def _cohort_tables(self, weighted: bool = True) -> Dict[str, np.ndarray]:
+        """
+        Таблицы накопленных весов для пакетной генерации персон (строятся один раз и кэшируются)
+
+        Args:
+            weighted: Использовать взвешенное распределение (как в generate_persona)
+
+        Returns:
+            Словарь массивов с условными распределениями
+        """
+        if weighted in self._cohort_tables_cache:
+            return self._cohort_tables_cache[weighted]
+
+        # Плоский список городов: город региона r - это элемент city_offsets[r] + k
+        self._flat_cities = []
+        city_offsets, city_counts = [], []
+        for region in self.regions:
+            region_cities = self.cities.get(region, ["Не указан"])
+            city_offsets.append(len(self._flat_cities))
+            city_counts.append(len(region_cities))
+            self._flat_cities.extend(region_cities)
+
+        def uniform(size):
+            return [1.0] * size
+
+        def bounds(table):
+            return np.array([row[0] for row in table[:-1]])
+
+        # Отношение к риску: строки для обычного и высокого дохода по каждой возрастной группе
+        risk_rows = []
+        for _, weights in self.risk_by_age:
+            risk_rows.append(weights)
+            risk_rows.append([max(0.1, weights[0] - 0.2), weights[1], min(0.6, weights[2] + 0.2)])
+
+        # Вероятность отсутствия детей для каждого семейного статуса
+        no_children = []
+        for status in self.family_statuses:
+            weight = self.no_children_default_weight
+            for status_part, status_weight in self.no_children_weights:
+                if status_part in status:
+                    weight = status_weight
+                    break
+            no_children.append(weight)
+
+        tables = {
+            "gender": cumulative_weights([self.gender_weights if weighted else uniform(len(self.gender_options))]),
+            "age_group": cumulative_weights([self.age_group_weights if weighted else uniform(len(self.age_groups))]),
+            "age_low": np.array([group[0] for group in self.age_groups]),
+            "age_high": np.array([group[1] for group in self.age_groups]),
+            "region": cumulative_weights([self.region_weights if weighted else uniform(len(self.regions))]),
+            "city_offsets": np.array(city_offsets),
+            "city_counts": np.array(city_counts),
+            "income_bounds": bounds(self.income_by_age),
+            "income_mean": np.array([row[1] for row in self.income_by_age]),
+            "income_std": np.array([row[2] for row in self.income_by_age]),
+            "education_bounds": bounds(self.education_by_age),
+            "education": cumulative_weights([row[1] for row in self.education_by_age], len(self.education_levels)),
+            "family_bounds": bounds(self.family_by_age),
+            "family": cumulative_weights([row[1] for row in self.family_by_age]),
+            "no_children": np.array(no_children),
+            "hobby_count": cumulative_weights([self.hobby_count_weights]),
+            "education_factor": np.array([self.education_literacy_factors.get(e, 0.5) for e in self.education_levels]),
+            "income_factor": np.array([self.income_literacy_factors.get(i, 0.5) for i in self.income_brackets]),
+            "literacy_thresholds": np.array(self.literacy_thresholds),
+            "trust": cumulative_weights([self.trust_weights_by_literacy[l] for l in self.financial_literacy_levels]),
+            "loan": cumulative_weights([self.loan_weights_by_literacy[l] for l in self.financial_literacy_levels]),
+            "risk_bounds": bounds(self.risk_by_age),
+            "risk": cumulative_weights(risk_rows),
+            "behavior": cumulative_weights([self.behavior_weights_by_risk[r] for r in self.risk_attitudes])
+        }
+
+        self._cohort_tables_cache[weighted] = tables
+        return tables
+
+    def generate_cohort(self, n: int, weighted: bool = True, seed: Optional[int] = None,
+                        enhance: bool = True) -> PersonaCohort:
+        """
+        Пакетная генерация когорты персон с векторизованной выборкой NumPy
+
+        Распределения совпадают с generate_persona, но все атрибуты выбираются сразу для всей
+        когорты по колонкам. Словари персон собираются лениво при обращении к элементам когорты.
+
+        Args:
+            n: Количество персон
+            weighted: Использовать взвешенное распределение для реалистичности
+            seed: Зерно генератора случайных чисел (для воспроизводимости)
+            enhance: Расширять ли персоны дополнительными факторами (как generate_persona)
+
+        Returns:
+            PersonaCohort - последовательность персон в формате словарей
+        """
+        if n < 0:
+            raise ValueError("Количество персон не может быть отрицательным")
+
+        rng = spawn_generator(seed, RNG_STREAM_PERSONA)
+        t = self._cohort_tables(weighted)
+
+        # Демография
+        gender = sample_categorical(rng, t["gender"], size=n)
+        age_group = sample_categorical(rng, t["age_group"], size=n)
+        age = rng.integers(t["age_low"][age_group], t["age_high"][age_group] + 1)
+
+        region = sample_categorical(rng, t["region"], size=n)
+        city = t["city_offsets"][region] + (rng.random(n) * t["city_counts"][region]).astype(np.int64)
+
+        # Доход: нормальное распределение индекса, параметры зависят от возраста (int() отбрасывает дробную часть)
+        income_row = np.searchsorted(t["income_bounds"], age, side="right")
+        income = rng.normal(t["income_mean"][income_row], t["income_std"][income_row])
+        income = np.clip(np.trunc(income), 0, len(self.income_brackets) - 1).astype(np.int64)
+
+        education = sample_categorical(rng, t["education"], np.searchsorted(t["education_bounds"], age, side="right"))
+        family_status = sample_categorical(rng, t["family"], np.searchsorted(t["family_bounds"], age, side="right"))
+
+        # Дети: с вероятностью no_children детей нет, иначе равномерно от 1 до max_children
+        max_children = np.clip((age - 18) // 5, 0, 5)
+        no_children = np.where(age < 22, self.no_children_weights[0][1], t["no_children"][family_status])
+        children = np.where(
+            (rng.random(n) < no_children) | (max_children == 0),
+            0,
+            1 + (rng.random(n) * max_children).astype(np.int64)
+        )
+
+        hobby_count = 1 + sample_categorical(rng, t["hobby_count"], size=n)
+        hobbies = sample_prefix_without_replacement(
+            rng, np.full(n, len(self.hobby_options)), hobby_count, 3
+        )
+
+        profession = rng.integers(0, len(self.professions), size=n)
+
+        # Финансовая грамотность
+        age_factor = np.clip((age - 18) / 40, 0.1, 1.0)
+        literacy_score = (t["education_factor"][education] * 0.4 + age_factor * 0.3
+                          + t["income_factor"][income] * 0.3) * rng.uniform(0.7, 1.3, size=n)
+        literacy = np.searchsorted(t["literacy_thresholds"], literacy_score, side="right")
+
+        # Продукты (порядок колонок - PERSONA_PRODUCT_NAMES)
+        mortgage_chance = 0.01 + 0.15 * ((age >= 25) & (age <= 50)) + 0.15 * (income >= 3)
+        product_chances = np.column_stack([
+            0.5 + literacy * 0.1,
+            0.1 + literacy * 0.15,
+            0.15 + literacy * 0.1,
+            mortgage_chance,
+            0.05 + literacy * 0.2,
+            0.01 + (literacy ** 2) * 0.05,
+            0.05 + literacy * 0.15
+        ])
+        products = rng.random((n, len(PERSONA_PRODUCT_NAMES))) < product_chances
+
+        # Отношение к финансам
+        trust = sample_categorical(rng, t["trust"], literacy)
+        loan = sample_categorical(rng, t["loan"], literacy)
+        risk_row = np.searchsorted(t["risk_bounds"], age, side="right") * 2 + (income >= self.high_income_risk_idx)
+        risk = sample_categorical(rng, t["risk"], risk_row)
+        behavior = sample_categorical(rng, t["behavior"], risk)
+
+        # Знания и цели из базы знаний
+        kb = self.knowledge_base
+        columns = {
+            "gender": gender.astype(np.int8),
+            "age": age.astype(np.int16),
+            "region": region.astype(np.int8),
+            "city": city.astype(np.int16),
+            "profession": profession.astype(np.int8),
+            "education": education.astype(np.int8),
+            "family_status": family_status.astype(np.int8),
+            "children": children.astype(np.int8),
+            "income": income.astype(np.int8),
+            "hobbies": hobbies.astype(np.int8),
+            "literacy": literacy.astype(np.int8),
+            "products": products,
+            "trust": trust.astype(np.int8),
+            "loan": loan.astype(np.int8),
+            "risk": risk.astype(np.int8),
+            "behavior": behavior.astype(np.int8),
+            "vocabulary": kb.sample_vocabulary_batch(literacy, rng, 15).astype(np.int16),
+            "misconceptions": kb.sample_misconceptions_batch(literacy, rng).astype(np.int16),
+            "goals": kb.sample_goals_batch(n, rng, 2).astype(np.int16)
+        }
+
+        # Дополнительные факторы (искажения, эмоции, лингвистика, непоследовательность) - тоже по колонкам
+        if enhance:
+            columns.update(self.enhanced_respondent.enhance_cohort(columns, rng))
+
+        return PersonaCohort(self, columns, enhance=enhance)
+
+    def load_questions(self, file_data, file_format: Optional[str] = None) -> "QuestionTable":
+        """
+        Загрузка вопросов из файла Excel, CSV, JSONL или Parquet (см. load_questions)
+
+        Args:
+            file_data: Путь к файлу, загруженный файл, файловый объект или байты
+            file_format: Формат файла (по умолчанию определяется автоматически)
+
+        Returns:
+            Неизменяемая таблица вопросов
+        """
+        return load_questions(file_data, file_format)
+
+    def _classify_question_topic(self, question_text: str) -> str:
+        """
+        Определение финансовой темы вопроса по ключевым словам
+
+        Args:
+            question_text: Текст вопроса
+
+        Returns:
+            Название темы из financial_topic_mapping
+        """
+        return classify_question_topic(question_text)
+
+    def prepare_questions(self, raw_questions: List[Any]) -> List[Dict]:
+        """
+        Приведение вопросов, переданных программно (например, через HTTP API), к внутреннему формату
+
+        Args:
+            raw_questions: Список строк или словарей с ключами text/question, type, topic, options, context
+
+        Returns:
+            Список словарей с вопросами в том же формате, что возвращает load_questions
+
+        Raises:
+            ValueError: Если вопрос некорректен или ID вопросов повторяются (в том числе с позиционными ID)
+        """
+        questions = []
+        seen_ids = set()
+
+        for idx, raw in enumerate(raw_questions):
+            if isinstance(raw, str):
+                raw = {"text": raw}
+            if not isinstance(raw, dict):
+                raise ValueError(f"Вопрос #{idx + 1} должен быть строкой или словарем")
+
+            text = raw.get("text", raw.get("question"))
+            if not text:
+                raise ValueError(f"У вопроса #{idx + 1} отсутствует текст")
+
+            options = raw.get("options") or []
+            if isinstance(options, str):
+                options = options.split(',')
+
+            question_id = raw.get("id", idx + 1)
+            if question_id in seen_ids:
+                raise ValueError(f"Повторяющийся ID вопроса #{idx + 1}: {question_id} "
+                                 "(вопросы без явного ID нумеруются по позиции)")
+            seen_ids.add(question_id)
+
+            questions.append({
+                "id": question_id,
+                "text": text,
+                "type": raw.get("type", "open"),
+                "topic": raw.get("topic") or self._classify_question_topic(text),
+                "options": list(options),
+                "context": raw.get("context", "")
+            })
+
+        return questions
+
+    def set_prompt_profile(self, profile: str) -> None:
+        """
+        Выбор профиля промпта
+
+        Args:
+            profile: 'full' - полный промпт, 'compact' - сокращенные разделы для экономии входных токенов
+
+        Raises:
+            ValueError: Если профиль неизвестен
+        """
+        if profile not in PROMPT_PROFILES:
+            raise ValueError(f"Неизвестный профиль промпта: {profile} (доступны: {', '.join(PROMPT_PROFILES)})")
+        self.prompting_params["prompt_profile"] = profile
+
+    def load_bank_reviews(self, file_data) -> bool:
+        """
+        Загрузка и анализ отзывов о банках
+
+        Args:
+            file_data: Данные Excel файла с отзывами
+
+        Returns:
+            True если загрузка прошла успешно, иначе False
+        """
+        try:
+            self.reviews_analyzer.load_reviews(file_data)
+
+            # Извлекаем данные для улучшения промптов
+            self.prompting_params["prompt_data"] = self.reviews_analyzer.extract_prompting_data()
+            self.prompting_params["use_reviews_data"] = True
+
+            self.notify(f"Загружено и проанализировано {len(self.reviews_analyzer.reviews_data)} отзывов о банках",
+                        level="info")
+            return True
+        except Exception as e:
+            self.notify(f"Ошибка при загрузке отзывов о банках: {str(e)}", level="error")
+            return False
+
+    def _format_persona_for_prompt(self, persona: Dict, compact: bool = False) -> str:
+        """
+        Форматирование персоны для использования в промпте
+
+        Args:
+            persona: Словарь с данными персоны
+            compact: Сокращенная запись (компактный профиль промпта)
+
+        Returns:
+            Строка с отформатированной информацией о персоне
+        """
+        if compact:
+            return self._format_persona_compact(persona)
+
+        # Базовая демографическая информация
+        basic_info = [
+            f"Пол: {persona['Пол']}",
+            f"Возраст: {persona['Возраст']}",
+            f"Город: {persona['Город']} ({persona['Регион']})",
+            f"Профессия: {persona['Профессия']}",
+            f"Образование: {persona['Образование']}",
+            f"Семейное положение: {persona['Семейное положение']}",
+            f"Количество детей: {persona['Количество детей']}",
+            f"Доход: {persona['Доход']}"
+        ]
+
+        if 'Увлечения' in persona and persona['Увлечения']:
+            basic_info.append(f"Увлечения: {', '.join(persona['Увлечения'])}")
+
+        # Финансовый профиль
+        financial_profile = []
+        if 'Финансовый профиль' in persona:
+            fp = persona['Финансовый профиль']
+
+            financial_profile.append(f"Уровень финансовой грамотности: {fp.get('Уровень финансовой грамотности', 'средний')}")
+
+            # Используемые продукты
+            products_used = []
+            for product, used in fp.get('Используемые продукты', {}).items():
+                if used:
+                    products_used.append(product)
+
+            if products_used:
+                financial_profile.append(f"Используемые финансовые продукты: {', '.join(products_used)}")
+            else:
+                financial_profile.append("Не использует банковские продукты")
+
+            # Отношение к финансам
+            if 'Отношение к финансам' in fp:
+                for key, value in fp['Отношение к финансам'].items():
+                    financial_profile.append(f"{key}: {value}")
+
+            # Финансовые цели
+            if 'Финансовые цели' in fp and fp['Финансовые цели']:
+                financial_profile.append(f"Финансовые цели: {', '.join(fp['Финансовые цели'])}")
+
+        # Собираем все вместе
+        formatted_persona = "БАЗОВАЯ ИНФОРМАЦИЯ:\n" + "\n".join(basic_info)
+        formatted_persona += "\n\nФИНАНСОВЫЙ ПРОФИЛЬ:\n" + "\n".join(financial_profile)
+
+        # Добавляем поведенческие паттерны, если есть
+        if 'Финансовый профиль' in persona and 'Поведенческие паттерны' in persona['Финансовый профиль']:
+            patterns = persona['Финансовый профиль']['Поведенческие паттерны']
+            if patterns:
+                formatted_persona += "\n\nПОВЕДЕНЧЕСКИЕ ПАТТЕРНЫ:\n" + "\n".join([f"- {p}" for p in patterns])
+
+        # Добавляем заблуждения, если необходимо
+        if ('Финансовый профиль' in persona and 'Финансовые знания' in persona['Финансовый профиль'] and
+            'Заблуждения' in persona['Финансовый профиль']['Финансовые знания']):
+
+            misconceptions = persona['Финансовый профиль']['Финансовые знания']['Заблуждения']
+            if misconceptions:
+                formatted_persona += "\n\nВОЗМОЖНЫЕ ФИНАНСОВЫЕ ЗАБЛУЖДЕНИЯ:\n" + "\n".join([f"- {m}" for m in misconceptions])
+
+        return formatted_persona
+
+    def _format_persona_compact(self, persona: Dict) -> str:
+        """
+        Сокращенное форматирование персоны: основные поля в несколько строк, без пустых значений
+
+        Args:
+            persona: Словарь с данными персоны
+
+        Returns:
+            Строка с отформатированной информацией о персоне
+        """
+        fp = persona.get('Финансовый профиль', {})
+        attitudes = fp.get('Отношение к финансам', {})
+        products = [product for product, used in fp.get('Используемые продукты', {}).items() if used]
+
+        lines = [
+            f"{persona['Пол']}, {persona['Возраст']} лет, {persona['Город']} ({persona['Регион']}), "
+            f"{persona['Профессия']}, образование: {persona['Образование']}",
+            f"{persona['Семейное положение']}, детей: {persona['Количество детей']}, доход: {persona['Доход']}"
+        ]
+        if persona.get('Увлечения'):
+            lines.append(f"Увлечения: {', '.join(persona['Увлечения'])}")
+
+        lines.append(f"Грамотность: {fp.get('Уровень финансовой грамотности', 'средний')}; "
+                     f"продукты: {', '.join(products) if products else 'нет'}")
+        if attitudes:
+            lines.append("; ".join(f"{key}: {value}" for key, value in attitudes.items()))
+        if fp.get('Финансовые цели'):
+            lines.append(f"Цели: {', '.join(fp['Финансовые цели'])}")
+
+        patterns = fp.get('Поведенческие паттерны', [])
+        if patterns:
+            lines.append(f"Поведение: {'; '.join(patterns)}")
+        misconceptions = fp.get('Финансовые знания', {}).get('Заблуждения', [])
+        if misconceptions:
+            lines.append(f"Заблуждения: {'; '.join(misconceptions)}")
+
+        return "\n".join(lines)
+
+    def _base_prompt_sections(self, persona: Dict, question: Dict, persona_text: Optional[str] = None) -> Dict[str, str]:
+        """
+        Разделы базового промпта с учетом финансовой грамотности (слоты PromptCompiler)
+
+        Args:
+            persona: Словарь с данными персоны
+            question: Словарь с вопросом
+            persona_text: Заранее отформатированные характеристики персоны (опционально)
+
+        Returns:
+            Словарь {слот: текст}
+        """
+        # Форматируем данные о персоне
+        if persona_text is None:
+            compact = self.prompting_params.get("prompt_profile") == "compact"
+            persona_text = self._format_persona_for_prompt(persona, compact=compact)
+        persona_str = persona_text
+
+        # Получаем уровень финансовой грамотности
+        literacy_level = persona.get('Финансовый профиль', {}).get('Уровень финансовой грамотности', 'средний')
+
+        # Словарный запас для уровня
+        vocab_examples = persona.get('Финансовый профиль', {}).get('Финансовые знания', {}).get('Словарный запас', [])
+
+        # Определяем тему вопроса
+        question_topic = question.get('topic', 'общие')
+        if question_topic not in self.financial_topic_mapping:
+            question_topic = "общие"
+
+        # Добавляем контекстную информацию из отзывов о банках, если доступно
+        context_from_reviews = ""
+        if self.prompting_params["use_reviews_data"]:
+            prompt_data = self.prompting_params["prompt_data"]
+
+            relevant_terms = []
+            if question_topic in prompt_data.get("categorized_terms", {}):
+                relevant_terms = prompt_data["categorized_terms"][question_topic][:5]
+            else:
+                relevant_terms = prompt_data.get("banking_terms", [])[:5]
+
+            # Добавляем релевантные проблемы из отзывов
+            relevant_issues = prompt_data.get("common_issues", [])[:3]
+
+            if relevant_terms or relevant_issues:
+                context_from_reviews = "\nКОНТЕКСТ ИЗ ОТЗЫВОВ КЛИЕНТОВ БАНКОВ:\n"
+
+                if relevant_terms:
+                    context_from_reviews += f"Часто упоминаемые термины: {', '.join(relevant_terms)}\n"
+
+                if relevant_issues:
+                    context_from_reviews += f"Типичные проблемы: {'; '.join(relevant_issues)}\n"
+
+        # Статические разделы (вступление, инструкции по грамотности, общие правила) готовы заранее
+        profile = self.prompting_params.get("prompt_profile", "full")
+        sections = dict(self.prompt_compiler.static_sections(literacy_level, profile))
+        sections["persona"] = f"{persona_str}\n"
+        sections["reviews_context"] = context_from_reviews
+        sections["question"] = f"\n\nВОПРОС:\n{question['text']}\n\n"
+
+        # Добавляем примеры словарного запаса для подсказки
+        if vocab_examples:
+            sections["vocabulary"] = f"\nПРИМЕРЫ ФИНАНСОВЫХ ТЕРМИНОВ, КОТОРЫЕ ТЫ МОЖЕШЬ ИСПОЛЬЗОВАТЬ:\n{', '.join(vocab_examples)}\n"
+
+        # Добавляем подсказку для эмоционального окраса ответа
+        behavior = persona.get('Финансовый профиль', {}).get('Отношение к финансам', {}).get('Модель финансового поведения', 'прагматичный')
+        sections["behavior"] = BEHAVIOR_PROMPT_HINTS.get(behavior, "")
+
+        if profile == "compact":
+            for slot in ("persona", "reviews_context", "question", "vocabulary", "behavior"):
+                sections[slot] = compact_prompt_text(sections.get(slot, ""))
+
+        return sections
+
+    def _generate_enhanced_prompt(self, persona: Dict, question: Dict, persona_text: Optional[str] = None) -> str:
+        """
+        Генерация базового промпта с учетом финансовой грамотности
+
+        Args:
+            persona: Словарь с данными персоны
+            question: Словарь с вопросом
+            persona_text: Заранее отформатированные характеристики персоны (опционально)
+
+        Returns:
+            Строка с подготовленным промптом
+        """
+        return self.prompt_compiler.compile(self._base_prompt_sections(persona, question, persona_text))
+
+    def _resolve_temperature(self, persona: Dict, temperature: Optional[float] = None,
+                             rng: Optional[random.Random] = None) -> float:
+        """
+        Определение температуры генерации с учетом уровня финансовой грамотности
+
+        Args:
+            persona: Словарь с данными персоны
+            temperature: Явно заданная температура (опционально)
+            rng: Генератор случайных чисел (random.Random; по умолчанию - глобальный модуль random)
+
+        Returns:
+            Температура в диапазоне 0.0-1.0
+        """
+        rng = rng or random
+        if temperature is None:
+            literacy_level = persona.get('Финансовый профиль', {}).get('Уровень финансовой грамотности', 'средний')
+            literacy_levels = ["отсутствие знаний", "начинающий", "средний", "продвинутый", "эксперт"]
+            literacy_index = literacy_levels.index(literacy_level) if literacy_level in literacy_levels else 2
+
+            # Более низкая температура для экспертов (более структурированные ответы)
+            # Более высокая для низкой грамотности (более случайные ответы)
+            temperature = self.prompting_params["temperature_max"] - (literacy_index * 0.1)
+
+            # Добавляем немного случайности
+            temperature = min(1.0, max(0.1, temperature + rng.uniform(-0.1, 0.1)))
+
+        # Ограничиваем температуру диапазоном 0.0-1.0 для совместимости с API
+        return min(1.0, max(0.0, temperature))
+
+    def generate_answer(self, persona: Dict, question: Dict,
+                        model: str = None, api_preference: str = None,
+                        temperature: Optional[float] = None, rng: Optional[random.Random] = None,
+                        _enhanced_prompt: Optional[str] = None) -> str:
+        """
+        Генерация ответа через выбранное API
+
+        Args:
+            persona: Словарь с данными персоны
+            question: Словарь с вопросом
+            model: Конкретная модель для использования (опционально)
+            api_preference: Предпочтительное API ('claude' или 'openai')
+            temperature: Температура для генерации (опционально)
+            rng: Генератор случайных чисел задачи (промпт и температура)
+            _enhanced_prompt: Готовый промпт (для внутреннего использования)
+
+        Returns:
+            Сгенерированный ответ
+        """
+        # Создаем уникальный ключ для кэша ответов (готовый промпт определяет ответ, поэтому входит в ключ)
+        cache_key = hashlib.sha256(json.dumps(
+            [persona, question, model, api_preference, temperature, _enhanced_prompt],
+            sort_keys=True, ensure_ascii=False, cls=NumpyEncoder
+        ).encode("utf-8")).hexdigest()
+
+        # Возвращаем кэшированный ответ, если доступен
+        if cache_key in self.response_cache:
+            return self.response_cache[cache_key]
+
+        # Используем предоставленный промпт или генерируем новый
+        if _enhanced_prompt:
+            prompt = _enhanced_prompt
+        else:
+            # Используем расширенную генерацию промпта через EnhancedFinancialRespondent
+            prompt = self.enhanced_respondent.generate_enhanced_prompt(persona, question, rng=rng)
+
+        # Устанавливаем температуру на основе уровня грамотности, если не указана явно
+        temperature = self._resolve_temperature(persona, temperature, rng=rng)
+
+        # Определяем, какое API использовать
+        use_claude = True  # По умолчанию используем Claude, если доступен
+
+        if api_preference == "openai" and self.client_openai:
+            use_claude = False
+        elif api_preference == "claude" and self.client_claude:
+            use_claude = True
+        elif self.client_claude is None and self.client_openai:
+            use_claude = False
+
+        max_retries = 3
+        result = None
+
+        for retry in range(max_retries):
+            try:
+                if use_claude:
+                    # Используем Claude API
+                    # Определяем модель Claude
+                    claude_model = model if model in self.claude_models else self.claude_models[0]
+
+                    response = self._create_claude_message(claude_model, temperature, prompt)
+
+                    result = response.content[0].text
+
+                    # Обновляем счетчик токенов
+                    if hasattr(response, 'usage') and response.usage:
+                        self._record_usage(
+                            "claude", claude_model, response.usage.input_tokens, response.usage.output_tokens,
+                            getattr(response.usage, "cache_read_input_tokens", 0) or 0,
+                            getattr(response.usage, "cache_creation_input_tokens", 0) or 0
+                        )
+                        self._record_output_tokens(persona, question, response.usage.output_tokens)
+                else:
+                    # Используем OpenAI API
+                    # Определяем модель OpenAI
+                    openai_model = model if model in self.openai_models else self.openai_models[0]
+
+                    response = self._create_openai_completion(openai_model, temperature, prompt)
+
+                    result = response.choices[0].message.content
+
+                    # Обновляем счетчик токенов
+                    if hasattr(response, 'usage') and response.usage:
+                        # В OpenAI prompt_tokens включает кэшированные токены
+                        cached_tokens = getattr(getattr(response.usage, "prompt_tokens_details", None),
+                                                "cached_tokens", 0) or 0
+                        self._record_usage(
+                            "openai", openai_model, response.usage.prompt_tokens - cached_tokens,
+                            response.usage.completion_tokens, cached_tokens
+                        )
+                        self._record_output_tokens(persona, question, response.usage.completion_tokens)
+
+                # Кэшируем ответ
+                self.response_cache[cache_key] = result
+
+                return result
+
+            except Exception as e:
+                if retry < max_retries - 1:
+                    # Экспоненциальная задержка перед повторной попыткой
+                    wait_time = 2 ** retry
+                    self.notify(f"Повторная попытка через {wait_time} секунд...")
+                    time.sleep(wait_time)
+
+                    # Если ошибка связана с API Claude, попробуем OpenAI, и наоборот
+                    if use_claude and self.client_openai:
+                        use_claude = False
+                        self.notify(f"Ошибка с Claude API, переключаемся на OpenAI: {str(e)}")
+                    elif not use_claude and self.client_claude:
+                        use_claude = True
+                        self.notify(f"Ошибка с OpenAI API, переключаемся на Claude: {str(e)}")
+                else:
+                    error_msg = f"""
+                    Невозможно сгенерировать ответ после {max_retries} попыток.
+                    Технические детали: {str(e)}
+
+                    Возможные причины:
+                    1. Неверный API-ключ
+                    2. Проблемы с подключением
+                    3. Временные ограничения сервиса
+
+                    Пожалуйста, проверьте:
+                    - Корректность API-ключа
+                    - Наличие доступа к сервису
+                    - Текущий статус сервиса API
+                    """
+                    return error_msg
+
+        return "Не удалось сгенерировать ответ после нескольких попыток."
+
+    def notify(self, message: str, level: str = "warning") -> None:
+        """
+        Сообщение о ходе генерации (повторы запросов, смена провайдера, ошибки)
+
+        Генерация выполняется в фоновых потоках и без Streamlit (API заданий, CLI, воркеры очереди),
+        поэтому сообщение пишется в журнал модуля и передается в notice_callback, если он задан.
+
+        Args:
+            message: Текст сообщения
+            level: Уровень ('info', 'warning' или 'error')
+        """
+        getattr(logger, level)(message)
+        callback = self.notice_callback
+        if callback is not None:
+            callback(level, message)
+
+    def _partial_answer_handler(self) -> Optional[Callable[[str], None]]:
+        """Обработчик частичного текста для запроса текущего потока (None - ответ запрашивается целиком)"""
+        answer_id = getattr(self._stream_task, "answer_id", None)
+        callback = self.partial_answer_callback
+        if not self.prompting_params.get("stream_responses") or callback is None or answer_id is None:
+            return None
+        return lambda text: callback(answer_id, text)
+
+    def _create_claude_message(self, model: str, temperature: float, prompt: str):
+        """
+        Запрос к Claude API (потоковый, если включен stream_responses и задан partial_answer_callback)
+
+        Args:
+            model: Модель Claude
+            temperature: Температура генерации
+            prompt: Текст промпта
+
+        Returns:
+            Сообщение в формате messages.create (текст и usage)
+        """
+        request = {
+            "model": model,
+            "max_tokens": self.prompting_params["max_tokens"],
+            "temperature": temperature,
+            "messages": [{"role": "user", "content": prompt}]
+        }
+        on_partial = self._partial_answer_handler()
+        if on_partial is None:
+            return self.client_claude.messages.create(**request)
+
+        text = ""
+        with self.client_claude.messages.stream(**request) as stream:
+            for delta in stream.text_stream:
+                text += delta
+                on_partial(text)
+            return stream.get_final_message()
+
+    def _create_openai_completion(self, model: str, temperature: float, prompt: str):
+        """
+        Запрос к OpenAI API (потоковый, если включен stream_responses и задан partial_answer_callback)
+
+        Args:
+            model: Модель OpenAI
+            temperature: Температура генерации
+            prompt: Текст промпта
+
+        Returns:
+            Ответ в формате chat.completions.create (текст и usage)
+        """
+        request = {
+            "model": model,
+            "max_tokens": self.prompting_params["max_tokens"],
+            "temperature": temperature,
+            "messages": [{"role": "user", "content": prompt}]
+        }
+        on_partial = self._partial_answer_handler()
+        if on_partial is None:
+            return self.client_openai.chat.completions.create(**request)
+
+        # Использование токенов приходит последним фрагментом потока
+        text, usage = "", None
+        for chunk in self.client_openai.chat.completions.create(
+                **request, stream=True, stream_options={"include_usage": True}):
+            if chunk.choices and chunk.choices[0].delta.content:
+                text += chunk.choices[0].delta.content
+                on_partial(text)
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=usage)
+
+    def generate_realistic_answer(self, persona_id: str, persona: Dict, question: Dict,
+                                 question_index: int = 0, **kwargs) -> str:
+        """
+        Генерация реалистичного ответа с учетом всех факторов
+
+        Args:
+            persona_id: Уникальный идентификатор персоны
+            persona: Словарь с данными персоны
+            question: Словарь с вопросом
+            question_index: Индекс вопроса в последовательности
+            **kwargs: Дополнительные параметры для метода generate_answer
+
+        Returns:
+            Сгенерированный ответ
+        """
+        return self.enhanced_respondent.generate_realistic_answer(
+            persona_id, persona, question, question_index, **kwargs
+        )
+
+    def generate_task_answer(self, i: int, persona: Dict, j: int, question: Dict, num_questions: int,
+                             api_preference: Optional[str] = None, use_enhanced: bool = True,
+                             seed: Optional[int] = None) -> Dict:
+        """
+        Генерация ответа одной персоны на один вопрос (одна задача пакета)
+
+        Args:
+            i: Индекс персоны в пакете
+            persona: Словарь с персоной
+            j: Индекс вопроса в пакете (используется для моделирования усталости)
+            question: Словарь с вопросом
+            num_questions: Общее количество вопросов в пакете (для вычисления ID ответа)
+            api_preference: Предпочтительное API ('claude' или 'openai')
+            use_enhanced: Использовать ли улучшенное генерирование ответов
+            seed: Зерно запуска (None - без фиксации)
+
+        Returns:
+            Словарь с ответом (при ошибке содержит флаг error)
+        """
+        task_rng = spawn_rng(seed, RNG_STREAM_TASK, i, j)
+        try:
+            self._request_usage.last = None
+            self._request_usage.records = []
+            started = time.perf_counter()
+            # Используем улучшенную генерацию ответов, если запрошено
+            if use_enhanced:
+                answer_text = self.generate_realistic_answer(
+                    str(i), persona, question, j,
+                    api_preference=api_preference,
+                    rng=task_rng, enhance_rng=spawn_rng(seed, RNG_STREAM_ENHANCE, i),
+                    postprocess_rng=spawn_rng(seed, RNG_STREAM_POSTPROCESS, i, j)
+                )
+            else:
+                answer_text = self.generate_answer(
+                    persona, question, api_preference=api_preference, rng=task_rng
+                )
+            latency = time.perf_counter() - started
+
+            answer = {
+                "id": i * num_questions + j + 1,
+                "persona_id": i + 1,
+                "question": question,
+                "text": answer_text,
+                "timestamp": datetime.now().isoformat()
+            }
+            # Модель и токены - как в generate_prompt_answer (ответ из кэша их не содержит)
+            if self._request_usage.last is not None:
+                provider, model, input_tokens, output_tokens = self._request_usage.last
+                answer.update({
+                    "model": model,
+                    "provider": provider,
+                    "latency": latency,
+                    "input_tokens": input_tokens,
+                    "output_tokens": output_tokens
+                })
+            return answer
+        except Exception as e:
+            return {
+                "id": i * num_questions + j + 1,
+                "persona_id": i + 1,
+                "question": question,
+                "text": f"ОШИБКА: {str(e)}",
+                "timestamp": datetime.now().isoformat(),
+                "error": True
+            }
+
+    def build_prompt_entries(self, persona_items: List[Tuple[int, Dict]], questions: List[Dict], num_questions: int,
+                             api_preference: Optional[str] = None, use_enhanced: bool = True,
+                             seed: Optional[int] = None) -> List[Dict]:
+        """
+        Построение промптов для группы персон (все вопросы каждой персоны по порядку)
+
+        Вопросы одной персоны обрабатываются последовательно, чтобы сохранить
+        накопление усталости в профиле непоследовательности. При заданном зерне расширение персоны
+        и каждая задача используют собственные потоки случайных чисел (spawn_rng), поэтому промпты
+        не зависят от разбиения на порции и количества процессов.
+
+        Args:
+            persona_items: Список пар (индекс персоны в пакете, персона)
+            questions: Список словарей с вопросами
+            num_questions: Общее количество вопросов в пакете (для вычисления ID задачи)
+            api_preference: Предпочтительное API ('claude' или 'openai')
+            use_enhanced: Использовать ли улучшенное генерирование ответов
+            seed: Зерно запуска (None - без фиксации)
+
+        Returns:
+            Список записей набора промптов
+        """
+        api = api_preference or "claude"
+        model = self.openai_models[0] if api == "openai" else self.claude_models[0]
+
+        entries = []
+        for i, persona in persona_items:
+            # Копия персоны: расширение профиля и накопление усталости не затрагивают исходные данные
+            # (так же ведет себя построение в пуле процессов)
+            persona = copy.deepcopy(persona)
+            persona_rng = spawn_rng(seed, RNG_STREAM_ENHANCE, i)
+
+            # Та же логика, что и в EnhancedFinancialRespondent.generate_realistic_answer:
+            # персона расширяется один раз, и расширенный профиль используется для всех ее вопросов
+            prompt_persona = persona
+            if use_enhanced and not persona.get('Финансовый профиль', {}).get('Когнитивные искажения'):
+                prompt_persona = self.enhanced_respondent.enhance_persona(persona, rng=persona_rng)
+
+            # Сессия персоны: контекст и блоки промпта готовятся один раз, каждый вопрос только собирается
+            session = self.enhanced_respondent.create_session(prompt_persona, len(questions), rng=persona_rng)
+
+            for j, question in enumerate(questions):
+                task_rng = spawn_rng(seed, RNG_STREAM_TASK, i, j)
+                sections = session.build_sections(question, j if use_enhanced else 0, rng=task_rng)
+                prompt = self.prompt_compiler.compile(sections)
+
+                entries.append({
+                    "task_id": i * num_questions + j,
+                    "persona_idx": i,
+                    "question_idx": j,
+                    "persona": prompt_persona,
+                    "question": question,
+                    "prompt": prompt,
+                    "prompt_hash": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+                    "section_sizes": self.prompt_compiler.section_sizes(sections),
+                    "api": api,
+                    "model": model,
+                    "temperature": self._resolve_temperature(prompt_persona, rng=task_rng),
+                    "max_tokens": self.prompting_params["max_tokens"],
+                    "use_enhanced": use_enhanced
+                })
+                if self.prompting_params.get("local_postprocessing"):
+                    # Зерно для потока постобработки, который применяется на стадии отправки
+                    entries[-1]["postprocess_seed"] = seed
+
+        return entries
+
+    def build_prompt_set(self, personas: List[Dict], questions: List[Dict], api_preference: Optional[str] = None,
+                         use_enhanced: bool = True, workers: Optional[int] = None,
+                         seed: Optional[int] = None) -> List[Dict]:
+        """
+        Стадия построения промптов: формирует набор промптов для всех задач пакета
+
+        Построение промптов - чистая CPU-работа, поэтому при workers > 1 она выполняется
+        в пуле процессов порциями по персонам и не конкурирует за GIL с сетевыми запросами.
+
+        Args:
+            personas: Список словарей с персонами
+            questions: Список словарей с вопросами
+            api_preference: Предпочтительное API ('claude' или 'openai')
+            use_enhanced: Использовать ли улучшенное генерирование ответов
+            workers: Количество процессов (None - по числу ядер, 0 или 1 - в текущем процессе)
+            seed: Зерно запуска: одинаковые зерно и входные данные дают побайтно одинаковые промпты
+
+        Returns:
+            Список записей набора промптов, отсортированный по ID задачи
+        """
+        num_questions = len(questions)
+        persona_items = list(enumerate(personas))
+
+        cache_key = self.prompt_set_cache_key(personas, questions, api_preference, use_enhanced, seed)
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(persona_items))
+
+        # Для небольших пакетов запуск процессов обходится дороже самого построения
+        if workers <= 1 or len(persona_items) * num_questions < self.prompt_pool_min_tasks:
+            entries = self.build_prompt_entries(
+                persona_items, questions, num_questions, api_preference, use_enhanced, seed
+            )
+        else:
+            entries = self._build_prompt_entries_in_pool(
+                persona_items, questions, num_questions, api_preference, use_enhanced, workers, seed
+            )
+
+        entries.sort(key=lambda x: x["task_id"])
+        for entry in entries:
+            entry["prompt_set_key"] = cache_key
+        return entries
+
+    def _build_prompt_entries_in_pool(self, persona_items: List[Tuple[int, Dict]], questions: List[Dict],
+                                      num_questions: int, api_preference: Optional[str], use_enhanced: bool,
+                                      workers: int, seed: Optional[int] = None) -> List[Dict]:
+        """
+        Построение промптов в пуле процессов порциями по персонам
+
+        Args:
+            persona_items: Список пар (индекс персоны в пакете, персона)
+            questions: Список словарей с вопросами
+            num_questions: Общее количество вопросов в пакете
+            api_preference: Предпочтительное API ('claude' или 'openai')
+            use_enhanced: Использовать ли улучшенное генерирование ответов
+            workers: Количество процессов
+            seed: Зерно запуска (None - без фиксации)
+
+        Returns:
+            Список записей набора промптов
+        """
+        # Порции по несколько персон: меньше накладных расходов на передачу данных между процессами
+        chunk_size = max(1, math.ceil(len(persona_items) / (workers * 4)))
+        chunks = [persona_items[k:k + chunk_size] for k in range(0, len(persona_items), chunk_size)]
+
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_prompt_builder,
+                initargs=(self.prompting_params,)
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        _build_prompt_chunk, chunk, questions, num_questions, api_preference, use_enhanced, seed
+                    )
+                    for chunk in chunks
+                ]
+                return [entry for future in futures for entry in future.result()]
+        except (concurrent.futures.BrokenExecutor, pickle.PicklingError, AttributeError, TypeError, OSError) as e:
+            # Пул процессов недоступен (например, функции модуля нельзя сериализовать) - строим в текущем процессе
+            logger.warning(f"Пул процессов для построения промптов недоступен, используется текущий процесс: {e}")
+            return self.build_prompt_entries(persona_items, questions, num_questions, api_preference, use_enhanced, seed)
+
+    def generate_prompt_answer(self, entry: Dict) -> Dict:
+        """
+        Стадия отправки: генерация ответа по готовой записи набора промптов
+
+        Args:
+            entry: Запись набора промптов
+
+        Returns:
+            Словарь с ответом (при ошибке содержит флаг error)
+        """
+        i = entry["persona_idx"]
+        question = entry["question"]
+
+        # Контроль бюджета: оценка стоимости запроса до отправки
+        estimated_cost, input_cost = self.estimate_request_cost(entry)
+        if not self.spend_ledger.reserve(estimated_cost, input_cost):
+            return {
+                "id": entry["task_id"] + 1,
+                "persona_id": i + 1,
+                "question": question,
+                "text": "ПРОПУЩЕНО: превышен бюджет запуска",
+                "timestamp": datetime.now().isoformat(),
+                "error": True,
+                "skipped": True
+            }
+
+        try:
+            self._request_usage.last = None
+            self._stream_task.answer_id = entry["task_id"] + 1
+            started = time.perf_counter()
+            answer_text = self.generate_answer(
+                entry["persona"], question,
+                model=entry["model"], api_preference=entry["api"],
+                temperature=entry["temperature"], _enhanced_prompt=entry["prompt"]
+            )
+            latency = time.perf_counter() - started
+            self.spend_ledger.record_prompt_sections(entry.get("section_sizes") or {})
+            if "postprocess_seed" in entry:
+                postprocess_seed = entry["postprocess_seed"]
+                if postprocess_seed is not None and not isinstance(postprocess_seed, int):
+                    # В Parquet отсутствующее зерно читается как NaN
+                    postprocess_seed = None if pd.isna(postprocess_seed) else int(postprocess_seed)
+                answer_text = self.enhanced_respondent.postprocess_answer(
+                    answer_text, entry["persona"],
+                    rng=spawn_rng(postprocess_seed, RNG_STREAM_POSTPROCESS, i, entry["question_idx"]),
+                    # Набор построен без инструкций о шуме в промпте: постобработка не зависит от настроек
+                    # маркетплейса, который отправляет набор
+                    enabled=True
+                )
+            # Ответ из кэша не расходует токены
+            provider, model, input_tokens, output_tokens = self._request_usage.last or (entry["api"], entry["model"], 0, 0)
+            if input_tokens:
+                with self._usage_lock:
+                    self._input_token_calibration[0] += estimate_tokens(entry["prompt"])
+                    self._input_token_calibration[1] += input_tokens
+
+            # Сохраняем ответ в историю персоны, как при улучшенной генерации
+            if entry.get("use_enhanced", True):
+                self.enhanced_respondent.response_history.setdefault(str(i), []).append({
+                    "question": question,
+                    "answer": answer_text,
+                    "timestamp": datetime.now().isoformat()
+                })
+
+            return {
+                "id": entry["task_id"] + 1,
+                "persona_id": i + 1,
+                "question": question,
+                "text": answer_text,
+                "timestamp": datetime.now().isoformat(),
+                "model": model,
+                "provider": provider,
+                "latency": latency,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens
+            }
+        except Exception as e:
+            return {
+                "id": entry["task_id"] + 1,
+                "persona_id": i + 1,
+                "question": question,
+                "text": f"ОШИБКА: {str(e)}",
+                "timestamp": datetime.now().isoformat(),
+                "error": True
+            }
+        finally:
+            self._stream_task.answer_id = None
+            self.spend_ledger.release(estimated_cost)
+
+    def prompt_section_sizes(self, prompt: str) -> Dict[str, int]:
+        """
+        Размеры разделов промпта в символах (разделы выделяются по заголовкам вида "ЗАГОЛОВОК:")
+
+        Args:
+            prompt: Текст промпта
+
+        Returns:
+            Словарь {название раздела: количество символов}
+        """
+        sizes = {}
+        headers = list(PROMPT_SECTION_HEADER_RE.finditer(prompt))
+
+        # Текст до первого заголовка
+        preamble_end = headers[0].start() if headers else len(prompt)
+        if preamble_end:
+            sizes["ВСТУПЛЕНИЕ"] = preamble_end
+
+        for k, header in enumerate(headers):
+            end = headers[k + 1].start() if k + 1 < len(headers) else len(prompt)
+            name = header.group(1).strip()
+            sizes[name] = sizes.get(name, 0) + end - header.start()
+
+        return sizes
+
+    def prompt_set_cache_key(self, personas: List[Dict], questions: List[Dict],
+                             api_preference: Optional[str] = None, use_enhanced: bool = True,
+                             seed: Optional[int] = None) -> str:
+        """
+        Ключ кэша набора промптов: хеш всех входных данных стадии построения промптов
+
+        Args:
+            personas: Список словарей с персонами
+            questions: Список словарей с вопросами
+            api_preference: Предпочтительное API ('claude' или 'openai')
+            use_enhanced: Использовать ли улучшенное генерирование ответов
+            seed: Зерно запуска (None - без фиксации)
+
+        Returns:
+            Hex-строка SHA-256
+        """
+        payload = json.dumps({
+            "version": PROMPT_SET_VERSION,
+            "personas": personas,
+            "questions": questions,
+            "api_preference": api_preference,
+            "use_enhanced": use_enhanced,
+            "seed": seed,
+            "prompting_params": self.prompting_params
+        }, ensure_ascii=False, sort_keys=True, cls=NumpyEncoder)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def save_prompt_set(self, prompt_set: List[Dict], path: str) -> None:
+        """
+        Сохранение набора промптов в файл JSONL или Parquet (по расширению файла)
+
+        Args:
+            prompt_set: Список записей набора промптов
+            path: Путь к файлу (.jsonl или .parquet)
+        """
+        try:
+            if path.endswith(".parquet"):
+                # Вложенные структуры сохраняются как JSON-строки
+                rows = [
+                    {key: json.dumps(value, ensure_ascii=False, cls=NumpyEncoder)
+                     if key in PROMPT_SET_JSON_COLUMNS else value
+                     for key, value in entry.items()}
+                    for entry in prompt_set
+                ]
+                pd.DataFrame(rows).to_parquet(path, index=False)
+            else:
+                with open(path, "w", encoding="utf-8") as f:
+                    for entry in prompt_set:
+                        f.write(json.dumps(entry, ensure_ascii=False, cls=NumpyEncoder) + "\n")
+        except Exception as e:
+            raise ValueError(f"Ошибка при сохранении набора промптов: {str(e)}")
+
+    def load_prompt_set(self, path: str) -> List[Dict]:
+        """
+        Загрузка набора промптов из файла JSONL или Parquet
+
+        Args:
+            path: Путь к файлу (.jsonl или .parquet)
+
+        Returns:
+            Список записей набора промптов, отсортированный по ID задачи
+        """
+        try:
+            if path.endswith(".parquet"):
+                prompt_set = []
+                for row in pd.read_parquet(path).to_dict(orient="records"):
+                    for key in PROMPT_SET_JSON_COLUMNS:
+                        if isinstance(row.get(key), str):
+                            row[key] = json.loads(row[key])
+                    prompt_set.append(row)
+            else:
+                with open(path, "r", encoding="utf-8") as f:
+                    prompt_set = [json.loads(line) for line in f if line.strip()]
+        except Exception as e:
+            raise ValueError(f"Ошибка при загрузке набора промптов: {str(e)}")
+
+        missing = [field for field in ("task_id", "persona_idx", "persona", "question", "prompt")
+                   if prompt_set and field not in prompt_set[0]]
+        if missing:
+            raise ValueError(f"В наборе промптов отсутствуют поля: {', '.join(missing)}")
+
+        prompt_set.sort(key=lambda x: x["task_id"])
+        return prompt_set
+
+    def dispatch_prompt_set(self, prompt_set: List[Dict], max_workers: int = 3,
+                            progress_callback: Optional[Callable[[int], None]] = None,
+                            answer_callback: Optional[Callable[[Dict], None]] = None) -> "AnswerStore":
+        """
+        Стадия отправки: генерация ответов по набору промптов в пуле потоков
+
+        Args:
+            prompt_set: Список записей набора промптов
+            max_workers: Количество параллельных запросов к API
+            progress_callback: Функция, получающая количество готовых ответов
+            answer_callback: Функция, вызываемая для каждого готового ответа
+
+        Returns:
+            AnswerStore с ответами, отсортированными по ID
+        """
+        all_answers = AnswerStore(capacity=max(1, len(prompt_set)))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self.generate_prompt_answer, entry) for entry in prompt_set]
+
+            for future in concurrent.futures.as_completed(futures):
+                answer = future.result()
+                all_answers.append(answer)
+
+                if answer_callback is not None:
+                    answer_callback(answer)
+                if progress_callback is not None:
+                    progress_callback(len(all_answers))
+
+        # Сортировка ответов по ID
+        all_answers.sort_by_id()
+
+        return all_answers
+
+    def _record_usage(self, provider: str, model: str, input_tokens: int, output_tokens: int,
+                      cached_tokens: int = 0, cache_write_tokens: int = 0) -> None:
+        """
+        Учет использования токенов запросом (журнал расходов и совместимый счетчик tokens_used)
+
+        Args:
+            provider: Провайдер ('claude' или 'openai')
+            model: Название модели
+            input_tokens: Входные токены (без кэшированных)
+            output_tokens: Выходные токены
+            cached_tokens: Входные токены, прочитанные из кэша провайдера
+            cache_write_tokens: Входные токены, записанные в кэш провайдера (Claude)
+        """
+        self.spend_ledger.record(provider, model, input_tokens, output_tokens, cached_tokens, cache_write_tokens)
+        self._request_usage.last = (provider, model, input_tokens + cached_tokens + cache_write_tokens, output_tokens)
+        records = getattr(self._request_usage, "records", None)
+        if records is not None:
+            records.append([provider, model, input_tokens, output_tokens, cached_tokens, cache_write_tokens])
+
+        with self._usage_lock:
+            if provider == "openai":
+                # Как и раньше, для OpenAI учитываются все входные токены (включая кэшированные)
+                self.tokens_used[provider] += input_tokens + cached_tokens + output_tokens
+            else:
+                self.tokens_used[provider] += input_tokens + cache_write_tokens + output_tokens
+
+    def task_usage(self) -> List[List]:
+        """
+        Использование токенов последней задачей generate_task_answer текущего потока
+
+        Returns:
+            Список записей [провайдер, модель, входные, выходные, кэшированные, записанные в кэш токены]
+        """
+        return list(getattr(self._request_usage, "records", None) or [])
+
+    def _output_segment(self, persona: Dict, question: Dict) -> str:
+        """Сегмент для статистики длины ответов: уровень грамотности и тип вопроса"""
+        literacy_level = persona.get('Финансовый профиль', {}).get('Уровень финансовой грамотности', 'средний')
+        return f"{literacy_level}|{question.get('type', 'open')}"
+
+    def _record_output_tokens(self, persona: Dict, question: Dict, output_tokens: int) -> None:
+        """Сохранение фактической длины ответа в историю сегмента"""
+        self.output_token_history[self._output_segment(persona, question)].append(output_tokens)
+
+    def estimate_output_tokens(self, persona: Dict, question: Dict) -> Tuple[float, bool]:
+        """
+        Оценка длины ответа в токенах по истории сегмента
+
+        Args:
+            persona: Словарь с данными персоны
+            question: Словарь с вопросом
+
+        Returns:
+            Tuple (оценка количества выходных токенов, основана ли оценка на истории самого сегмента;
+            априорная оценка, масштабированная по другим сегментам, историей не считается)
+        """
+        history = self.output_token_history.get(self._output_segment(persona, question))
+        if history:
+            return float(np.mean(history)), True
+
+        literacy_level = persona.get('Финансовый профиль', {}).get('Уровень финансовой грамотности', 'средний')
+        estimate = DEFAULT_OUTPUT_TOKENS.get(literacy_level, DEFAULT_OUTPUT_TOKENS["средний"])
+
+        # Для сегмента без истории априорная оценка масштабируется по истории остальных сегментов
+        observed, expected = 0, 0
+        for segment, values in list(self.output_token_history.items()):
+            if values:
+                observed += sum(values)
+                expected += len(values) * DEFAULT_OUTPUT_TOKENS.get(segment.split("|")[0],
+                                                                    DEFAULT_OUTPUT_TOKENS["средний"])
+        if expected:
+            return float(min(estimate * observed / expected, self.prompting_params["max_tokens"])), False
+
+        return float(min(estimate, self.prompting_params["max_tokens"])), False
+
+    def estimate_request_cost(self, entry: Dict) -> Tuple[float, float]:
+        """
+        Оценка стоимости запроса для резервирования бюджета
+
+        Входные токены оцениваются по тексту промпта с поправкой на отношение фактических входных
+        токенов к оценке в уже выполненных запросах, выходные - по истории длины ответов.
+
+        Args:
+            entry: Запись набора промптов
+
+        Returns:
+            Tuple (оценка стоимости запроса, стоимость только входных токенов) в USD
+        """
+        input_tokens = estimate_tokens(entry["prompt"])
+        with self._usage_lock:
+            estimated, actual = self._input_token_calibration
+        if estimated:
+            input_tokens = input_tokens * actual / estimated
+        output_tokens, _ = self.estimate_output_tokens(entry["persona"], entry["question"])
+        return (self.spend_ledger.price(entry["model"], input_tokens, output_tokens),
+                self.spend_ledger.price(entry["model"], input_tokens, 0))
+
+    def estimate_generation(self, personas: List[Dict], questions: List[Dict], api_preference: Optional[str] = None,
+                            use_enhanced: bool = True, max_workers: int = 3, rpm_limit: Optional[int] = None,
+                            tpm_limit: Optional[int] = None, sample_size: int = 300) -> Dict:
+        """
+        Пробный прогон: оценка токенов, стоимости и времени генерации без обращения к API
+
+        Строятся реальные промпты (для больших пакетов - по выборке персон), входные токены
+        считаются локально, выходные оцениваются по истории ответов соответствующих сегментов.
+
+        Args:
+            personas: Список словарей с персонами
+            questions: Список словарей с вопросами
+            api_preference: Предпочтительное API ('claude' или 'openai')
+            use_enhanced: Использовать ли улучшенное генерирование ответов
+            max_workers: Количество параллельных запросов к API
+            rpm_limit: Лимит запросов в минуту (None - без ограничения)
+            tpm_limit: Лимит токенов в минуту (None - без ограничения)
+            sample_size: Максимальное количество задач, для которых строятся промпты
+
+        Returns:
+            Словарь с оценкой (токены, стоимость по моделям, время выполнения)
+        """
+        total_tasks = len(personas) * len(questions)
+        if total_tasks == 0:
+            raise ValueError("Нет задач для оценки: список персон или вопросов пуст")
+
+        # Выборка персон для больших пакетов
+        sample_personas = personas
+        max_personas = max(1, sample_size // len(questions))
+        if len(personas) > max_personas:
+            sample_personas = random.sample(personas, max_personas)
+
+        prompt_set = self.build_prompt_set(
+            sample_personas, questions, api_preference=api_preference, use_enhanced=use_enhanced, workers=0
+        )
+
+        input_tokens = 0
+        output_tokens = 0
+        from_history = 0
+        for entry in prompt_set:
+            input_tokens += estimate_tokens(entry["prompt"])
+            estimate, is_historical = self.estimate_output_tokens(entry["persona"], entry["question"])
+            output_tokens += estimate
+            from_history += int(is_historical)
+
+        # Масштабирование выборки на весь пакет
+        scale = total_tasks / len(prompt_set)
+        input_tokens = int(round(input_tokens * scale))
+        output_tokens = int(round(output_tokens * scale))
+
+        # Стоимость для моделей выбранных провайдеров
+        providers = [api_preference] if api_preference else ["claude", "openai"]
+        selected_model = self.openai_models[0] if api_preference == "openai" else self.claude_models[0]
+        models = []
+        for model, pricing in MODEL_PRICING.items():
+            if pricing["provider"] not in providers:
+                continue
+            input_cost = input_tokens / 1_000_000 * pricing["input"]
+            output_cost = output_tokens / 1_000_000 * pricing["output"]
+            models.append({
+                "provider": pricing["provider"],
+                "model": model,
+                "input_cost": input_cost,
+                "output_cost": output_cost,
+                "total_cost": input_cost + output_cost,
+                "selected": model == selected_model
+            })
+
+        # Время выполнения: ограничение параллельностью и лимитами API
+        avg_output = output_tokens / total_tasks
+        request_seconds = LLM_LATENCY_MODEL["base_seconds"] + avg_output / LLM_LATENCY_MODEL["output_tokens_per_second"]
+        bounds = {"параллельность": total_tasks * request_seconds / max(1, max_workers)}
+        if rpm_limit:
+            bounds["лимит запросов (RPM)"] = total_tasks / rpm_limit * 60
+        if tpm_limit:
+            bounds["лимит токенов (TPM)"] = (input_tokens + output_tokens) / tpm_limit * 60
+        limiting_factor = max(bounds, key=bounds.get)
+
+        return {
+            "total_tasks": total_tasks,
+            "sampled_tasks": len(prompt_set),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "output_from_history": from_history / len(prompt_set),
+            "models": models,
+            "selected_model": selected_model,
+            "request_seconds": request_seconds,
+            "wall_time_seconds": bounds[limiting_factor],
+            "limiting_factor": limiting_factor,
+            "time_bounds": bounds
+        }
+
+    def benchmark_prompt_profiles(self, personas: List[Dict], questions: List[Dict], seed: int = 0,
+                                  profiles: Sequence[str] = PROMPT_PROFILES, max_workers: int = 3) -> Dict[str, Dict]:
+        """
+        Сравнение профилей промпта: входные токены по разделам и распределение длины ответов
+
+        Для каждого профиля строится набор промптов с одним и тем же зерном и отправляется
+        через текущие клиенты (для офлайн-сравнения - фейковый LLM).
+
+        Args:
+            personas: Список словарей с персонами
+            questions: Список словарей с вопросами
+            seed: Зерно запуска (одинаковое для всех профилей)
+            profiles: Сравниваемые профили промпта
+            max_workers: Количество параллельных запросов
+
+        Returns:
+            Словарь {профиль: {"prompts", "input_tokens", "sections", "answer_length"}}
+        """
+        original_profile = self.prompting_params.get("prompt_profile", "full")
+        original_ledger = self.spend_ledger
+        report = {}
+
+        try:
+            for profile in profiles:
+                self.set_prompt_profile(profile)
+                self.spend_ledger = SpendLedger()
+
+                prompt_set = self.build_prompt_set(personas, questions, workers=0, seed=seed)
+                answers = self.dispatch_prompt_set(prompt_set, max_workers=max_workers)
+                spend = self.spend_ledger.summary()
+
+                prompt_tokens = np.array([estimate_tokens(entry["prompt"]) for entry in prompt_set])
+                lengths = answers.column("length")[~answers.column("error")]
+                report[profile] = {
+                    "prompts": len(prompt_set),
+                    "input_tokens": {
+                        "total": int(prompt_tokens.sum()),
+                        "mean": float(prompt_tokens.mean()) if len(prompt_tokens) else 0.0
+                    },
+                    "sections": {
+                        section["section"]: section["tokens"] / max(1, len(prompt_set))
+                        for section in spend["prompt_sections"]
+                    },
+                    "answer_length": {
+                        "mean": float(lengths.mean()) if len(lengths) else 0.0,
+                        "median": float(np.median(lengths)) if len(lengths) else 0.0,
+                        "p90": float(np.percentile(lengths, 90)) if len(lengths) else 0.0
+                    }
+                }
+        finally:
+            self.prompting_params["prompt_profile"] = original_profile
+            self.spend_ledger = original_ledger
+
+        return report
+
+    def run_generation_batch(self, personas, questions, max_workers=3, api_preference=None, use_enhanced=True,
+                             progress_callback: Optional[Callable[[int, int], None]] = None,
+                             answer_callback: Optional[Callable[[Dict], None]] = None,
+                             queue_path: Optional[str] = None, local_queue_workers: int = 0,
+                             queue_timeout: Optional[float] = None, prompt_workers: Optional[int] = None,
+                             prompt_set: Optional[List[Dict]] = None, prompt_set_path: Optional[str] = None,
+                             budget: Optional[float] = None, soft_budget: Optional[float] = None,
+                             seed: Optional[int] = None):
+        """
+        Обработка пакета персон и вопросов с параллельным выполнением
+
+        Args:
+            personas: Список словарей с персонами
+            questions: Список словарей с вопросами
+            max_workers: Максимальное количество параллельных рабочих процессов
+            api_preference: Предпочтительное API ('claude' или 'openai')
+            use_enhanced: Использовать ли улучшенное генерирование ответов
+            progress_callback: Функция (выполнено, всего) для отображения прогресса вне Streamlit
+            answer_callback: Функция, вызываемая для каждого готового ответа (по мере завершения)
+            queue_path: Путь к базе очереди задач; если задан, задачи выполняются воркер-процессами
+            local_queue_workers: Количество воркер-процессов, запускаемых локально для очереди
+            queue_timeout: Максимальное время ожидания очереди в секундах (None - без ограничения)
+            prompt_workers: Количество процессов для построения промптов (None - по числу ядер)
+            prompt_set: Готовый набор промптов (стадия построения промптов пропускается)
+            prompt_set_path: Файл набора промптов (.jsonl или .parquet): используется повторно, если
+                построен из тех же входных данных, иначе перезаписывается
+            budget: Жесткий бюджет запуска в USD (после его исчерпания запросы пропускаются)
+            soft_budget: Мягкий бюджет запуска в USD (при превышении выдается предупреждение)
+            seed: Зерно запуска: при одинаковом зерне промпты воспроизводятся независимо от числа потоков
+
+        Returns:
+            AnswerStore с ответами (последовательность словарей в прежнем формате)
+        """
+        # Новый журнал расходов для каждого запуска
+        self.spend_ledger = SpendLedger(hard_budget=budget, soft_budget=soft_budget)
+
+        if prompt_set is not None:
+            total_items = len(prompt_set)
+        else:
+            total_items = len(personas) * len(questions)
+
+        # Настройка отображения прогресса через Streamlit (если не передан внешний обработчик)
+        if progress_callback is None:
+            progress_bar = st.progress(0)
+            status_text = st.empty()
+            status_text.text("Генерация ответов: 0%")
+            budget_warning = st.empty()
+
+        def report_progress(done):
+            if progress_callback is not None:
+                progress_callback(done, total_items)
+            else:
+                progress_percentage = done/total_items if total_items else 1.0
+                progress_bar.progress(progress_percentage)
+                status_text.text(
+                    f"Генерация ответов: {int(progress_percentage*100)}% | "
+                    f"Расходы: ${self.spend_ledger.total_cost:.4f}"
+                )
+                if self.spend_ledger.budget_stopped:
+                    budget_warning.error("Жесткий бюджет исчерпан: оставшиеся запросы не отправляются")
+                elif self.spend_ledger.soft_budget_exceeded:
+                    budget_warning.warning(
+                        f"Превышен мягкий бюджет ${self.spend_ledger.soft_budget:.2f}: "
+                        f"потрачено ${self.spend_ledger.total_cost:.4f}"
+                    )
+
+        # Распределенное выполнение через очередь задач
+        if queue_path:
+            return self._run_generation_via_queue(
+                personas, questions, queue_path, api_preference, use_enhanced,
+                local_queue_workers, max_workers, queue_timeout, report_progress, answer_callback, seed
+            )
+
+        # Стадия 1: построение промптов (CPU, пул процессов); пропускается при повторном запуске
+        if prompt_set is None:
+            cache_key = self.prompt_set_cache_key(personas, questions, api_preference, use_enhanced, seed)
+
+            if prompt_set_path and os.path.exists(prompt_set_path):
+                cached_set = self.load_prompt_set(prompt_set_path)
+                if cached_set and cached_set[0].get("prompt_set_key") == cache_key:
+                    prompt_set = cached_set
+
+            if prompt_set is None:
+                prompt_set = self.build_prompt_set(
+                    personas, questions, api_preference=api_preference,
+                    use_enhanced=use_enhanced, workers=prompt_workers, seed=seed
+                )
+                if prompt_set_path:
+                    self.save_prompt_set(prompt_set, prompt_set_path)
+
+        # Стадия 2: отправка запросов к API (ввод-вывод, пул потоков)
+        return self.dispatch_prompt_set(
+            prompt_set, max_workers=max_workers,
+            progress_callback=report_progress, answer_callback=answer_callback
+        )
+
+    def _run_generation_via_queue(self, personas, questions, queue_path, api_preference, use_enhanced,
+                                  local_workers, worker_threads, timeout, report_progress, answer_callback,
+                                  seed=None):
+        """
+        Выполнение пакета через очередь задач с арендой (воркеры могут работать на разных хостах)
+
+        Расходы воркеров записываются в очередь по задачам и учитываются в журнале расходов координатора.
+        Жесткий бюджет проверяется по фактическим расходам запуска: когда он исчерпан, воркеры пропускают
+        новые задачи, а координатор отменяет ожидающие; уже отправленные запросы выполняются до конца.
+
+        Args:
+            personas: Список словарей с персонами
+            questions: Список словарей с вопросами
+            queue_path: Путь к базе очереди задач на общей файловой системе
+            api_preference: Предпочтительное API ('claude' или 'openai')
+            use_enhanced: Использовать ли улучшенное генерирование ответов
+            local_workers: Количество воркер-процессов, запускаемых локально
+            worker_threads: Количество потоков запросов к API в каждом воркере
+            timeout: Максимальное время ожидания в секундах (None - без ограничения, но если ни один воркер
+                не взял задачу за GenerationWorkQueue.claim_grace_period, запуск отменяется)
+            report_progress: Функция обновления прогресса (количество готовых ответов)
+            answer_callback: Функция, вызываемая для каждого готового ответа
+            seed: Зерно запуска (None - без фиксации)
+
+        Returns:
+            AnswerStore с ответами, отсортированными по ID
+
+        Raises:
+            ValueError: Если ни один воркер не взял задачи запуска в течение claim_grace_period
+        """
+        queue = GenerationWorkQueue(queue_path)
+        run_id = queue.create_run({
+            "prompting_params": self.prompting_params,
+            "api_preference": api_preference,
+            "use_enhanced": use_enhanced,
+            "seed": seed,
+            "use_fake_llm": self.use_fake_llm,
+            "hard_budget": self.spend_ledger.hard_budget
+        }, personas, questions)
+
+        processes = [
+            start_queue_worker_process(
+                queue_path, run_id, threads=worker_threads,
+                api_key_claude=self.api_key_claude, api_key_openai=self.api_key_openai
+            )
+            for _ in range(local_workers)
+        ]
+
+        done = 0
+        last_seq = 0
+        started = time.time()
+        claimed = False
+
+        def collect(after):
+            nonlocal done
+            new_answers, usages, after = queue.fetch_completed(run_id, after=after)
+            for records in usages:
+                for record in records:
+                    self._record_usage(*record)
+            # Задачи, пропущенные воркерами или отмененные по бюджету
+            self.spend_ledger.record_skipped(sum(1 for answer in new_answers if answer.get("skipped")))
+            if new_answers:
+                done += len(new_answers)
+                if answer_callback is not None:
+                    for answer in new_answers:
+                        answer_callback(answer)
+                report_progress(done)
+            return after
+
+        try:
+            while True:
+                queue.requeue_expired_leases()
+
+                # Без воркеров координатор ждал бы бесконечно
+                if not claimed:
+                    claimed = queue.run_claimed(run_id)
+                    if not claimed and time.time() - started > GenerationWorkQueue.claim_grace_period:
+                        queue.cancel_pending(run_id, "ОШИБКА: задача не была выполнена воркерами очереди")
+                        raise ValueError(
+                            f"Ни один воркер очереди не взял задачи за {GenerationWorkQueue.claim_grace_period:.0f} с: "
+                            "запустите воркеры (команда worker) или укажите local_queue_workers"
+                        )
+
+                last_seq = collect(last_seq)
+
+                # Фактические расходы достигли жесткого бюджета: оставшиеся задачи не отправляются
+                if self.spend_ledger.budget_stopped:
+                    queue.cancel_pending(run_id, "ПРОПУЩЕНО: превышен бюджет запуска", skipped=True)
+
+                if not queue.has_unfinished(run_id):
+                    break
+                if timeout is not None and time.time() - started > timeout:
+                    break
+                # Локальные воркеры завершились, а внешних не ожидается
+                if processes and all(p.poll() is not None for p in processes):
+                    break
+
+                time.sleep(GenerationWorkQueue.poll_interval)
+
+            # Ответы, завершенные между последним опросом и выходом из цикла
+            collect(last_seq)
+        finally:
+            for process in processes:
+                if process.poll() is None:
+                    process.terminate()
+
+        return AnswerStore.from_answers(queue.collect_answers(run_id), questions)
+
+    def analyze_results(self, personas: List[Dict], questions: List[Dict], answers: List[Dict]) -> Dict:
+        """
+        Формирование аналитического отчета
+
+        Args:
+            personas: Список словарей с персонами
+            questions: Список словарей с вопросами
+            answers: Список словарей с ответами
+
+        Returns:
+            Словарь с аналитическим отчетом
+        """
+        try:
+            answers = AnswerStore.from_answers(answers, questions)
+            errors = answers.column("error")
+            error_count = int(errors.sum())
+
+            # Базовая статистика
+            report = {
+                "Общая статистика": {
+                    "Количество респондентов": len(personas),
+                    "Количество вопросов": len(questions),
+                    "Количество ответов": len(answers),
+                    "API токенов использовано (Claude)": self.tokens_used["claude"],
+                    "API токенов использовано (OpenAI)": self.tokens_used["openai"],
+                    "Стоимость запуска (USD)": self.spend_ledger.total_cost
+                },
+                "Демографический состав": {
+                    "Пол": {},
+                    "Возраст": {
+                        "Средний": float(np.mean([p["Возраст"] for p in personas])),
+                        "Медианный": float(np.median([p["Возраст"] for p in personas])),
+                        "Минимальный": int(min([p["Возраст"] for p in personas])),
+                        "Максимальный": int(max([p["Возраст"] for p in personas]))
+                    },
+                    "Регионы": {},
+                    "Города": {},
+                    "Профессии": {},
+                    "Образование": {},
+                    "Семейное положение": {},
+                    "Доход": {},
+                    "Дети": {
+                        "Среднее количество": float(np.mean([p.get("Количество детей", 0) for p in personas])),
+                        "Распределение": {}
+                    }
+                },
+                "Финансовые характеристики": {
+                    "Уровни финансовой грамотности": {},
+                    "Доверие к банкам": {},
+                    "Отношение к кредитам": {},
+                    "Отношение к риску": {},
+                    "Модели финансового поведения": {},
+                    "Используемые финансовые продукты": {}
+                },
+                "Аналитика ответов": [],
+                "Качество данных": {
+                    "Ошибки генерации": error_count,
+                    "Успешность": float((len(answers) - error_count) / len(answers) * 100) if answers else 0
+                }
+            }
+
+            # Подсчет демографических характеристик
+            for key in ["Пол", "Регион", "Город", "Профессия", "Образование", "Семейное положение", "Доход"]:
+                value_counts = pd.Series([p.get(key, "Не указано") for p in personas]).value_counts()
+                report["Демографический состав"][key if key != "Город" else "Города"] = {
+                    str(k): int(v) for k, v in value_counts.items()
+                }
+
+            # Распределение детей
+            children_counts = pd.Series([p.get("Количество детей", 0) for p in personas]).value_counts()
+            report["Демографический состав"]["Дети"]["Распределение"] = {
+                str(k): int(v) for k, v in children_counts.items()
+            }
+
+            # Подсчет финансовых характеристик
+            literacy_counts = pd.Series([
+                p.get("Финансовый профиль", {}).get("Уровень финансовой грамотности", "средний")
+                for p in personas
+            ]).value_counts()
+
+            report["Финансовые характеристики"]["Уровни финансовой грамотности"] = {
+                str(k): int(v) for k, v in literacy_counts.items()
+            }
+
+            trust_counts = pd.Series([
+                p.get("Финансовый профиль", {}).get("Отношение к финансам", {}).get("Доверие к банкам", "среднее")
+                for p in personas
+            ]).value_counts()
+
+            report["Финансовые характеристики"]["Доверие к банкам"] = {
+                str(k): int(v) for k, v in trust_counts.items()
+            }
+
+            loan_counts = pd.Series([
+                p.get("Финансовый профиль", {}).get("Отношение к финансам", {}).get("Отношение к кредитам", "нейтральное")
+                for p in personas
+            ]).value_counts()
+
+            report["Финансовые характеристики"]["Отношение к кредитам"] = {
+                str(k): int(v) for k, v in loan_counts.items()
+            }
+
+            risk_counts = pd.Series([
+                p.get("Финансовый профиль", {}).get("Отношение к финансам", {}).get("Отношение к риску", "умеренный")
+                for p in personas
+            ]).value_counts()
+
+            report["Финансовые характеристики"]["Отношение к риску"] = {
+                str(k): int(v) for k, v in risk_counts.items()
+            }
+
+            behavior_counts = pd.Series([
+                p.get("Финансовый профиль", {}).get("Отношение к финансам", {}).get("Модель финансового поведения", "прагматичный")
+                for p in personas
+            ]).value_counts()
+
+            report["Финансовые характеристики"]["Модели финансового поведения"] = {
+                str(k): int(v) for k, v in behavior_counts.items()
+            }
+
+            # Подсчет используемых финансовых продуктов
+            products_usage = {}
+            for persona in personas:
+                fp = persona.get("Финансовый профиль", {})
+                products = fp.get("Используемые продукты", {})
+
+                for product, used in products.items():
+                    if product not in products_usage:
+                        products_usage[product] = {"Используют": 0, "Не используют": 0}
+
+                    if used:
+                        products_usage[product]["Используют"] += 1
+                    else:
+                        products_usage[product]["Не используют"] += 1
+
+            report["Финансовые характеристики"]["Используемые финансовые продукты"] = products_usage
+
+            # Анализ ответов для каждого вопроса
+            lengths = answers.column("length")
+            for question in questions:
+                rows = answers.rows_for_question(question["id"])
+                rows = rows[~errors[rows]]
+
+                question_analysis = {
+                    "Вопрос": question["text"],
+                    "Тип вопроса": question["type"],
+                    "Тема": question.get("topic", "общие"),
+                    "Количество ответов": len(rows),
+                    "Средняя длина ответа (символы)": int(np.mean(lengths[rows]) if len(rows) else 0),
+                    "Медианная длина ответа": int(np.median(lengths[rows]) if len(rows) else 0)
+                }
+
+                # Анализ для вопросов с вариантами ответов
+                if question["type"] in ["single", "multiple"] and question["options"]:
+                    option_counts = {}
+                    texts = [answers.text(k).lower() for k in rows]
+                    for option in question["options"]:
+                        option = option.strip()
+                        if not option:
+                            continue
+                        count = sum(1 for text in texts if option.lower() in text)
+                        option_counts[option] = count
+
+                    question_analysis["Распределение ответов"] = option_counts
+
+                report["Аналитика ответов"].append(question_analysis)
+
+            # Текстовый анализ - вычисление среднего настроения и сложности ответов
+            if answers:
+                try:
+                    # Средняя длина слов в ответах
+                    word_counts = [len(answers.text(k).split()) for k in np.flatnonzero(~errors)]
+                    report["Аналитика текста"] = {
+                        "Средняя длина ответа (слова)": float(np.mean(word_counts)) if word_counts else 0,
+                        "Медианная длина ответа (слова)": float(np.median(word_counts)) if word_counts else 0,
+                        "Максимальная длина ответа (слова)": max(word_counts) if word_counts else 0,
+                        "Минимальная длина ответа (слова)": min(word_counts) if word_counts else 0
+                    }
+                except Exception as e:
+                    self.notify(f"Ошибка в текстовом анализе: {e}")
+
+            return report
+        except Exception as e:
+            self.notify(f"Ошибка при анализе результатов: {str(e)}", level="error")
+            # Возвращаем базовый отчет в случае ошибки
+            return {
+                "Общая статистика": {
+                    "Количество респондентов": len(personas),
+                    "Количество вопросов": len(questions),
+                    "Ошибка анализа": str(e)
+                }
+            }
+
+    def export_to_excel(self, personas: List[Dict], questions: List[Dict], answers: List[Dict]) -> io.BytesIO:
+        """
+        Экспорт результатов в Excel файл
+
+        Args:
+            personas: Список словарей с персонами
+            questions: Список словарей с вопросами
+            answers: Список словарей с ответами
+
+        Returns:
             io.BytesIO с Excel файлом
         """
-        try:
-            # Создаем DataFrame с ответами
-            data = []
+        try:
+            answers = AnswerStore.from_answers(answers, questions)
+            # Словари персон собираются один раз (когорта собирает их при каждом обращении)
+            personas = list(personas)
+
+            # Создаем DataFrame с ответами
+            data = []
+
+            for answer in answers:
+                persona_id = answer["persona_id"]
+                persona = personas[persona_id-1]
+                question = answer["question"]
+
+                row = {
+                    "Респондент_ID": persona_id,
+                    "Вопрос_ID": question["id"],
+                    "Вопрос": question["text"],
+                    "Тип_вопроса": question.get("type", "open"),
+                    "Тема_вопроса": question.get("topic", "общие"),
+                    "Ответ": answer["text"][:32767] if len(answer["text"]) > 32767 else answer["text"],
+                    "Дата_время": answer["timestamp"],
+                    "Ошибка": answer.get("error", False)
+                }
+
+                # Добавляем демографические характеристики из persona
+                for key, value in persona.items():
+                    if key != "Финансовый профиль" and key != "Лингвистический профиль" and key != "Профиль непоследовательности":
+                        if isinstance(value, list):
+                            row[f"Респондент_{key}"] = ", ".join(str(v) for v in value)
+                        else:
+                            row[f"Респондент_{key}"] = value
+
+                # Добавляем финансовые характеристики
+                if "Финансовый профиль" in persona:
+                    fp = persona["Финансовый профиль"]
+
+                    # Уровень финансовой грамотности
+                    row["Финансовая_грамотность"] = fp.get("Уровень финансовой грамотности", "средний")
+
+                    # Отношение к финансам
+                    if "Отношение к финансам" in fp:
+                        for key, value in fp["Отношение к финансам"].items():
+                            row[f"Финансы_{key.replace(' ', '_')}"] = value
+
+                data.append(row)
+
+            # Создаем основной DataFrame с ответами
+            answers_df = pd.DataFrame(data)
+
+            # Создаем DataFrame для респондентов
+            personas_data = []
+            for i, p in enumerate(personas):
+                row = {"ID": i+1}
+
+                # Базовые демографические данные
+                for key, value in p.items():
+                    if key != "Финансовый профиль" and key != "Лингвистический профиль" and key != "Профиль непоследовательности":
+                        if isinstance(value, list):
+                            row[key] = ", ".join(str(v) for v in value)
+                        else:
+                            row[key] = value
+
+                # Финансовый профиль
+                if "Финансовый профиль" in p:
+                    fp = p["Финансовый профиль"]
+
+                    # Уровень финансовой грамотности
+                    row["Уровень_финансовой_грамотности"] = fp.get("Уровень финансовой грамотности", "средний")
+
+                    # Используемые продукты
+                    if "Используемые продукты" in fp:
+                        for product, used in fp["Используемые продукты"].items():
+                            row[f"Продукт_{product.replace(' ', '_')}"] = "Да" if used else "Нет"
+
+                    # Отношение к финансам
+                    if "Отношение к финансам" in fp:
+                        for key, value in fp["Отношение к финансам"].items():
+                            row[f"Отношение_{key.replace(' ', '_')}"] = value
+
+                personas_data.append(row)
+
+            personas_df = pd.DataFrame(personas_data)
+
+            # Создаем DataFrame для вопросов
+            questions_df = pd.DataFrame([
+                {
+                    "ID": q["id"],
+                    "Вопрос": q["text"],
+                    "Тип": q["type"],
+                    "Тема": q.get("topic", "общие"),
+                    "Варианты_ответов": ", ".join(q["options"]) if q.get("options") else "",
+                    "Контекст": q.get("context", "")
+                } for q in questions
+            ])
+
+            # Создаем сводную таблицу ответов по респондентам и вопросам
+            wide_data = []
+
+            for i, persona in enumerate(personas):
+                row = {"Респондент_ID": i+1}
+
+                # Добавляем все характеристики респондента
+                for key, value in persona.items():
+                    if key != "Финансовый профиль" and key != "Лингвистический профиль" and key != "Профиль непоследовательности":
+                        if isinstance(value, list):
+                            row[key] = ", ".join(str(v) for v in value)
+                        else:
+                            row[key] = value
+
+                # Добавляем финансовый профиль
+                if "Финансовый профиль" in persona:
+                    fp = persona["Финансовый профиль"]
+
+                    # Уровень финансовой грамотности
+                    row["Уровень_финансовой_грамотности"] = fp.get("Уровень финансовой грамотности", "средний")
+
+                    # Отношение к финансам
+                    if "Отношение к финансам" in fp:
+                        for key, value in fp["Отношение к финансам"].items():
+                            row[f"Отношение_{key.replace(' ', '_')}"] = value
+
+                # Добавляем ответы на все вопросы
+                for question in questions:
+                    question_id = question["id"]
+
+                    # Находим ответ этого респондента на этот вопрос
+                    answer_row = answers.find(i+1, question_id)
+
+                    if answer_row is not None and not answers.column("error")[answer_row]:
+                        # Ограничение для Excel на длину ячейки
+                        answer_text = answers.text(answer_row)
+                        if len(answer_text) > 32767:
+                            answer_text = answer_text[:32764] + "..."
+                        row[f"Вопрос_{question_id}"] = answer_text
+                    else:
+                        row[f"Вопрос_{question_id}"] = ""
+
+                wide_data.append(row)
+
+            wide_df = pd.DataFrame(wide_data)
+
+            # Генерируем отчет
+            report = self.analyze_results(personas, questions, answers)
+
+            # Создаем DataFrame для аналитики
+            analytics_data = []
+
+            # Общая статистика
+            analytics_data.append(["ОБЩАЯ СТАТИСТИКА", "", ""])
+            for key, value in report["Общая статистика"].items():
+                analytics_data.append([key, value, ""])
+            analytics_data.append(["", "", ""])
+
+            # Демографический анализ
+            analytics_data.append(["ДЕМОГРАФИЧЕСКИЙ СОСТАВ", "", ""])
+            analytics_data.append(["", "", ""])
+
+            # Пол
+            analytics_data.append(["Распределение по полу", "", ""])
+            for gender, count in report["Демографический состав"]["Пол"].items():
+                analytics_data.append([gender, int(count), f"{float(count)/len(personas)*100:.1f}%"])
+            analytics_data.append(["", "", ""])
+
+            # Возраст
+            analytics_data.append(["Возрастное распределение", "", ""])
+            age_stats = report["Демографический состав"]["Возраст"]
+            analytics_data.append(["Средний возраст", f"{age_stats['Средний']:.1f}", ""])
+            analytics_data.append(["Медианный возраст", f"{age_stats['Медианный']:.1f}", ""])
+            analytics_data.append(["Минимальный возраст", int(age_stats['Минимальный']), ""])
+            analytics_data.append(["Максимальный возраст", int(age_stats['Максимальный']), ""])
+            analytics_data.append(["", "", ""])
+
+            # Финансовая грамотность
+            analytics_data.append(["ФИНАНСОВЫЕ ХАРАКТЕРИСТИКИ", "", ""])
+            analytics_data.append(["", "", ""])
+
+            # Уровни финансовой грамотности
+            analytics_data.append(["Распределение по уровню финансовой грамотности", "", ""])
+            for level, count in report["Финансовые характеристики"]["Уровни финансовой грамотности"].items():
+                analytics_data.append([level, int(count), f"{float(count)/len(personas)*100:.1f}%"])
+            analytics_data.append(["", "", ""])
+
+            # Доверие к банкам
+            analytics_data.append(["Распределение по уровню доверия к банкам", "", ""])
+            for trust, count in report["Финансовые характеристики"]["Доверие к банкам"].items():
+                analytics_data.append([trust, int(count), f"{float(count)/len(personas)*100:.1f}%"])
+            analytics_data.append(["", "", ""])
+
+            # Отношение к кредитам
+            analytics_data.append(["Распределение по отношению к кредитам", "", ""])
+            for attitude, count in report["Финансовые характеристики"]["Отношение к кредитам"].items():
+                analytics_data.append([attitude, int(count), f"{float(count)/len(personas)*100:.1f}%"])
+            analytics_data.append(["", "", ""])
+
+            # Создаем DataFrame для аналитики
+            analytics_df = pd.DataFrame(analytics_data)
+
+            # Подготовка сводки по вопросам
+            question_analysis_data = []
+            question_analysis_data.append(["АНАЛИЗ ОТВЕТОВ НА ВОПРОСЫ", "", "", ""])
+            question_analysis_data.append(["Вопрос", "Тема", "Количество ответов", "Средняя длина (символы)"])
+
+            for qa in report["Аналитика ответов"]:
+                question_analysis_data.append([
+                    qa["Вопрос"],
+                    qa.get("Тема", "общие"),
+                    qa["Количество ответов"],
+                    qa.get("Средняя длина ответа (символы)", 0)
+                ])
+
+            question_analysis_df = pd.DataFrame(question_analysis_data)
+
+            # Журнал расходов по провайдерам и моделям
+            spend = self.spend_ledger.summary()
+            spend_df = pd.DataFrame([
+                {
+                    "Провайдер": m["provider"],
+                    "Модель": m["model"],
+                    "Запросов": m["requests"],
+                    "Входные токены": m["input_tokens"],
+                    "Выходные токены": m["output_tokens"],
+                    "Кэшированные токены": m["cached_tokens"],
+                    "Стоимость (USD)": round(m["cost"], 6)
+                }
+                for m in spend["models"]
+            ], columns=["Провайдер", "Модель", "Запросов", "Входные токены", "Выходные токены",
+                        "Кэшированные токены", "Стоимость (USD)"])
+
+            # Входные токены по разделам промпта
+            sections_df = pd.DataFrame([
+                {
+                    "Раздел": section["section"],
+                    "Промптов": section["prompts"],
+                    "Токены (оценка)": section["tokens"],
+                    "Байты": section["bytes"],
+                    "Доля токенов": round(section["share"], 4)
+                }
+                for section in spend["prompt_sections"]
+            ], columns=["Раздел", "Промптов", "Токены (оценка)", "Байты", "Доля токенов"])
+
+            # Создаем объект BytesIO для сохранения Excel файла в памяти
+            output = io.BytesIO()
+
+            # Экспорт всех таблиц в один Excel файл
+            with pd.ExcelWriter(output, engine='openpyxl') as writer:
+                wide_df.to_excel(writer, sheet_name='Респонденты_и_ответы', index=False)
+                answers_df.to_excel(writer, sheet_name='Все_ответы', index=False)
+                personas_df.to_excel(writer, sheet_name='Респонденты', index=False)
+                questions_df.to_excel(writer, sheet_name='Вопросы', index=False)
+                analytics_df.to_excel(writer, sheet_name='Демография', index=False, header=False)
+                question_analysis_df.to_excel(writer, sheet_name='Анализ_вопросов', index=False, header=False)
+                spend_df.to_excel(writer, sheet_name='Расходы', index=False)
+                sections_df.to_excel(writer, sheet_name='Разделы_промпта', index=False)
+
+            # Сброс указателя на начало файла
+            output.seek(0)
+            return output
+        except Exception as e:
+            raise ValueError(f"Ошибка при экспорте в Excel: {str(e)}")
+
+    def export_to_json(self, personas: List[Dict], questions: List[Dict], answers: List[Dict]) -> io.BytesIO:
+        """
+        Экспорт результатов в JSON файл
+
+        Args:
+            personas: Список словарей с персонами
+            questions: Список словарей с вопросами
+            answers: Список словарей с ответами
+
+        Returns:
+            io.BytesIO с JSON файлом
+        """
+        try:
+            # Генерируем отчет
+            report = self.analyze_results(personas, questions, answers)
+
+            # Создаем структуру данных
+            result = {
+                "personas": personas,
+                "questions": questions,
+                "answers": answers,
+                "report": report,
+                "spend": self.spend_ledger.summary(),
+                "generated_at": datetime.now().isoformat(),
+                "settings": {
+                    "api_key_claude": "***РЕДАКТИРОВАНО***",
+                    "api_key_openai": "***РЕДАКТИРОВАНО***" if self.api_key_openai else None,
+                }
+            }
+
+            # Создаем объект BytesIO для сохранения JSON файла
+            output = io.BytesIO()
+            output.write(json.dumps(result, ensure_ascii=False, indent=2, cls=NumpyEncoder).encode('utf-8'))
+            output.seek(0)
+            return output
+        except Exception as e:
+            raise ValueError(f"Ошибка при экспорте в JSON: {str(e)}")
+
+    def visualize_demographics(self, personas) -> "plt.Figure":
+        """
+        Создание визуализаций демографических данных
+
+        Args:
+            personas: Список словарей с персонами
+
+        Returns:
+            matplotlib Figure с визуализацией
+        """
+        # Создаем DataFrame из персон
+        persona_df = pd.DataFrame([
+            {
+                "Пол": p["Пол"],
+                "Возраст": p["Возраст"],
+                "Регион": p["Регион"],
+                "Образование": p["Образование"],
+                "Уровень финансовой грамотности": p.get("Финансовый профиль", {}).get("Уровень финансовой грамотности", "средний"),
+                "Доверие к банкам": p.get("Финансовый профиль", {}).get("Отношение к финансам", {}).get("Доверие к банкам", "среднее"),
+                "Отношение к кредитам": p.get("Финансовый профиль", {}).get("Отношение к финансам", {}).get("Отношение к кредитам", "нейтральное"),
+                "Отношение к риску": p.get("Финансовый профиль", {}).get("Отношение к финансам", {}).get("Отношение к риску", "умеренный")
+            }
+            for p in personas
+        ])
+
+        # Настройка подграфиков
+        fig, axes = plt.subplots(2, 3, figsize=(18, 12))
+        fig.suptitle('Демографический и финансовый анализ респондентов', fontsize=16)
+
+        # Распределение по полу
+        gender_counts = persona_df['Пол'].value_counts()
+        axes[0, 0].pie(gender_counts, labels=gender_counts.index, autopct='%1.1f%%', startangle=90)
+        axes[0, 0].set_title('Распределение по полу')
+
+        # Распределение по возрасту
+        sns.histplot(persona_df['Возраст'], kde=True, ax=axes[0, 1])
+        axes[0, 1].set_title('Распределение по возрасту')
+        axes[0, 1].set_xlabel('Возраст')
+        axes[0, 1].set_ylabel('Количество')
+
+        # Распределение по регионам
+        region_counts = persona_df['Регион'].value_counts().head(8)
+        sns.barplot(x=region_counts.index, y=region_counts.values, ax=axes[0, 2])
+        axes[0, 2].set_title('Распределение по регионам (топ 8)')
+        axes[0, 2].set_xlabel('Регион')
+        axes[0, 2].set_ylabel('Количество')
+        axes[0, 2].tick_params(axis='x', rotation=45)
+
+        # Распределение по уровню финансовой грамотности
+        literacy_counts = persona_df['Уровень финансовой грамотности'].value_counts()
+        sorted_literacy = pd.Series(
+            [literacy_counts.get(level, 0) for level in ['отсутствие знаний', 'начинающий', 'средний', 'продвинутый', 'эксперт']],
+            index=['отсутствие знаний', 'начинающий', 'средний', 'продвинутый', 'эксперт']
+        )
+        sns.barplot(x=sorted_literacy.index, y=sorted_literacy.values, ax=axes[1, 0])
+        axes[1, 0].set_title('Уровень финансовой грамотности')
+        axes[1, 0].set_xlabel('Уровень')
+        axes[1, 0].set_ylabel('Количество')
+        axes[1, 0].tick_params(axis='x', rotation=45)
+
+        # Доверие к банкам
+        trust_counts = persona_df['Доверие к банкам'].value_counts()
+        sorted_trust = pd.Series(
+            [trust_counts.get(level, 0) for level in ['низкое', 'среднее', 'высокое']],
+            index=['низкое', 'среднее', 'высокое']
+        )
+        sns.barplot(x=sorted_trust.index, y=sorted_trust.values, ax=axes[1, 1])
+        axes[1, 1].set_title('Доверие к банкам')
+        axes[1, 1].set_xlabel('Уровень доверия')
+        axes[1, 1].set_ylabel('Количество')
+
+        # Отношение к кредитам
+        loan_counts = persona_df['Отношение к кредитам'].value_counts()
+        sorted_loan = pd.Series(
+            [loan_counts.get(level, 0) for level in ['негативное', 'нейтральное', 'позитивное']],
+            index=['негативное', 'нейтральное', 'позитивное']
+        )
+        sns.barplot(x=sorted_loan.index, y=sorted_loan.values, ax=axes[1, 2])
+        axes[1, 2].set_title('Отношение к кредитам')
+        axes[1, 2].set_xlabel('Отношение')
+        axes[1, 2].set_ylabel('Количество')
+
+        # Настройка макета
+        plt.tight_layout(rect=[0, 0, 1, 0.96])
+
+        return fig
+
+# Версия формата набора промптов (входит в ключ кэша стадии построения промптов)
+PROMPT_SET_VERSION = 2
+
+# Поля набора промптов со вложенными структурами (в Parquet хранятся как JSON-строки)
+PROMPT_SET_JSON_COLUMNS = ("persona", "question", "section_sizes")
+
+# Заголовки разделов промпта вида "ВОПРОС:" в начале строки
+PROMPT_SECTION_HEADER_RE = re.compile(r"^([А-ЯЁA-Z][А-ЯЁA-Z0-9 ,\-]{2,}):", re.MULTILINE)
+
+# Экземпляр маркетплейса для построения промптов в процессе пула (создается инициализатором)
+_PROMPT_BUILDER = None
+
+
+def _init_prompt_builder(prompting_params: Dict) -> None:
+    """
+    Инициализатор процесса пула построения промптов
+
+    Args:
+        prompting_params: Параметры промптинга маркетплейса-координатора
+    """
+    global _PROMPT_BUILDER
+    _PROMPT_BUILDER = RespondentsMarketplace(prompt_only=True)
+    _PROMPT_BUILDER.prompting_params.update(prompting_params)
+
+
+def _build_prompt_chunk(persona_items: List[Tuple[int, Dict]], questions: List[Dict], num_questions: int,
+                        api_preference: Optional[str], use_enhanced: bool, seed: Optional[int] = None) -> List[Dict]:
+    """Построение промптов для порции персон в процессе пула"""
+    return _PROMPT_BUILDER.build_prompt_entries(
+        persona_items, questions, num_questions, api_preference, use_enhanced, seed
+    )
+
+
+class GenerationWorkQueue:
+    """
+    Встроенная очередь задач генерации на SQLite с арендой (lease) задач.
+
+    Базу можно разместить на общей файловой системе: несколько воркер-процессов
+    на одном или нескольких хостах забирают задачи (персона, вопрос) в аренду,
+    генерируют ответы и записывают их обратно. Просроченная аренда возвращает задачу в очередь.
+    """
+
+    # Интервал опроса очереди (секунды)
+    poll_interval = 1.0
+
+    # Максимальное количество попыток выполнения одной задачи
+    max_attempts = 3
+
+    # Задержка перед повторной попыткой задачи после сбоя (секунды, удваивается с каждой попыткой) и ее предел
+    retry_backoff = 2.0
+    retry_backoff_max = 60.0
+
+    # Сколько секунд координатор ждет, пока хотя бы один воркер возьмет задачу запуска
+    claim_grace_period = 60.0
+
+    def __init__(self, db_path: str):
+        """
+        Открытие (или создание) очереди задач
 
-            for answer in answers:
-                persona_id = answer["persona_id"]
-                persona = personas[persona_id-1]
-                question = answer["question"]
+        Args:
+            db_path: Путь к файлу базы данных очереди
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # Режим WAL не работает на сетевых файловых системах, поэтому используется стандартный журнал
+        self._conn = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS queue_runs (
+                    id TEXT PRIMARY KEY,
+                    config TEXT NOT NULL,
+                    num_questions INTEGER NOT NULL,
+                    created_at TEXT NOT NULL,
+                    spent REAL NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS queue_personas (
+                    run_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    persona TEXT NOT NULL,
+                    PRIMARY KEY (run_id, idx)
+                );
+                CREATE TABLE IF NOT EXISTS queue_questions (
+                    run_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    question TEXT NOT NULL,
+                    PRIMARY KEY (run_id, idx)
+                );
+                CREATE TABLE IF NOT EXISTS queue_tasks (
+                    run_id TEXT NOT NULL,
+                    task_id INTEGER NOT NULL,
+                    persona_idx INTEGER NOT NULL,
+                    question_idx INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    answer TEXT,
+                    completed_seq INTEGER,
+                    available_at REAL NOT NULL DEFAULT 0,
+                    usage TEXT,
+                    PRIMARY KEY (run_id, task_id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_queue_tasks_status ON queue_tasks (status, run_id, task_id);
+            """)
+            # Очереди, созданные предыдущими версиями (без задержки повторных попыток и учета токенов)
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(queue_tasks)")}
+            if "available_at" not in columns:
+                self._conn.execute("ALTER TABLE queue_tasks ADD COLUMN available_at REAL NOT NULL DEFAULT 0")
+            if "usage" not in columns:
+                self._conn.execute("ALTER TABLE queue_tasks ADD COLUMN usage TEXT")
+            if "spent" not in {row["name"] for row in self._conn.execute("PRAGMA table_info(queue_runs)")}:
+                self._conn.execute("ALTER TABLE queue_runs ADD COLUMN spent REAL NOT NULL DEFAULT 0")
+
+    def _write(self, operation: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Выполнение операции в эксклюзивной транзакции (безопасно для нескольких процессов)"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = operation(self._conn)
+                self._conn.execute("COMMIT")
+                return result
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
 
-                row = {
-                    "Респондент_ID": persona_id,
-                    "Вопрос_ID": question["id"],
-                    "Вопрос": question["text"],
-                    "Тип_вопроса": question.get("type", "open"),
-                    "Тема_вопроса": question.get("topic", "общие"),
-                    "Ответ": answer["text"][:32767] if len(answer["text"]) > 32767 else answer["text"],
-                    "Дата_время": answer["timestamp"],
-                    "Ошибка": answer.get("error", False)
+    def create_run(self, config: Dict, personas: List[Dict], questions: List[Dict]) -> str:
+        """
+        Создание запуска и постановка всех задач (персона x вопрос) в очередь
+
+        Args:
+            config: Параметры генерации (без API ключей)
+            personas: Список словарей с персонами
+            questions: Список словарей с вопросами
+
+        Returns:
+            Идентификатор запуска
+        """
+        run_id = uuid.uuid4().hex
+        num_questions = len(questions)
+
+        def operation(conn):
+            conn.execute(
+                "INSERT INTO queue_runs (id, config, num_questions, created_at) VALUES (?, ?, ?, ?)",
+                (run_id, json.dumps(config, ensure_ascii=False, cls=NumpyEncoder), num_questions,
+                 datetime.now().isoformat())
+            )
+            conn.executemany(
+                "INSERT INTO queue_personas (run_id, idx, persona) VALUES (?, ?, ?)",
+                ((run_id, i, json.dumps(p, ensure_ascii=False, cls=NumpyEncoder)) for i, p in enumerate(personas))
+            )
+            conn.executemany(
+                "INSERT INTO queue_questions (run_id, idx, question) VALUES (?, ?, ?)",
+                ((run_id, j, json.dumps(q, ensure_ascii=False, cls=NumpyEncoder)) for j, q in enumerate(questions))
+            )
+            conn.executemany(
+                "INSERT INTO queue_tasks (run_id, task_id, persona_idx, question_idx) VALUES (?, ?, ?, ?)",
+                ((run_id, i * num_questions + j, i, j)
+                 for i in range(len(personas)) for j in range(num_questions))
+            )
+
+        self._write(operation)
+        return run_id
+
+    def get_run_config(self, run_id: str) -> Dict:
+        """Получение параметров запуска"""
+        with self._lock:
+            row = self._conn.execute("SELECT config, num_questions FROM queue_runs WHERE id = ?", (run_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"Запуск {run_id} не найден в очереди")
+        return dict(json.loads(row["config"]), num_questions=row["num_questions"])
+
+    def get_persona(self, run_id: str, idx: int) -> Dict:
+        """Получение персоны запуска по индексу"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT persona FROM queue_personas WHERE run_id = ? AND idx = ?", (run_id, idx)
+            ).fetchone()
+        return json.loads(row["persona"])
+
+    def get_question(self, run_id: str, idx: int) -> Dict:
+        """Получение вопроса запуска по индексу"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT question FROM queue_questions WHERE run_id = ? AND idx = ?", (run_id, idx)
+            ).fetchone()
+        return json.loads(row["question"])
+
+    def requeue_expired_leases(self) -> int:
+        """
+        Возврат в очередь задач с просроченной арендой
+
+        Returns:
+            Количество возвращенных задач
+        """
+        def operation(conn):
+            return conn.execute(
+                "UPDATE queue_tasks SET status = 'pending', lease_owner = NULL, lease_expires = NULL "
+                "WHERE status = 'leased' AND lease_expires < ?",
+                (time.time(),)
+            ).rowcount
+
+        return self._write(operation)
+
+    def claim_tasks(self, worker_id: str, limit: int = 4, lease_seconds: float = 300,
+                    run_id: Optional[str] = None) -> List[Dict]:
+        """
+        Аренда ожидающих задач воркером
+
+        Args:
+            worker_id: Идентификатор воркера
+            limit: Максимальное количество задач
+            lease_seconds: Длительность аренды в секундах
+            run_id: Ограничить выборку конкретным запуском (опционально)
+
+        Returns:
+            Список арендованных задач (run_id, task_id, persona_idx, question_idx, attempts)
+        """
+        def operation(conn):
+            now = time.time()
+            conn.execute(
+                "UPDATE queue_tasks SET status = 'pending', lease_owner = NULL, lease_expires = NULL "
+                "WHERE status = 'leased' AND lease_expires < ?",
+                (now,)
+            )
+
+            query = ("SELECT run_id, task_id, persona_idx, question_idx, attempts FROM queue_tasks "
+                     "WHERE status = 'pending' AND available_at <= ?")
+            params = [now]
+            if run_id:
+                query += " AND run_id = ?"
+                params.append(run_id)
+            query += " ORDER BY run_id, task_id LIMIT ?"
+            params.append(limit)
+
+            rows = [dict(row) for row in conn.execute(query, params).fetchall()]
+            conn.executemany(
+                "UPDATE queue_tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE run_id = ? AND task_id = ?",
+                ((worker_id, now + lease_seconds, row["run_id"], row["task_id"]) for row in rows)
+            )
+            for row in rows:
+                row["attempts"] += 1
+            return rows
+
+        return self._write(operation)
+
+    def complete_task(self, run_id: str, task_id: int, answer: Dict, usage: Optional[List[List]] = None,
+                      cost: float = 0.0) -> bool:
+        """
+        Запись результата задачи (побеждает первое завершение, повторные игнорируются)
+
+        Args:
+            run_id: Идентификатор запуска
+            task_id: Идентификатор задачи
+            answer: Словарь с ответом
+            usage: Использование токенов задачей (RespondentsMarketplace.task_usage) для журнала расходов координатора
+            cost: Стоимость задачи в USD (добавляется к расходам запуска, см. run_spent)
+
+        Returns:
+            True, если результат записан
+        """
+        def operation(conn):
+            written = conn.execute(
+                "UPDATE queue_tasks SET status = 'done', lease_owner = NULL, lease_expires = NULL, answer = ?, "
+                "usage = ?, "
+                "completed_seq = (SELECT COALESCE(MAX(completed_seq), 0) + 1 FROM queue_tasks WHERE run_id = ?) "
+                "WHERE run_id = ? AND task_id = ? AND status != 'done'",
+                (json.dumps(answer, ensure_ascii=False, cls=NumpyEncoder), json.dumps(usage or []),
+                 run_id, run_id, task_id)
+            ).rowcount > 0
+            if written and cost:
+                conn.execute("UPDATE queue_runs SET spent = spent + ? WHERE id = ?", (cost, run_id))
+            return written
+
+        return self._write(operation)
+
+    def release_task(self, run_id: str, task_id: int, worker_id: str, delay: float = 0.0) -> None:
+        """
+        Досрочный возврат арендованной задачи в очередь (например, после сбоя)
+
+        Args:
+            run_id: Идентификатор запуска
+            task_id: Идентификатор задачи
+            worker_id: Идентификатор воркера, арендовавшего задачу
+            delay: Через сколько секунд задачу можно арендовать снова
+        """
+        def operation(conn):
+            conn.execute(
+                "UPDATE queue_tasks SET status = 'pending', lease_owner = NULL, lease_expires = NULL, "
+                "available_at = ? WHERE run_id = ? AND task_id = ? AND status = 'leased' AND lease_owner = ?",
+                (time.time() + delay, run_id, task_id, worker_id)
+            )
+
+        self._write(operation)
+
+    def run_spent(self, run_id: str) -> float:
+        """Фактические расходы запуска в USD по завершенным задачам"""
+        with self._lock:
+            row = self._conn.execute("SELECT spent FROM queue_runs WHERE id = ?", (run_id,)).fetchone()
+        return row["spent"] if row is not None else 0.0
+
+    def run_claimed(self, run_id: str) -> bool:
+        """Бралась ли в аренду хотя бы одна задача запуска"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM queue_tasks WHERE run_id = ? AND attempts > 0 LIMIT 1", (run_id,)
+            ).fetchone() is not None
+
+    def cancel_pending(self, run_id: str, text: str, skipped: bool = False) -> int:
+        """
+        Завершение ожидающих задач запуска без выполнения (арендованные задачи выполняются до конца)
+
+        Args:
+            run_id: Идентификатор запуска
+            text: Текст ответа для отмененных задач
+            skipped: Пометить ответы как пропущенные (например, по бюджету)
+
+        Returns:
+            Количество отмененных задач
+        """
+        num_questions = self.get_run_config(run_id)["num_questions"]
+
+        def operation(conn):
+            rows = conn.execute(
+                "SELECT t.task_id, t.persona_idx, t.question_idx, q.question FROM queue_tasks t "
+                "JOIN queue_questions q ON q.run_id = t.run_id AND q.idx = t.question_idx "
+                "WHERE t.run_id = ? AND t.status = 'pending' ORDER BY t.task_id",
+                (run_id,)
+            ).fetchall()
+            seq = conn.execute(
+                "SELECT COALESCE(MAX(completed_seq), 0) FROM queue_tasks WHERE run_id = ?", (run_id,)
+            ).fetchone()[0]
+            for row in rows:
+                seq += 1
+                answer = {
+                    "id": row["persona_idx"] * num_questions + row["question_idx"] + 1,
+                    "persona_id": row["persona_idx"] + 1,
+                    "question": json.loads(row["question"]),
+                    "text": text,
+                    "timestamp": datetime.now().isoformat(),
+                    "error": True
                 }
+                if skipped:
+                    answer["skipped"] = True
+                conn.execute(
+                    "UPDATE queue_tasks SET status = 'done', answer = ?, completed_seq = ? "
+                    "WHERE run_id = ? AND task_id = ?",
+                    (json.dumps(answer, ensure_ascii=False, cls=NumpyEncoder), seq, run_id, row["task_id"])
+                )
+            return len(rows)
+
+        return self._write(operation)
+
+    @classmethod
+    def retry_delay(cls, attempts: int) -> float:
+        """Задержка перед следующей попыткой задачи после указанного количества неудачных попыток"""
+        return min(cls.retry_backoff * 2 ** max(0, attempts - 1), cls.retry_backoff_max)
+
+    def has_unfinished(self, run_id: Optional[str] = None) -> bool:
+        """Проверка наличия ожидающих или арендованных задач"""
+        query = "SELECT 1 FROM queue_tasks WHERE status != 'done'"
+        params = ()
+        if run_id:
+            query += " AND run_id = ?"
+            params = (run_id,)
+        with self._lock:
+            return self._conn.execute(query + " LIMIT 1", params).fetchone() is not None
+
+    def run_progress(self, run_id: str) -> Dict[str, int]:
+        """
+        Статистика выполнения запуска
 
-                # Добавляем демографические характеристики из persona
-                for key, value in persona.items():
-                    if key != "Финансовый профиль" and key != "Лингвистический профиль" and key != "Профиль непоследовательности":
-                        if isinstance(value, list):
-                            row[f"Респондент_{key}"] = ", ".join(str(v) for v in value)
-                        else:
-                            row[f"Респондент_{key}"] = value
+        Returns:
+            Словарь с количеством задач по статусам и общим количеством
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) AS cnt FROM queue_tasks WHERE run_id = ? GROUP BY status", (run_id,)
+            ).fetchall()
+        counts = {"pending": 0, "leased": 0, "done": 0}
+        counts.update({row["status"]: row["cnt"] for row in rows})
+        counts["total"] = sum(counts.values())
+        return counts
+
+    def fetch_completed(self, run_id: str, after: int = 0) -> Tuple[List[Dict], List[List[List]], int]:
+        """
+        Получение ответов, завершенных после указанного порядкового номера
 
-                # Добавляем финансовые характеристики
-                if "Финансовый профиль" in persona:
-                    fp = persona["Финансовый профиль"]
+        Args:
+            run_id: Идентификатор запуска
+            after: Порядковый номер завершения, после которого нужны ответы
 
-                    # Уровень финансовой грамотности
-                    row["Финансовая_грамотность"] = fp.get("Уровень финансовой грамотности", "средний")
+        Returns:
+            Tuple (список ответов, использование токенов каждой задачей, последний порядковый номер)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT answer, usage, completed_seq FROM queue_tasks WHERE run_id = ? AND status = 'done' "
+                "AND completed_seq > ? ORDER BY completed_seq",
+                (run_id, after)
+            ).fetchall()
+        if not rows:
+            return [], [], after
+        return ([json.loads(row["answer"]) for row in rows], [json.loads(row["usage"] or "[]") for row in rows],
+                rows[-1]["completed_seq"])
+
+    def collect_answers(self, run_id: str) -> List[Dict]:
+        """
+        Объединение результатов запуска (координатор); невыполненные задачи помечаются как ошибки
 
-                    # Отношение к финансам
-                    if "Отношение к финансам" in fp:
-                        for key, value in fp["Отношение к финансам"].items():
-                            row[f"Финансы_{key.replace(' ', '_')}"] = value
+        Args:
+            run_id: Идентификатор запуска
 
-                data.append(row)
+        Returns:
+            Список словарей с ответами, отсортированный по ID
+        """
+        num_questions = self.get_run_config(run_id)["num_questions"]
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT task_id, persona_idx, question_idx, status, answer FROM queue_tasks "
+                "WHERE run_id = ? ORDER BY task_id",
+                (run_id,)
+            ).fetchall()
+
+        answers = []
+        for row in rows:
+            if row["status"] == "done":
+                answers.append(json.loads(row["answer"]))
+            else:
+                answers.append({
+                    "id": row["persona_idx"] * num_questions + row["question_idx"] + 1,
+                    "persona_id": row["persona_idx"] + 1,
+                    "question": self.get_question(run_id, row["question_idx"]),
+                    "text": "ОШИБКА: задача не была выполнена воркерами очереди",
+                    "timestamp": datetime.now().isoformat(),
+                    "error": True
+                })
 
-            # Создаем основной DataFrame с ответами
-            answers_df = pd.DataFrame(data)
+        answers.sort(key=lambda x: x["id"])
+        return answers
 
-            # Создаем DataFrame для респондентов
-            personas_data = []
-            for i, p in enumerate(personas):
-                row = {"ID": i+1}
 
-                # Базовые демографические данные
-                for key, value in p.items():
-                    if key != "Финансовый профиль" and key != "Лингвистический профиль" and key != "Профиль непоследовательности":
-                        if isinstance(value, list):
-                            row[key] = ", ".join(str(v) for v in value)
-                        else:
-                            row[key] = value
+def run_queue_worker(queue_path: str, run_id: Optional[str] = None, worker_id: Optional[str] = None,
+                     threads: int = 3, lease_seconds: float = 300, exit_when_idle: bool = True) -> int:
+    """
+    Воркер очереди: арендует задачи, генерирует ответы и записывает их обратно
 
-                # Финансовый профиль
-                if "Финансовый профиль" in p:
-                    fp = p["Финансовый профиль"]
+    API ключи берутся из переменных окружения ANTHROPIC_API_KEY / OPENAI_API_KEY
+    (в базе очереди они не хранятся).
 
-                    # Уровень финансовой грамотности
-                    row["Уровень_финансовой_грамотности"] = fp.get("Уровень финансовой грамотности", "средний")
+    Args:
+        queue_path: Путь к базе очереди задач
+        run_id: Обрабатывать только указанный запуск (опционально)
+        worker_id: Идентификатор воркера (по умолчанию hostname-pid)
+        threads: Количество потоков запросов к API
+        lease_seconds: Длительность аренды задачи в секундах
+        exit_when_idle: Завершаться, когда в очереди не осталось невыполненных задач
 
-                    # Используемые продукты
-                    if "Используемые продукты" in fp:
-                        for product, used in fp["Используемые продукты"].items():
-                            row[f"Продукт_{product.replace(' ', '_')}"] = "Да" if used else "Нет"
+    Returns:
+        Количество обработанных задач
+    """
+    queue = GenerationWorkQueue(queue_path)
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+
+    marketplaces = {}
+    marketplaces_lock = threading.Lock()
+    # Один словарь на персону: сессия персоны не хэширует ее заново для каждого вопроса
+    get_persona = lru_cache(maxsize=PERSONA_SESSION_CACHE_SIZE)(queue.get_persona)
+
+    def get_marketplace(task_run_id):
+        with marketplaces_lock:
+            if task_run_id not in marketplaces:
+                config = queue.get_run_config(task_run_id)
+                marketplace = RespondentsMarketplace(
+                    os.environ.get("ANTHROPIC_API_KEY"), os.environ.get("OPENAI_API_KEY"),
+                    use_fake_llm=config.get("use_fake_llm", False)
+                )
+                marketplace.prompting_params.update(config.get("prompting_params", {}))
+                marketplaces[task_run_id] = (marketplace, config)
+            return marketplaces[task_run_id]
+
+    def process_task(task):
+        marketplace, config = get_marketplace(task["run_id"])
+        persona = get_persona(task["run_id"], task["persona_idx"])
+        question = queue.get_question(task["run_id"], task["question_idx"])
+
+        # Жесткий бюджет запуска исчерпан фактическими расходами всех воркеров
+        budget = config.get("hard_budget")
+        if budget is not None and queue.run_spent(task["run_id"]) >= budget:
+            return queue.complete_task(task["run_id"], task["task_id"], {
+                "id": task["persona_idx"] * config["num_questions"] + task["question_idx"] + 1,
+                "persona_id": task["persona_idx"] + 1,
+                "question": question,
+                "text": "ПРОПУЩЕНО: превышен бюджет запуска",
+                "timestamp": datetime.now().isoformat(),
+                "error": True,
+                "skipped": True
+            })
+
+        answer = marketplace.generate_task_answer(
+            task["persona_idx"], persona, task["question_idx"], question, config["num_questions"],
+            api_preference=config.get("api_preference"), use_enhanced=config.get("use_enhanced", True),
+            seed=config.get("seed")
+        )
+        # Ответ с ошибкой API повторяем, пока не исчерпаны попытки
+        if answer.get("error") and task["attempts"] < GenerationWorkQueue.max_attempts:
+            queue.release_task(task["run_id"], task["task_id"], worker_id,
+                               delay=GenerationWorkQueue.retry_delay(task["attempts"]))
+            return False
+        usage = marketplace.task_usage()
+        cost = sum(marketplace.spend_ledger.price(*record[1:]) for record in usage)
+        return queue.complete_task(task["run_id"], task["task_id"], answer, usage=usage, cost=cost)
 
-                    # Отношение к финансам
-                    if "Отношение к финансам" in fp:
-                        for key, value in fp["Отношение к финансам"].items():
-                            row[f"Отношение_{key.replace(' ', '_')}"] = value
+    processed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        while True:
+            tasks = queue.claim_tasks(worker_id, limit=threads, lease_seconds=lease_seconds, run_id=run_id)
+
+            if not tasks:
+                if exit_when_idle and not queue.has_unfinished(run_id):
+                    break
+                time.sleep(GenerationWorkQueue.poll_interval)
+                continue
+
+            futures = {executor.submit(process_task, task): task for task in tasks}
+            for future in concurrent.futures.as_completed(futures):
+                task = futures[future]
+                try:
+                    if future.result():
+                        processed += 1
+                except Exception as e:
+                    logger.exception(f"Воркер {worker_id}: ошибка задачи {task['task_id']}: {e}")
+                    queue.release_task(task["run_id"], task["task_id"], worker_id,
+                                       delay=GenerationWorkQueue.retry_delay(task["attempts"]))
+
+    return processed
+
+
+def start_queue_worker_process(queue_path: str, run_id: Optional[str] = None, threads: int = 3,
+                               api_key_claude: Optional[str] = None,
+                               api_key_openai: Optional[str] = None) -> subprocess.Popen:
+    """
+    Запуск локального воркер-процесса очереди (отдельный интерпретатор, без конкуренции за GIL)
+
+    Args:
+        queue_path: Путь к базе очереди задач
+        run_id: Обрабатывать только указанный запуск (опционально)
+        threads: Количество потоков запросов к API в воркере
+        api_key_claude: API ключ Claude (передается через переменные окружения)
+        api_key_openai: API ключ OpenAI (передается через переменные окружения)
+
+    Returns:
+        Объект запущенного процесса
+    """
+    env = dict(os.environ)
+    if api_key_claude:
+        env["ANTHROPIC_API_KEY"] = api_key_claude
+    if api_key_openai:
+        env["OPENAI_API_KEY"] = api_key_openai
+
+    command = [sys.executable, os.path.abspath(__file__), "worker", "--queue", queue_path, "--threads", str(threads)]
+    if run_id:
+        command += ["--run-id", run_id]
+    if API_CLIENTS.settings["http2"]:
+        # Настройки HTTP-пула процесса воркера задаются только аргументами командной строки
+        command.append("--http2")
+
+    return subprocess.Popen(command, env=env)
+
+
+def run_generation_pipeline(api_key_claude, api_key_openai, questions_file, personas, output_format='json',
+                           max_workers=3, api_preference=None, visualize=True,
+                           reviews_file=None, use_enhanced=True, questions=None, marketplace=None,
+                           progress_callback=None, answer_callback=None, queue_path=None, local_queue_workers=0,
+                           prompt_workers=None, prompt_set_path=None, budget=None, soft_budget=None, seed=None,
+                           prompt_profile=None, local_postprocessing=None, stream_responses=None):
+    """
+    Основной пайплайн генерации данных с указанными персонами и поддержкой многопоточности
+
+    Args:
+        api_key_claude: API ключ для Anthropic Claude
+        api_key_openai: API ключ для OpenAI (опционально)
+        questions_file: Файл с вопросами (Excel, CSV, JSONL или Parquet)
+        personas: Список словарей с персонами
+        output_format: 'json' или 'excel'
+        max_workers: Максимальное количество параллельных рабочих процессов
+        api_preference: Предпочтительное API ('claude' или 'openai')
+        visualize: Создавать ли визуализации
+        reviews_file: Данные файла с отзывами о банках (опционально)
+        use_enhanced: Использовать ли расширенную генерацию с поведенческими факторами
+        questions: Уже подготовленный список вопросов (если задан, questions_file не читается)
+        marketplace: Готовый экземпляр RespondentsMarketplace (опционально)
+        progress_callback: Функция (выполнено, всего) для отображения прогресса вне Streamlit
+        answer_callback: Функция, вызываемая для каждого готового ответа
+        queue_path: Путь к базе очереди задач для распределенной генерации (опционально)
+        local_queue_workers: Количество локальных воркер-процессов очереди
+        prompt_workers: Количество процессов для построения промптов (None - по числу ядер)
+        prompt_set_path: Файл для сохранения (и повторного использования) набора промптов
+        budget: Жесткий бюджет запуска в USD
+        soft_budget: Мягкий бюджет запуска в USD
+        seed: Зерно запуска для воспроизводимых промптов (None - без фиксации)
+        prompt_profile: Профиль промпта ('full' или 'compact'; None - текущий профиль маркетплейса)
+        local_postprocessing: Добавлять опечатки, слова-паразиты и региональные выражения локально
+            (None - текущая настройка маркетплейса)
+        stream_responses: Запрашивать ответы потоком (частичный текст - в marketplace.partial_answer_callback;
+            None - текущая настройка маркетплейса)
+
+    Returns:
+        Tuple (Результаты, Данные для загрузки)
+    """
+    try:
+        # Создаем экземпляр маркетплейса
+        if marketplace is None:
+            marketplace = RespondentsMarketplace(api_key_claude, api_key_openai)
+        if prompt_profile is not None:
+            marketplace.set_prompt_profile(prompt_profile)
+        if local_postprocessing is not None:
+            marketplace.prompting_params["local_postprocessing"] = bool(local_postprocessing)
+        if stream_responses is not None:
+            marketplace.prompting_params["stream_responses"] = bool(stream_responses)
+
+        # Загружаем вопросы
+        if questions is None:
+            questions = marketplace.load_questions(questions_file)
+
+        # Если указан файл с отзывами о банках, загружаем его
+        if reviews_file:
+            marketplace.load_bank_reviews(reviews_file)
+
+        # Генерируем ответы
+        marketplace.notify(f"Генерация ответов для {len(personas)} респондентов на {len(questions)} вопросов...",
+                           level="info")
+        all_answers = marketplace.run_generation_batch(
+            personas, questions, max_workers=max_workers,
+            api_preference=api_preference, use_enhanced=use_enhanced,
+            progress_callback=progress_callback, answer_callback=answer_callback,
+            queue_path=queue_path, local_queue_workers=local_queue_workers,
+            prompt_workers=prompt_workers, prompt_set_path=prompt_set_path,
+            budget=budget, soft_budget=soft_budget, seed=seed
+        )
+
+        # Генерируем отчет
+        report = marketplace.analyze_results(personas, questions, all_answers)
+
+        # Сохраняем результаты в соответствующем формате
+        download_data = None
+        if output_format == 'excel':
+            download_data = marketplace.export_to_excel(personas, questions, all_answers)
+            file_ext = '.xlsx'
+        else:
+            download_data = marketplace.export_to_json(personas, questions, all_answers)
+            file_ext = '.json'
+
+        # Визуализация
+        fig = None
+        if visualize:
+            fig = marketplace.visualize_demographics(personas)
+
+        results = {
+            "personas": personas,
+            "questions": questions,
+            "answers": all_answers,
+            "report": report,
+            "spend": marketplace.spend_ledger.summary(),
+            "fig": fig,
+            "file_ext": file_ext
+        }
+
+        return results, download_data
+    except Exception as e:
+        # Ошибку показывает вызывающий код (лента ответов, API заданий); здесь она только журналируется
+        logger.exception(f"Ошибка в процессе генерации: {str(e)}")
+        raise e
+
+class GenerationJobStore:
+    """Персистентное хранилище заданий генерации на базе SQLite"""
+
+    def __init__(self, db_path: str = "synthetica_jobs.sqlite3"):
+        """
+        Инициализация хранилища заданий
+
+        Args:
+            db_path: Путь к файлу базы данных SQLite (':memory:' для временного хранилища)
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    request TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT,
+                    completed INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    report TEXT
+                );
+                CREATE TABLE IF NOT EXISTS job_answers (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    answer TEXT NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                );
+                CREATE TABLE IF NOT EXISTS job_exports (
+                    job_id TEXT NOT NULL,
+                    format TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    PRIMARY KEY (job_id, format)
+                );
+            """)
+            self._conn.commit()
+
+    def create_job(self, request: Dict) -> str:
+        """
+        Создание нового задания в статусе 'queued'
 
-                personas_data.append(row)
+        Args:
+            request: Параметры задания (API ключи в хранилище не сохраняются)
 
-            personas_df = pd.DataFrame(personas_data)
+        Returns:
+            Идентификатор задания
+        """
+        job_id = uuid.uuid4().hex
+        settings = {
+            k: v for k, v in request.get("settings", {}).items()
+            if k not in ("api_key_claude", "api_key_openai")
+        }
+        stored_request = dict(request, settings=settings)
 
-            # Создаем DataFrame для вопросов
-            questions_df = pd.DataFrame([
-                {
-                    "ID": q["id"],
-                    "Вопрос": q["text"],
-                    "Тип": q["type"],
-                    "Тема": q.get("topic", "общие"),
-                    "Варианты_ответов": ", ".join(q["options"]) if q.get("options") else "",
-                    "Контекст": q.get("context", "")
-                } for q in questions
-            ])
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, request, created_at) VALUES (?, 'queued', ?, ?)",
+                (job_id, json.dumps(stored_request, ensure_ascii=False, cls=NumpyEncoder), datetime.now().isoformat())
+            )
+            self._conn.commit()
 
-            # Создаем сводную таблицу ответов по респондентам и вопросам
-            wide_data = []
+        return job_id
 
-            for i, persona in enumerate(personas):
-                row = {"Респондент_ID": i+1}
+    def update_job(self, job_id: str, **fields) -> None:
+        """
+        Обновление полей задания (status, started_at, finished_at, error, report)
 
-                # Добавляем все характеристики респондента
-                for key, value in persona.items():
-                    if key != "Финансовый профиль" and key != "Лингвистический профиль" and key != "Профиль непоследовательности":
-                        if isinstance(value, list):
-                            row[key] = ", ".join(str(v) for v in value)
-                        else:
-                            row[key] = value
+        Args:
+            job_id: Идентификатор задания
+            **fields: Обновляемые поля
+        """
+        allowed = {"status", "started_at", "finished_at", "error", "report", "completed", "total"}
+        updates = {k: v for k, v in fields.items() if k in allowed}
+        if not updates:
+            return
 
-                # Добавляем финансовый профиль
-                if "Финансовый профиль" in persona:
-                    fp = persona["Финансовый профиль"]
+        assignments = ", ".join(f"{k} = ?" for k in updates)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*updates.values(), job_id))
+            self._conn.commit()
 
-                    # Уровень финансовой грамотности
-                    row["Уровень_финансовой_грамотности"] = fp.get("Уровень финансовой грамотности", "средний")
+    def add_answer(self, job_id: str, answer: Dict) -> int:
+        """
+        Сохранение готового ответа и увеличение счетчика прогресса
 
-                    # Отношение к финансам
-                    if "Отношение к финансам" in fp:
-                        for key, value in fp["Отношение к финансам"].items():
-                            row[f"Отношение_{key.replace(' ', '_')}"] = value
+        Args:
+            job_id: Идентификатор задания
+            answer: Словарь с ответом
 
-                # Добавляем ответы на все вопросы
-                for question in questions:
-                    question_id = question["id"]
+        Returns:
+            Порядковый номер ответа в задании (начиная с 1)
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM job_answers WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            seq = row[0] + 1
+            self._conn.execute(
+                "INSERT INTO job_answers (job_id, seq, answer) VALUES (?, ?, ?)",
+                (job_id, seq, json.dumps(answer, ensure_ascii=False, cls=NumpyEncoder))
+            )
+            self._conn.execute("UPDATE jobs SET completed = ? WHERE id = ?", (seq, job_id))
+            self._conn.commit()
+        return seq
 
-                    # Находим ответ этого респондента на этот вопрос
-                    answer_obj = next(
-                        (a for a in answers if a["persona_id"] == i+1 and a["question"]["id"] == question_id),
-                        None
-                    )
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """
+        Получение информации о задании
 
-                    if answer_obj and not answer_obj.get("error", False):
-                        # Ограничение для Excel на длину ячейки
-                        answer_text = answer_obj["text"]
-                        if len(answer_text) > 32767:
-                            answer_text = answer_text[:32764] + "..."
-                        row[f"Вопрос_{question_id}"] = answer_text
-                    else:
-                        row[f"Вопрос_{question_id}"] = ""
+        Args:
+            job_id: Идентификатор задания
 
-                wide_data.append(row)
+        Returns:
+            Словарь с информацией о задании или None, если задание не найдено
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            formats = [r[0] for r in self._conn.execute(
+                "SELECT format FROM job_exports WHERE job_id = ?", (job_id,)
+            )]
+
+        total = row["total"]
+        return {
+            "id": row["id"],
+            "status": row["status"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "progress": {
+                "completed": row["completed"],
+                "total": total,
+                "percent": round(row["completed"] / total * 100, 1) if total else 0.0
+            },
+            "error": row["error"],
+            "report": json.loads(row["report"]) if row["report"] else None,
+            "exports": formats
+        }
 
-            wide_df = pd.DataFrame(wide_data)
+    def list_jobs(self, limit: int = 50) -> List[Dict]:
+        """
+        Получение списка последних заданий
 
-            # Генерируем отчет
-            report = self.analyze_results(personas, questions, answers)
+        Args:
+            limit: Максимальное количество заданий
 
-            # Создаем DataFrame для аналитики
-            analytics_data = []
+        Returns:
+            Список кратких описаний заданий
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, status, created_at, completed, total FROM jobs ORDER BY created_at DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_answers(self, job_id: str, after: int = 0, limit: int = 1000) -> List[Dict]:
+        """
+        Получение ответов задания, сохраненных после указанного порядкового номера
 
-            # Общая статистика
-            analytics_data.append(["ОБЩАЯ СТАТИСТИКА", "", ""])
-            for key, value in report["Общая статистика"].items():
-                analytics_data.append([key, value, ""])
-            analytics_data.append(["", "", ""])
+        Args:
+            job_id: Идентификатор задания
+            after: Порядковый номер, после которого нужно вернуть ответы
+            limit: Максимальное количество ответов
 
-            # Демографический анализ
-            analytics_data.append(["ДЕМОГРАФИЧЕСКИЙ СОСТАВ", "", ""])
-            analytics_data.append(["", "", ""])
+        Returns:
+            Список словарей {"seq": номер, "answer": ответ}
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, answer FROM job_answers WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (job_id, after, limit)
+            ).fetchall()
+        return [{"seq": row["seq"], "answer": json.loads(row["answer"])} for row in rows]
+
+    def save_export(self, job_id: str, export_format: str, data: bytes) -> None:
+        """Сохранение файла экспорта для задания"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO job_exports (job_id, format, data) VALUES (?, ?, ?)",
+                (job_id, export_format, data)
+            )
+            self._conn.commit()
 
-            # Пол
-            analytics_data.append(["Распределение по полу", "", ""])
-            for gender, count in report["Демографический состав"]["Пол"].items():
-                analytics_data.append([gender, int(count), f"{float(count)/len(personas)*100:.1f}%"])
-            analytics_data.append(["", "", ""])
+    def get_export(self, job_id: str, export_format: str) -> Optional[bytes]:
+        """Получение файла экспорта для задания"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM job_exports WHERE job_id = ? AND format = ?", (job_id, export_format)
+            ).fetchone()
+        return bytes(row["data"]) if row else None
 
-            # Возраст
-            analytics_data.append(["Возрастное распределение", "", ""])
-            age_stats = report["Демографический состав"]["Возраст"]
-            analytics_data.append(["Средний возраст", f"{age_stats['Средний']:.1f}", ""])
-            analytics_data.append(["Медианный возраст", f"{age_stats['Медианный']:.1f}", ""])
-            analytics_data.append(["Минимальный возраст", int(age_stats['Минимальный']), ""])
-            analytics_data.append(["Максимальный возраст", int(age_stats['Максимальный']), ""])
-            analytics_data.append(["", "", ""])
+    def mark_interrupted_jobs(self) -> int:
+        """
+        Пометка заданий, прерванных перезапуском процесса (API ключи не сохраняются, поэтому их нельзя продолжить)
 
-            # Финансовая грамотность
-            analytics_data.append(["ФИНАНСОВЫЕ ХАРАКТЕРИСТИКИ", "", ""])
-            analytics_data.append(["", "", ""])
+        Returns:
+            Количество прерванных заданий
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'interrupted', finished_at = ? WHERE status IN ('queued', 'running')",
+                (datetime.now().isoformat(),)
+            )
+            self._conn.commit()
+        return cursor.rowcount
 
-            # Уровни финансовой грамотности
-            analytics_data.append(["Распределение по уровню финансовой грамотности", "", ""])
-            for level, count in report["Финансовые характеристики"]["Уровни финансовой грамотности"].items():
-                analytics_data.append([level, int(count), f"{float(count)/len(personas)*100:.1f}%"])
-            analytics_data.append(["", "", ""])
+    def close(self) -> None:
+        """Закрытие соединения с базой данных"""
+        with self._lock:
+            self._conn.close()
 
-            # Доверие к банкам
-            analytics_data.append(["Распределение по уровню доверия к банкам", "", ""])
-            for trust, count in report["Финансовые характеристики"]["Доверие к банкам"].items():
-                analytics_data.append([trust, int(count), f"{float(count)/len(personas)*100:.1f}%"])
-            analytics_data.append(["", "", ""])
 
-            # Отношение к кредитам
-            analytics_data.append(["Распределение по отношению к кредитам", "", ""])
-            for attitude, count in report["Финансовые характеристики"]["Отношение к кредитам"].items():
-                analytics_data.append([attitude, int(count), f"{float(count)/len(personas)*100:.1f}%"])
-            analytics_data.append(["", "", ""])
+class GenerationJobService:
+    """Сервис асинхронного выполнения заданий генерации с ограниченным пулом исполнителей"""
 
-            # Создаем DataFrame для аналитики
-            analytics_df = pd.DataFrame(analytics_data)
+    # Обязательные поля персоны, переданной через API
+    required_persona_fields = [
+        "Пол", "Возраст", "Регион", "Город", "Профессия", "Образование",
+        "Семейное положение", "Количество детей", "Доход"
+    ]
 
-            # Подготовка сводки по вопросам
-            question_analysis_data = []
-            question_analysis_data.append(["АНАЛИЗ ОТВЕТОВ НА ВОПРОСЫ", "", "", ""])
-            question_analysis_data.append(["Вопрос", "Тема", "Количество ответов", "Средняя длина (символы)"])
+    def __init__(self, store: GenerationJobStore, max_concurrent_jobs: int = 2, max_queued_jobs: int = 100,
+                 max_workers_per_job: int = 5, api_key_claude: Optional[str] = None,
+                 api_key_openai: Optional[str] = None, use_fake_llm: bool = False):
+        """
+        Инициализация сервиса заданий
 
-            for qa in report["Аналитика ответов"]:
-                question_analysis_data.append([
-                    qa["Вопрос"],
-                    qa.get("Тема", "общие"),
-                    qa["Количество ответов"],
-                    qa.get("Средняя длина ответа (символы)", 0)
-                ])
+        Args:
+            store: Хранилище заданий
+            max_concurrent_jobs: Количество одновременно выполняемых заданий
+            max_queued_jobs: Максимальное количество заданий в очереди и в работе
+            max_workers_per_job: Верхняя граница потоков запросов к API внутри одного задания
+            api_key_claude: API ключ Claude по умолчанию
+            api_key_openai: API ключ OpenAI по умолчанию
+            use_fake_llm: Использовать локальный фейковый LLM для всех заданий
+        """
+        self.store = store
+        self.max_queued_jobs = max_queued_jobs
+        self.max_workers_per_job = max_workers_per_job
+        self.api_key_claude = api_key_claude
+        self.api_key_openai = api_key_openai
+        self.use_fake_llm = use_fake_llm
 
-            question_analysis_df = pd.DataFrame(question_analysis_data)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrent_jobs, thread_name_prefix="generation-job"
+        )
+        self._active_jobs = 0
+        self._lock = threading.Lock()
 
-            # Создаем объект BytesIO для сохранения Excel файла в памяти
-            output = io.BytesIO()
+    def _validate_request(self, request: Dict) -> None:
+        """
+        Проверка параметров задания
 
-            # Экспорт всех таблиц в один Excel файл
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                wide_df.to_excel(writer, sheet_name='Респонденты_и_ответы', index=False)
-                answers_df.to_excel(writer, sheet_name='Все_ответы', index=False)
-                personas_df.to_excel(writer, sheet_name='Респонденты', index=False)
-                questions_df.to_excel(writer, sheet_name='Вопросы', index=False)
-                analytics_df.to_excel(writer, sheet_name='Демография', index=False, header=False)
-                question_analysis_df.to_excel(writer, sheet_name='Анализ_вопросов', index=False, header=False)
+        Args:
+            request: Параметры задания
 
-            # Сброс указателя на начало файла
-            output.seek(0)
-            return output
-        except Exception as e:
-            raise ValueError(f"Ошибка при экспорте в Excel: {str(e)}")
+        Raises:
+            ValueError: Если параметры некорректны
+        """
+        if not isinstance(request, dict):
+            raise ValueError("Тело запроса должно быть JSON-объектом")
+
+        questions = request.get("questions")
+        if not questions or not isinstance(questions, list):
+            raise ValueError("Необходимо передать непустой список 'questions'")
+
+        personas = request.get("personas")
+        persona_spec = request.get("persona_spec", {})
+        if personas:
+            if not isinstance(personas, list):
+                raise ValueError("'personas' должен быть списком")
+            for idx, persona in enumerate(personas):
+                missing = [f for f in self.required_persona_fields if f not in persona]
+                if missing:
+                    raise ValueError(f"У персоны #{idx + 1} отсутствуют поля: {missing}")
+        else:
+            count = persona_spec.get("count")
+            if not isinstance(count, int) or count < 1:
+                raise ValueError("Необходимо передать 'personas' или 'persona_spec' с положительным 'count'")
+
+        settings = request.get("settings", {})
+        if settings.get("output_format", "json") not in ("json", "excel"):
+            raise ValueError("'output_format' должен быть 'json' или 'excel'")
+        if settings.get("api_preference") not in (None, "claude", "openai"):
+            raise ValueError("'api_preference' должен быть 'claude', 'openai' или null")
+        for budget_field in ("budget", "soft_budget"):
+            value = settings.get(budget_field)
+            if value is not None and (not isinstance(value, (int, float)) or value <= 0):
+                raise ValueError(f"'{budget_field}' должен быть положительным числом (USD)")
+        seed = settings.get("seed")
+        if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool) or seed < 0):
+            raise ValueError("'seed' должен быть неотрицательным целым числом")
+        if settings.get("prompt_profile", "full") not in PROMPT_PROFILES:
+            raise ValueError(f"'prompt_profile' должен быть одним из: {', '.join(PROMPT_PROFILES)}")
+        if not isinstance(settings.get("local_postprocessing", False), bool):
+            raise ValueError("'local_postprocessing' должен быть логическим значением")
+
+        use_fake_llm = self.use_fake_llm or settings.get("fake_llm", False)
+        has_keys = settings.get("api_key_claude") or settings.get("api_key_openai") \
+            or self.api_key_claude or self.api_key_openai
+        if not use_fake_llm and not has_keys:
+            raise ValueError("Необходим хотя бы один API ключ (Claude или OpenAI)")
 
-    def export_to_json(self, personas: List[Dict], questions: List[Dict], answers: List[Dict]) -> io.BytesIO:
+    def submit(self, request: Dict) -> str:
         """
-        Экспорт результатов в JSON файл
+        Постановка задания в очередь
 
         Args:
-            personas: Список словарей с персонами
-            questions: Список словарей с вопросами
-            answers: Список словарей с ответами
+            request: Параметры задания (questions, personas или persona_spec, settings)
 
         Returns:
-            io.BytesIO с JSON файлом
+            Идентификатор задания
+
+        Raises:
+            ValueError: Если параметры некорректны
+            RuntimeError: Если очередь заданий переполнена
         """
-        try:
-            # Генерируем отчет
-            report = self.analyze_results(personas, questions, answers)
+        self._validate_request(request)
 
-            # Создаем структуру данных
-            result = {
-                "personas": personas,
-                "questions": questions,
-                "answers": answers,
-                "report": report,
-                "generated_at": datetime.now().isoformat(),
-                "settings": {
-                    "api_key_claude": "***РЕДАКТИРОВАНО***",
-                    "api_key_openai": "***РЕДАКТИРОВАНО***" if self.api_key_openai else None,
-                }
-            }
+        with self._lock:
+            if self._active_jobs >= self.max_queued_jobs:
+                raise RuntimeError("Очередь заданий переполнена, повторите попытку позже")
+            self._active_jobs += 1
 
-            # Создаем объект BytesIO для сохранения JSON файла
-            output = io.BytesIO()
-            output.write(json.dumps(result, ensure_ascii=False, indent=2, cls=NumpyEncoder).encode('utf-8'))
-            output.seek(0)
-            return output
-        except Exception as e:
-            raise ValueError(f"Ошибка при экспорте в JSON: {str(e)}")
+        job_id = self.store.create_job(request)
+        self._executor.submit(self._run_job, job_id, request)
+        return job_id
 
-    def visualize_demographics(self, personas) -> plt.Figure:
+    def _run_job(self, job_id: str, request: Dict) -> None:
         """
-        Создание визуализаций демографических данных
+        Выполнение задания в рабочем потоке
 
         Args:
-            personas: Список словарей с персонами
-
-        Returns:
-            matplotlib Figure с визуализацией
+            job_id: Идентификатор задания
+            request: Параметры задания (включая API ключи, которые хранятся только в памяти)
         """
-        # Создаем DataFrame из персон
-        persona_df = pd.DataFrame([
-            {
-                "Пол": p["Пол"],
-                "Возраст": p["Возраст"],
-                "Регион": p["Регион"],
-                "Образование": p["Образование"],
-                "Уровень финансовой грамотности": p.get("Финансовый профиль", {}).get("Уровень финансовой грамотности", "средний"),
-                "Доверие к банкам": p.get("Финансовый профиль", {}).get("Отношение к финансам", {}).get("Доверие к банкам", "среднее"),
-                "Отношение к кредитам": p.get("Финансовый профиль", {}).get("Отношение к финансам", {}).get("Отношение к кредитам", "нейтральное"),
-                "Отношение к риску": p.get("Финансовый профиль", {}).get("Отношение к финансам", {}).get("Отношение к риску", "умеренный")
-            }
-            for p in personas
-        ])
+        settings = request.get("settings", {})
+        self.store.update_job(job_id, status="running", started_at=datetime.now().isoformat())
 
-        # Настройка подграфиков
-        fig, axes = plt.subplots(2, 3, figsize=(18, 12))
-        fig.suptitle('Демографический и финансовый анализ респондентов', fontsize=16)
+        try:
+            api_key_claude = settings.get("api_key_claude") or self.api_key_claude
+            api_key_openai = settings.get("api_key_openai") or self.api_key_openai
+            marketplace = RespondentsMarketplace(
+                api_key_claude, api_key_openai,
+                use_fake_llm=self.use_fake_llm or settings.get("fake_llm", False)
+            )
 
-        # Распределение по полу
-        gender_counts = persona_df['Пол'].value_counts()
-        axes[0, 0].pie(gender_counts, labels=gender_counts.index, autopct='%1.1f%%', startangle=90)
-        axes[0, 0].set_title('Распределение по полу')
+            questions = marketplace.prepare_questions(request["questions"])
+            personas = request.get("personas")
+            if not personas:
+                persona_spec = request.get("persona_spec", {})
+                personas = marketplace.generate_cohort(
+                    persona_spec["count"], weighted=persona_spec.get("weighted", True), seed=persona_spec.get("seed")
+                )
 
-        # Распределение по возрасту
-        sns.histplot(persona_df['Возраст'], kde=True, ax=axes[0, 1])
-        axes[0, 1].set_title('Распределение по возрасту')
-        axes[0, 1].set_xlabel('Возраст')
-        axes[0, 1].set_ylabel('Количество')
+            self.store.update_job(job_id, total=len(personas) * len(questions))
+
+            results, _ = run_generation_pipeline(
+                api_key_claude, api_key_openai, None, personas,
+                output_format=settings.get("output_format", "json"),
+                max_workers=max(1, min(int(settings.get("max_workers", 3)), self.max_workers_per_job)),
+                api_preference=settings.get("api_preference"),
+                visualize=False,
+                use_enhanced=settings.get("use_enhanced", True),
+                questions=questions,
+                marketplace=marketplace,
+                progress_callback=lambda completed, total: None,
+                answer_callback=lambda answer: self.store.add_answer(job_id, answer),
+                budget=settings.get("budget"),
+                soft_budget=settings.get("soft_budget"),
+                seed=settings.get("seed"),
+                prompt_profile=settings.get("prompt_profile"),
+                local_postprocessing=settings.get("local_postprocessing")
+            )
 
-        # Распределение по регионам
-        region_counts = persona_df['Регион'].value_counts().head(8)
-        sns.barplot(x=region_counts.index, y=region_counts.values, ax=axes[0, 2])
-        axes[0, 2].set_title('Распределение по регионам (топ 8)')
-        axes[0, 2].set_xlabel('Регион')
-        axes[0, 2].set_ylabel('Количество')
-        axes[0, 2].tick_params(axis='x', rotation=45)
+            answers = results["answers"]
+            self.store.save_export(job_id, "json", marketplace.export_to_json(personas, questions, answers).getvalue())
+            self.store.save_export(job_id, "excel", marketplace.export_to_excel(personas, questions, answers).getvalue())
+
+            self.store.update_job(
+                job_id, status="completed", finished_at=datetime.now().isoformat(),
+                report=json.dumps(results["report"], ensure_ascii=False, cls=NumpyEncoder)
+            )
+        except Exception as e:
+            self.store.update_job(job_id, status="failed", finished_at=datetime.now().isoformat(), error=str(e))
+        finally:
+            with self._lock:
+                self._active_jobs -= 1
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Остановка пула исполнителей"""
+        self._executor.shutdown(wait=wait)
+
+
+class _GenerationAPIHandler(BaseHTTPRequestHandler):
+    """HTTP обработчик API заданий генерации"""
+
+    server_version = "SyntheticaJobs/1.0"
+
+    # Интервал опроса хранилища при потоковой выдаче ответов (секунды)
+    stream_poll_interval = 0.5
+
+    # Максимальный размер страницы ответов (параметр limit)
+    max_page_size = 1000
+
+    @property
+    def job_service(self) -> GenerationJobService:
+        return self.server.job_service
+
+    def _send_json(self, payload: Any, status: int = 200) -> None:
+        body = json.dumps(payload, ensure_ascii=False, cls=NumpyEncoder).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error_json(self, status: int, message: str) -> None:
+        self._send_json({"error": message}, status=status)
+
+    @staticmethod
+    def _query_int(query: Dict[str, List[str]], name: str, default: int, maximum: Optional[int] = None) -> int:
+        """
+        Неотрицательный целочисленный параметр запроса
+
+        Args:
+            query: Параметры запроса (parse_qs)
+            name: Имя параметра
+            default: Значение по умолчанию
+            maximum: Верхняя граница значения (большие значения ограничиваются ею)
+
+        Returns:
+            Значение параметра
+
+        Raises:
+            ValueError: Если значение не является неотрицательным целым числом
+        """
+        raw = query.get(name, [str(default)])[0]
+        try:
+            value = int(raw)
+        except ValueError:
+            raise ValueError(f"Параметр '{name}' должен быть целым числом, получено: '{raw}'")
+        if value < 0:
+            raise ValueError(f"Параметр '{name}' не может быть отрицательным, получено: {value}")
+        return min(value, maximum) if maximum is not None else value
 
-        # Распределение по уровню финансовой грамотности
-        literacy_counts = persona_df['Уровень финансовой грамотности'].value_counts()
-        sorted_literacy = pd.Series(
-            [literacy_counts.get(level, 0) for level in ['отсутствие знаний', 'начинающий', 'средний', 'продвинутый', 'эксперт']],
-            index=['отсутствие знаний', 'начинающий', 'средний', 'продвинутый', 'эксперт']
-        )
-        sns.barplot(x=sorted_literacy.index, y=sorted_literacy.values, ax=axes[1, 0])
-        axes[1, 0].set_title('Уровень финансовой грамотности')
-        axes[1, 0].set_xlabel('Уровень')
-        axes[1, 0].set_ylabel('Количество')
-        axes[1, 0].tick_params(axis='x', rotation=45)
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        parts = [p for p in parsed.path.split("/") if p]
+        query = parse_qs(parsed.query)
+        store = self.job_service.store
 
-        # Доверие к банкам
-        trust_counts = persona_df['Доверие к банкам'].value_counts()
-        sorted_trust = pd.Series(
-            [trust_counts.get(level, 0) for level in ['низкое', 'среднее', 'высокое']],
-            index=['низкое', 'среднее', 'высокое']
-        )
-        sns.barplot(x=sorted_trust.index, y=sorted_trust.values, ax=axes[1, 1])
-        axes[1, 1].set_title('Доверие к банкам')
-        axes[1, 1].set_xlabel('Уровень доверия')
-        axes[1, 1].set_ylabel('Количество')
+        if parts == ["health"]:
+            return self._send_json({"status": "ok"})
 
-        # Отношение к кредитам
-        loan_counts = persona_df['Отношение к кредитам'].value_counts()
-        sorted_loan = pd.Series(
-            [loan_counts.get(level, 0) for level in ['негативное', 'нейтральное', 'позитивное']],
-            index=['негативное', 'нейтральное', 'позитивное']
-        )
-        sns.barplot(x=sorted_loan.index, y=sorted_loan.values, ax=axes[1, 2])
-        axes[1, 2].set_title('Отношение к кредитам')
-        axes[1, 2].set_xlabel('Отношение')
-        axes[1, 2].set_ylabel('Количество')
+        if parts == ["jobs"]:
+            return self._send_json({"jobs": store.list_jobs()})
 
-        # Настройка макета
-        plt.tight_layout(rect=[0, 0, 1, 0.96])
+        if len(parts) < 2 or parts[0] != "jobs":
+            return self._send_error_json(404, "Не найдено")
 
-        return fig
+        job = store.get_job(parts[1])
+        if job is None:
+            return self._send_error_json(404, "Задание не найдено")
 
-def run_generation_pipeline(api_key_claude, api_key_openai, questions_file, personas, output_format='json',
-                           max_workers=3, api_preference=None, visualize=True,
-                           reviews_file=None, use_enhanced=True):
-    """
-    Основной пайплайн генерации данных с указанными персонами и поддержкой многопоточности
+        if len(parts) == 2:
+            return self._send_json(job)
 
-    Args:
-        api_key_claude: API ключ для Anthropic Claude
-        api_key_openai: API ключ для OpenAI (опционально)
-        questions_file: Данные Excel файла с вопросами
-        personas: Список словарей с персонами
-        output_format: 'json' или 'excel'
-        max_workers: Максимальное количество параллельных рабочих процессов
-        api_preference: Предпочтительное API ('claude' или 'openai')
-        visualize: Создавать ли визуализации
-        reviews_file: Данные файла с отзывами о банках (опционально)
-        use_enhanced: Использовать ли расширенную генерацию с поведенческими факторами
+        action = parts[2]
+        if action in ("answers", "stream"):
+            try:
+                after = self._query_int(query, "after", 0)
+                if action == "answers":
+                    limit = self._query_int(query, "limit", self.max_page_size, maximum=self.max_page_size)
+            except ValueError as e:
+                return self._send_error_json(400, str(e))
+
+        if action == "answers":
+            answers = store.get_answers(job["id"], after=after, limit=limit)
+            return self._send_json({
+                "status": job["status"],
+                "answers": answers,
+                "next": answers[-1]["seq"] if answers else after
+            })
+
+        if action == "stream":
+            return self._stream_answers(job["id"], after)
+
+        if action == "export":
+            export_format = query.get("format", ["json"])[0]
+            data = store.get_export(job["id"], export_format)
+            if data is None:
+                return self._send_error_json(409, f"Экспорт '{export_format}' пока недоступен (статус: {job['status']})")
+
+            is_excel = export_format == "excel"
+            self.send_response(200)
+            self.send_header(
+                "Content-Type",
+                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" if is_excel else "application/json"
+            )
+            self.send_header(
+                "Content-Disposition",
+                f'attachment; filename="financial_responses_{job["id"]}{".xlsx" if is_excel else ".json"}"'
+            )
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
 
-    Returns:
-        Tuple (Результаты, Данные для загрузки)
-    """
-    try:
-        # Создаем экземпляр маркетплейса
-        marketplace = RespondentsMarketplace(api_key_claude, api_key_openai)
+        return self._send_error_json(404, "Не найдено")
 
-        # Загружаем вопросы
-        questions = marketplace.load_questions(questions_file)
+    def _stream_answers(self, job_id: str, after: int) -> None:
+        """
+        Потоковая выдача ответов в формате NDJSON до завершения задания
 
-        # Если указан файл с отзывами о банках, загружаем его
-        if reviews_file:
-            marketplace.load_bank_reviews(reviews_file)
+        Args:
+            job_id: Идентификатор задания
+            after: Порядковый номер, после которого нужно выдавать ответы
+        """
+        store = self.job_service.store
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.end_headers()
 
-        # Генерируем ответы
-        st.info(f"Генерация ответов для {len(personas)} респондентов на {len(questions)} вопросов...")
-        all_answers = marketplace.run_generation_batch(
-            personas, questions, max_workers=max_workers,
-            api_preference=api_preference, use_enhanced=use_enhanced
-        )
+        try:
+            while True:
+                job = store.get_job(job_id)
+                for item in store.get_answers(job_id, after=after):
+                    self.wfile.write((json.dumps(item, ensure_ascii=False, cls=NumpyEncoder) + "\n").encode("utf-8"))
+                    after = item["seq"]
+                self.wfile.flush()
+
+                if job["status"] not in ("queued", "running"):
+                    # Дочитываем ответы, сохраненные между проверкой статуса и выборкой
+                    for item in store.get_answers(job_id, after=after):
+                        self.wfile.write((json.dumps(item, ensure_ascii=False, cls=NumpyEncoder) + "\n").encode("utf-8"))
+                    final = {"status": job["status"], "error": job["error"]}
+                    self.wfile.write((json.dumps(final, ensure_ascii=False) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+                    return
+
+                time.sleep(self.stream_poll_interval)
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент закрыл соединение
+            return
 
-        # Генерируем отчет
-        report = marketplace.analyze_results(personas, questions, all_answers)
+    def do_POST(self):
+        parts = [p for p in urlparse(self.path).path.split("/") if p]
+        if parts != ["jobs"]:
+            return self._send_error_json(404, "Не найдено")
 
-        # Сохраняем результаты в соответствующем формате
-        download_data = None
-        if output_format == 'excel':
-            download_data = marketplace.export_to_excel(personas, questions, all_answers)
-            file_ext = '.xlsx'
-        else:
-            download_data = marketplace.export_to_json(personas, questions, all_answers)
-            file_ext = '.json'
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+        except (ValueError, UnicodeDecodeError):
+            return self._send_error_json(400, "Некорректный JSON в теле запроса")
 
-        # Визуализация
-        fig = None
-        if visualize:
-            fig = marketplace.visualize_demographics(personas)
+        try:
+            job_id = self.job_service.submit(request)
+        except ValueError as e:
+            return self._send_error_json(400, str(e))
+        except RuntimeError as e:
+            return self._send_error_json(429, str(e))
 
-        results = {
-            "personas": personas,
-            "questions": questions,
-            "answers": all_answers,
-            "report": report,
-            "fig": fig,
-            "file_ext": file_ext
-        }
+        self._send_json({"job_id": job_id, "status": "queued"}, status=202)
 
-        return results, download_data
-    except Exception as e:
-        st.error(f"Ошибка в процессе генерации: {str(e)}")
-        raise e
+
+def create_generation_api_server(host: str = "127.0.0.1", port: int = 8765,
+                                 db_path: str = "synthetica_jobs.sqlite3", max_concurrent_jobs: int = 2,
+                                 max_workers_per_job: int = 5, use_fake_llm: bool = False) -> ThreadingHTTPServer:
+    """
+    Создание HTTP сервера API заданий генерации
+
+    Args:
+        host: Адрес для прослушивания
+        port: Порт (0 - выбрать свободный)
+        db_path: Путь к базе данных заданий
+        max_concurrent_jobs: Количество одновременно выполняемых заданий
+        max_workers_per_job: Верхняя граница потоков запросов к API внутри одного задания
+        use_fake_llm: Использовать локальный фейковый LLM вместо реальных API
+
+    Returns:
+        Настроенный ThreadingHTTPServer (запуск через serve_forever)
+    """
+    store = GenerationJobStore(db_path)
+    store.mark_interrupted_jobs()
+
+    service = GenerationJobService(
+        store,
+        max_concurrent_jobs=max_concurrent_jobs,
+        max_workers_per_job=max_workers_per_job,
+        api_key_claude=os.environ.get("ANTHROPIC_API_KEY"),
+        api_key_openai=os.environ.get("OPENAI_API_KEY"),
+        use_fake_llm=use_fake_llm
+    )
+
+    server = ThreadingHTTPServer((host, port), _GenerationAPIHandler)
+    server.daemon_threads = True
+    server.job_service = service
+    return server
+
+
+def serve_generation_api(host: str = "127.0.0.1", port: int = 8765, db_path: str = "synthetica_jobs.sqlite3",
+                         max_concurrent_jobs: int = 2, max_workers_per_job: int = 5,
+                         use_fake_llm: bool = False) -> None:
+    """Запуск HTTP сервиса заданий генерации (блокирующий вызов)"""
+    server = create_generation_api_server(
+        host, port, db_path, max_concurrent_jobs, max_workers_per_job, use_fake_llm
+    )
+    print(f"API заданий генерации доступно на http://{host}:{server.server_address[1]}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.job_service.shutdown(wait=False)
+        server.job_service.store.close()
 
 def save_uploaded_config(config_data):
     """Сохранение конфигурации в сессии Streamlit"""
@@ -4401,6 +10807,9 @@ def display_persona_editor(persona_id, marketplace, initial_persona=None):
     # Ключи для хранения состояния в session_state
     persona_key = f"persona_state_{persona_id}"
     randomize_key = f"randomize_{persona_id}"
+
+    # Расширенная версия персоны с прошлого перезапуска: ее профили переиспользуются, пока не изменены поля
+    previous_persona = st.session_state.get(persona_key, initial_persona)
     
     # Инициализация состояния для кнопки рандомизации
     if randomize_key not in st.session_state:
@@ -4596,6 +11005,12 @@ def display_persona_editor(persona_id, marketplace, initial_persona=None):
         # Возвращаем текущую персону, новая будет создана при следующей перерисовке
         return st.session_state[persona_key]
 
+    # Явный перевыбор искажений, эмоций, стиля речи и непоследовательности без изменения полей
+    reroll = st.button(
+        "🔁 Пересчитать психологический профиль", key=f"reroll_button_{persona_id}",
+        help="Заново выбрать когнитивные искажения, эмоции, лингвистический профиль и непоследовательность"
+    )
+
     # Собираем данные персоны
     persona = {
         "Пол": gender,
@@ -4640,14 +11055,424 @@ def display_persona_editor(persona_id, marketplace, initial_persona=None):
     else:
         persona['Финансовый профиль']['Поведенческие паттерны'] = marketplace.knowledge_base.get_behavior_patterns(financial_behavior)
 
-    # Применяем расширение через EnhancedFinancialRespondent
-    enhanced_persona = marketplace.enhanced_respondent.enhance_persona(persona)
+    # Применяем расширение через EnhancedFinancialRespondent (повторно, только если изменились базовые поля)
+    enhanced_persona = marketplace.enhanced_respondent.enhance_persona_memoized(
+        persona, previous=previous_persona, reroll=reroll
+    )
     
     # Сохраняем финальную версию персоны в session_state
     st.session_state[persona_key] = enhanced_persona
 
     return enhanced_persona
 
+# Размер когорты: до PERSONA_EDITOR_MAX_SIZE - отдельные редакторы персон, больше - табличный режим
+PERSONA_EDITOR_MAX_SIZE = 30
+LARGE_COHORT_MAX_SIZE = 100_000
+
+# Размеры страницы таблицы когорты
+COHORT_PAGE_SIZES = (50, 100, 250, 500)
+
+# Столбцы с фильтрами в таблице когорты
+COHORT_FILTER_COLUMNS = ("Регион", "Уровень финансовой грамотности", "Доход", "Модель финансового поведения")
+
+# Интервал обновления ленты ответов во время генерации (секунды) и количество отображаемых ответов
+LIVE_RESULTS_REFRESH = 1.0
+LIVE_RESULTS_TAIL = 20
+LIVE_PARTIAL_LIMIT = 5
+# Количество последних сообщений о ходе генерации (повторы, смена провайдера, ошибки) в ленте
+LIVE_NOTICE_LIMIT = 5
+
+
+def display_cohort_table(marketplace, cohort: PersonaCohort) -> None:
+    """
+    Табличный редактор большой когорты: фильтры, постраничная таблица и массовые изменения
+
+    Количество виджетов не зависит от размера когорты, а изменения записываются в колонки когорты на месте.
+    Фильтры применяются к кодам колонок, а таблица строится только для строк текущей страницы.
+
+    Args:
+        marketplace: Экземпляр RespondentsMarketplace
+        cohort: Колоночная когорта персон
+    """
+    editable_labels = list(PersonaCohort.editable_columns) + list(PersonaCohort.numeric_columns) \
+        + list(PERSONA_PRODUCT_NAMES)
+
+    st.markdown(f"Персон в когорте: **{len(cohort)}**")
+
+    # Фильтры по столбцам (значения - из справочников)
+    filters = {}
+    with st.expander("Фильтры", expanded=False):
+        filter_cols = st.columns(len(COHORT_FILTER_COLUMNS) + 1)
+        for col, label in zip(filter_cols, COHORT_FILTER_COLUMNS):
+            options = "regions" if label == "Регион" else PersonaCohort.editable_columns[label][1]
+            with col:
+                filters[label] = st.multiselect(
+                    label, options=list(getattr(marketplace, options)), key=f"cohort_filter_{label}"
+                )
+        with filter_cols[-1]:
+            age_range = st.slider("Возраст", 18, 80, (18, 80), key="cohort_filter_age")
+
+    selected_idx = np.flatnonzero(cohort.filter_mask(filters, age_range))
+
+    # Пагинация
+    page_cols = st.columns([1, 1, 3])
+    with page_cols[0]:
+        page_size = st.selectbox("Строк на странице", COHORT_PAGE_SIZES, index=1, key="cohort_page_size")
+    num_pages = max(1, math.ceil(len(selected_idx) / page_size))
+    if st.session_state.get("cohort_page", 1) > num_pages:
+        st.session_state["cohort_page"] = num_pages
+    with page_cols[1]:
+        page = st.number_input("Страница", min_value=1, max_value=num_pages, value=1, step=1, key="cohort_page")
+    with page_cols[2]:
+        st.caption(f"Отобрано персон: {len(selected_idx)}, страниц: {num_pages}")
+
+    page_idx = selected_idx[(page - 1) * page_size:page * page_size]
+    page_df = cohort.to_pandas(page_idx)
+
+    column_config = {
+        label: st.column_config.SelectboxColumn(label, options=list(getattr(marketplace, options)), required=True)
+        for label, (_, options) in PersonaCohort.editable_columns.items()
+    }
+    column_config.update({
+        label: st.column_config.NumberColumn(label, min_value=low, max_value=high, step=1, required=True)
+        for label, (_, low, high) in PersonaCohort.numeric_columns.items()
+    })
+
+    # Ключ таблицы зависит от набора строк, чтобы правки не переносились на другую страницу или выборку
+    grid_key = hashlib.sha256(page_idx.tobytes()).hexdigest()[:16]
+    edited = st.data_editor(
+        page_df, column_config=column_config, disabled=["Регион", "Город"], key=f"cohort_grid_{grid_key}"
+    )
+
+    # Переносим правки ячеек в когорту по столбцам
+    try:
+        changed = 0
+        for label in editable_labels:
+            before = page_df[label].astype(object).to_numpy()
+            after = edited[label].astype(object).to_numpy()
+            rows = np.flatnonzero(before != after)
+            if len(rows):
+                changed += cohort.update_column(label, page_idx[rows], after[rows])
+        if changed:
+            st.caption(f"Изменено значений: {changed}")
+    except ValueError as e:
+        st.error(f"Ошибка при изменении когорты: {str(e)}")
+
+    # Массовое изменение всех отфильтрованных персон
+    with st.expander("Массовое изменение", expanded=False):
+        bulk_cols = st.columns([2, 2, 1])
+        with bulk_cols[0]:
+            bulk_label = st.selectbox("Атрибут", editable_labels, key="cohort_bulk_label")
+        with bulk_cols[1]:
+            if bulk_label in PersonaCohort.editable_columns:
+                options = getattr(marketplace, PersonaCohort.editable_columns[bulk_label][1])
+                bulk_value = st.selectbox("Новое значение", options, key="cohort_bulk_value")
+            elif bulk_label in PersonaCohort.numeric_columns:
+                _, low, high = PersonaCohort.numeric_columns[bulk_label]
+                bulk_value = st.number_input("Новое значение", min_value=low, max_value=high, value=low,
+                                             step=1, key="cohort_bulk_number")
+            else:
+                bulk_value = st.checkbox("Пользуется продуктом", key="cohort_bulk_flag")
+        with bulk_cols[2]:
+            if st.button(f"Применить к отфильтрованным ({len(selected_idx)})", key="cohort_bulk_apply",
+                         disabled=not len(selected_idx)):
+                try:
+                    cohort.update_column(bulk_label, selected_idx, [bulk_value])
+                    safe_rerun()
+                except ValueError as e:
+                    st.error(f"Ошибка при изменении когорты: {str(e)}")
+
+
+def display_cohort_export(cohort: PersonaCohort) -> None:
+    """
+    Выгрузка когорты в файл панели (файл готовится по кнопке, а не при каждом перезапуске)
+
+    Args:
+        cohort: Колоночная когорта персон
+    """
+    with st.expander("Экспорт панели", expanded=False):
+        export_cols = st.columns([1, 1, 2])
+        with export_cols[0]:
+            file_format = st.selectbox("Формат", ["parquet", "csv", "jsonl"], key="panel_export_format")
+        with export_cols[1]:
+            if st.button("Подготовить файл", key="panel_export_prepare"):
+                try:
+                    st.session_state.panel_export = (cohort.fingerprint(), file_format,
+                                                     save_cohort(cohort, file_format=file_format))
+                except ValueError as e:
+                    st.error(f"Ошибка при экспорте панели: {str(e)}")
+
+        prepared = st.session_state.get("panel_export")
+        if prepared and prepared[0] == cohort.fingerprint() and prepared[1] == file_format:
+            with export_cols[2]:
+                st.download_button(
+                    f"Скачать панель ({len(cohort)} персон)",
+                    data=prepared[2],
+                    file_name=f"respondents_panel.{file_format}",
+                    mime="application/octet-stream"
+                )
+
+
+def display_snapshot_controls(api_key_claude: str, api_key_openai: str) -> None:
+    """
+    Сохранение и восстановление снимка окружения (маркетплейс, когорта, вопросы) в каталоге на сервере
+
+    Снимки доступны только внутри SNAPSHOT_BASE_DIR; глобальные генераторы случайных чисел по умолчанию
+    не восстанавливаются, так как они общие для всех сеансов сервера.
+
+    Args:
+        api_key_claude: API ключ Claude для восстановленного маркетплейса
+        api_key_openai: API ключ OpenAI для восстановленного маркетплейса
+    """
+    with st.expander("Снимок окружения", expanded=False):
+        snapshot_name = st.text_input(f"Имя снимка (в каталоге {SNAPSHOT_BASE_DIR}):", value="synthetica_snapshot")
+        restore_rng = st.checkbox(
+            "Восстанавливать состояние генераторов случайных чисел", value=False,
+            help="Глобальные генераторы random и numpy.random общие для всех сеансов сервера"
+        )
+        save_col, load_col = st.columns(2)
+        with save_col:
+            if st.button("Сохранить", key="snapshot_save", disabled=st.session_state.marketplace is None):
+                try:
+                    snapshot_path = resolve_snapshot_path(snapshot_name)
+                    save_marketplace_snapshot(st.session_state.marketplace, snapshot_path,
+                                              cohort=st.session_state.personas or None,
+                                              questions=st.session_state.questions)
+                    st.success("Снимок сохранен")
+                except (OSError, ValueError) as e:
+                    st.error(f"Ошибка при сохранении снимка: {str(e)}")
+        with load_col:
+            if st.button("Восстановить", key="snapshot_load"):
+                try:
+                    marketplace, cohort, questions = load_marketplace_snapshot(
+                        resolve_snapshot_path(snapshot_name), restore_rng=restore_rng,
+                        api_key_claude=api_key_claude or None, api_key_openai=api_key_openai or None
+                    )
+                    st.session_state.marketplace = marketplace
+                    st.session_state.personas = cohort if cohort is not None else []
+                    if questions is not None:
+                        st.session_state.questions = questions
+                    st.session_state.show_results = False
+                    st.success("Снимок восстановлен")
+                except (OSError, ValueError) as e:
+                    st.error(f"Ошибка при восстановлении снимка: {str(e)}")
+
+
+class LiveAnswerFeed:
+    """
+    Лента ответов фонового запуска генерации для интерфейса
+
+    Запуск выполняется в отдельном потоке, а фрагмент Streamlit периодически читает ленту. Счетчики по
+    вопросам обновляются при добавлении ответа, поэтому отрисовка не зависит от общего числа ответов.
+    """
+
+    def __init__(self, questions: Sequence[Dict], num_personas: int):
+        """
+        Args:
+            questions: Вопросы запуска
+            num_personas: Количество персон (ожидаемое число ответов на каждый вопрос)
+        """
+        self.questions = list(questions)
+        self.num_personas = num_personas
+        self.total = num_personas * len(self.questions)
+        self.done = 0
+        self.counts = Counter()
+        self.errors = Counter()
+        self.recent = defaultdict(lambda: deque(maxlen=LIVE_RESULTS_TAIL))
+        self.partial = {}
+        self.results = None
+        self.download_data = None
+        self.error = None
+        self.finished = False
+        # Расходы запуска и состояние бюджетов (по журналу расходов маркетплейса)
+        self.total_cost = 0.0
+        self.budget_stopped = False
+        self.soft_budget_exceeded = False
+        self.soft_budget = None
+        self.marketplace = None
+        # Последние сообщения о ходе генерации (уровень, текст): в фоновом потоке st.* не отображается
+        self.notices = deque(maxlen=LIVE_NOTICE_LIMIT)
+        self._lock = threading.Lock()
+
+    def add_answer(self, answer: Dict) -> None:
+        """Готовый ответ (answer_callback запуска)"""
+        question_id = answer["question"].get("id")
+        with self._lock:
+            self.counts[question_id] += 1
+            if answer.get("error"):
+                self.errors[question_id] += 1
+            self.recent[question_id].append(answer)
+            self.partial.pop(answer["id"], None)
+
+    def set_partial(self, answer_id: int, text: str) -> None:
+        """Частичный текст потокового ответа (partial_answer_callback маркетплейса)"""
+        with self._lock:
+            self.partial[answer_id] = text
+
+    def add_notice(self, level: str, message: str) -> None:
+        """Сообщение о ходе генерации (notice_callback маркетплейса)"""
+        with self._lock:
+            self.notices.append((level, message))
+
+    def set_progress(self, done: int, total: int) -> None:
+        """Прогресс запуска и текущие расходы (progress_callback запуска)"""
+        self.done, self.total = done, total
+        ledger = self.marketplace.spend_ledger if self.marketplace is not None else None
+        if ledger is not None:
+            self.total_cost = ledger.total_cost
+            self.budget_stopped = ledger.budget_stopped
+            self.soft_budget_exceeded = ledger.soft_budget_exceeded
+            self.soft_budget = ledger.soft_budget
+
+    def run(self, marketplace: "RespondentsMarketplace", **pipeline_kwargs) -> None:
+        """
+        Выполнение запуска генерации с записью ответов в ленту (целевая функция фонового потока)
+
+        Args:
+            marketplace: Экземпляр RespondentsMarketplace
+            **pipeline_kwargs: Аргументы run_generation_pipeline
+        """
+        self.marketplace = marketplace
+        marketplace.partial_answer_callback = self.set_partial
+        marketplace.notice_callback = self.add_notice
+        try:
+            self.results, self.download_data = run_generation_pipeline(
+                marketplace=marketplace, progress_callback=self.set_progress, answer_callback=self.add_answer,
+                **pipeline_kwargs
+            )
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            marketplace.partial_answer_callback = None
+            marketplace.notice_callback = None
+            self.finished = True
+
+    def question_view(self, question_id) -> Tuple[int, int, List[Dict], List[Tuple[int, str]]]:
+        """
+        Состояние вопроса для отображения
+
+        Returns:
+            Кортеж (готово ответов, ошибок, последние ответы от новых к старым, ответы в процессе получения)
+        """
+        with self._lock:
+            recent = list(reversed(self.recent[question_id]))
+            partial = list(self.partial.items())[-LIVE_PARTIAL_LIMIT:]
+            return self.counts[question_id], self.errors[question_id], recent, partial
+
+    def recent_notices(self) -> List[Tuple[str, str]]:
+        """Последние сообщения о ходе генерации (уровень, текст)"""
+        with self._lock:
+            return list(self.notices)
+
+    def counters(self) -> pd.DataFrame:
+        """Счетчики готовых ответов по вопросам"""
+        with self._lock:
+            return pd.DataFrame({
+                "Вопрос": [q.get("text", "") for q in self.questions],
+                "Готово": [self.counts[q.get("id")] for q in self.questions],
+                "Ошибок": [self.errors[q.get("id")] for q in self.questions],
+                "Всего": self.num_personas
+            })
+
+
+def display_live_results(feed: LiveAnswerFeed) -> None:
+    """
+    Ответы запуска генерации по мере готовности (вызывается как фрагмент Streamlit с run_every)
+
+    После завершения запуска результаты и история длины ответов переносятся в сессию,
+    страница перезапускается целиком.
+
+    Args:
+        feed: Лента ответов текущего запуска
+    """
+    if feed.finished:
+        st.session_state.live_feed = None
+        # История длины ответов запуска уточняет следующие оценки стоимости в сессии
+        if st.session_state.get("marketplace") is not None and feed.marketplace is not None:
+            for key, values in feed.marketplace.output_token_history.items():
+                st.session_state.marketplace.output_token_history[key].extend(values)
+        if feed.error is not None:
+            st.session_state.live_error = feed.error
+        else:
+            st.session_state.results = feed.results
+            st.session_state.download_data = feed.download_data
+            st.session_state.show_results = True
+        st.rerun()
+
+    progress = feed.done / feed.total if feed.total else 0.0
+    st.progress(progress, text=f"Готово ответов: {feed.done} из {feed.total} | Расходы: ${feed.total_cost:.4f}"
+                if feed.done else "Построение промптов...")
+    if feed.budget_stopped:
+        st.error("Жесткий бюджет исчерпан: оставшиеся запросы не отправляются")
+    elif feed.soft_budget_exceeded:
+        st.warning(f"Превышен мягкий бюджет ${feed.soft_budget:.2f}: потрачено ${feed.total_cost:.4f}")
+    for level, message in feed.recent_notices():
+        {"info": st.info, "warning": st.warning, "error": st.error}[level](message)
+    st.dataframe(feed.counters(), hide_index=True)
+
+    question_index = st.selectbox(
+        "Вопрос:",
+        options=range(len(feed.questions)),
+        format_func=lambda k: f"{k + 1}. {feed.questions[k].get('text', '')}",
+        key="live_question"
+    )
+    question = feed.questions[question_index]
+    done, errors, recent, partial = feed.question_view(question.get("id"))
+    st.caption(f"Готово: {done} из {feed.num_personas}, ошибок: {errors}. "
+               f"Показаны последние {len(recent)} ответов")
+
+    # Ответы, которые еще приходят потоком (по всем вопросам)
+    for answer_id, text in partial:
+        st.markdown(f"*Ответ {answer_id} (получение...)*: {text}")
+    for answer in recent:
+        st.markdown(f"**Респондент {answer['persona_id']}**: {answer['text']}")
+
+
+def display_generation_estimate(estimate):
+    """
+    Отображение оценки стоимости и времени генерации (пробный прогон)
+
+    Args:
+        estimate: Словарь с оценкой из RespondentsMarketplace.estimate_generation
+    """
+    st.subheader("Оценка запуска")
+
+    selected = next((m for m in estimate["models"] if m["selected"]), None)
+
+    cols = st.columns(4)
+    with cols[0]:
+        st.metric("Запросов к API", estimate["total_tasks"])
+    with cols[1]:
+        st.metric("Входных токенов", f"{estimate['input_tokens']:,}".replace(",", " "))
+    with cols[2]:
+        st.metric("Выходных токенов (оценка)", f"{estimate['output_tokens']:,}".replace(",", " "))
+    with cols[3]:
+        minutes, seconds = divmod(int(estimate["wall_time_seconds"]), 60)
+        st.metric("Время выполнения", f"{minutes} мин {seconds} с")
+
+    if selected:
+        st.markdown(f"**Ожидаемая стоимость ({selected['model']}):** ${selected['total_cost']:.4f}")
+
+    st.caption(
+        f"Время ограничено фактором: {estimate['limiting_factor']}. "
+        f"Промпты построены для {estimate['sampled_tasks']} из {estimate['total_tasks']} задач; "
+        f"длина ответов оценена по истории для {estimate['output_from_history']:.0%} задач "
+        f"(для остальных - по уровню финансовой грамотности)."
+    )
+
+    models_df = pd.DataFrame([
+        {
+            "Модель": m["model"],
+            "Вход, $": round(m["input_cost"], 4),
+            "Выход, $": round(m["output_cost"], 4),
+            "Итого, $": round(m["total_cost"], 4),
+            "Используется": "да" if m["selected"] else ""
+        }
+        for m in estimate["models"]
+    ])
+    st.dataframe(models_df, hide_index=True)
+
+
 def display_results(results):
     """
     Отображение результатов генерации
@@ -4678,6 +11503,33 @@ def display_results(results):
         with cols_tokens[1]:
             st.metric("OpenAI", stats["API токенов использовано (OpenAI)"])
 
+        spend = results.get("spend")
+        if spend:
+            st.subheader("Расходы")
+            cols_spend = st.columns(3)
+            with cols_spend[0]:
+                st.metric("Стоимость запуска", f"${spend['total_cost']:.4f}")
+            with cols_spend[1]:
+                st.metric("Кэшированные токены", spend["cached_tokens"])
+            with cols_spend[2]:
+                st.metric("Пропущено запросов (бюджет)", spend["skipped_requests"])
+
+            if spend["budget_stopped"]:
+                st.error(f"Генерация остановлена: исчерпан жесткий бюджет ${spend['hard_budget']:.2f}")
+            elif spend["soft_budget_exceeded"]:
+                st.warning(f"Превышен мягкий бюджет ${spend['soft_budget']:.2f}")
+
+            if spend["models"]:
+                st.dataframe(pd.DataFrame(spend["models"]), hide_index=True)
+
+            if spend.get("prompt_sections"):
+                st.caption("Входные токены по разделам промпта (оценка)")
+                st.dataframe(pd.DataFrame(spend["prompt_sections"]), hide_index=True)
+
+            if spend.get("postprocess"):
+                st.caption("Правки локальной постобработки ответов")
+                st.dataframe(pd.DataFrame([spend["postprocess"]]), hide_index=True)
+
     # Демографические визуализации
     if results.get("fig"):
         with st.expander("Визуализация данных", expanded=True):
@@ -4713,6 +11565,19 @@ def display_results(results):
         st.dataframe(literacy_df)
 
 def main():
+    st.set_page_config(
+        page_title="Synthetica Financial: Симулятор финансовых респондентов",
+        page_icon="",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+
+    # Streamlit заново выполняет модуль при каждом перезапуске; общий реестр клиентов и кэш
+    # таблиц вопросов берем из кэша ресурсов, чтобы они жили дольше одного перезапуска
+    global API_CLIENTS, QUESTION_TABLES
+    API_CLIENTS = st.cache_resource(show_spinner=False)(_streamlit_api_clients)()
+    QUESTION_TABLES = st.cache_resource(show_spinner=False)(_streamlit_question_tables)()
+
     # Заголовок и описание
     st.title("Synthetica Financial: Симулятор финансовых респондентов")
     st.markdown("Генерация реалистичных ответов респондентов с разным уровнем финансовой грамотности")
@@ -4728,6 +11593,8 @@ def main():
         st.session_state.results = None
     if 'show_results' not in st.session_state:
         st.session_state.show_results = False
+    if 'live_feed' not in st.session_state:
+        st.session_state.live_feed = None
 
     # Боковая панель для настройки
     with st.sidebar:
@@ -4754,26 +11621,27 @@ def main():
 
         # Файлы с вопросами
         questions_file = st.file_uploader(
-            "Загрузить Excel с вопросами",
-            type=["xlsx", "xls"],
-            help="Выберите файл Excel с вопросами"
+            "Загрузить файл с вопросами",
+            type=[extension.lstrip(".") for extension in QUESTION_FILE_FORMATS],
+            help="Excel, CSV, JSONL или Parquet со столбцом 'question'"
         )
 
         if questions_file is not None:
             try:
-                # Создаем временный экземпляр маркетплейса для загрузки вопросов,
-                # используя текущие API ключи из интерфейса
-                temp_marketplace = RespondentsMarketplace(
-                    api_key_claude=api_key_claude,
-                    api_key_openai=api_key_openai if api_key_openai else None
-                )
-                questions = temp_marketplace.load_questions(questions_file)
+                questions = load_questions(questions_file)
                 st.session_state.questions = questions
                 st.success(f"Загружено {len(questions)} вопросов")
             except Exception as e:
                 st.error(f"Ошибка при загрузке вопросов: {str(e)}")
                 st.session_state.questions = None
 
+        # Готовая панель респондентов (опционально) вместо генерации новых персон
+        panel_file = st.file_uploader(
+            "Загрузить панель респондентов (опционально)",
+            type=[extension.lstrip(".") for extension in COHORT_FILE_FORMATS],
+            help="Parquet, CSV или JSONL, выгруженные кнопкой «Экспорт панели» или подготовленные заранее"
+        )
+
         # Файл с отзывами о банках (опционально)
         reviews_file = st.file_uploader(
             "Загрузить Excel с отзывами о банках (опционально)",
@@ -4782,12 +11650,27 @@ def main():
         )
 
         # Количество респондентов
-        num_respondents = st.slider(
-            "Количество респондентов:",
-            min_value=1,
-            max_value=30,
-            value=5
+        # Большие когорты редактируются одной таблицей вместо отдельных редакторов персон
+        large_cohort = st.checkbox(
+            "Режим большой когорты (таблица)",
+            value=False,
+            help="Тысячи персон в одной таблице с фильтрами и массовыми изменениями"
         )
+        if large_cohort:
+            num_respondents = st.number_input(
+                "Количество респондентов:",
+                min_value=1,
+                max_value=LARGE_COHORT_MAX_SIZE,
+                value=1000,
+                step=100
+            )
+        else:
+            num_respondents = st.slider(
+                "Количество респондентов:",
+                min_value=1,
+                max_value=PERSONA_EDITOR_MAX_SIZE,
+                value=5
+            )
 
         # Предпочтительное API
         api_preference = st.radio(
@@ -4823,6 +11706,68 @@ def main():
                 options=[("Excel таблица", "excel"), ("JSON", "json")]
             )[1]
 
+            prompt_profile = st.radio(
+                "Профиль промпта:",
+                options=[("Полный", "full"), ("Компактный", "compact")],
+                format_func=lambda x: x[0],
+                help="Компактный профиль сокращает разделы промпта (меньше входных токенов)"
+            )[1]
+
+            local_postprocessing = st.checkbox(
+                "Локальные опечатки и слова-паразиты",
+                value=False,
+                help="Ошибки, слова-паразиты и региональные выражения добавляются в ответ локально "
+                     "по профилю персоны, а не через инструкции в промпте"
+            )
+
+            stream_responses = st.checkbox(
+                "Потоковые ответы API",
+                value=False,
+                help="Ответы запрашиваются потоком и появляются в ленте результатов по мере получения текста"
+            )
+
+            rpm_limit = st.number_input(
+                "Лимит запросов в минуту (RPM):",
+                min_value=0,
+                value=50,
+                help="Ограничение API по количеству запросов (0 - без ограничения); используется для оценки времени"
+            )
+
+            tpm_limit = st.number_input(
+                "Лимит токенов в минуту (TPM):",
+                min_value=0,
+                value=40000,
+                step=1000,
+                help="Ограничение API по количеству токенов (0 - без ограничения); используется для оценки времени"
+            )
+
+            hard_budget = st.number_input(
+                "Жесткий бюджет запуска, $:",
+                min_value=0.0,
+                value=0.0,
+                step=0.5,
+                help="Запросы перестают отправляться, если прогноз расходов превышает бюджет (0 - без ограничения)"
+            )
+
+            soft_budget = st.number_input(
+                "Мягкий бюджет запуска, $:",
+                min_value=0.0,
+                value=0.0,
+                step=0.5,
+                help="При превышении выдается предупреждение (0 - без ограничения)"
+            )
+
+            run_seed = st.number_input(
+                "Зерно запуска:",
+                min_value=0,
+                value=None,
+                step=1,
+                placeholder="без фиксации",
+                help="Одинаковое зерно дает одинаковых персон и одинаковые промпты при любом количестве потоков "
+                     "(пустое поле - без фиксации)"
+            )
+            run_seed = None if run_seed is None else int(run_seed)
+
             if st.button("Сохранить настройки"):
                 config = {
                     'api_key_claude': api_key_claude,
@@ -4832,7 +11777,15 @@ def main():
                     'num_threads': num_threads,
                     'visualize': visualize_data,
                     'use_enhanced': use_enhanced,
-                    'output_format': output_format
+                    'output_format': output_format,
+                    'rpm_limit': rpm_limit,
+                    'tpm_limit': tpm_limit,
+                    'hard_budget': hard_budget,
+                    'soft_budget': soft_budget,
+                    'run_seed': run_seed,
+                    'prompt_profile': prompt_profile,
+                    'local_postprocessing': local_postprocessing,
+                    'stream_responses': stream_responses
                 }
                 save_uploaded_config(config)
                 st.success("Настройки сохранены")
@@ -4857,53 +11810,130 @@ def main():
                     api_key_openai=api_key_openai if api_key_openai else None
                 )
 
-                # Генерируем персоны
-                st.session_state.personas = [
-                    st.session_state.marketplace.generate_persona() for _ in range(num_respondents)
-                ]
+                # Загружаем готовую панель или генерируем персоны
+                if panel_file is not None:
+                    try:
+                        st.session_state.personas = load_cohort(st.session_state.marketplace, panel_file,
+                                                                seed=run_seed)
+                    except ValueError as e:
+                        st.error(f"Ошибка при загрузке панели: {str(e)}")
+                        st.session_state.personas = []
+                else:
+                    st.session_state.personas = st.session_state.marketplace.generate_cohort(
+                        num_respondents, seed=run_seed
+                    )
                 st.session_state.show_results = False
 
+        # Готовое окружение из снимка вместо повторной настройки
+        display_snapshot_controls(api_key_claude, api_key_openai)
+
     # Основная область
     if st.session_state.marketplace and st.session_state.personas:
-        if not st.session_state.show_results:
+        if st.session_state.live_feed is not None:
+            # Ответы появляются по мере готовности: фрагмент обновляется сам, без перезапуска всей страницы
+            st.header("Генерация ответов")
+            st.fragment(run_every=LIVE_RESULTS_REFRESH)(display_live_results)(st.session_state.live_feed)
+        elif not st.session_state.show_results:
             st.header("Настройка респондентов")
 
-            # Отображаем редакторы персон
-            updated_personas = []
-            for i, persona in enumerate(st.session_state.personas):
-                updated_persona = display_persona_editor(i+1, st.session_state.marketplace, persona)
-                updated_personas.append(updated_persona)
-                st.markdown("---")
-
-            # Обновляем персоны
-            st.session_state.personas = updated_personas
-
-            # Кнопка запуска генерации
-            if st.button("Запустить генерацию", disabled=st.session_state.questions is None):
+            if large_cohort or len(st.session_state.personas) > PERSONA_EDITOR_MAX_SIZE:
+                # Табличный режим: когорта изменяется на месте
+                display_cohort_table(st.session_state.marketplace, st.session_state.personas)
+            else:
+                # В session_state хранится компактная колоночная когорта (класс определяется заново
+                # при каждом перезапуске скрипта, поэтому проверяется интерфейс, а не isinstance)
+                if not hasattr(st.session_state.personas, "set_persona"):
+                    st.session_state.personas = PersonaCohort.from_personas(
+                        st.session_state.marketplace, st.session_state.personas
+                    )
+                cohort = st.session_state.personas
+
+                # Отображаем редакторы персон; в когорту кодируются только измененные персоны
+                for i, persona in enumerate(cohort):
+                    updated_persona = display_persona_editor(i+1, st.session_state.marketplace, persona)
+                    if updated_persona != persona:
+                        cohort.set_persona(i, updated_persona)
+                    st.markdown("---")
+
+            display_cohort_export(st.session_state.personas)
+
+            # Пробный прогон: оценка стоимости и времени для текущей конфигурации
+            st.session_state.marketplace.set_prompt_profile(prompt_profile)
+            st.session_state.marketplace.prompting_params["local_postprocessing"] = local_postprocessing
+            estimate_key = None
+            if st.session_state.questions is not None:
+                estimate_key = hashlib.sha256(json.dumps({
+                    # Отпечаток когорты вместо сериализации всех персон
+                    "personas": st.session_state.personas.fingerprint(),
+                    "questions": st.session_state.questions,
+                    "api_preference": api_preference,
+                    "use_enhanced": use_enhanced,
+                    "prompt_profile": prompt_profile,
+                    "local_postprocessing": local_postprocessing,
+                    "num_threads": num_threads,
+                    "rpm_limit": rpm_limit,
+                    "tpm_limit": tpm_limit,
+                    "hard_budget": hard_budget,
+                    "soft_budget": soft_budget,
+                    "run_seed": run_seed,
+                    "stream_responses": stream_responses
+                }, ensure_ascii=False, sort_keys=True, cls=NumpyEncoder).encode("utf-8")).hexdigest()
+
+                if st.button("Оценить стоимость и время"):
+                    try:
+                        st.session_state.estimate = st.session_state.marketplace.estimate_generation(
+                            st.session_state.personas, st.session_state.questions,
+                            api_preference=api_preference, use_enhanced=use_enhanced,
+                            max_workers=num_threads, rpm_limit=rpm_limit or None, tpm_limit=tpm_limit or None
+                        )
+                        st.session_state.estimate_key = estimate_key
+                    except Exception as e:
+                        st.error(f"Ошибка при оценке: {str(e)}")
+
+            estimate_ready = estimate_key is not None and st.session_state.get('estimate_key') == estimate_key
+            if estimate_ready:
+                display_generation_estimate(st.session_state.estimate)
+            elif st.session_state.questions is not None:
+                st.info("Перед запуском выполните оценку стоимости и времени для текущих настроек")
+
+            # Кнопка запуска генерации (доступна после оценки текущей конфигурации)
+            if st.button("Запустить генерацию", disabled=not estimate_ready):
                 if st.session_state.questions is None:
                     st.error("Необходимо загрузить файл с вопросами")
                 else:
-                    with st.spinner("Генерация ответов..."):
-                        try:
-                            results, download_data = run_generation_pipeline(
-                                api_key_claude=api_key_claude,
-                                api_key_openai=api_key_openai if api_key_openai else None,
-                                questions_file=questions_file,
-                                personas=st.session_state.personas,
-                                output_format=output_format,
-                                max_workers=num_threads,
-                                api_preference=api_preference,
-                                visualize=visualize_data,
-                                reviews_file=reviews_file,
-                                use_enhanced=use_enhanced
-                            )
-
-                            st.session_state.results = results
-                            st.session_state.download_data = download_data
-                            st.session_state.show_results = True
-                            st.rerun()
-                        except Exception as e:
-                            st.error(f"Ошибка при генерации: {str(e)}")
+                    try:
+                        marketplace = RespondentsMarketplace(api_key_claude, api_key_openai if api_key_openai else None)
+                    except Exception as e:
+                        st.error(f"Ошибка при генерации: {str(e)}")
+                    else:
+                        # Запуск выполняется в фоновом потоке, ответы показываются в ленте по мере готовности
+                        feed = LiveAnswerFeed(st.session_state.questions, len(st.session_state.personas))
+                        threading.Thread(target=feed.run, kwargs={
+                            "marketplace": marketplace,
+                            "api_key_claude": api_key_claude,
+                            "api_key_openai": api_key_openai if api_key_openai else None,
+                            "questions_file": questions_file,
+                            "questions": st.session_state.questions,
+                            "personas": st.session_state.personas,
+                            "output_format": output_format,
+                            "max_workers": num_threads,
+                            "api_preference": api_preference,
+                            "visualize": visualize_data,
+                            "reviews_file": reviews_file,
+                            "use_enhanced": use_enhanced,
+                            "budget": hard_budget or None,
+                            "soft_budget": soft_budget or None,
+                            "seed": run_seed,
+                            "prompt_profile": prompt_profile,
+                            "local_postprocessing": local_postprocessing,
+                            "stream_responses": stream_responses
+                        }, daemon=True).start()
+                        st.session_state.live_feed = feed
+                        st.session_state.live_error = None
+                        st.rerun()
+
+            if st.session_state.get("live_error"):
+                st.error(f"Ошибка при генерации: {st.session_state.live_error}")
         else:
             # Отображение результатов
             display_results(st.session_state.results)
@@ -4977,5 +12007,249 @@ def main():
         - **Социальная желательность** - преувеличение доходов, сокрытие долгов, рационализация трат
         """)
 
+# Код замера импорта в отдельном интерпретаторе (холодный старт модуля приложения)
+IMPORT_BENCHMARK_CODE = """
+import importlib.util, json, sys, time
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location("synthetica_app", sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "loaded": [name for name in module.LAZY_DEPENDENCIES if name in sys.modules]}))
+"""
+
+
+def benchmark_import(runs: int = 5) -> Dict[str, Any]:
+    """
+    Замер времени импорта модуля приложения в новых процессах
+
+    Args:
+        runs: Количество запусков
+
+    Returns:
+        Словарь со временем импорта (медиана, минимум, максимум) и тяжелыми модулями, загруженными при импорте
+    """
+    timings = []
+    loaded = set()
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-c", IMPORT_BENCHMARK_CODE, os.path.abspath(__file__)],
+            capture_output=True, text=True, check=True
+        )
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        timings.append(result["seconds"])
+        loaded.update(result["loaded"])
+
+    return {
+        "runs": runs,
+        "median": float(np.median(timings)),
+        "min": min(timings),
+        "max": max(timings),
+        "loaded_dependencies": sorted(loaded)
+    }
+
+
+def _build_cli_parser() -> Tuple[argparse.ArgumentParser, Set[str]]:
+    """Создание парсера консольных команд (режимы работы без интерфейса Streamlit)"""
+    parser = argparse.ArgumentParser(description="Synthetica Financial: консольные режимы")
+    subparsers = parser.add_subparsers(dest="command")
+
+    serve_parser = subparsers.add_parser("serve", help="HTTP сервис заданий генерации")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--db", default="synthetica_jobs.sqlite3", help="Путь к базе данных заданий")
+    serve_parser.add_argument("--max-jobs", type=int, default=2, help="Количество одновременно выполняемых заданий")
+    serve_parser.add_argument("--max-workers-per-job", type=int, default=5)
+    serve_parser.add_argument("--fake-llm", action="store_true", help="Использовать локальный фейковый LLM")
+    serve_parser.add_argument("--http2", action="store_true", help="HTTP/2 для клиентов API (нужен пакет h2)")
+
+    worker_parser = subparsers.add_parser("worker", help="Воркер очереди задач генерации")
+    worker_parser.add_argument("--queue", required=True, help="Путь к базе очереди задач")
+    worker_parser.add_argument("--run-id", default=None, help="Обрабатывать только указанный запуск")
+    worker_parser.add_argument("--worker-id", default=None)
+    worker_parser.add_argument("--threads", type=int, default=3, help="Количество потоков запросов к API")
+    worker_parser.add_argument("--lease-seconds", type=float, default=300)
+    worker_parser.add_argument("--keep-alive", action="store_true", help="Не завершаться при пустой очереди")
+    worker_parser.add_argument("--http2", action="store_true", help="HTTP/2 для клиентов API (нужен пакет h2)")
+
+    build_parser = subparsers.add_parser("build-prompts", help="Построение набора промптов без обращения к API")
+    build_parser.add_argument("--questions", required=True, help="Файл с вопросами (Excel, CSV, JSONL или Parquet)")
+    build_parser.add_argument("--personas", required=True,
+                              help="Персоны: JSON (список или экспорт результатов) или панель Parquet/CSV/JSONL")
+    build_parser.add_argument("--output", required=True, help="Файл набора промптов (.jsonl или .parquet)")
+    build_parser.add_argument("--api", choices=["claude", "openai"], default=None)
+    build_parser.add_argument("--basic", action="store_true", help="Базовая генерация без расширенных профилей")
+    build_parser.add_argument("--workers", type=int, default=None, help="Количество процессов построения промптов")
+    build_parser.add_argument("--seed", type=int, default=None, help="Зерно запуска для воспроизводимых промптов")
+    build_parser.add_argument("--profile", choices=PROMPT_PROFILES, default="full", help="Профиль промпта")
+    build_parser.add_argument("--local-noise", action="store_true",
+                              help="Опечатки, слова-паразиты и региональные выражения добавлять в ответ локально")
+
+    bench_parser = subparsers.add_parser("bench-prompts", help="Сравнение полного и компактного профилей промпта")
+    bench_parser.add_argument("--questions", required=True, help="Файл с вопросами (Excel, CSV, JSONL или Parquet)")
+    bench_parser.add_argument("--count", type=int, default=50, help="Количество генерируемых персон")
+    bench_parser.add_argument("--seed", type=int, default=0, help="Зерно персон и промптов")
+    bench_parser.add_argument("--live", action="store_true",
+                              help="Отправлять запросы в API (ключи из ANTHROPIC_API_KEY/OPENAI_API_KEY)")
+    bench_parser.add_argument("--max-workers", type=int, default=3, help="Количество параллельных запросов")
+    bench_parser.add_argument("--output", default=None, help="JSON файл для отчета")
+
+    panel_parser = subparsers.add_parser("export-cohort", help="Генерация панели респондентов в Parquet/CSV/JSONL")
+    panel_parser.add_argument("--count", type=int, required=True, help="Количество персон")
+    panel_parser.add_argument("--seed", type=int, default=None, help="Зерно генерации")
+    panel_parser.add_argument("--output", required=True, help="Файл панели (.parquet, .csv или .jsonl)")
+
+    snapshot_parser = subparsers.add_parser("snapshot", help="Снимок настроенного окружения для быстрого запуска")
+    snapshot_parser.add_argument("--output", required=True, help="Каталог снимка")
+    snapshot_parser.add_argument("--questions", default=None, help="Файл с вопросами (Excel, CSV, JSONL или Parquet)")
+    snapshot_parser.add_argument("--reviews", default=None, help="Excel с отзывами о банках")
+    snapshot_parser.add_argument("--panel", default=None, help="Панель респондентов (Parquet, CSV или JSONL)")
+    snapshot_parser.add_argument("--count", type=int, default=0, help="Количество генерируемых персон (без --panel)")
+    snapshot_parser.add_argument("--seed", type=int, default=None, help="Зерно генерации")
+    snapshot_parser.add_argument("--profile", choices=PROMPT_PROFILES, default="full", help="Профиль промпта")
+
+    import_parser = subparsers.add_parser("bench-import", help="Замер времени холодного импорта приложения")
+    import_parser.add_argument("--runs", type=int, default=5, help="Количество запусков")
+    import_parser.add_argument("--output", default=None, help="JSON файл для отчета")
+
+    dispatch_parser = subparsers.add_parser("dispatch", help="Генерация ответов по готовому набору промптов")
+    dispatch_parser.add_argument("--prompt-set", required=True, help="Файл набора промптов (.jsonl или .parquet)")
+    dispatch_parser.add_argument("--output", required=True, help="JSON файл для ответов")
+    dispatch_parser.add_argument("--max-workers", type=int, default=3, help="Количество параллельных запросов")
+    dispatch_parser.add_argument("--fake-llm", action="store_true", help="Использовать локальный фейковый LLM")
+    dispatch_parser.add_argument("--http2", action="store_true", help="HTTP/2 для клиентов API (нужен пакет h2)")
+    dispatch_parser.add_argument("--budget", type=float, default=None, help="Жесткий бюджет в USD")
+
+    return parser, set(subparsers.choices)
+
+def run_cli(argv: List[str]) -> bool:
+    """
+    Выполнение консольной команды, если она указана
+
+    Args:
+        argv: Аргументы командной строки (без имени скрипта)
+
+    Returns:
+        True, если команда была обработана, иначе False (запускается интерфейс Streamlit)
+    """
+    parser, commands = _build_cli_parser()
+    if not argv or argv[0] not in commands:
+        return False
+
+    args = parser.parse_args(argv)
+    # Сообщения генерации (повторы запросов, ошибки заданий) выводятся в журнал консоли
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if getattr(args, "http2", False):
+        API_CLIENTS.configure(http2=True)
+
+    if args.command == "serve":
+        serve_generation_api(
+            host=args.host, port=args.port, db_path=args.db,
+            max_concurrent_jobs=args.max_jobs, max_workers_per_job=args.max_workers_per_job,
+            use_fake_llm=args.fake_llm
+        )
+    elif args.command == "worker":
+        processed = run_queue_worker(
+            args.queue, run_id=args.run_id, worker_id=args.worker_id, threads=args.threads,
+            lease_seconds=args.lease_seconds, exit_when_idle=not args.keep_alive
+        )
+        print(f"Воркер завершен, обработано задач: {processed}")
+    elif args.command == "build-prompts":
+        marketplace = RespondentsMarketplace(prompt_only=True)
+        questions = marketplace.load_questions(args.questions)
+        if os.path.splitext(args.personas)[1].lower() in COHORT_FILE_FORMATS:
+            personas = load_cohort(marketplace, args.personas)
+        else:
+            with open(args.personas, "r", encoding="utf-8") as f:
+                personas = json.load(f)
+            if isinstance(personas, dict):
+                personas = personas.get("personas", [])
+
+        use_enhanced = not args.basic
+        marketplace.set_prompt_profile(args.profile)
+        marketplace.prompting_params["local_postprocessing"] = args.local_noise
+        prompt_set = marketplace.build_prompt_set(
+            personas, questions, api_preference=args.api, use_enhanced=use_enhanced, workers=args.workers,
+            seed=args.seed
+        )
+        marketplace.save_prompt_set(prompt_set, args.output)
+        print(f"Набор промптов сохранен: {args.output} ({len(prompt_set)} задач)")
+    elif args.command == "bench-prompts":
+        if args.live:
+            marketplace = RespondentsMarketplace(os.environ.get("ANTHROPIC_API_KEY"), os.environ.get("OPENAI_API_KEY"))
+        else:
+            marketplace = RespondentsMarketplace(use_fake_llm=True)
+        questions = marketplace.load_questions(args.questions)
+        personas = marketplace.generate_cohort(args.count, seed=args.seed)
+
+        report = marketplace.benchmark_prompt_profiles(
+            personas, questions, seed=args.seed, max_workers=args.max_workers
+        )
+
+        full, compact = report["full"], report["compact"]
+        print(f"{'Раздел':<20}{'full':>10}{'compact':>10}")
+        for slot in PROMPT_SLOTS:
+            if slot in full["sections"] or slot in compact["sections"]:
+                print(f"{slot:<20}{full['sections'].get(slot, 0):>10.1f}{compact['sections'].get(slot, 0):>10.1f}")
+        saving = 1 - compact["input_tokens"]["total"] / max(1, full["input_tokens"]["total"])
+        print(f"{'токенов на промпт':<20}{full['input_tokens']['mean']:>10.1f}{compact['input_tokens']['mean']:>10.1f}"
+              f"  (экономия {saving:.1%})")
+        for stat in ("mean", "median", "p90"):
+            print(f"{'длина ответа ' + stat:<20}{full['answer_length'][stat]:>10.1f}"
+                  f"{compact['answer_length'][stat]:>10.1f}")
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2, cls=NumpyEncoder)
+            print(f"Отчет сохранен: {args.output}")
+    elif args.command == "export-cohort":
+        marketplace = RespondentsMarketplace(prompt_only=True)
+        cohort = marketplace.generate_cohort(args.count, seed=args.seed)
+        save_cohort(cohort, args.output)
+        print(f"Панель сохранена: {args.output} ({len(cohort)} персон)")
+    elif args.command == "snapshot":
+        marketplace = RespondentsMarketplace(prompt_only=True)
+        marketplace.set_prompt_profile(args.profile)
+        questions = load_questions(args.questions) if args.questions else None
+        if args.reviews:
+            marketplace.load_bank_reviews(args.reviews)
+        if args.panel:
+            cohort = load_cohort(marketplace, args.panel, seed=args.seed)
+        else:
+            cohort = marketplace.generate_cohort(args.count, seed=args.seed) if args.count else None
+        save_marketplace_snapshot(marketplace, args.output, cohort=cohort, questions=questions)
+        print(f"Снимок сохранен: {args.output} "
+              f"({len(cohort) if cohort is not None else 0} персон, {len(questions) if questions else 0} вопросов)")
+    elif args.command == "bench-import":
+        report = benchmark_import(runs=args.runs)
+        print(f"Импорт приложения: медиана {report['median']:.3f} с "
+              f"(мин. {report['min']:.3f} с, макс. {report['max']:.3f} с, запусков: {report['runs']})")
+        if report["loaded_dependencies"]:
+            print(f"Загружены при импорте: {', '.join(report['loaded_dependencies'])}")
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"Отчет сохранен: {args.output}")
+    elif args.command == "dispatch":
+        marketplace = RespondentsMarketplace(
+            os.environ.get("ANTHROPIC_API_KEY"), os.environ.get("OPENAI_API_KEY"), use_fake_llm=args.fake_llm
+        )
+        prompt_set = marketplace.load_prompt_set(args.prompt_set)
+        marketplace.spend_ledger = SpendLedger(hard_budget=args.budget)
+        answers = marketplace.dispatch_prompt_set(
+            prompt_set, max_workers=args.max_workers,
+            progress_callback=lambda done: print(f"\rГотово ответов: {done}/{len(prompt_set)}", end="", flush=True)
+        )
+        print()
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(answers, f, ensure_ascii=False, indent=2, cls=NumpyEncoder)
+        spend = marketplace.spend_ledger.summary()
+        print(f"Ответы сохранены: {args.output}")
+        print(f"Расходы: ${spend['total_cost']:.4f}, пропущено запросов по бюджету: {spend['skipped_requests']}")
+
+    return True
+
 if __name__ == "__main__":
-    main()
+    if not run_cli(sys.argv[1:]):
+        main()
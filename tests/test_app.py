@@ -0,0 +1,196 @@
+"""
+Офлайн-тесты приложения на тестовой LLM (use_fake_llm): сеть и API ключи не нужны
+"""
+
+import copy
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app (2).py")
+
+QUESTIONS = ["Как вы выбираете кредитную карту?", "Пользуетесь ли вы вкладами?"]
+
+
+@pytest.fixture(scope="module")
+def app():
+    """Модуль приложения (имя файла содержит пробел, поэтому загружается по пути)"""
+    spec = importlib.util.spec_from_file_location("synthetica_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def marketplace(app):
+    return app.RespondentsMarketplace(use_fake_llm=True)
+
+
+def _get_json(url):
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return json.load(response)
+
+
+def _get_status(url):
+    try:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_job_api_create_poll_answers(app, tmp_path):
+    server = app.create_generation_api_server(port=0, db_path=str(tmp_path / "jobs.sqlite3"), use_fake_llm=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        body = {"questions": QUESTIONS, "persona_spec": {"count": 2}, "settings": {"max_workers": 2}}
+        request = urllib.request.Request(base + "/jobs", data=json.dumps(body).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            job_id = json.load(response)["job_id"]
+
+        deadline = time.time() + 120
+        status = _get_json(f"{base}/jobs/{job_id}")
+        while status["status"] not in ("completed", "failed") and time.time() < deadline:
+            time.sleep(0.2)
+            status = _get_json(f"{base}/jobs/{job_id}")
+        assert status["status"] == "completed", status["error"]
+
+        answers = _get_json(f"{base}/jobs/{job_id}/answers")["answers"]
+        assert sorted(item["answer"]["id"] for item in answers) == [1, 2, 3, 4]
+
+        page = _get_json(f"{base}/jobs/{job_id}/answers?limit=2")
+        assert len(page["answers"]) == 2
+        rest = _get_json(f"{base}/jobs/{job_id}/answers?after={page['next']}")
+        assert len(rest["answers"]) == 2
+
+        for query in ("limit=-1", "limit=1.5", "limit=x", "after=-3"):
+            assert _get_status(f"{base}/jobs/{job_id}/answers?{query}") == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _create_queue_run(app, marketplace, tmp_path, config, num_personas=2):
+    queue = app.GenerationWorkQueue(str(tmp_path / "queue.sqlite3"))
+    personas = marketplace.generate_cohort(num_personas, seed=1).to_dicts()
+    questions = marketplace.prepare_questions(QUESTIONS)
+    return queue, queue.create_run(config, personas, questions)
+
+
+def test_queue_lease_and_retry_backoff(app, marketplace, tmp_path):
+    queue, run_id = _create_queue_run(app, marketplace, tmp_path, {"use_fake_llm": True})
+
+    first = queue.claim_tasks("w1", limit=3, run_id=run_id)
+    second = queue.claim_tasks("w2", limit=3, run_id=run_id)
+    assert [task["task_id"] for task in first] == [0, 1, 2]
+    assert [task["task_id"] for task in second] == [3]
+    assert all(task["attempts"] == 1 for task in first + second)
+
+    # Задачу возвращает только воркер, который ее арендовал; с задержкой она недоступна сразу
+    queue.release_task(run_id, 0, "w2")
+    queue.release_task(run_id, 1, "w1", delay=60)
+    assert queue.claim_tasks("w2", run_id=run_id) == []
+    queue.release_task(run_id, 0, "w1")
+    retried = queue.claim_tasks("w2", run_id=run_id)
+    assert [(task["task_id"], task["attempts"]) for task in retried] == [(0, 2)]
+
+    # Просроченная аренда возвращает задачу в очередь
+    assert queue.complete_task(run_id, 0, {"id": 1})
+    queue.release_task(run_id, 2, "w1")
+    assert [task["task_id"] for task in queue.claim_tasks("w1", run_id=run_id, lease_seconds=-1)] == [2]
+    assert [task["task_id"] for task in queue.claim_tasks("w3", run_id=run_id)] == [2]
+
+    backoff = app.GenerationWorkQueue.retry_backoff
+    assert app.GenerationWorkQueue.retry_delay(1) == backoff
+    assert app.GenerationWorkQueue.retry_delay(2) == 2 * backoff
+    assert app.GenerationWorkQueue.retry_delay(100) == app.GenerationWorkQueue.retry_backoff_max
+
+
+def test_queue_worker_skips_tasks_over_budget(app, marketplace, tmp_path):
+    config = {"use_fake_llm": True, "seed": 3, "hard_budget": 1e-9, "prompting_params": {}}
+    queue, run_id = _create_queue_run(app, marketplace, tmp_path, config, num_personas=3)
+
+    processed = app.run_queue_worker(queue.db_path, run_id=run_id, worker_id="w1", threads=1)
+    answers = queue.collect_answers(run_id)
+
+    assert processed == len(answers) == 6
+    assert queue.run_spent(run_id) >= config["hard_budget"]
+    skipped = [answer for answer in answers if answer.get("skipped")]
+    assert 0 < len(skipped) < len(answers)
+    assert all(answer["error"] for answer in skipped)
+
+
+def test_cohort_round_trip(app, marketplace):
+    cohort = marketplace.generate_cohort(6, seed=2)
+    # Персона со значениями вне справочников хранится отдельно от колонок когорты
+    persona = copy.deepcopy(cohort[2])
+    persona["Увлечения"] = ["Свой вариант хобби"]
+    persona["Заметка"] = "вне схемы"
+    cohort.set_persona(2, persona)
+
+    formats = ["csv", "jsonl"]
+    if importlib.util.find_spec("pyarrow") is not None:
+        formats.append("parquet")
+    for file_format in formats:
+        data = app.save_cohort(cohort, file_format=file_format)
+        restored = app.load_cohort(marketplace, data, file_format=file_format)
+        assert restored.to_dicts() == cohort.to_dicts(), file_format
+        assert restored[2] == persona
+
+
+def test_answer_store_round_trip(app):
+    questions = [{"id": 1, "text": "Q1"}, {"id": 2, "text": "Q2"}]
+    answers = [
+        {"id": 1, "persona_id": 1, "question": questions[0], "text": "Да, пользуюсь",
+         "timestamp": "2024-01-01T10:00:00.123456", "model": "claude-3-haiku", "provider": "claude",
+         "latency": 0.5, "input_tokens": 120, "output_tokens": 30},
+        {"id": 2, "persona_id": 1, "question": questions[1], "text": "ПРОПУЩЕНО",
+         "timestamp": "2024-01-01T10:00:01", "error": True, "skipped": True},
+        {"id": 3, "persona_id": 2, "question": {"text": "Без ID"}, "text": "", "timestamp": "",
+         "note": "дополнительное поле"}
+    ]
+    store = app.AnswerStore.from_answers(answers, questions)
+
+    assert list(store) == answers
+    assert store.find(1, 2) == 1
+    assert store.to_pandas()["text"].tolist() == [answer["text"] for answer in answers]
+
+
+def test_same_seed_prompts_independent_of_max_workers(app, tmp_path):
+    questions = app.RespondentsMarketplace(prompt_only=True).prepare_questions(QUESTIONS)
+
+    def prompts(max_workers, seed):
+        marketplace = app.RespondentsMarketplace(use_fake_llm=True)
+        path = str(tmp_path / f"prompts-{max_workers}-{seed}.jsonl")
+        marketplace.run_generation_batch(marketplace.generate_cohort(5, seed=seed), questions,
+                                         max_workers=max_workers, prompt_workers=0, prompt_set_path=path,
+                                         progress_callback=lambda done, total: None, seed=seed)
+        return [(entry["prompt"], entry["temperature"]) for entry in marketplace.load_prompt_set(path)]
+
+    assert prompts(1, 11) == prompts(4, 11)
+    assert prompts(1, 11) != prompts(1, 12)
+
+
+def test_postprocessing_after_dispatch(app, marketplace, tmp_path):
+    marketplace.prompting_params["local_postprocessing"] = True
+    questions = marketplace.prepare_questions(QUESTIONS)
+    path = str(tmp_path / "prompts.jsonl")
+    marketplace.save_prompt_set(marketplace.build_prompt_set(marketplace.generate_cohort(8, seed=3), questions, seed=5),
+                                path)
+
+    # Отправка набора промптов в новом маркетплейсе (по умолчанию постобработка выключена)
+    dispatcher = app.RespondentsMarketplace(use_fake_llm=True)
+    answers = dispatcher.dispatch_prompt_set(dispatcher.load_prompt_set(path), max_workers=2)
+
+    assert len(answers) == 16
+    assert dispatcher.spend_ledger.summary().get("postprocess")